@@ -22,7 +22,7 @@ from rucio.common.schema import validate_schema
 from rucio.db.sqla.constants import DIDType
 
 
-def list_dids(scope, filters, type='collection', ignore_case=False, limit=None, offset=None, long=False):
+def list_dids(scope, filters, type='collection', ignore_case=False, limit=None, offset=None, long=False, marker=None, name_range=None):
     """
     List dids in a scope.
 
@@ -33,10 +33,12 @@ def list_dids(scope, filters, type='collection', ignore_case=False, limit=None,
     :param limit: The maximum number of DIDs returned.
     :param offset: Offset number.
     :param long: Long format option to display more information for each DID.
+    :param marker: Only return the DIDs with a name greater than the marker.
+    :param name_range: Tuple (start, end) to only return the DIDs with start <= name < end.
     """
     validate_schema(name='did_filters', obj=filters)
     return did.list_dids(scope=scope, filters=filters, type=type, ignore_case=ignore_case,
-                         limit=limit, offset=offset, long=long)
+                         limit=limit, offset=offset, long=long, marker=marker, name_range=name_range)
 
 
 def add_did(scope, name, type, issuer, account=None, statuses={}, meta={}, rules=[], lifetime=None, dids=[], rse=None):
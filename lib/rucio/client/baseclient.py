@@ -16,22 +16,28 @@
 
 import random
 import sys
+import time
 
 from rucio.common import exception
 from rucio.common.config import config_get
 from rucio.common.exception import CannotAuthenticate, ClientProtocolNotSupported, NoAuthInformation, MissingClientParameter
+from rucio.common.streaming import (JSON_STREAM, COMPACT_JSON_STREAM, MSGPACK_STREAM, STREAM_DECODERS,
+                                    DecompressingReader, content_codings, iter_metalink, stream_formats)
 from rucio.common.utils import build_url, get_tmp_dir, my_key_generator, parse_response
 from rucio import version
 
 from logging import getLogger, StreamHandler, ERROR
 from os import environ, fdopen, path, makedirs
+from Queue import Empty, Queue
 from shutil import move
 from tempfile import mkstemp
+from threading import Lock, Thread
 from urlparse import urlparse
 
 from ConfigParser import NoOptionError, NoSectionError
 from dogpile.cache import make_region
 from requests import session
+from requests.adapters import HTTPAdapter
 from requests.status_codes import codes, _codes
 from requests.exceptions import ConnectionError
 from requests_kerberos import HTTPKerberosAuth
@@ -68,6 +74,17 @@ class BaseClient(object):
     """Main client class for accessing Rucio resources. Handles the authentication."""
 
     AUTH_RETRIES, REQUEST_RETRIES = 2, 3
+    # Threads used by execute_concurrently
+    REQUEST_WORKERS = 4
+    # Base and maximum delay before retrying a request, in seconds
+    RETRY_BACKOFF, MAX_RETRY_BACKOFF = 0.5, 30
+    # Size of the chunks read from the streamed responses, in bytes
+    STREAM_CHUNK_SIZE = 65536
+    # Preferred format of the streamed responses, see rucio.common.streaming
+    STREAM_FORMAT = 'compact'
+    STREAM_FORMATS = {'json': JSON_STREAM, 'compact': COMPACT_JSON_STREAM, 'msgpack': MSGPACK_STREAM}
+    # Server errors after which a GET request is retried
+    RETRY_STATUS_CODES = (codes.bad_gateway, codes.service_unavailable, codes.gateway_timeout)  # pylint: disable-msg=E1101
     TOKEN_PATH_PREFIX = get_tmp_dir() + '/.rucio_'
     TOKEN_PREFIX = 'auth_token_'
 
@@ -168,6 +185,20 @@ class BaseClient(object):
                 except KeyError:
                     raise MissingClientParameter('Option \'account\' cannot be found in config file and RUCIO_ACCOUNT is not set.')
 
+        self.request_workers = self.REQUEST_WORKERS
+        try:
+            self.request_workers = int(config_get('client', 'request_workers'))
+        except NoOptionError:
+            LOG.debug('request_workers not specified in config file. Taking default.')
+        except ValueError:
+            LOG.debug('request_workers must be an integer. Taking default.')
+
+        # Keep a connection per concurrent request
+        adapter = HTTPAdapter(pool_maxsize=max(self.request_workers, 10))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.__token_lock = Lock()
         token_path = self.TOKEN_PATH_PREFIX + self.account
         self.token_file = token_path + '/' + self.TOKEN_PREFIX + self.account
         self.__authenticate()
@@ -179,6 +210,18 @@ class BaseClient(object):
         except ValueError:
             LOG.debug('request_retries must be an integer. Taking default.')
 
+        stream_format = self.STREAM_FORMAT
+        try:
+            stream_format = config_get('client', 'stream_format')
+        except NoOptionError:
+            LOG.debug('stream_format not specified in config file. Taking default.')
+        if self.STREAM_FORMATS.get(stream_format) not in stream_formats():
+            LOG.debug('stream_format %s is not supported. Taking default.' % stream_format)
+            stream_format = self.STREAM_FORMAT
+        # The servers not supporting the preferred format send a JSON stream
+        self.accept = ', '.join([self.STREAM_FORMATS[stream_format], JSON_STREAM, '*/*'])
+        self.accept_encoding = ', '.join(content_codings())
+
     def _get_exception(self, headers, status_code=None, data=None):
         """
         Helper method to parse an error string send by the server and transform it into the corresponding rucio exception.
@@ -204,21 +247,32 @@ class BaseClient(object):
 
         return exc_cls, data['ExceptionMessage']
 
-    def _load_json_data(self, response):
+    def _load_json_data(self, response, fields=None):
         """
         Helper method to correctly load json data based on the content type of the http response.
+        The streamed responses are decoded as they are received.
 
         :param response: the response received from the server.
+        :param fields: if given, the objects of a stream are returned as named tuples with these fields.
         """
-        if 'content-type' in response.headers and response.headers['content-type'] == 'application/x-json-stream':
-            for line in response.iter_lines():
-                if line:
-                    yield parse_response(line)
+        if response.headers.get('content-type') in STREAM_DECODERS:
+            decoder = STREAM_DECODERS[response.headers['content-type']]
+            for obj in decoder(response.iter_content(chunk_size=self.STREAM_CHUNK_SIZE), fields=fields):
+                yield obj
         elif 'content-type' in response.headers and response.headers['content-type'] == 'application/json':
             yield parse_response(response.text)
         else:  # Exception ?
             yield response.text
 
+    def _load_metalink_data(self, response, fields=None):
+        """
+        Helper method to decode the files of a metalink4+xml response as they are received.
+
+        :param response: the response received from the server.
+        :param fields: if given, the files are returned as named tuples with these fields.
+        """
+        return iter_metalink(response.iter_content(chunk_size=self.STREAM_CHUNK_SIZE), fields=fields)
+
     def _send_request(self, url, headers=None, type='GET', data=None, params=None):
         """
         Helper method to send requests to the rucio server. Gets a new token and retries if an unauthorized error is returned.
@@ -232,13 +286,15 @@ class BaseClient(object):
         """
         hds = {'X-Rucio-Auth-Token': self.auth_token, 'X-Rucio-Account': self.account,
                'Connection': 'Keep-Alive', 'User-Agent': self.user_agent,
-               'X-Rucio-Script': self.script_id}
+               'X-Rucio-Script': self.script_id, 'Accept': self.accept,
+               'Accept-Encoding': self.accept_encoding}
 
         if headers is not None:
             hds.update(headers)
 
         result = None
-        for retry in range(self.AUTH_RETRIES + 1):
+        auth_retries, request_retries = 0, 0
+        while True:
             try:
                 if type == 'GET':
                     result = self.session.get(url, headers=hds, verify=self.ca_cert, timeout=self.timeout, params=params, stream=True)
@@ -253,17 +309,78 @@ class BaseClient(object):
             except ConnectionError as error:
                 LOG.warning('ConnectionError: ' + str(error))
                 self.ca_cert = False
-                if retry > self.request_retries:
+                if request_retries >= self.request_retries:
                     raise
+                self._backoff(request_retries)
+                request_retries += 1
                 continue
 
-            if result is not None and result.status_code == codes.unauthorized:  # pylint: disable-msg=E1101
-                self.__get_token()
+            if result.status_code == codes.unauthorized and auth_retries < self.AUTH_RETRIES:  # pylint: disable-msg=E1101
+                # Release the connection of the streamed response before retrying
+                result.close()
+                self.__refresh_token(hds['X-Rucio-Auth-Token'])
                 hds['X-Rucio-Auth-Token'] = self.auth_token
+                auth_retries += 1
+            elif type == 'GET' and result.status_code in self.RETRY_STATUS_CODES and request_retries < self.request_retries:
+                LOG.warning('HTTP %s on %s, retrying' % (result.status_code, url))
+                result.close()
+                self._backoff(request_retries)
+                request_retries += 1
             else:
                 break
+
+        # urllib3 only decodes gzip and deflate
+        if type in ('GET', 'POST') and result.headers.get('content-encoding') == 'zstd':
+            result.raw = DecompressingReader(result.raw, 'zstd', chunk_size=self.STREAM_CHUNK_SIZE)
         return result
 
+    def _backoff(self, retry):
+        """
+        Wait before retrying a request, with an exponential backoff and a random jitter so that concurrent requests do not retry together.
+
+        :param retry: the number of retries already done.
+        """
+        time.sleep(random.uniform(0, min(self.MAX_RETRY_BACKOFF, self.RETRY_BACKOFF * 2 ** retry)))
+
+    def execute_concurrently(self, function, items, max_workers=None):
+        """
+        Call a function for each item from a pool of threads. The threads share the connections and the auth token of the client.
+
+        :param function: the function to call with each item, e.g. a method of the client.
+        :param items: the list of items.
+        :param max_workers: the number of threads. If None, the request_workers option of the client section is used (default 4).
+        :return: the list of the results, in the order of the items.
+        :raises: the first exception raised by a call, once all the calls are done.
+        """
+        items = list(items)
+        results, errors = [None] * len(items), []
+        queue = Queue()
+        for index, item in enumerate(items):
+            queue.put((index, item))
+
+        def worker():
+            while True:
+                try:
+                    index, item = queue.get_nowait()
+                except Empty:
+                    return
+                try:
+                    results[index] = function(item)
+                except Exception as error:
+                    errors.append((index, error, sys.exc_info()[2]))
+
+        threads = [Thread(target=worker) for _ in xrange(min(max_workers or self.request_workers, len(items)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            index, error, traceback = min(errors, key=lambda error: error[0])
+            raise error, None, traceback
+        return results
+
     def __get_token_userpass(self):
         """
         Sends a request to get an auth token from the server and stores it as a class attribute. Uses username/password.
@@ -421,6 +538,16 @@ class BaseClient(object):
         if self.auth_token is None:
             raise CannotAuthenticate('cannot get an auth token from server')
 
+    def __refresh_token(self, used_token):
+        """
+        Get a new auth token after the used one was refused, unless a concurrent request already replaced it.
+
+        :param used_token: the token which was refused.
+        """
+        with self.__token_lock:
+            if self.auth_token == used_token:
+                self.__get_token()
+
     def __read_token(self):
         """
         Checks if a local token file exists and reads the token from it.
@@ -16,6 +16,9 @@
 '''
 
 from json import dumps
+from Queue import Queue, Full
+from threading import Event, Thread
+
 from requests.status_codes import codes
 
 from rucio.client.baseclient import BaseClient
@@ -29,13 +32,16 @@ class DIDClient(BaseClient):
 
     DIDS_BASEURL = 'dids'
     ARCHIVES_BASEURL = 'archives'
+    # Characters used to split the names of a scope in ranges listed in parallel.
+    # They sort the same way with binary and case insensitive collations.
+    NAME_RANGE_CHARS = '0123456789abcdefghijklmnopqrstuvwxyz'
 
     def __init__(self, rucio_host=None, auth_host=None, account=None, ca_cert=None,
                  auth_type=None, creds=None, timeout=None, user_agent='rucio-clients'):
         super(DIDClient, self).__init__(rucio_host, auth_host, account, ca_cert,
                                         auth_type, creds, timeout, user_agent)
 
-    def list_dids(self, scope, filters, type='collection', long=False):
+    def list_dids(self, scope, filters, type='collection', long=False, limit=None, marker=None, threads=1):
         """
         List all data identifiers in a scope which match a given pattern.
 
@@ -43,11 +49,39 @@ class DIDClient(BaseClient):
         :param filters: A dictionary of key/value pairs like {'name': 'file_name','rse-expression': 'tier0'}.
         :param type: The type of the did: 'all'(container, dataset or file)|'collection'(dataset or container)|'dataset'|'container'|'file'
         :param long: Long format option to display more information for each DID.
+        :param limit: The maximum number of DIDs returned.
+        :param marker: Only list the DIDs with a name greater than the marker, e.g. to resume an interrupted listing.
+        :param threads: Number of name ranges of the scope listed in parallel. The DIDs are then returned ordered by name.
+        """
+        if threads > 1:
+            return self._list_dids_parallel(scope, filters, type=type, long=long, limit=limit, marker=marker, threads=threads)
+        return self._list_dids(scope, filters, type=type, long=long, limit=limit, marker=marker)
+
+    def _list_dids(self, scope, filters, type='collection', long=False, limit=None, marker=None, name_range=None):
+        """
+        List the data identifiers of a scope, optionally restricted to a name range.
+
+        :param scope: The scope name.
+        :param filters: A dictionary of key/value pairs like {'name': 'file_name','rse-expression': 'tier0'}.
+        :param type: The type of the did.
+        :param long: Long format option to display more information for each DID.
+        :param limit: The maximum number of DIDs returned.
+        :param marker: Only list the DIDs with a name greater than the marker.
+        :param name_range: Tuple (start, end) to only list the DIDs with start <= name < end.
         """
         path = '/'.join([self.DIDS_BASEURL, scope, 'dids', 'search'])
         payload = {}
         if long:
             payload['long'] = 1
+        if limit:
+            payload['limit'] = limit
+        if marker:
+            payload['marker'] = marker
+        if name_range:
+            if name_range[0]:
+                payload['range_start'] = name_range[0]
+            if name_range[1]:
+                payload['range_end'] = name_range[1]
 
         for k, v in filters.items():
             if k in ('created_before', 'created_after'):
@@ -66,6 +100,71 @@ class DIDClient(BaseClient):
             exc_cls, exc_msg = self._get_exception(headers=r.headers, status_code=r.status_code, data=r.content)
             raise exc_cls(exc_msg)
 
+    def _list_dids_parallel(self, scope, filters, type='collection', long=False, limit=None, marker=None, threads=2):
+        """
+        List the data identifiers of a scope by splitting it in name ranges listed concurrently.
+        The ranges are disjoint and ordered, so their streams are merged by concatenation.
+
+        :param scope: The scope name.
+        :param filters: A dictionary of key/value pairs like {'name': 'file_name','rse-expression': 'tier0'}.
+        :param type: The type of the did.
+        :param long: Long format option to display more information for each DID.
+        :param limit: The maximum number of DIDs returned.
+        :param marker: Only list the DIDs with a name greater than the marker.
+        :param threads: Number of name ranges listed in parallel.
+        """
+        # Split after the literal prefix of the name pattern, if any
+        prefix = ''
+        if isinstance(filters.get('name'), basestring):
+            prefix = filters['name'].split('*')[0].split('%')[0]
+        threads = min(threads, len(self.NAME_RANGE_CHARS))
+        bounds = [prefix + self.NAME_RANGE_CHARS[i * len(self.NAME_RANGE_CHARS) / threads] for i in xrange(1, threads)]
+        name_ranges = zip([None] + bounds, bounds + [None])
+
+        stop = Event()
+        end = object()
+
+        def list_range(name_range, queue):
+            def put(item):
+                while not stop.is_set():
+                    try:
+                        queue.put(item, timeout=1)
+                        return True
+                    except Full:
+                        continue
+                return False
+            try:
+                for did in self._list_dids(scope, filters, type=type, long=long, limit=limit, marker=marker, name_range=name_range):
+                    if not put(did):
+                        return
+                put(end)
+            except Exception as error:
+                put(error)
+
+        queues = []
+        for name_range in name_ranges:
+            queue = Queue(maxsize=10000)
+            thread = Thread(target=list_range, args=(name_range, queue))
+            thread.daemon = True
+            thread.start()
+            queues.append(queue)
+
+        count = 0
+        try:
+            for queue in queues:
+                while True:
+                    item = queue.get()
+                    if item is end:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+                    count += 1
+                    if limit and count >= limit:
+                        return
+        finally:
+            stop.set()
+
     def add_did(self, scope, name, type, statuses=None, meta=None, rules=None, lifetime=None, dids=None, rse=None):
         """
         Add data identifier for a dataset or container.
@@ -329,13 +428,15 @@ class DIDClient(BaseClient):
         exc_cls, exc_msg = self._get_exception(headers=r.headers, status_code=r.status_code, data=r.content)
         raise exc_cls(exc_msg)
 
-    def list_files(self, scope, name, long=None):
+    def list_files(self, scope, name, long=None, fields=None):
         """
         List data identifier file contents.
 
         :param scope: The scope name.
         :param name: The data identifier name.
         :param long: A boolean to choose if GUID is returned or not.
+        :param fields: Return the files as named tuples with these fields, e.g. ['scope', 'name', 'bytes'],
+                       instead of dictionaries, to reduce the memory used by long listings.
         """
 
         payload = {}
@@ -346,11 +447,23 @@ class DIDClient(BaseClient):
 
         r = self._send_request(url, type='GET')
         if r.status_code == codes.ok:
-            return self._load_json_data(r)
+            return self._load_json_data(r, fields=fields)
         else:
             exc_cls, exc_msg = self._get_exception(headers=r.headers, status_code=r.status_code, data=r.content)
             raise exc_cls(exc_msg)
 
+    def list_files_parallel(self, dids, long=None, max_workers=None):
+        """
+        List the file contents of several data identifiers, with concurrent requests.
+
+        :param dids: The list of data identifiers, as dictionaries with scope and name.
+        :param long: A boolean to choose if GUID is returned or not.
+        :param max_workers: The number of concurrent requests. If None, the request_workers client option is used.
+        :returns: The list of the files of each data identifier, in the order of the data identifiers.
+        """
+        return self.execute_concurrently(lambda did: list(self.list_files(did['scope'], did['name'], long=long)),
+                                         dids, max_workers=max_workers)
+
     def get_did(self, scope, name):
         """
         Retrieve a single data identifier.
@@ -54,14 +54,16 @@ class ObjectStoreClient(BaseClient):
         exc_cls, exc_msg = self._get_exception(headers=r.headers, status_code=r.status_code, data=r.content)
         raise exc_cls(exc_msg)
 
-    def get_signed_urls(self, urls, rse, operation='read'):
+    def get_signed_urls(self, urls, rse, operation='read', check=True):
         """
         :param ruls: List of URLs.
         :param rse: RSE name.
+        :param operation: read or write.
+        :param check: If False, the URLs to read are signed without checking that the files exist.
 
         :returns: URL dictionaries refering to the files.
         """
-        url = build_url(self.host, path='/'.join([self.OBJECTSTORE_BASEURL, rse, operation]))
+        url = build_url(self.host, path='/'.join([self.OBJECTSTORE_BASEURL, rse, operation]), params=None if check else {'check': False})
         headers = {}
         r = self._send_request(url, headers=headers, type='POST', data=json.dumps(urls))
 
@@ -79,7 +79,7 @@ class ReplicaClient(BaseClient):
 
     def list_replicas(self, dids, schemes=None, unavailable=False,
                       all_states=False, metalink=False, rse_expression=None,
-                      client_location=None, sort=None):
+                      client_location=None, sort=None, fields=None, parse_metalink=False):
         """
         List file replicas for a list of data identifiers (DIDs).
 
@@ -94,6 +94,10 @@ class ReplicaClient(BaseClient):
         :param sort: Sort the replicas: ``geoip`` - based on src/dst IP topographical distance
                                         ``closeness`` - based on src/dst closeness
                                         ``dynamic`` - Rucio Dynamic Smart Sort (tm)
+        :param fields: Return the replicas as named tuples with these fields, e.g. ['scope', 'name', 'pfns'],
+                       instead of dictionaries, to reduce the memory used by long listings.
+        :param parse_metalink: With metalink, yield the files decoded from the metalink as they are received,
+                               as dictionaries with scope, name, bytes, adler32, md5 and rses, instead of returning the text.
         """
         data = {'dids': dids}
 
@@ -123,11 +127,27 @@ class ReplicaClient(BaseClient):
         r = self._send_request(url, headers=headers, type='POST', data=dumps(data))
         if r.status_code == codes.ok:
             if not metalink:
-                return self._load_json_data(r)
+                return self._load_json_data(r, fields=fields)
+            if parse_metalink:
+                return self._load_metalink_data(r, fields=fields)
             return r.text
         exc_cls, exc_msg = self._get_exception(headers=r.headers, status_code=r.status_code, data=r.content)
         raise exc_cls(exc_msg)
 
+    def list_replicas_parallel(self, dids_lists, max_workers=None, **kwargs):
+        """
+        List file replicas for several lists of data identifiers (DIDs), with concurrent requests.
+
+        :param dids_lists: A list of lists of data identifiers (DIDs), each list being sent in one request.
+        :param max_workers: The number of concurrent requests. If None, the request_workers client option is used.
+        :param kwargs: The other parameters of list_replicas.
+        :returns: The list of the results of list_replicas, in the order of the DID lists.
+        """
+        def list_replicas(dids):
+            replicas = self.list_replicas(dids, **kwargs)
+            return replicas if kwargs.get('metalink') else list(replicas)
+        return self.execute_concurrently(list_replicas, dids_lists, max_workers=max_workers)
+
     def add_replica(self, rse, scope, name, bytes, adler32, pfn=None, md5=None, meta={}):
         """
         Add file replicas to a RSE.
@@ -10,78 +10,262 @@
 # - Thomas Beermann, <thomas.beermann@cern.ch>, 2012
 # - Ralph Vigne, <ralph.vigne@cern.ch>, 2015
 
+'''
+Upload engine.
+
+The files are uploaded in stages, each stage working on all the files in bulk:
+
+- checksum: the size, adler32 and GUID of the files are computed in a pool of processes;
+- check: the existing files and replicas are listed with one request per batch;
+- register: the dataset, the missing replicas and their rules are added with one request per batch;
+- upload: the files are copied to the RSE by a pool of threads sharing the protocol connections;
+- attach: the files are attached to the dataset in one request;
+- finalize: the uploaded replicas are made available with one request per batch.
+'''
 
 import os
 import os.path
+import time
 
 from logging import getLogger
+from multiprocessing import Pool, cpu_count
 
-from rucio.client.baseclient import BaseClient
-from rucio.common.exception import SourceAccessDenied
-from rucio.common.exception import SourceNotFound
-from rucio.common.exception import RSEAccessDenied
-from rucio.common.exception import FullStorage
+from rucio.client.didclient import DIDClient
+from rucio.client.replicaclient import ReplicaClient
+from rucio.client.ruleclient import RuleClient
+from rucio.common.exception import (DataIdentifierAlreadyExists, InputValidationError, RSEBlacklisted,
+                                    RucioException)
+from rucio.common.utils import adler32, chunks, execute, generate_uuid
+from rucio.rse import rsemanager as rsemgr
 
 LOG = getLogger(__name__)
 
+STAGES = ('checksum', 'check', 'register', 'upload', 'attach', 'finalize')
+
+
+def _file_info(args):
+    """
+    Get the size, adler32 and GUID of a local file. Run in the checksum processes.
+
+    :param args: tuple (path, guid, extract_guid). The GUID is read from the POOL file if extract_guid is True.
+    :returns: tuple (path, size, adler32, guid, error message).
+    """
+    path, guid, extract_guid = args
+    try:
+        size = os.stat(path).st_size
+        checksum = adler32(path)
+        if extract_guid:
+            status, output, _ = execute('pool_extractFileIdentifier {0}'.format(path))
+            if status != 0:
+                return path, None, None, None, 'pool_extractFileIdentifier failed on %s, setup your ATHENA environment' % path
+            guid = output.splitlines()[-1].split()[0].replace('-', '').lower()
+        return path, size, checksum, guid or generate_uuid(), None
+    except Exception as error:
+        return path, None, None, None, str(error)
 
-class UploadClient(BaseClient):
+
+class UploadClient(DIDClient, ReplicaClient, RuleClient):
     """ This class cover all functionality related to file uploads into Rucio."""
 
-    BASEURL = '??_uploadclient_??'
+    # Number of files per request
+    BATCH_SIZE = 500
+    # Number of concurrent transfers
+    UPLOAD_THREADS = rsemgr.UPLOAD_THREADS
 
     def __init__(self, rucio_host=None, auth_host=None, account=None, ca_cert=None, auth_type=None, creds=None, timeout=None, user_agent='rucio-clients'):
         super(UploadClient, self).__init__(rucio_host, auth_host, account, ca_cert, auth_type, creds, timeout, user_agent)
 
+    def upload_files(self, paths, rse, scope=None, dataset=None, register=True, lifetime=None, guid=None,
+                     threads=None, processes=None, batch_size=None, rse_settings=None, callback=None):
+        """
+        Upload local files to a RSE, register their replicas and attach them to a dataset.
+
+        A file already registered with another checksum is refused. A file whose replica on the RSE
+        is already available is not uploaded again, but it is still attached to the dataset.
+
+        :param paths: The list of the local file paths. The names of the files are their base names.
+        :param rse: The RSE name.
+        :param scope: The scope of the files, user.<account> by default.
+        :param dataset: Optional (scope, name) of the dataset to attach the files to. It is created if needed,
+                        with a rule on the RSE. Without dataset, a rule is added for each new file.
+        :param register: If False, the files are only uploaded, without registration in the catalog.
+        :param lifetime: The lifetime of the rules, in seconds.
+        :param guid: The GUID of the files. If None, it is read from the POOL files and generated for the others.
+        :param threads: The number of concurrent transfers and requests.
+        :param processes: The number of checksum processes, the number of CPUs by default.
+        :param batch_size: The number of files per request.
+        :param rse_settings: The RSE settings, as returned by rsemanager.get_rse_info, e.g. with a forced protocol.
+        :param callback: Optional function called after each transfer, as in rsemanager.upload_files.
+        :returns: A dictionary with 'files', {'scope:name': file} where each file has 'path', 'scope', 'name',
+                  'bytes', 'adler32', 'guid', 'pfn' and 'state', 'uploaded', 'exists' or the exception,
+                  and 'stages', {stage: {'files', 'bytes', 'seconds'}}.
+        :raises InputValidationError: If two paths have the same file name or a file has the name of the dataset.
+        :raises RSEBlacklisted: If the RSE is not available for writing.
+        """
+        scope = scope or 'user.' + self.account
+        threads = threads or self.UPLOAD_THREADS
+        batch_size = batch_size or self.BATCH_SIZE
+        if rse_settings is None:
+            rse_settings = rsemgr.get_rse_info(rse)
+        if rse_settings['availability_write'] != 1:
+            raise RSEBlacklisted('%s is not available for writing' % rse)
+
+        names = {}
+        for path in paths:
+            name = os.path.basename(path)
+            if name in names:
+                raise InputValidationError('%s and %s have the same file name' % (names[name], path))
+            if dataset and (scope, name) == tuple(dataset):
+                raise InputValidationError('The file %s has the name of the dataset' % path)
+            names[name] = path
+
+        stages = {}
+        files = self.__checksum(paths, scope, guid, register, processes, stages)
+        pending = [f for f in files.values() if f['state'] is None]
+
+        if register:
+            pending = self.__check(pending, rse, batch_size, threads, stages)
+            self.__register(pending, rse, dataset, lifetime, batch_size, threads, stages)
+        pending = [f for f in pending if f['state'] is None]
+
+        self.__upload(pending, rse_settings, threads, callback, stages)
+
+        if register:
+            self.__attach([f for f in files.values() if f['state'] in ('uploaded', 'exists')], dataset, stages)
+            self.__finalize([f for f in pending if f['state'] == 'uploaded'], rse, batch_size, threads, stages)
+
+        for stage in STAGES:
+            if stage in stages:
+                report = stages[stage]
+                LOG.info('%s: %i files, %.1f MB in %.2f seconds (%.1f files/s, %.1f MB/s)' % (stage, report['files'], report['bytes'] / 1e6, report['seconds'],
+                                                                                              report['files'] / max(report['seconds'], 1e-6),
+                                                                                              report['bytes'] / 1e6 / max(report['seconds'], 1e-6)))
+        return {'files': files, 'stages': stages}
+
     @staticmethod
-    def upload_files(account, sources):
+    def __stage(stages, stage, files, start):
+        stages[stage] = {'files': len(files), 'bytes': sum(f['bytes'] or 0 for f in files), 'seconds': time.time() - start}
+
+    def __checksum(self, paths, scope, guid, register, processes, stages):
+        start = time.time()
+        tasks = [(path, guid, register and not guid and 'pool.root' in os.path.basename(path).lower()) for path in paths]
+        processes = min(processes or cpu_count(), len(tasks))
+        if processes > 1:
+            pool = Pool(processes)
+            try:
+                infos = pool.map(_file_info, tasks, chunksize=max(1, len(tasks) / (processes * 4)))
+            finally:
+                pool.terminate()
+        else:
+            infos = [_file_info(task) for task in tasks]
+
+        files = {}
+        for path, size, checksum, file_guid, error in infos:
+            name = os.path.basename(path)
+            files['%s:%s' % (scope, name)] = {'path': path, 'scope': scope, 'name': name, 'bytes': size, 'adler32': checksum,
+                                              'guid': file_guid, 'pfn': None, 'state': RucioException(error) if error else None}
+        self.__stage(stages, 'checksum', [f for f in files.values() if f['state'] is None], start)
+        return files
+
+    def __check(self, files, rse, batch_size, threads, stages):
         """
-        This operation is used to upload files into the system. First, file size,
-        file checksum and access permissions on the local file system are derived.
-        Second, the rucio-server is called to register all necessary data in the
-        database i.e. add the file to file catalogue, add file metadata, add
-        replication rules. Note that file replicas without replication rule will be
-        deleted automatically and therefore at least one replication rule (default)
-        must be created. After the rucio server responded without error, the physical
-        copy of the file can be started. After the physical copy finished successfully
-        the replica's state is changed from 'queued' to 'active' to enable the
-        replica for users.
-
-        :param account Account identifier
-        :param sources Dictonary with the following structure: { path_to_file: { 'scope': scope, 'replication_spec': {replication_rules}, 'dataset': datasetname, 'checksum': checksum, 'filesize': filesize}}
-        :return: report represented by dictonary with informtion on a per file basis, e.g. { 'file.a': True, 'File.b': SourceNotFound, 'File.c': RSEAccessDenied, 'File.d': DatasetAcessDenied, ... }
+        Set the state of the files already registered with another checksum or available on the RSE.
+
+        :returns: The files to register or upload, with 'new' True for the files to register and 'register_replica'
+                  True for the files without replica on the RSE.
         """
-        report = {}
+        start = time.time()
+        batches = list(chunks([{'scope': f['scope'], 'name': f['name']} for f in files], batch_size))
+        existing = {}
+        for replicas in self.list_replicas_parallel(batches, max_workers=threads, all_states=True):
+            for replica in replicas:
+                existing['%s:%s' % (replica['scope'], replica['name'])] = replica
+
+        pending = []
+        for f in files:
+            replica = existing.get('%s:%s' % (f['scope'], f['name']))
+            f['new'] = replica is None
+            f['register_replica'] = replica is None or rse not in replica.get('states', {})
+            if replica is not None and replica['adler32'] != f['adler32']:
+                f['state'] = DataIdentifierAlreadyExists('%s:%s is already registered with the checksum %s' % (f['scope'], f['name'], replica['adler32']))
+            elif replica is not None and replica.get('states', {}).get(rse) == 'AVAILABLE':
+                f['state'] = 'exists'
+            else:
+                pending.append(f)
+        self.__stage(stages, 'check', files, start)
+        return pending
+
+    def __register(self, files, rse, dataset, lifetime, batch_size, threads, stages):
+        start = time.time()
+        if dataset:
+            try:
+                self.add_dataset(scope=dataset[0], name=dataset[1],
+                                 rules=[{'account': self.account, 'copies': 1, 'rse_expression': rse, 'grouping': 'DATASET', 'lifetime': lifetime}])
+                LOG.info('Dataset %s:%s successfully created' % tuple(dataset))
+            except DataIdentifierAlreadyExists:
+                LOG.warning('The dataset %s:%s already exists' % tuple(dataset))
+
+        def register(batch):
+            self.add_replicas(rse=rse, files=[{'scope': f['scope'], 'name': f['name'], 'bytes': f['bytes'], 'adler32': f['adler32'],
+                                               'state': 'C', 'meta': {'guid': f['guid']}} for f in batch if f['register_replica']])
+            new = [{'scope': f['scope'], 'name': f['name']} for f in batch if f['new']]
+            if new and not dataset:
+                self.add_replication_rule(new, copies=1, rse_expression=rse, lifetime=lifetime)
+
+        batches = list(chunks([f for f in files if f['register_replica']], batch_size))
+        for batch, error in zip(batches, self.__execute(register, batches, threads)):
+            if error is not None:
+                for f in batch:
+                    f['state'] = error
+        self.__stage(stages, 'register', sum(batches, []), start)
 
-        for src in sources:
+    def __upload(self, files, rse_settings, threads, callback, stages):
+        start = time.time()
+        lfns = [{'scope': f['scope'], 'name': f['name'], 'adler32': f['adler32'], 'filesize': f['bytes'],
+                 'source_dir': os.path.dirname(f['path']) or '.'} for f in files]
+        results = rsemgr.upload_files(rse_settings, lfns, threads=threads, callback=callback)
+        for f in files:
+            result = results['%s:%s' % (f['scope'], f['name'])]
+            if isinstance(result, Exception):
+                f['state'] = result
+            else:
+                f['state'], f['pfn'] = 'uploaded', result
+        self.__stage(stages, 'upload', [f for f in files if f['state'] == 'uploaded'], start)
+
+    def __attach(self, files, dataset, stages):
+        if not dataset or not files:
+            return
+        start = time.time()
+        try:
+            self.add_files_to_datasets([{'scope': dataset[0], 'name': dataset[1],
+                                         'dids': [{'scope': f['scope'], 'name': f['name']} for f in files]}],
+                                       ignore_duplicate=True)
+        except Exception as error:
+            LOG.warning('Failed to attach the files to the dataset %s:%s: %s' % (dataset[0], dataset[1], str(error)))
+        self.__stage(stages, 'attach', files, start)
+
+    def __finalize(self, files, rse, batch_size, threads, stages):
+        start = time.time()
+
+        def finalize(batch):
+            self.update_replicas_states(rse=rse, files=[{'scope': f['scope'], 'name': f['name'], 'state': 'A'} for f in batch])
+
+        batches = list(chunks(files, batch_size))
+        for batch, error in zip(batches, self.__execute(finalize, batches, threads)):
+            if error is not None:
+                for f in batch:
+                    f['state'] = error
+        self.__stage(stages, 'finalize', files, start)
+
+    def __execute(self, function, batches, threads):
+        """
+        Call a function for each batch concurrently.
+
+        :returns: The list of the exceptions raised for each batch, or None.
+        """
+        def call(batch):
             try:
-                if not os.access(src, os.R_OK):
-                    report[src] = SourceAccessDenied()
-                    continue
-            except Exception:
-                report[src] = SourceNotFound()
-            if not sources[src].filesize:
-                sources[src].filesize = os.path.getsize(src)
-            if not sources[src].checksum:
-                pass  # sources[src].cheksum = TODO: Derive checksum
-
-        # Remove unaccessible/unexisting files from sources to avoid unnecessary checks on the server
-        for src in report:
-            del sources[src]
-
-        # ToDo the REST call for:  report = rucio_server.declare_for_upload(sources, atomic=False)
-        # ToDo: Merge the response from above into the report array (per file)
-        #       possible file status are: DatasetAcessDenied, ScopeAccessDenied, RSEOverQuota, InvalidMetadata, FileReplicaAlreadyExsists, FileConsitencyConfilct, InvalidRepliactionRule, FullStorage
-        #       if the transfer is considered to be fine, the value fo the file will be True
-        RSEMgr, recommendation = None, None  # In waiting
-        for src in sources:
-            if report[src]:
-                # ToDo the REST call for: recommendation = rucio_server.recommend_storage(account, sources[src])
-                # ToDo the REST call for: rucio_server.prepare_upload(account, sources[src], recommendation)
-                try:
-                    RSEMgr.upload(src, recommendation)
-                except (RSEAccessDenied, FullStorage), error:
-                    report[src] = error
-                    continue
-                # ToDo the REST call for: rucio_server.confirm_upload(src, recommendation)
-                report[src] = True
+                function(batch)
+            except Exception as error:
+                return error
+        return self.execute_concurrently(call, batches, max_workers=threads)
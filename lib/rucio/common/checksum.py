@@ -0,0 +1,235 @@
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#                       http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+Checksums of files and streams.
+
+All the requested algorithms are computed in a single pass over the data. Files
+are read with a fixed buffer, reused for every read, whose size does not depend
+on the content of the file.
+"""
+
+import hashlib
+import os
+import threading
+import time
+import zlib
+
+from multiprocessing import Pool, cpu_count
+
+from rucio.common.exception import RucioException
+
+# Size of the reads, in bytes
+BUFFER_SIZE = 1024 * 1024
+# Algorithms computed by default
+DEFAULT_ALGORITHMS = ('adler32', 'md5')
+# Interval to check if a file being written has grown, in seconds
+POLL_INTERVAL = 0.05
+
+
+class Adler32(object):
+    """
+    Adler-32 checksum, with the interface of the hashlib objects.
+    """
+
+    name = 'adler32'
+
+    def __init__(self, data=None):
+        # adler starting value is _not_ 0
+        self.__value = 1
+        if data is not None:
+            self.update(data)
+
+    def update(self, data):
+        self.__value = zlib.adler32(data, self.__value)
+
+    def hexdigest(self):
+        return '%08x' % (self.__value & 0xffffffff)
+
+
+def is_supported(algorithm):
+    """
+    Check if a checksum algorithm is supported.
+
+    :param algorithm: The name of the algorithm, adler32 or any hashlib algorithm.
+    :returns: True if the algorithm is supported.
+    """
+    if algorithm == 'adler32':
+        return True
+    try:
+        hashlib.new(algorithm)
+    except ValueError:
+        return False
+    return True
+
+
+class Checksummer(object):
+    """
+    Compute several checksums of the same data in a single pass.
+    """
+
+    def __init__(self, algorithms=DEFAULT_ALGORITHMS):
+        """
+        :param algorithms: The names of the algorithms, adler32 or any hashlib algorithm.
+        :raises RucioException: If an algorithm is not supported.
+        """
+        self.__hashes = []
+        for algorithm in algorithms:
+            if algorithm == 'adler32':
+                self.__hashes.append((algorithm, Adler32()))
+            else:
+                try:
+                    self.__hashes.append((algorithm, hashlib.new(algorithm)))
+                except ValueError:
+                    raise RucioException('Checksum algorithm %s is not supported' % algorithm)
+        self.bytes = 0
+
+    def update(self, data):
+        """
+        Add data to the checksums.
+
+        :param data: A string or a buffer.
+        """
+        for _, hash in self.__hashes:
+            hash.update(data)
+        self.bytes += len(data)
+
+    def update_from(self, fileobj, size=None, buffer_size=BUFFER_SIZE):
+        """
+        Add the content of a file object to the checksums.
+
+        :param fileobj: The file object, opened in binary mode.
+        :param size: The maximum number of bytes to read. Until the end of the file if None.
+        :param buffer_size: The size of the reads.
+        :returns: The number of bytes read.
+        """
+        data = bytearray(buffer_size)
+        total = 0
+        while size is None or total < size:
+            length = fileobj.readinto(data if size is None or size - total >= buffer_size else memoryview(data)[:size - total])
+            if not length:
+                break
+            self.update(buffer(data, 0, length))
+            total += length
+        return total
+
+    def hexdigests(self):
+        """
+        :returns: A dictionary with the algorithm names as keys and the hexadecimal checksums as values.
+        """
+        return dict((algorithm, hash.hexdigest()) for algorithm, hash in self.__hashes)
+
+
+def file_checksums(path, algorithms=DEFAULT_ALGORITHMS, buffer_size=BUFFER_SIZE):
+    """
+    Compute the checksums of a file in a single pass.
+
+    :param path: The path of the file.
+    :param algorithms: The names of the algorithms.
+    :param buffer_size: The size of the reads.
+    :returns: A dictionary with the algorithm names as keys and the hexadecimal checksums as values.
+    :raises IOError, OSError: If the file cannot be read.
+    """
+    checksummer = Checksummer(algorithms)
+    with open(path, 'rb') as fileobj:
+        # No need for a buffer larger than the file
+        checksummer.update_from(fileobj, buffer_size=min(buffer_size, os.fstat(fileobj.fileno()).st_size + 1))
+    return checksummer.hexdigests()
+
+
+def _file_checksums(args):
+    """
+    Compute the checksums of a file in the pool of checksum_files.
+
+    :returns: tuple (path, checksums or the exception).
+    """
+    path, algorithms, buffer_size = args
+    try:
+        return path, file_checksums(path, algorithms, buffer_size)
+    except Exception as error:
+        return path, RucioException('Could not get checksum of file %s: %s' % (path, error))
+
+
+def checksum_files(paths, algorithms=DEFAULT_ALGORITHMS, processes=None, buffer_size=BUFFER_SIZE):
+    """
+    Compute the checksums of many files in parallel, in a pool of processes.
+
+    :param paths: The list of the file paths.
+    :param algorithms: The names of the algorithms.
+    :param processes: The number of processes, the number of CPUs by default.
+    :param buffer_size: The size of the reads.
+    :returns: A dictionary with the paths as keys and the checksums, as returned by file_checksums, or the exception as values.
+    """
+    tasks = [(path, tuple(algorithms), buffer_size) for path in paths]
+    processes = min(processes or cpu_count(), len(tasks))
+    if processes <= 1:
+        return dict(_file_checksums(task) for task in tasks)
+    pool = Pool(processes)
+    try:
+        return dict(pool.imap_unordered(_file_checksums, tasks))
+    finally:
+        pool.terminate()
+
+
+def checksum_during(path, write, algorithms=DEFAULT_ALGORITHMS, expected=None, buffer_size=BUFFER_SIZE, poll_interval=POLL_INTERVAL):
+    """
+    Call a function writing a file, e.g. the get of a protocol, and compute the checksums of the file while it is written.
+
+    The data is read as soon as it is written, so the checksums are available when the
+    write is done instead of requiring another read of the file. This requires the file to be
+    written sequentially. The checksums are computed again from the complete file if the size of
+    the file does not match the data read, or if they do not match the expected checksums, as
+    the file may have been written out of order, e.g. by a transfer with parallel streams.
+
+    :param path: The path of the file written.
+    :param write: The function writing the file, called without arguments.
+    :param algorithms: The names of the algorithms.
+    :param expected: Optional dictionary with the expected checksums of the file, by algorithm.
+    :param buffer_size: The size of the reads.
+    :param poll_interval: The interval to check if the file has grown, in seconds.
+    :returns: A dictionary with the algorithm names as keys and the hexadecimal checksums as values.
+    :raises: The exception raised by the write function.
+    """
+    checksummer = Checksummer(algorithms)
+    done = threading.Event()
+    errors = []
+
+    def follow():
+        try:
+            fileobj = None
+            while fileobj is None:
+                try:
+                    fileobj = open(path, 'rb')
+                except IOError:
+                    if done.is_set():
+                        return
+                    time.sleep(poll_interval)
+            with fileobj:
+                while True:
+                    # Check before reading, so the end of the file is read after the write is done
+                    finished = done.is_set()
+                    if not checksummer.update_from(fileobj, buffer_size=buffer_size) and finished:
+                        return
+                    if not finished:
+                        time.sleep(poll_interval)
+        except Exception as error:
+            errors.append(error)
+
+    follower = threading.Thread(target=follow)
+    follower.daemon = True
+    follower.start()
+    try:
+        write()
+    finally:
+        done.set()
+        follower.join()
+
+    checksums = checksummer.hexdigests()
+    mismatch = expected and any(checksums.get(algorithm) != value for algorithm, value in expected.items())
+    if errors or mismatch or checksummer.bytes != os.path.getsize(path):
+        return file_checksums(path, algorithms, buffer_size)
+    return checksums
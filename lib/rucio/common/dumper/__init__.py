@@ -15,6 +15,7 @@ from rucio.common import config
 import contextlib
 import datetime
 import gzip
+import heapq
 import json
 import logging
 import magic
@@ -109,6 +110,10 @@ def get_requests_session():
 DUMPS_CACHE_DIR = 'cache'
 RESULTS_DIR = 'results'
 CHUNK_SIZE = 4194304  # 4MiB
+# Memory used by each external sort to sort the runs, in bytes
+SORT_BUFFER_SIZE = 256 * 1024 * 1024
+# Estimated memory overhead of each line kept in memory, in bytes
+LINE_OVERHEAD = 64
 
 
 # There are two Python modules with the name `magic`, luckily both do
@@ -193,6 +198,78 @@ def temp_file(directory, final_name=None):
         os.unlink(tpath)
 
 
+def _write_run(lines, compress, cache_dir):
+    fd, run_path = tempfile.mkstemp(dir=cache_dir, prefix='sortrun_')
+    os.close(fd)
+    run = gzip.open(run_path, 'wb', 1) if compress else open(run_path, 'wb')
+    with run:
+        for line in lines:
+            run.write(line)
+            run.write('\n')
+    return run_path
+
+
+def _read_run(run):
+    for line in run:
+        yield line[:-1]
+
+
+def external_sort(lines, key=None, buffer_size=SORT_BUFFER_SIZE, compress=False, cache_dir=DUMPS_CACHE_DIR):
+    '''
+    Generator sorting the strings of the iterable `lines` by byte value, as
+    `LC_ALL=C sort` does, using a bounded amount of memory.
+
+    The lines are sorted in memory in chunks of about `buffer_size` bytes.
+    If there is more than one chunk, each chunk is written to a temporary
+    file (a run) in `cache_dir`, and the runs are merged while iterating.
+    The runs are removed when the generator is exhausted or closed.
+
+    :param lines: Iterable of strings without newline.
+    :param key: Function returning the sort key of a line, the whole line by default.
+    :param buffer_size: Approximate memory used to sort a chunk, in bytes.
+    :param compress: Compress the runs with gzip, trading CPU for disk I/O.
+    :param cache_dir: Working dir where the runs are written.
+    '''
+    runs = []
+    try:
+        chunk = []
+        size = 0
+        for line in lines:
+            chunk.append(line)
+            size += len(line) + LINE_OVERHEAD
+            if size >= buffer_size:
+                chunk.sort(key=key)
+                runs.append(_write_run(chunk, compress, cache_dir))
+                chunk = []
+                size = 0
+
+        chunk.sort(key=key)
+        if not runs:
+            for line in chunk:
+                yield line
+            return
+        if chunk:
+            runs.append(_write_run(chunk, compress, cache_dir))
+        del chunk
+
+        files = [gzip.open(run, 'rb') if compress else open(run, 'rb') for run in runs]
+        try:
+            iterators = [_read_run(f) for f in files]
+            if key is None:
+                for line in heapq.merge(*iterators):
+                    yield line
+            else:
+                decorated = [((key(line), line) for line in iterator) for iterator in iterators]
+                for _, line in heapq.merge(*decorated):
+                    yield line
+        finally:
+            for f in files:
+                f.close()
+    finally:
+        for run in runs:
+            os.unlink(run)
+
+
 DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
 DATETIME_FORMAT_FULL = '%Y-%m-%dT%H:%M:%S'
 MILLISECONDS_RE = re.compile(r'\.(\d{3})Z$')
@@ -7,7 +7,8 @@
 # Authors:
 # - Fernando Lopez, <felopez@cern.ch>, 2015
 from rucio.common import dumper
-from rucio.common.dumper import error, DUMPS_CACHE_DIR
+from rucio.common.dumper import error, external_sort, DUMPS_CACHE_DIR, SORT_BUFFER_SIZE
+from rucio.common.dumper.dump_index import DumpIndex, INDEX_SUFFIX
 import data_models
 import datetime
 import logging
@@ -30,13 +31,13 @@ class Consistency(data_models.DataModel):
     @classmethod
     def dump(cls, subcommand, ddm_endpoint, storage_dump, prev_date_fname=None, next_date_fname=None,
              prev_date=None, next_date=None, sort_rucio_replica_dumps=False, date=None,
-             cache_dir=DUMPS_CACHE_DIR):
+             cache_dir=DUMPS_CACHE_DIR, sort_buffer_size=SORT_BUFFER_SIZE, compress_sort_runs=False):
         logger = logging.getLogger('auditor.consistency')
         if subcommand == 'consistency':
             prev_date_fname = data_models.Replica.download(
-                ddm_endpoint, prev_date)
+                ddm_endpoint, prev_date, build_index=True)
             next_date_fname = data_models.Replica.download(
-                ddm_endpoint, next_date)
+                ddm_endpoint, next_date, build_index=True)
             assert prev_date_fname is not None
             assert next_date_fname is not None
         else:
@@ -76,81 +77,69 @@ class Consistency(data_models.DataModel):
                 relative = relative[1:]
             return '/'.join(relative)
 
-        if sort_rucio_replica_dumps:
-            prev_date_fname_sorted = gnu_sort(
-                parse_and_filter_file(prev_date_fname, parser=parser, cache_dir=cache_dir),
-                delimiter=',',
-                fieldspec='1',
-                cache_dir=cache_dir,
-            )
-
-            next_date_fname_sorted = gnu_sort(
-                parse_and_filter_file(next_date_fname, parser=parser, cache_dir=cache_dir),
-                delimiter=',',
-                fieldspec='1',
-                cache_dir=cache_dir,
-            )
-        else:
-            prev_date_fname_sorted = parse_and_filter_file(
-                prev_date_fname,
-                parser=parser,
-                cache_dir=cache_dir,
-            )
-            next_date_fname_sorted = parse_and_filter_file(
-                next_date_fname,
-                parser=parser,
-                cache_dir=cache_dir,
-            )
+        def replica_path(line):
+            '''
+            Sort key of the parsed Rucio replica dumps: the path without the status.
+            '''
+            return line.rsplit(',', 1)[0]
 
-        standard_name_re = r'(ddmendpoint_{0}_\d{{2}}-\d{{2}}-\d{{4}}_[0-9a-f]{{40}})$'.format(ddm_endpoint)
-        standard_name_match = re.search(standard_name_re, storage_dump)
-        if standard_name_match is not None:
-            # If the original filename was generated using the expected format,
-            # just use the name as prefix for the parsed file.
-            sd_prefix = standard_name_match.group(0)
-        elif date is not None:
-            # Otherwise try to use the date information and DDMEndpoint name to
-            # have a meaningful filename.
-            sd_prefix = 'ddmendpoint_{0}_{1}'.format(
-                ddm_endpoint,
-                date.strftime('%d-%m-%Y'),
-            )
-        else:
-            # As last resort use only the DDMEndpoint name, but this is error
-            # prone as old dumps may interfere with the checks.
-            sd_prefix = 'ddmendpoint_{0}_unknown_date'.format(
-                ddm_endpoint,
-            )
-            logger.warn(
-                'Using basic and error prune naming for RSE dump as no date '
-                'information was provided, %s dump will be named %s',
-                ddm_endpoint,
-                sd_prefix,
-            )
+        # Up to three sorts keep their buffer in memory at the same time
+        # while the dumps are compared, they share the sort buffer.
+        if sort_rucio_replica_dumps:
+            sort_buffer_size //= 3
+
+        logger.debug(
+            'Comparing %s with %s and %s (sort buffer of %d bytes)',
+            storage_dump,
+            prev_date_fname,
+            next_date_fname,
+            sort_buffer_size,
+        )
 
-        storage_dump_fname_sorted = gnu_sort(
-            parse_and_filter_file(
-                storage_dump,
-                parser=strip_storage_dump,
-                prefix=sd_prefix,
-                cache_dir=cache_dir,
-            ),
-            prefix=sd_prefix,
+        def replica_lines(fname):
+            '''
+            Parsed and sorted lines of a Rucio replica dump, read from the
+            index of the dump if it exists.
+            '''
+            if os.path.exists(fname + INDEX_SUFFIX):
+                with DumpIndex(fname + INDEX_SUFFIX) as index:
+                    for _, line in index:
+                        yield parser(line)
+                return
+
+            lines = parse_and_filter(fname, parser=parser)
+            if sort_rucio_replica_dumps:
+                lines = external_sort(
+                    lines,
+                    key=replica_path,
+                    buffer_size=sort_buffer_size,
+                    compress=compress_sort_runs,
+                    cache_dir=cache_dir,
+                )
+            for line in lines:
+                yield line
+
+        # The dumps are parsed, sorted and compared in a single pass, without
+        # intermediate files other than the runs of the external sort.
+        prev_date_lines = replica_lines(prev_date_fname)
+        next_date_lines = replica_lines(next_date_fname)
+
+        storage_dump_lines = external_sort(
+            parse_and_filter(storage_dump, parser=strip_storage_dump),
+            buffer_size=sort_buffer_size,
+            compress=compress_sort_runs,
             cache_dir=cache_dir,
         )
 
-        with open(prev_date_fname_sorted) as prevf:
-            with open(next_date_fname_sorted) as nextf:
-                with open(storage_dump_fname_sorted) as sdump:
-                    for path, where, status in compare3(prevf, sdump, nextf):
-                        prevstatus, nextstatus = status
+        for path, where, status in compare3(prev_date_lines, storage_dump_lines, next_date_lines):
+            prevstatus, nextstatus = status
 
-                        if where[0] and not where[1] and where[2]:
-                            if prevstatus == 'A' and nextstatus == 'A':
-                                yield cls('LOST', path)
+            if where[0] and not where[1] and where[2]:
+                if prevstatus == 'A' and nextstatus == 'A':
+                    yield cls('LOST', path)
 
-                        if not where[0] and where[1] and not where[2]:
-                            yield cls('DARK', path)
+            if not where[0] and where[1] and not where[2]:
+                yield cls('DARK', path)
 
 
 def _try_to_advance(it, default=None):
@@ -329,6 +318,21 @@ def gnu_sort(file_path, prefix=None, delimiter=None, fieldspec=None, cache_dir=D
     return sorted_path
 
 
+def parse_and_filter(filepath, parser=lambda s: s, filter_=lambda s: s):
+    '''
+    Streaming version of `parse_and_filter_file`: yields the version parsed
+    with the `parser` function of each line of `filepath` for which the
+    `filter_` function returns True, without writing it to a file.
+    '''
+    input_ = dumper.smart_open(filepath)
+    try:
+        for line in input_:
+            if filter_(line):
+                yield parser(line)
+    finally:
+        input_.close()
+
+
 def populate_args(argparser):
     # Option to download the rucio replica dumps automaticaly
     parser = argparser.add_parser(
@@ -27,6 +27,9 @@ from rucio.common.dumper import http_download_to_file
 from rucio.common.dumper import smart_open
 from rucio.common.dumper import temp_file
 from rucio.common.dumper import to_datetime
+from rucio.common.dumper.dump_index import DumpIndex
+from rucio.common.dumper.dump_index import INDEX_SUFFIX
+from rucio.common.dumper.dump_index import build_index
 
 
 class DataModel(object):
@@ -38,6 +41,8 @@ class DataModel(object):
     _FIELD_NAMES = None
     SCHEMA = []
     URI = None
+    # Fields identifying a record in the index of a dump
+    INDEX_FIELDS = ('scope', 'name')
     name = None
 
     def __init__(self, *args):
@@ -142,10 +147,56 @@ class DataModel(object):
         return instance
 
     @classmethod
-    def download(cls, rse, date='latest', cache_dir=DUMPS_CACHE_DIR):
+    def index_key(cls, line):
+        """
+        Key of a line of the dump in its index: the INDEX_FIELDS joined by ':'.
+        """
+        fields = line.split('\t')
+        return ':'.join(fields[cls.get_fieldnames().index(field)].strip() for field in cls.INDEX_FIELDS)
+
+    @classmethod
+    def build_index(cls, path, cache_dir=DUMPS_CACHE_DIR):
+        """
+        Builds, if it doesn't exist yet, the index of the dump in `path`
+        and returns the path of the index (`path` + INDEX_SUFFIX).
+        """
+        index_path = path + INDEX_SUFFIX
+        if not os.path.exists(index_path):
+            logger = logging.getLogger('auditor.data_models')
+            logger.debug('Building index of "%s"', path)
+            dump = smart_open(path)
+            try:
+                records = ((cls.index_key(line), line.rstrip('\n')) for line in dump if line.strip())
+                build_index(index_path, records, cache_dir=cache_dir)
+            finally:
+                dump.close()
+        return index_path
+
+    @classmethod
+    def open_index(cls, rse, date='latest', cache_dir=DUMPS_CACHE_DIR):
+        """
+        Downloads the requested dump if needed and returns its index as an
+        open DumpIndex.
+        """
+        return DumpIndex(cls.download(rse, date, cache_dir=cache_dir, build_index=True) + INDEX_SUFFIX)
+
+    @classmethod
+    def each_indexed(cls, index, rse=None, date=None, filter_=None, prefix=None):
+        """
+        Same as `each`, but reads the records from a DumpIndex in key order,
+        optionally only those whose key starts with `prefix`.
+        """
+        records = index.range() if prefix is None else index.prefix(prefix)
+        return cls.each((line for _, line in records), rse, date, filter_)
+
+    @classmethod
+    def download(cls, rse, date='latest', cache_dir=DUMPS_CACHE_DIR, build_index=False):
         """
         Downloads the requested dump and returns an open read-only mode file
         like object.
+
+        If `build_index` is True the index of the dump is built as well, once
+        per dump.
         """
         logger = logging.getLogger('auditor.data_models')
         requests_session = get_requests_session()
@@ -191,10 +242,24 @@ class DataModel(object):
             with temp_file(cache_dir, final_name=filename) as (tfile, _):
                 http_download_to_file(url, tfile, session=requests_session)
 
+        if build_index:
+            cls.build_index(path, cache_dir=cache_dir)
+
         return path
 
     @classmethod
-    def dump(cls, rse, date='latest', filter_=None):
+    def dump(cls, rse, date='latest', filter_=None, prefix=None):
+        if prefix is not None:
+            # Range scan on the index instead of parsing the whole dump
+            index_path = cls.download(rse, date, build_index=True) + INDEX_SUFFIX
+
+            def records():
+                with DumpIndex(index_path) as index:
+                    for record in cls.each_indexed(index, rse, date, filter_, prefix=prefix):
+                        yield record
+
+            return records()
+
         filename = cls.download(rse, date)
 
         # Should check errors, content size at least
@@ -266,6 +331,13 @@ class Replica(DataModel):
             logger.warn('Missing parameter\nrse: %s\ndataset: %s\n', self.rse, self.name)
         assert len(args) <= 9
 
+    @classmethod
+    def index_key(cls, line):
+        """
+        Replicas are indexed by path, formatted as in the consistency checks.
+        """
+        return line.split('\t')[6].strip().lstrip('/')
+
 
 class Filter(object):
     _Condition = collections.namedtuple('_Condition', ('comparator', 'attribute', 'expected'))
@@ -0,0 +1,218 @@
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+Compact on-disk index of the dumps.
+
+An index file holds (key, value) records sorted by key, e.g. the path and
+the original line of each replica of a Rucio replica dump. The records are
+stored in zlib compressed blocks, followed by a sparse index with the first
+key of each block, so that a key or a range of keys is found by reading a
+single block of the memory mapped file:
+
+    MAGIC
+    block 0: zlib('key\\tvalue\\nkey\\tvalue...')
+    ...
+    index: (offset, length, count, key length, first key) per block
+    footer: index offset, number of blocks, MAGIC
+
+Keys must not contain tabs or newlines, values must not contain newlines.
+"""
+
+import bisect
+import collections
+import mmap
+import os
+import struct
+import zlib
+
+from rucio.common.dumper import DUMPS_CACHE_DIR
+from rucio.common.dumper import SORT_BUFFER_SIZE
+from rucio.common.dumper import external_sort
+from rucio.common.dumper import temp_file
+
+MAGIC = 'RDIDX001'
+INDEX_SUFFIX = '.idx'
+# Uncompressed size of the blocks, in bytes
+BLOCK_SIZE = 65536
+# Number of decompressed blocks kept in memory by each reader
+BLOCK_CACHE_SIZE = 16
+
+_BLOCK_ENTRY = struct.Struct('>QIIH')
+_FOOTER = struct.Struct('>QI%ds' % len(MAGIC))
+
+
+class InvalidDumpIndex(Exception):
+    pass
+
+
+def build_index(path, records, presorted=False, block_size=BLOCK_SIZE, sort_buffer_size=SORT_BUFFER_SIZE,
+                cache_dir=DUMPS_CACHE_DIR):
+    '''
+    Write an index file with the given records.
+
+    :param path: Path of the index file. The file is created atomically.
+    :param records: Iterable of (key, value) string tuples.
+    :param presorted: The records are already sorted by key, skip the sort.
+    :param block_size: Uncompressed size of the blocks, in bytes.
+    :param sort_buffer_size: Memory used to sort the records, in bytes.
+    :param cache_dir: Working dir for the runs of the sort.
+    :returns: The path of the index file.
+    '''
+    lines = ('\t'.join(record) for record in records)
+    if not presorted:
+        # The tab sorts before any printable character, so the lines sort by key first
+        lines = external_sort(lines, buffer_size=sort_buffer_size, cache_dir=cache_dir)
+
+    directory, final_name = os.path.split(os.path.abspath(path))
+    with temp_file(directory, final_name=final_name) as (output, _):
+        output.write(MAGIC)
+        offset = len(MAGIC)
+        blocks = []
+        block, size = [], 0
+        for line in lines:
+            block.append(line)
+            size += len(line) + 1
+            if size >= block_size:
+                offset = _write_block(output, block, offset, blocks)
+                block, size = [], 0
+        if block:
+            offset = _write_block(output, block, offset, blocks)
+
+        for block_offset, length, count, first_key in blocks:
+            output.write(_BLOCK_ENTRY.pack(block_offset, length, count, len(first_key)))
+            output.write(first_key)
+        output.write(_FOOTER.pack(offset, len(blocks), MAGIC))
+    return path
+
+
+def _write_block(output, block, offset, blocks):
+    data = zlib.compress('\n'.join(block))
+    output.write(data)
+    blocks.append((offset, len(data), len(block), block[0].split('\t', 1)[0]))
+    return offset + len(data)
+
+
+class DumpIndex(object):
+    '''
+    Read-only access to an index file.
+
+    Example:
+    >>> index = DumpIndex('replicas.idx')
+    >>> 'user/jdoe/aa/bb/file' in index
+    >>> for key, value in index.range('user/jdoe/', 'user/jdoe0'):
+    >>>     print(value)
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            self._file.close()
+            raise InvalidDumpIndex('{0} is not a dump index'.format(path))
+
+        if len(self._map) < len(MAGIC) + _FOOTER.size or self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise InvalidDumpIndex('{0} is not a dump index'.format(path))
+        index_offset, nblocks, magic = _FOOTER.unpack(self._map[-_FOOTER.size:])
+        if magic != MAGIC:
+            self.close()
+            raise InvalidDumpIndex('{0} is truncated'.format(path))
+
+        self._offsets, self._lengths, self._counts, self._first_keys = [], [], [], []
+        position = index_offset
+        for _ in xrange(nblocks):
+            offset, length, count, key_length = _BLOCK_ENTRY.unpack(self._map[position:position + _BLOCK_ENTRY.size])
+            position += _BLOCK_ENTRY.size
+            self._offsets.append(offset)
+            self._lengths.append(length)
+            self._counts.append(count)
+            self._first_keys.append(self._map[position:position + key_length])
+            position += key_length
+        self._blocks = collections.OrderedDict()
+
+    def close(self):
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return sum(self._counts)
+
+    def _block(self, number):
+        '''
+        Return the keys and values of a block as two lists, with a small LRU cache.
+        '''
+        block = self._blocks.pop(number, None)
+        if block is None:
+            offset = self._offsets[number]
+            data = zlib.decompress(self._map[offset:offset + self._lengths[number]])
+            keys, values = [], []
+            for line in data.split('\n'):
+                key, value = line.split('\t', 1)
+                keys.append(key)
+                values.append(value)
+            block = (keys, values)
+            if len(self._blocks) >= BLOCK_CACHE_SIZE:
+                self._blocks.popitem(last=False)
+        self._blocks[number] = block
+        return block
+
+    def _first_block(self, key):
+        # The first block that can contain the key, blocks may start with the same key
+        return max(bisect.bisect_left(self._first_keys, key) - 1, 0)
+
+    def get(self, key, default=None):
+        '''
+        :returns: The value of the first record with the given key, or `default`.
+        '''
+        for record_key, value in self.range(key):
+            if record_key == key:
+                return value
+            break
+        return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def range(self, start=None, end=None):
+        '''
+        Generator of the (key, value) records with start <= key < end, in key order.
+
+        :param start: The first key, None to start from the first record.
+        :param end: The key after the last one, None to continue up to the last record.
+        '''
+        number = 0 if start is None else self._first_block(start)
+        while number < len(self._offsets):
+            keys, values = self._block(number)
+            position = 0 if start is None else bisect.bisect_left(keys, start)
+            for position in xrange(position, len(keys)):
+                if end is not None and keys[position] >= end:
+                    return
+                yield keys[position], values[position]
+            start = None
+            number += 1
+
+    def prefix(self, prefix):
+        '''
+        Generator of the (key, value) records whose key starts with `prefix`.
+        '''
+        for key, value in self.range(prefix):
+            if not key.startswith(prefix):
+                return
+            yield key, value
+
+    def __iter__(self):
+        return self.range()
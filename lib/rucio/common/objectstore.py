@@ -16,9 +16,13 @@ methods of objectstore
 import boto
 import boto.s3.connection
 import logging
+import threading
 import traceback
 import urlparse
 
+from ConfigParser import NoOptionError, NoSectionError
+from Queue import Queue, Empty
+
 from dogpile.cache import make_region
 from dogpile.cache.api import NoValue
 
@@ -37,6 +41,23 @@ REGION = make_region().configure('dogpile.cache.memory',
                                  expiration_time=3600)
 
 
+def _config_get_int(option, default):
+    try:
+        return config.config_get_int('objectstore', option)
+    except (NoOptionError, NoSectionError, ValueError):
+        return default
+
+
+# Lifetime of the connection and bucket objects, in seconds
+CONNECTION_TTL = _config_get_int('connection_ttl', 3600)
+# Number of concurrent HEAD requests of get_signed_urls, get_metadata and delete
+THREADS = _config_get_int('threads', 16)
+
+# The connections and buckets hold sockets, they are cached in the memory of the process only
+CONNECTIONS = make_region().configure('dogpile.cache.memory',
+                                      expiration_time=CONNECTION_TTL)
+
+
 def _get_credentials(rse, endpoint):
     """
     Pass an endpoint and return its credentials.
@@ -76,7 +97,7 @@ def _get_connection(rse, endpoint):
     """
 
     key = "connection:%s_%s" % (rse, endpoint)
-    result = REGION.get(key)
+    result = CONNECTIONS.get(key)
     if type(result) is NoValue:
         try:
             logging.debug("Creating connection object")
@@ -97,7 +118,7 @@ def _get_connection(rse, endpoint):
                                          is_secure=credentials['is_secure'],
                                          calling_format=boto.s3.connection.OrdinaryCallingFormat())
 
-                REGION.set(key, result)
+                CONNECTIONS.set(key, result)
                 logging.debug("Created connection object")
             else:
                 raise exception.CannotAuthenticate("Either access_key, secret_key or is_secure is not defined for RSE %s endpoint %s" % (rse, endpoint))
@@ -118,7 +139,7 @@ def _get_bucket(rse, endpoint, bucket_name, operation='read'):
     """
 
     key = "%s:%s:%s" % (rse, endpoint, bucket_name)
-    result = REGION.get(key)
+    result = CONNECTIONS.get(key)
     if type(result) is NoValue:
         try:
             logging.debug("Creating bucket object")
@@ -131,10 +152,10 @@ def _get_bucket(rse, endpoint, bucket_name, operation='read'):
                     raise exception.SourceNotFound('Bucket %s not found on %s' % (bucket_name, rse))
                 else:
                     result = bucket
-                    REGION.set(key, result)
+                    CONNECTIONS.set(key, result)
             else:
                 result = conn.create_bucket(bucket_name)
-                REGION.set(key, result)
+                CONNECTIONS.set(key, result)
         except exception.RucioException, e:
             raise e
         except:
@@ -182,46 +203,132 @@ def connect(rse, url):
         raise exception.RucioException("Failed to connect url %s, error: %s" % (url, traceback.format_exc()))
 
 
-def get_signed_urls(urls, rse, operation='read'):
+def _group_by_bucket(urls, result, message):
+    """
+    Group URLs by endpoint and bucket.
+
+    :param urls:          A list of URL string.
+    :param result:        Dictionary where the URLs which cannot be parsed are set, with the exception as value.
+    :param message:       The message of the exceptions.
+    :returns:             Dictionary of {(endpoint, bucket_name): {key_name: url}}.
+    """
+    buckets = {}
+    for url in urls:
+        try:
+            endpoint, bucket_name, key_name = _get_endpoint_bucket_key(url)
+            buckets.setdefault((endpoint, bucket_name), {})[key_name] = url
+        except exception.RucioException, e:
+            result[url] = exception.RucioException("%s %s, error: %s" % (message, url, e))
+    return buckets
+
+
+def _get_exception(error, message):
+    """
+    Convert the exception being handled to a rucio exception.
+
+    :param error:         The exception.
+    :param message:       The message, if the exception is not expected.
+    :returns:             Rucio exception.
+    """
+    if isinstance(error, boto.exception.S3ResponseError):
+        if error.status in [404, 403]:
+            return exception.DestinationNotAccessible(error)
+        return exception.ServiceUnavailable(error)
+    if isinstance(error, exception.RucioException):
+        return error
+    return exception.RucioException("%s, error: %s" % (message, traceback.format_exc()))
+
+
+def _run_concurrently(function, items, threads=THREADS):
+    """
+    Call a function on each item, from several threads.
+
+    :param function:      The function, which must not raise.
+    :param items:         A list of items.
+    :param threads:       The number of threads.
+    :returns:             The list of the return values, in no particular order.
+    """
+    if len(items) <= 1 or threads <= 1:
+        return [function(item) for item in items]
+    queue = Queue()
+    for item in items:
+        queue.put(item)
+    results = []
+
+    def worker():
+        while True:
+            try:
+                item = queue.get_nowait()
+            except Empty:
+                return
+            results.append(function(item))
+
+    workers = [threading.Thread(target=worker) for _ in xrange(min(threads, len(items)))]
+    for thread in workers:
+        thread.daemon = True
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return results
+
+
+def _generate_get_url(key):
+    """
+    Sign a GET request of a key.
+
+    :param key:           Key object.
+    :returns:             Signed URL.
+    """
+    try:
+        return key.generate_url(3600, 'GET', query_auth=True, merge_meta=False, force_http=False)
+    except TypeError:
+        # merge_meta option is not supported
+        return key.generate_url(3600, 'GET', query_auth=True, force_http=False)
+
+
+def get_signed_urls(urls, rse, operation='read', check=True):
     """
     Pass list of urls and return their signed urls.
 
+    The URLs are signed locally. The connection and bucket are looked up once per bucket,
+    and the existence of the keys to read is checked with concurrent HEAD requests.
+
     :param urls:          A list of URL string.
     :param rse:           RSE name.
+    :param operation:     read or write.
+    :param check:         Check that the keys to read exist. If False, no request is sent to the object store to sign them.
     :returns:             Dictionary of Signed URLs.
     """
     result = {}
-    for url in urls:
+    for (endpoint, bucket_name), keys in _group_by_bucket(urls, result, 'Failed to get signed url for').items():
         try:
-            endpoint, bucket_name, key_name = _get_endpoint_bucket_key(url)
-
-            signed_url = None
             if operation == 'read':
-                # signed_url = conn.generate_url(3600, 'GET', bucket_name, key_name, query_auth=True, force_http=False)
-                bucket = _get_bucket(rse, endpoint, bucket_name)
-                key = bucket.get_key(key_name)
-                if key is None:
-                    signed_url = exception.SourceNotFound('Key %s not found on %s' % (key_name, endpoint))
+                if check:
+                    bucket = _get_bucket(rse, endpoint, bucket_name)
+
+                    def sign(item):
+                        key_name, url = item
+                        try:
+                            key = bucket.get_key(key_name)
+                            if key is None:
+                                return url, exception.SourceNotFound('Key %s not found on %s' % (key_name, endpoint))
+                            return url, _generate_get_url(key)
+                        except Exception, e:
+                            return url, _get_exception(e, "Failed to get signed url for %s" % url)
+                    result.update(_run_concurrently(sign, keys.items()))
                 else:
-                    try:
-                        signed_url = key.generate_url(3600, 'GET', query_auth=True, merge_meta=False, force_http=False)
-                    except TypeError:
-                        # merge_meta option is not supported
-                        signed_url = key.generate_url(3600, 'GET', query_auth=True, force_http=False)
+                    conn = _get_connection(rse, endpoint)
+                    for key_name, url in keys.items():
+                        result[url] = conn.generate_url(3600, 'GET', bucket_name, key_name, query_auth=True, force_http=False)
             else:
                 conn = _get_connection(rse, endpoint)
                 _get_bucket(rse, endpoint, bucket_name, operation='write')
-                signed_url = conn.generate_url(3600, 'PUT', bucket_name, key_name, query_auth=True, force_http=False)
-            result[url] = signed_url
-        except boto.exception.S3ResponseError as e:
-            if e.status in [404, 403]:
-                result[url] = exception.DestinationNotAccessible(e)
-            else:
-                result[url] = exception.ServiceUnavailable(e)
-        except exception.RucioException, e:
-            result[url] = e
-        except:
-            result[url] = exception.RucioException("Failed to get signed url for %s, error: %s" % (url, traceback.format_exc()))
+                for key_name, url in keys.items():
+                    result[url] = conn.generate_url(3600, 'PUT', bucket_name, key_name, query_auth=True, force_http=False)
+        except Exception, e:
+            for url in keys.values():
+                if url not in result:
+                    result[url] = _get_exception(e, "Failed to get signed url for %s" % url)
     return result
 
 
@@ -229,31 +336,30 @@ def get_metadata(urls, rse):
     """
     Pass list of urls and return their metadata.
 
+    The HEAD requests of the keys are sent concurrently.
+
     :param urls:          A list of URL string.
     :param rse:           RSE name.
     :returns:             Dictonary of metadatas.
     """
     result = {}
-    for url in urls:
+    for (endpoint, bucket_name), keys in _group_by_bucket(urls, result, 'Failed to get metadata for').items():
         try:
-            endpoint, bucket_name, key_name = _get_endpoint_bucket_key(url)
             bucket = _get_bucket(rse, endpoint, bucket_name)
-            metadata = None
-            key = bucket.get_key(key_name)
-            if key is None:
-                metadata = exception.SourceNotFound('Key %s not found on %s' % (key_name, endpoint))
-            else:
-                metadata = {'filesize': key.size}
-            result[url] = metadata
-        except boto.exception.S3ResponseError as e:
-            if e.status in [404, 403]:
-                raise exception.DestinationNotAccessible(e)
-            else:
-                raise exception.ServiceUnavailable(e)
-        except exception.RucioException, e:
-            result[url] = e
-        except:
-            result[url] = exception.RucioException("Failed to get metadata for %s, error: %s" % (endpoint, traceback.format_exc()))
+
+            def head(item):
+                key_name, url = item
+                try:
+                    key = bucket.get_key(key_name)
+                    if key is None:
+                        return url, exception.SourceNotFound('Key %s not found on %s' % (key_name, endpoint))
+                    return url, {'filesize': key.size}
+                except Exception, e:
+                    return url, _get_exception(e, "Failed to get metadata for %s" % url)
+            result.update(_run_concurrently(head, keys.items()))
+        except Exception, e:
+            for url in keys.values():
+                result[url] = _get_exception(e, "Failed to get metadata for %s" % url)
     return result
 
 
@@ -288,36 +394,28 @@ def delete(urls, rse):
     """
     Delete objects.
 
+    The objects of each bucket are deleted with multi-object delete requests, the buckets concurrently.
+
     :param urls:          A list of URL string.
     :param rse:           RSE name.
     :returns:             Dictonary of {'status': status, 'output': output}.
     """
-    result = {}
-    bucket_keys = {}
-    for url in urls:
-        try:
-            endpoint, bucket_name, key_name = _get_endpoint_bucket_key(url)
-            bucket_key = '%s+%s' % (endpoint, bucket_name)
-            if bucket_key not in bucket_keys:
-                bucket_keys[bucket_key] = {}
-            bucket_keys[bucket_key][key_name] = url
-        except:
-            result[url] = {'status': -1, 'output': "Failed to delete url: %s, error: %s" % (url, traceback.format_exc())}
+    errors = {}
+    buckets = _group_by_bucket(urls, errors, 'Failed to delete url')
+    result = dict((url, {'status': -1, 'output': str(error)}) for url, error in errors.items())
 
-    for bucket_key in bucket_keys:
+    def delete_bucket(item):
+        (endpoint, bucket_name), keys = item
         try:
-            endpoint, bucket_name = bucket_key.split('+')
             bucket = _get_bucket(rse, endpoint, bucket_name)
-            ret = _delete_keys(bucket, bucket_keys[bucket_key].keys())
-            for key in ret:
-                result[bucket_keys[bucket_key][key]] = ret[key]
+            ret = _delete_keys(bucket, keys.keys())
+            return dict((keys[key], ret[key]) for key in ret)
         except:
-            ret = {'status': -1, 'output': "Failed to delete url: %s, error: %s" % (url, traceback.format_exc())}
-            for key in bucket_keys[bucket_key].keys():
-                url = bucket_keys[bucket_key][key]
-                if url not in result:
-                    result[url] = ret
+            ret = {'status': -1, 'output': "Failed to delete urls on bucket %s of %s, error: %s" % (bucket_name, endpoint, traceback.format_exc())}
+            return dict((url, ret) for url in keys.values())
 
+    for ret in _run_concurrently(delete_bucket, buckets.items()):
+        result.update(ret)
     return result
 
 
@@ -0,0 +1,400 @@
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+Incremental decoders of the list responses.
+
+The decoders take an iterable of byte chunks, e.g. the iter_content() of a
+streamed HTTP response, and yield the decoded objects as soon as they are
+complete, so that the memory does not grow with the size of the response.
+The objects can be returned as compact records, i.e. named tuples with only
+the requested fields, instead of dictionaries.
+
+Besides the JSON stream, the objects can be sent in two compact formats,
+negotiated with the Accept header: the compact JSON stream and the msgpack
+stream. Both send each object as the list of its values, preceded by the
+columns, i.e. the keys, whenever they differ from the previous object:
+
+    {"columns": ["scope", "name", "bytes"]}
+    ["mock", "file_1", 1024]
+    ["mock", "file_2", 2048]
+
+The objects which are not dictionaries are sent as {"value": ...}.
+
+The streams can also be compressed with gzip or, if zstandard is installed,
+zstd, negotiated with the Accept-Encoding header.
+"""
+
+import json
+import time
+import zlib
+
+from collections import namedtuple
+from functools import partial
+from itertools import izip
+from xml.etree.ElementTree import XMLParser
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from rucio.common.exception import RucioException
+from rucio.common.utils import APIEncoder, datetime_parser
+
+# Maximum size of a JSON line, in bytes
+MAX_LINE_SIZE = 16 * 1024 * 1024
+
+METALINK_NS = '{urn:ietf:params:xml:ns:metalink}'
+
+JSON_STREAM = 'application/x-json-stream'
+COMPACT_JSON_STREAM = 'application/x-rucio-compact-json-stream'
+MSGPACK_STREAM = 'application/x-rucio-msgpack-stream'
+METALINK = 'application/metalink4+xml'
+
+GZIP_LEVEL = 1
+ZSTD_LEVEL = 3
+# Maximum time the compressed data is held back, in seconds
+FLUSH_INTERVAL = 1
+
+__RECORDS = {}
+
+
+def make_record(fields):
+    """
+    Get the named tuple class holding the given fields.
+
+    :param fields: The list of fields.
+    :returns: The named tuple class.
+    """
+    fields = tuple(fields)
+    if fields not in __RECORDS:
+        __RECORDS[fields] = namedtuple('Record', fields, rename=True)
+    return __RECORDS[fields]
+
+
+def iter_lines(chunks, max_line_size=MAX_LINE_SIZE):
+    """
+    Split a stream of byte chunks in lines. Empty lines are skipped.
+
+    :param chunks: Iterable of strings.
+    :param max_line_size: Maximum size of a line, to bound the buffered data.
+    :returns: Generator of the lines, without the line separator.
+    :raises RucioException: If a line is longer than max_line_size.
+    """
+    pending = ''
+    for chunk in chunks:
+        if not chunk:
+            continue
+        lines = chunk.split('\n')
+        lines[0] = pending + lines[0]
+        pending = lines.pop()
+        if len(pending) > max_line_size:
+            raise RucioException('Line longer than %s bytes in the response' % max_line_size)
+        for line in lines:
+            if line:
+                yield line
+    if pending:
+        yield pending
+
+
+def iter_json(chunks, fields=None, max_line_size=MAX_LINE_SIZE):
+    """
+    Decode a stream of JSON objects, one per line, e.g. an application/x-json-stream response.
+
+    :param chunks: Iterable of strings.
+    :param fields: If given, yield records with these fields instead of dictionaries.
+    :param max_line_size: Maximum size of a line, to bound the buffered data.
+    :returns: Generator of the decoded objects.
+    """
+    record = make_record(fields) if fields else None
+    for line in iter_lines(chunks, max_line_size=max_line_size):
+        obj = json.loads(line, object_hook=datetime_parser)
+        if record is not None:
+            obj = record._make(obj.get(field) for field in fields)
+        yield obj
+
+
+class _MetalinkTarget(object):
+    """
+    Parser target building a dictionary per file of a metalink, without building the XML tree.
+    """
+
+    def __init__(self):
+        self.files = []
+        self.current = None
+        self.attribute = None
+        self.text = []
+
+    def start(self, tag, attrib):
+        self.text = []
+        if tag == METALINK_NS + 'file':
+            self.current = {'scope': None, 'name': None, 'bytes': None,
+                            'adler32': None, 'md5': None, 'rses': {}}
+        elif tag == METALINK_NS + 'hash':
+            self.attribute = attrib.get('type')
+        elif tag == METALINK_NS + 'url':
+            self.attribute = attrib.get('location')
+
+    def data(self, data):
+        self.text.append(data)
+
+    def end(self, tag):
+        if self.current is None:
+            return
+        text = ''.join(self.text).strip()
+        if tag == METALINK_NS + 'file':
+            if self.current['name'] is None:
+                raise RucioException('Failed to locate identity-tag of a file in the metalink')
+            self.files.append(self.current)
+            self.current = None
+        elif tag == METALINK_NS + 'identity':
+            if ':' not in text:
+                raise RucioException('Failed extract scope,name from %s' % text)
+            self.current['scope'], self.current['name'] = text.split(':', 1)
+        elif tag == METALINK_NS + 'size':
+            self.current['bytes'] = int(text)
+        elif tag == METALINK_NS + 'hash':
+            if self.attribute in ('adler32', 'md5'):
+                self.current[self.attribute] = text
+        elif tag == METALINK_NS + 'url':
+            # The replicas without location are skipped
+            if self.attribute is not None:
+                self.current['rses'].setdefault(self.attribute, []).append(text)
+
+    def close(self):
+        pass
+
+
+def iter_metalink(chunks, fields=None):
+    """
+    Decode a metalink4+xml stream of file replicas.
+
+    :param chunks: Iterable of strings.
+    :param fields: If given, yield records with these fields instead of dictionaries.
+    :returns: Generator of dictionaries with scope, name, bytes, adler32, md5 and
+              rses, the dictionary of the PFNs per RSE.
+    """
+    record = make_record(fields) if fields else None
+    target = _MetalinkTarget()
+    parser = XMLParser(target=target)
+    for chunk in chunks:
+        parser.feed(chunk)
+        for replica in target.files:
+            yield replica if record is None else record._make(replica.get(field) for field in fields)
+        del target.files[:]
+    parser.close()
+    for replica in target.files:
+        yield replica if record is None else record._make(replica.get(field) for field in fields)
+
+
+def _iter_rows(values, fields=None):
+    """
+    Rebuild the objects of a compact stream from its decoded columns and rows.
+    """
+    record = make_record(fields) if fields else None
+    columns = None
+    for value in values:
+        if isinstance(value, dict):
+            if 'columns' in value:
+                columns = value['columns']
+            else:
+                yield value['value']
+            continue
+        if columns is None:
+            raise RucioException('Row received before its columns in the response')
+        obj = datetime_parser(dict(izip(columns, value)))
+        yield obj if record is None else record._make(obj.get(field) for field in fields)
+
+
+def iter_compact_json(chunks, fields=None, max_line_size=MAX_LINE_SIZE):
+    """
+    Decode a compact JSON stream.
+
+    :param chunks: Iterable of strings.
+    :param fields: If given, yield records with these fields instead of dictionaries.
+    :param max_line_size: Maximum size of a line, to bound the buffered data.
+    :returns: Generator of the decoded objects.
+    """
+    values = (json.loads(line, object_hook=datetime_parser) for line in iter_lines(chunks, max_line_size=max_line_size))
+    return _iter_rows(values, fields=fields)
+
+
+def iter_msgpack(chunks, fields=None, max_line_size=MAX_LINE_SIZE):
+    """
+    Decode a msgpack stream.
+
+    :param chunks: Iterable of strings.
+    :param fields: If given, yield records with these fields instead of dictionaries.
+    :param max_line_size: Maximum size of an object, to bound the buffered data.
+    :returns: Generator of the decoded objects.
+    :raises RucioException: If msgpack is not installed.
+    """
+    if msgpack is None:
+        raise RucioException('msgpack is needed to decode %s' % MSGPACK_STREAM)
+
+    def values():
+        unpacker = msgpack.Unpacker(object_hook=datetime_parser, max_buffer_size=max_line_size)
+        for chunk in chunks:
+            unpacker.feed(chunk)
+            for value in unpacker:
+                yield value
+    return _iter_rows(values(), fields=fields)
+
+
+# The decoders of the object streams, by content type
+STREAM_DECODERS = {JSON_STREAM: iter_json,
+                   COMPACT_JSON_STREAM: iter_compact_json,
+                   MSGPACK_STREAM: iter_msgpack}
+
+
+def stream_formats():
+    """
+    The content types of the object streams which can be encoded and decoded here.
+    """
+    formats = [JSON_STREAM, COMPACT_JSON_STREAM]
+    if msgpack is not None:
+        formats.append(MSGPACK_STREAM)
+    return formats
+
+
+def content_codings():
+    """
+    The content codings which can be compressed and decompressed here, by preference.
+    """
+    return ['zstd', 'gzip'] if zstandard is not None else ['gzip']
+
+
+class StreamEncoder(object):
+    """
+    Encode objects, e.g. the dictionaries of a list response, in one of the stream formats.
+    """
+
+    def __init__(self, content_type=JSON_STREAM):
+        """
+        :param content_type: The format of the stream.
+        :raises RucioException: If the format is not supported.
+        """
+        if content_type not in stream_formats():
+            raise RucioException('Cannot encode %s' % content_type)
+        self.content_type = content_type
+        self.columns = None
+        self.__default = APIEncoder().default
+
+    def encode(self, obj):
+        """
+        Encode one object of the stream.
+
+        :param obj: The dictionary, or any other JSON serializable object.
+        :returns: The string to send.
+        """
+        if self.content_type == JSON_STREAM:
+            return json.dumps(obj, cls=APIEncoder) + '\n'
+        if not isinstance(obj, dict):
+            return self.__dump({'value': obj})
+
+        columns = obj.keys()
+        data = ''
+        if columns != self.columns:
+            self.columns = columns
+            data = self.__dump({'columns': columns})
+        return data + self.__dump([obj[column] for column in columns])
+
+    def __dump(self, value):
+        if self.content_type == MSGPACK_STREAM:
+            return msgpack.packb(value, default=self.__default)
+        return json.dumps(value, cls=APIEncoder, separators=(',', ':')) + '\n'
+
+
+def compress_stream(chunks, encoding, level=None, flush_interval=FLUSH_INTERVAL):
+    """
+    Compress a stream of strings. The compressor is flushed when data was held back
+    for flush_interval seconds, so that the slow streams are still delivered incrementally.
+
+    :param chunks: Iterable of strings.
+    :param encoding: The content coding, gzip or zstd.
+    :param level: The compression level, the default of the coding if None.
+    :param flush_interval: Maximum time the compressed data is held back, in seconds.
+    :returns: Generator of the compressed strings.
+    :raises RucioException: If the coding is not supported.
+    """
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(level or GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        flush = partial(compressor.flush, zlib.Z_SYNC_FLUSH)
+    elif encoding == 'zstd' and zstandard is not None:
+        compressor = zstandard.ZstdCompressor(level=level or ZSTD_LEVEL).compressobj()
+        flush = partial(compressor.flush, zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+    else:
+        raise RucioException('Cannot compress with %s' % encoding)
+
+    flushed_at = time.time()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            flushed_at = time.time()
+        elif time.time() - flushed_at >= flush_interval:
+            data = flush()
+            flushed_at = time.time()
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class DecompressingReader(object):
+    """
+    File-like object decompressing the body of a response, e.g. the raw response of
+    requests when the content coding is not decoded by urllib3.
+    """
+
+    def __init__(self, raw, encoding, chunk_size=65536):
+        """
+        :param raw: The file-like object to read the compressed data from.
+        :param encoding: The content coding, gzip or zstd.
+        :param chunk_size: The size of the compressed reads, in bytes.
+        :raises RucioException: If the coding is not supported.
+        """
+        if encoding == 'gzip':
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'zstd' and zstandard is not None:
+            self.decompressor = zstandard.ZstdDecompressor().decompressobj()
+        else:
+            raise RucioException('Cannot decompress %s' % encoding)
+        self.raw = raw
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.offset = 0
+        self.eof = False
+
+    def read(self, amt=None):
+        """
+        Read up to amt decompressed bytes, everything if amt is None. An empty string means the end of the body.
+        """
+        if amt is None:
+            return ''.join(iter(partial(self.read, self.chunk_size), ''))
+        while self.offset >= len(self.buffer) and not self.eof:
+            data = self.raw.read(self.chunk_size)
+            if data:
+                self.buffer = self.decompressor.decompress(data)
+            else:
+                self.eof = True
+                flush = getattr(self.decompressor, 'flush', None)
+                self.buffer = flush() if flush is not None else ''
+            self.offset = 0
+        data = self.buffer[self.offset:self.offset + amt]
+        self.offset += len(data)
+        return data
+
+    def __getattr__(self, name):
+        # requests reads the urllib3 responses with stream(), which would bypass the decompression
+        if name == 'stream':
+            raise AttributeError(name)
+        return getattr(self.raw, name)
@@ -20,8 +20,6 @@ import pwd
 import re
 import socket
 import subprocess
-import zlib
-
 
 from getpass import getuser
 from itertools import izip_longest
@@ -30,6 +28,7 @@ from logging.handlers import RotatingFileHandler
 from urllib import urlencode, quote
 from uuid import uuid4 as uuid
 
+from rucio.common.checksum import file_checksums
 from rucio.common.config import config_get
 
 try:
@@ -110,23 +109,11 @@ def adler32(file):
 
     :returns: Hexified string, padded to 8 values.
     """
-
-    # adler starting value is _not_ 0
-    adler = 1L
-
     try:
-        openFile = open(file, 'rb')
-        for line in openFile:
-            adler = zlib.adler32(line, adler)
+        return file_checksums(file, algorithms=('adler32',))['adler32']
     except:
         raise Exception('FATAL - could not get checksum of file %s' % file)
 
-    # backflip on 32bit
-    if adler < 0:
-        adler = adler + 2 ** 32
-
-    return str('%08x' % adler)
-
 
 def str_to_date(string):
     """ Converts a RFC-1123 string to the corresponding datetime value.
@@ -10,16 +10,20 @@
 # - Mario Lassnig, <mario.lassnig@cern.ch>, 2013-2014
 # - Martin Barisits, <martin.barisits@cern.ch>, 2014
 
+from sqlalchemy import func
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql.expression import bindparam, text
 
 import rucio.core.account
 import rucio.core.rse
 
+from rucio.common.utils import chunks
 from rucio.db.sqla import models
 from rucio.db.sqla.session import read_session, transactional_session
 
 MAX_COUNTERS = 10
+# Maximum number of ids per IN clause
+CHUNK_SIZE = 1000
 
 
 @transactional_session
@@ -134,16 +138,7 @@ def get_updated_account_counters(total_workers, worker_number, session=None):
     """
     query = session.query(models.UpdatedAccountCounter.account, models.UpdatedAccountCounter.rse_id).\
         distinct(models.UpdatedAccountCounter.account, models.UpdatedAccountCounter.rse_id)
-
-    if total_workers > 0:
-        if session.bind.dialect.name == 'oracle':
-            bindparams = [bindparam('worker_number', worker_number),
-                          bindparam('total_workers', total_workers)]
-            query = query.filter(text('ORA_HASH(CONCAT(account, rse_id), :total_workers) = :worker_number', bindparams=bindparams))
-        elif session.bind.dialect.name == 'mysql':
-            query = query.filter('mod(md5(concat(account, rse_id)), %s) = %s' % (total_workers + 1, worker_number))
-        elif session.bind.dialect.name == 'postgresql':
-            query = query.filter('mod(abs((\'x\'||md5(concat(account, rse_id)))::bit(32)::int), %s) = %s' % (total_workers + 1, worker_number))
+    query = __filter_worker(query, total_workers, worker_number, session)
 
     return query.all()
 
@@ -158,17 +153,88 @@ def update_account_counter(account, rse_id, session=None):
     :param session:  Database session in use.
     """
 
-    updated_account_counters = session.query(models.UpdatedAccountCounter).filter_by(account=account, rse_id=rse_id).all()
+    query = session.query(models.UpdatedAccountCounter.id).filter_by(account=account, rse_id=rse_id)
+    __apply_updates([id for id, in query], session=session)
 
-    try:
-        account_counter = session.query(models.AccountUsage).filter_by(account=account, rse_id=rse_id).one()
-        account_counter.bytes += sum([updated_account_counter.bytes for updated_account_counter in updated_account_counters])
-        account_counter.files += sum([updated_account_counter.files for updated_account_counter in updated_account_counters])
-    except NoResultFound:
-        models.AccountUsage(rse_id=rse_id,
-                            account=account,
-                            files=sum([updated_account_counter.files for updated_account_counter in updated_account_counters]),
-                            bytes=sum([updated_account_counter.bytes for updated_account_counter in updated_account_counters])).save(session=session)
 
-    for update in updated_account_counters:
-        update.delete(flush=False, session=session)
+@transactional_session
+def update_account_counters(total_workers, worker_number, limit=1000, session=None):
+    """
+    Apply a batch of the updated_account_counters of a worker to the account_counters.
+
+    The updates are summed per account and rse_id in the database, each account_counter
+    is incremented in place and the consumed updates are deleted.
+
+    :param total_workers:      Number of total workers.
+    :param worker_number:      id of the executing worker.
+    :param limit:              Maximum number of updates to apply.
+    :param session:            Database session in use.
+    :returns:                  The number of applied updates.
+    """
+    query = session.query(models.UpdatedAccountCounter.id)
+    query = __filter_worker(query, total_workers, worker_number, session)
+    ids = [id for id, in query.limit(limit)]
+    __apply_updates(ids, session=session)
+    return len(ids)
+
+
+@read_session
+def get_updated_account_counters_lag(total_workers, worker_number, session=None):
+    """
+    Get the backlog of updated_account_counters of a worker.
+
+    :param total_workers:      Number of total workers.
+    :param worker_number:      id of the executing worker.
+    :param session:            Database session in use.
+    :returns:                  Dictionary with the number of pending updates and the creation date of the oldest one.
+    """
+    query = session.query(func.count(models.UpdatedAccountCounter.id), func.min(models.UpdatedAccountCounter.created_at))
+    query = __filter_worker(query, total_workers, worker_number, session)
+    rows, oldest = query.one()
+    return {'rows': rows, 'oldest': oldest}
+
+
+def __filter_worker(query, total_workers, worker_number, session):
+    """
+    Restrict a query on the updated_account_counters to the account and rse_id pairs of a worker.
+    """
+    if total_workers > 0:
+        if session.bind.dialect.name == 'oracle':
+            bindparams = [bindparam('worker_number', worker_number),
+                          bindparam('total_workers', total_workers)]
+            query = query.filter(text('ORA_HASH(CONCAT(account, rse_id), :total_workers) = :worker_number', bindparams=bindparams))
+        elif session.bind.dialect.name == 'mysql':
+            query = query.filter('mod(md5(concat(account, rse_id)), %s) = %s' % (total_workers + 1, worker_number))
+        elif session.bind.dialect.name == 'postgresql':
+            query = query.filter('mod(abs((\'x\'||md5(concat(account, rse_id)))::bit(32)::int), %s) = %s' % (total_workers + 1, worker_number))
+    return query
+
+
+def __apply_updates(ids, session):
+    """
+    Add the given updated_account_counters to the account_counters and delete them.
+    """
+    deltas = {}
+    for chunk in chunks(ids, CHUNK_SIZE):
+        query = session.query(models.UpdatedAccountCounter.account,
+                              models.UpdatedAccountCounter.rse_id,
+                              func.sum(models.UpdatedAccountCounter.files),
+                              func.sum(models.UpdatedAccountCounter.bytes)).\
+            filter(models.UpdatedAccountCounter.id.in_(chunk)).\
+            group_by(models.UpdatedAccountCounter.account, models.UpdatedAccountCounter.rse_id)
+        for account, rse_id, files, bytes in query:
+            total_files, total_bytes = deltas.get((account, rse_id), (0, 0))
+            deltas[(account, rse_id)] = (total_files + (files or 0), total_bytes + (bytes or 0))
+
+    for (account, rse_id), (files, bytes) in deltas.items():
+        rowcount = session.query(models.AccountUsage).filter_by(account=account, rse_id=rse_id).\
+            update({models.AccountUsage.files: models.AccountUsage.files + files,
+                    models.AccountUsage.bytes: models.AccountUsage.bytes + bytes},
+                   synchronize_session=False)
+        if not rowcount:
+            models.AccountUsage(rse_id=rse_id, account=account, files=files, bytes=bytes).save(session=session)
+
+    for chunk in chunks(ids, CHUNK_SIZE):
+        session.query(models.UpdatedAccountCounter).\
+            filter(models.UpdatedAccountCounter.id.in_(chunk)).\
+            delete(synchronize_session=False)
@@ -0,0 +1,220 @@
+"""
+  Copyright European Organization for Nuclear Research (CERN)
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+  http://www.apache.org/licenses/LICENSE-2.0
+
+  Deletion candidates are the replicas of a RSE which can be deleted, i.e.
+  with an expired tombstone and without locks, ordered by tombstone. They are
+  selected in the background from the replicas table, so that the reapers only
+  claim the first candidates of a RSE instead of scanning its replicas. A
+  claimed candidate stays in the queue until its replica is deleted, so that
+  it can be claimed again if the deletion fails.
+"""
+
+from datetime import datetime, timedelta
+from itertools import islice
+
+from sqlalchemy import and_, or_, exists, not_
+from sqlalchemy.sql.expression import bindparam, case, select, text
+
+from rucio.common.utils import chunks
+from rucio.db.sqla import models
+from rucio.db.sqla.constants import ReplicaState, OBSOLETE
+from rucio.db.sqla.session import read_session, transactional_session
+
+# Number of candidates checked against the replicas per query
+CHECK_CHUNK_SIZE = 100
+
+
+@transactional_session
+def add_deletion_candidates(rse_id, since=None, session=None):
+    """
+    Queue the deletable replicas of a RSE which are not queued yet.
+
+    :param rse_id:  The id of the RSE.
+    :param since:   Only consider the replicas whose tombstone expired or which were updated after this date,
+                    e.g. which lost their last lock. If None, all the replicas of the RSE are considered.
+    :param session: The database session in use.
+
+    :returns: The number of queued replicas.
+    """
+    now = datetime.utcnow()
+    none_value = None  # Hack to get pep8 happy...
+    queued = exists(select([1]).where(and_(models.DeletionCandidate.rse_id == models.RSEFileAssociation.rse_id,
+                                           models.DeletionCandidate.scope == models.RSEFileAssociation.scope,
+                                           models.DeletionCandidate.name == models.RSEFileAssociation.name)))
+    query = select([models.RSEFileAssociation.rse_id,
+                    models.RSEFileAssociation.scope,
+                    models.RSEFileAssociation.name,
+                    models.RSEFileAssociation.bytes,
+                    models.RSEFileAssociation.path,
+                    models.RSEFileAssociation.tombstone]).\
+        with_hint(models.RSEFileAssociation, "INDEX_RS_ASC(replicas REPLICAS_TOMBSTONE_IDX)  NO_INDEX_FFS(replicas REPLICAS_TOMBSTONE_IDX)", 'oracle').\
+        where(models.RSEFileAssociation.tombstone < now).\
+        where(models.RSEFileAssociation.lock_cnt == 0).\
+        where(case([(models.RSEFileAssociation.tombstone != none_value, models.RSEFileAssociation.rse_id), ]) == rse_id).\
+        where(models.RSEFileAssociation.state.in_((ReplicaState.AVAILABLE, ReplicaState.UNAVAILABLE,
+                                                   ReplicaState.BAD, ReplicaState.BEING_DELETED))).\
+        where(not_(queued))
+    if since:
+        # The tombstone set when the last lock is removed is in the past, the update date is not
+        query = query.where(or_(models.RSEFileAssociation.tombstone >= since,
+                                models.RSEFileAssociation.updated_at >= since))
+
+    stmt = models.DeletionCandidate.__table__.insert().\
+        from_select(['rse_id', 'scope', 'name', 'bytes', 'path', 'tombstone'], query)
+    return session.execute(stmt).rowcount
+
+
+@transactional_session
+def prune_deletion_candidates(rse_id, session=None):
+    """
+    Remove the queued replicas of a RSE which were deleted, locked or got a new tombstone since they were queued.
+
+    :param rse_id:  The id of the RSE.
+    :param session: The database session in use.
+
+    :returns: The number of removed candidates.
+    """
+    stmt = exists(select([1]).where(and_(models.RSEFileAssociation.rse_id == models.DeletionCandidate.rse_id,
+                                         models.RSEFileAssociation.scope == models.DeletionCandidate.scope,
+                                         models.RSEFileAssociation.name == models.DeletionCandidate.name,
+                                         models.RSEFileAssociation.lock_cnt == 0,
+                                         models.RSEFileAssociation.tombstone == models.DeletionCandidate.tombstone)))
+    return session.query(models.DeletionCandidate).\
+        filter(models.DeletionCandidate.rse_id == rse_id).\
+        filter(not_(stmt)).\
+        delete(synchronize_session=False)
+
+
+@read_session
+def count_deletion_candidates(rse_id, session=None):
+    """
+    Count the queued replicas of a RSE.
+
+    :param rse_id:  The id of the RSE.
+    :param session: The database session in use.
+
+    :returns: The number of candidates.
+    """
+    return session.query(models.DeletionCandidate).filter_by(rse_id=rse_id).count()
+
+
+@transactional_session
+def claim_deletion_candidates(rse_id, limit, bytes=None, worker_number=None, total_workers=None, delay_seconds=0, session=None):
+    """
+    Take the first queued replicas of a RSE, by tombstone, until the needed space is reached.
+
+    The candidates are checked against the replicas table. The ones which can no longer be
+    deleted are removed from the queue. The claimed candidates are marked as claimed and are
+    not returned again before delay_seconds, they are removed from the queue by delete_replicas.
+    The replicas used as transfer sources or whose deletion is in progress are left in the queue.
+
+    :param rse_id:        The id of the RSE.
+    :param limit:         The maximum number of replicas to return.
+    :param bytes:         The amount of needed bytes.
+    :param worker_number: The worker number, starting at 1.
+    :param total_workers: The total number of workers.
+    :param delay_seconds: The delay to retry failed deletions.
+    :param session:       The database session in use.
+
+    :returns: a list of dictionary replica, as list_unlocked_replicas.
+    """
+    now = datetime.utcnow()
+    none_value = None  # Hack to get pep8 happy...
+    query = session.query(models.DeletionCandidate.scope, models.DeletionCandidate.name).\
+        with_hint(models.DeletionCandidate, "INDEX(deletion_candidates DELETION_CANDIDATES_TOMBSTONE_IDX)", 'oracle').\
+        filter(models.DeletionCandidate.rse_id == rse_id).\
+        filter(or_(models.DeletionCandidate.claimed_at == none_value,
+                   models.DeletionCandidate.claimed_at < now - timedelta(seconds=delay_seconds))).\
+        order_by(models.DeletionCandidate.tombstone)
+
+    if worker_number and total_workers and total_workers - 1 > 0:
+        if session.bind.dialect.name == 'oracle':
+            bindparams = [bindparam('worker_number', worker_number - 1), bindparam('total_workers', total_workers - 1)]
+            query = query.filter(text('ORA_HASH(name, :total_workers) = :worker_number', bindparams=bindparams))
+        elif session.bind.dialect.name == 'mysql':
+            query = query.filter(text('mod(md5(name), %s) = %s' % (total_workers - 1, worker_number - 1)))
+        elif session.bind.dialect.name == 'postgresql':
+            query = query.filter(text('mod(abs((\'x\'||md5(name))::bit(32)::int), %s) = %s' % (total_workers - 1, worker_number - 1)))
+
+    needed_space = bytes
+    total_bytes, total_files = 0, 0
+    rows, claimed, dropped = [], [], []
+    candidates = iter(query.yield_per(CHECK_CHUNK_SIZE))
+    done = False
+    while not done:
+        page = [(scope, name) for scope, name in islice(candidates, CHECK_CHUNK_SIZE)]
+        if not page:
+            break
+        replicas, page_dropped = __check_candidates(rse_id=rse_id, candidates=page, delay_seconds=delay_seconds, session=session)
+        dropped.extend(page_dropped)
+        for replica in replicas:
+            if replica['state'] != ReplicaState.UNAVAILABLE:
+
+                total_bytes += replica['bytes']
+                if replica['tombstone'] != OBSOLETE and needed_space is not None and total_bytes > needed_space:
+                    done = True
+                    break
+
+                total_files += 1
+                if total_files > limit:
+                    done = True
+                    break
+
+            rows.append(replica)
+            claimed.append((replica['scope'], replica['name']))
+
+    for chunk in chunks(claimed, CHECK_CHUNK_SIZE):
+        session.query(models.DeletionCandidate).\
+            filter(models.DeletionCandidate.rse_id == rse_id).\
+            filter(or_(*[and_(models.DeletionCandidate.scope == scope, models.DeletionCandidate.name == name) for scope, name in chunk])).\
+            update({'claimed_at': now}, synchronize_session=False)
+    for chunk in chunks(dropped, CHECK_CHUNK_SIZE):
+        session.query(models.DeletionCandidate).\
+            filter(models.DeletionCandidate.rse_id == rse_id).\
+            filter(or_(*[and_(models.DeletionCandidate.scope == scope, models.DeletionCandidate.name == name) for scope, name in chunk])).\
+            delete(synchronize_session=False)
+    return rows
+
+
+def __check_candidates(rse_id, candidates, delay_seconds, session):
+    """
+    Check a page of candidates against the replicas and the transfer requests.
+
+    :returns: The deletable replicas, in the order of the candidates, and the (scope, name) of the candidates to remove from the queue.
+    """
+    now = datetime.utcnow()
+    replicas = {}
+    query = session.query(models.RSEFileAssociation.scope, models.RSEFileAssociation.name,
+                          models.RSEFileAssociation.path, models.RSEFileAssociation.bytes,
+                          models.RSEFileAssociation.tombstone, models.RSEFileAssociation.state,
+                          models.RSEFileAssociation.lock_cnt, models.RSEFileAssociation.updated_at).\
+        filter(models.RSEFileAssociation.rse_id == rse_id).\
+        filter(or_(*[and_(models.RSEFileAssociation.scope == scope, models.RSEFileAssociation.name == name) for scope, name in candidates]))
+    for scope, name, path, bytes, tombstone, state, lock_cnt, updated_at in query:
+        replicas[(scope, name)] = {'scope': scope, 'name': name, 'path': path, 'bytes': bytes,
+                                   'tombstone': tombstone, 'state': state, 'lock_cnt': lock_cnt, 'updated_at': updated_at}
+
+    # do no delete files used as sources
+    sources = set(session.query(models.Request.scope, models.Request.name).
+                  with_hint(models.Request, "INDEX(requests REQUESTS_SCOPE_NAME_RSE_IDX)", 'oracle').
+                  filter(or_(*[and_(models.Request.scope == scope, models.Request.name == name) for scope, name in candidates])))
+
+    deletable, dropped = [], []
+    for key in candidates:
+        replica = replicas.get(key)
+        if replica is None or replica['lock_cnt'] != 0 or replica['tombstone'] is None or replica['tombstone'] >= now:
+            dropped.append(key)
+        elif key in sources:
+            continue
+        elif replica['state'] == ReplicaState.BEING_DELETED and replica['updated_at'] >= now - timedelta(seconds=delay_seconds):
+            continue
+        elif replica['state'] in (ReplicaState.AVAILABLE, ReplicaState.UNAVAILABLE, ReplicaState.BAD, ReplicaState.BEING_DELETED):
+            deletable.append(dict((column, replica[column]) for column in ('scope', 'name', 'path', 'bytes', 'tombstone', 'state')))
+        else:
+            dropped.append(key)
+    return deletable, dropped
@@ -37,7 +37,7 @@ import rucio.core.replica  # import add_replicas
 import rucio.common.policy
 
 from rucio.common import exception
-from rucio.common.config import config_get
+from rucio.common.config import config_get, config_get_int
 from rucio.common.utils import str_to_date, is_archive
 from rucio.core import account_counter, rse_counter
 from rucio.core.message import add_message
@@ -53,6 +53,11 @@ logging.basicConfig(stream=sys.stdout,
                     level=getattr(logging, config_get('common', 'loglevel').upper()),
                     format='%(asctime)s\t%(process)d\t%(levelname)s\t%(message)s')
 
+try:
+    LIST_DIDS_BATCH_SIZE = config_get_int('database', 'list_dids_batch_size')
+except:
+    LIST_DIDS_BATCH_SIZE = 1000
+
 
 @read_session
 def list_expired_dids(worker_number=None, total_workers=None, limit=None, session=None):
@@ -314,6 +319,7 @@ def __add_files_to_dataset(scope, name, files, account, rse, ignore_duplicate=Fa
     :param rse: The RSE name for the replicas.
     :param ignore_duplicate: If True, ignore duplicate entries.
     :param session: The database session in use.
+    :returns: The list of the new contents.
     """
     # Get metadata from dataset
     try:
@@ -356,6 +362,7 @@ def __add_files_to_dataset(scope, name, files, account, rse, ignore_duplicate=Fa
     try:
         contents and session.bulk_insert_mappings(models.DataIdentifierAssociation, contents)
         session.flush()
+        return contents
     except IntegrityError as error:
         if match('.*IntegrityError.*ORA-02291: integrity constraint .*CONTENTS_CHILD_ID_FK.*violated - parent key not found.*', error.args[0]) \
                 or match('.*IntegrityError.*1452.*Cannot add or update a child row: a foreign key constraint fails.*', error.args[0]) \
@@ -444,6 +451,26 @@ def __add_collections_to_container(scope, name, collections, account, session):
         raise exception.RucioException(error.args)
 
 
+def __add_to_size(scope, name, contents, session):
+    """
+    Add new contents to the length, bytes and events of a did, detach_dids does the reverse.
+    The row is updated in the database, so that concurrent attachments are all counted.
+
+    :param scope: The scope name.
+    :param name: The data identifier name.
+    :param contents: The list of the new contents, with their bytes and events if known.
+    :param session: The database session in use.
+    """
+    if not contents:
+        return
+    values = {'length': func.coalesce(models.DataIdentifier.length, 0) + len(contents)}
+    for column in ('bytes', 'events'):
+        sizes = [content[column] for content in contents if content.get(column) is not None]
+        if sizes:
+            values[column] = func.coalesce(getattr(models.DataIdentifier, column), 0) + sum(sizes)
+    session.query(models.DataIdentifier).filter_by(scope=scope, name=name).update(values, synchronize_session=False)
+
+
 @transactional_session
 def attach_dids(scope, name, dids, account, rse=None, session=None):
     """
@@ -500,17 +527,19 @@ def attach_dids_to_dids(attachments, account, ignore_duplicate=False, session=No
                 raise exception.UnsupportedOperation("Data identifier '%(scope)s:%(name)s' is closed" % attachment)
 
             elif parent_did.did_type == DIDType.DATASET:
-                __add_files_to_dataset(scope=attachment['scope'], name=attachment['name'],
-                                       files=attachment['dids'], account=account,
-                                       ignore_duplicate=ignore_duplicate,
-                                       rse=attachment.get('rse'),
-                                       session=session)
+                contents = __add_files_to_dataset(scope=attachment['scope'], name=attachment['name'],
+                                                  files=attachment['dids'], account=account,
+                                                  ignore_duplicate=ignore_duplicate,
+                                                  rse=attachment.get('rse'),
+                                                  session=session)
+                __add_to_size(scope=parent_did.scope, name=parent_did.name, contents=contents, session=session)
 
             elif parent_did.did_type == DIDType.CONTAINER:
                 __add_collections_to_container(scope=attachment['scope'],
                                                name=attachment['name'],
                                                collections=attachment['dids'],
                                                account=account, session=session)
+                __add_to_size(scope=parent_did.scope, name=parent_did.name, contents=attachment['dids'], session=session)
 
             parent_did_condition.append(and_(models.DataIdentifier.scope == parent_did.scope,
                                              models.DataIdentifier.name == parent_did.name))
@@ -1295,10 +1324,14 @@ def set_status(scope, name, session=None, **kwargs):
 
 @stream_session
 def list_dids(scope, filters, type='collection', ignore_case=False, limit=None,
-              offset=None, long=False, session=None):
-    """0
+              offset=None, long=False, marker=None, name_range=None, session=None):
+    """
     Search data identifiers
 
+    The dids are returned ordered by name when a marker, an offset or a name range is given,
+    so that a listing can be resumed from the name of the last did received (keyset pagination)
+    or split in disjoint name ranges listed in parallel.
+
     :param scope: the scope name.
     :param filters: dictionary of attributes by which the results should be filtered.
     :param type: the type of the did: all(container, dataset, file), collection(dataset or container), dataset, container, file.
@@ -1306,6 +1339,8 @@ def list_dids(scope, filters, type='collection', ignore_case=False, limit=None,
     :param limit: limit number.
     :param offset: offset number.
     :param long: Long format option to display more information for each DID.
+    :param marker: only return the dids with a name greater than the marker, i.e. the name of the last did already received.
+    :param name_range: tuple (start, end) to only return the dids with start <= name < end. Either bound can be None.
     :param session: The database session in use.
     """
     types = ['all', 'collection', 'container', 'dataset', 'file']
@@ -1371,18 +1406,34 @@ def list_dids(scope, filters, type='collection', ignore_case=False, limit=None,
             query = query.\
                 with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle')
 
+    if marker:
+        query = query.filter(models.DataIdentifier.name > marker)
+
+    if name_range:
+        start, end = name_range
+        if start:
+            query = query.filter(models.DataIdentifier.name >= start)
+        if end:
+            query = query.filter(models.DataIdentifier.name < end)
+
+    if marker or offset or limit or name_range:
+        query = query.order_by(models.DataIdentifier.name)
+
+    if offset:
+        query = query.offset(offset)
+
     if limit:
         query = query.limit(limit)
 
     if long:
-        for scope, name, did_type, bytes, length in query.yield_per(5):
+        for scope, name, did_type, bytes, length in query.yield_per(LIST_DIDS_BATCH_SIZE):
             yield {'scope': scope,
                    'name': name,
                    'did_type': str(did_type),
                    'bytes': bytes,
                    'length': length}
     else:
-        for scope, name, did_type, bytes, length in query.yield_per(5):
+        for scope, name, did_type, bytes, length in query.yield_per(LIST_DIDS_BATCH_SIZE):
             yield name
 
 
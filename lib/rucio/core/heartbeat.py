@@ -9,16 +9,89 @@
 # - Mario Lassnig, <mario.lassnig@cern.ch>, 2015
 # - Vincent Garonne, <vincent.garonne@cern.ch>, 2015-2017
 
+import bisect
 import datetime
 import hashlib
+import time
 
+from ConfigParser import NoOptionError, NoSectionError
+
+from sqlalchemy import func
 from sqlalchemy.sql import distinct
 
 from rucio.db.sqla.models import Heartbeats
 from rucio.db.sqla.session import read_session, transactional_session
+from rucio.common.config import config_get_int
 from rucio.common.exception import DatabaseException
 from rucio.common.utils import pid_exists
 
+try:
+    ASSIGNMENT_LEASE = config_get_int('heartbeat', 'assignment_lease')
+except (NoOptionError, NoSectionError, ValueError):
+    ASSIGNMENT_LEASE = 300
+
+# (hash_executable, hostname, pid, thread_id, older_than) -> cached assignment of the thread
+__ASSIGNMENTS = {}
+
+
+class HashRing(object):
+    """
+    Consistent hashing ring over the live threads of an executable.
+    Adding or removing a thread only moves the keys of its neighbours on the ring.
+    """
+
+    def __init__(self, members, member=None, replicas=100):
+        """
+        :param members:  List of member identifiers.
+        :param member:   Identifier of the calling thread.
+        :param replicas: Number of points per member on the ring.
+        """
+        self.members = list(members)
+        self.member = member
+        self.__points = []
+        self.__owners = {}
+        for owner in self.members:
+            for replica in xrange(replicas):
+                point = self.__hash('%s-%s' % (owner, replica))
+                self.__owners[point] = owner
+                self.__points.append(point)
+        self.__points.sort()
+
+    @staticmethod
+    def __hash(key):
+        return int(hashlib.md5(str(key)).hexdigest()[:16], 16)
+
+    def __len__(self):
+        return len(self.members)
+
+    def get_member(self, key):
+        """
+        Return the member owning a key.
+
+        :param key: The key, e.g., a RSE id.
+        :returns:   The member identifier, None if the ring is empty.
+        """
+        if not self.__points:
+            return None
+        index = bisect.bisect(self.__points, self.__hash(key)) % len(self.__points)
+        return self.__owners[self.__points[index]]
+
+    def is_assigned(self, key):
+        """
+        Check if a key is assigned to the calling thread.
+
+        :param key: The key, e.g., a RSE id.
+        :returns:   True if the calling thread owns the key.
+        """
+        return self.get_member(key) == self.member
+
+
+def _member(hostname, pid, thread_id):
+    """
+    Return the identifier of a thread on the hash ring.
+    """
+    return '%s:%s:%s' % (hostname, pid, thread_id)
+
 
 @transactional_session
 def sanity_check(executable, hostname, hash_executable=None, pid=None, thread=None,
@@ -73,7 +146,9 @@ def live(executable, hostname, pid, thread, older_than=600, hash_executable=None
     The executable name is used for the calculation of thread assignments.
     Removal of stale heartbeats is done as a scheduled database job.
 
-    TODO: Returns an assignment dictionary for the given executable.
+    The assignment is cached per thread and only recomputed when the membership
+    generation of the executable (number of live heartbeats and latest registration)
+    changes, or when the cached assignment is older than ASSIGNMENT_LEASE seconds.
 
     :param executable: Executable name as a string, e.g., conveyor-submitter.
     :param hostname: Hostname as a string, e.g., rucio-daemon-prod-01.cern.ch.
@@ -101,6 +176,19 @@ def live(executable, hostname, pid, thread, older_than=600, hash_executable=None
                    pid=pid,
                    thread_id=thread.ident,
                    thread_name=thread.name).save(session=session)
+        session.flush()
+
+    # check if the membership changed since the last assignment
+    key = (hash_executable, hostname, pid, thread.ident, older_than)
+    generation = session.query(func.count(), func.max(Heartbeats.created_at))\
+                        .filter(Heartbeats.executable == hash_executable)\
+                        .filter(Heartbeats.updated_at >= datetime.datetime.utcnow() - datetime.timedelta(seconds=older_than))\
+                        .one()
+    generation = tuple(generation)
+    cached = __ASSIGNMENTS.get(key)
+    if cached and cached['generation'] == generation and time.time() - cached['refreshed_at'] < ASSIGNMENT_LEASE:
+        return {'assign_thread': cached['assign_thread'],
+                'nr_threads': cached['nr_threads']}
 
     # assign thread identifier
     query = session.query(Heartbeats.hostname,
@@ -125,10 +213,45 @@ def live(executable, hostname, pid, thread, older_than=600, hash_executable=None
             assign_thread = r
             break
 
+    __ASSIGNMENTS[key] = {'generation': generation,
+                          'refreshed_at': time.time(),
+                          'assign_thread': assign_thread,
+                          'nr_threads': len(result),
+                          'members': [_member(*r) for r in result],
+                          'ring': None}
+
     return {'assign_thread': assign_thread,
             'nr_threads': len(result)}
 
 
+@transactional_session
+def live_ring(executable, hostname, pid, thread, older_than=600, hash_executable=None, session=None):
+    """
+    Register a heartbeat for a process/thread on a given node and return
+    the consistent hashing ring of the live threads of the executable.
+    Keys are only moved between neighbouring threads when a thread joins or leaves.
+
+    :param executable: Executable name as a string, e.g., conveyor-submitter.
+    :param hostname: Hostname as a string, e.g., rucio-daemon-prod-01.cern.ch.
+    :param pid: UNIX Process ID as a number, e.g., 1234.
+    :param thread: Python Thread Object.
+    :param older_than: Ignore specified heartbeats older than specified nr of seconds.
+    :param hash_executable: Hash of the executable.
+
+    :returns ring: HashRing of the live threads; ring.is_assigned(key) tells if the key belongs to the thread.
+    """
+    if not hash_executable:
+        hash_executable = hashlib.sha256(executable).hexdigest()
+
+    live(executable=executable, hostname=hostname, pid=pid, thread=thread,
+         older_than=older_than, hash_executable=hash_executable, session=session)
+
+    cached = __ASSIGNMENTS[(hash_executable, hostname, pid, thread.ident, older_than)]
+    if cached['ring'] is None:
+        cached['ring'] = HashRing(cached['members'], member=_member(hostname, pid, thread.ident))
+    return cached['ring']
+
+
 @transactional_session
 def die(executable, hostname, pid, thread, older_than=None, hash_executable=None, session=None):
     """
@@ -156,6 +279,9 @@ def die(executable, hostname, pid, thread, older_than=None, hash_executable=None
 
     query.delete()
 
+    for key in [key for key in __ASSIGNMENTS if key[:4] == (hash_executable, hostname, pid, thread.ident)]:
+        __ASSIGNMENTS.pop(key, None)
+
 
 @transactional_session
 def cardiac_arrest(older_than=None, session=None):
@@ -172,6 +298,8 @@ def cardiac_arrest(older_than=None, session=None):
 
     query.delete()
 
+    __ASSIGNMENTS.clear()
+
 
 @read_session
 def list_heartbeats(session=None):
@@ -16,6 +16,7 @@ import logging
 import sys
 
 from datetime import datetime
+from uuid import UUID
 
 from sqlalchemy.exc import DatabaseError
 from sqlalchemy.sql.expression import and_, or_
@@ -24,10 +25,11 @@ import rucio.core.rule
 import rucio.core.did
 
 from rucio.common.config import config_get
+from rucio.common.utils import chunks
 from rucio.core.lifetime_exception import define_eol
 from rucio.core.rse import get_rse_name, get_rse_id
 from rucio.db.sqla import models
-from rucio.db.sqla.constants import LockState, RuleState, RuleGrouping, DIDType, RuleNotification
+from rucio.db.sqla.constants import LockState, ReplicaState, RuleState, RuleGrouping, DIDType, RuleNotification
 from rucio.db.sqla.session import read_session, transactional_session, stream_session
 
 logging.basicConfig(stream=sys.stdout,
@@ -250,60 +252,7 @@ def successful_transfer(scope, name, rse_id, nowait, session=None):
     :param nowait:   Nowait parameter for the for_update queries.
     :param session:  DB Session.
     """
-
-    locks = session.query(models.ReplicaLock).with_for_update(nowait=nowait).filter_by(scope=scope, name=name, rse_id=rse_id)
-    for lock in locks:
-        if lock.state == LockState.OK:
-            continue
-        logging.debug('Marking lock %s:%s for rule %s on rse %s as OK' % (lock.scope, lock.name, str(lock.rule_id), str(lock.rse_id)))
-        # Update the rule counters
-        rule = session.query(models.ReplicationRule).with_for_update(nowait=nowait).filter_by(id=lock.rule_id).one()
-        logging.debug('Updating rule counters for rule %s [%d/%d/%d]' % (str(rule.id), rule.locks_ok_cnt, rule.locks_replicating_cnt, rule.locks_stuck_cnt))
-
-        if lock.state == LockState.REPLICATING:
-            rule.locks_replicating_cnt -= 1
-        elif lock.state == LockState.STUCK:
-            rule.locks_stuck_cnt -= 1
-        rule.locks_ok_cnt += 1
-        lock.state = LockState.OK
-        logging.debug('Finished updating rule counters for rule %s [%d/%d/%d]' % (str(rule.id), rule.locks_ok_cnt, rule.locks_replicating_cnt, rule.locks_stuck_cnt))
-
-        # Insert UpdatedCollectionReplica
-        if rule.did_type == DIDType.DATASET:
-            models.UpdatedCollectionReplica(scope=rule.scope,
-                                            name=rule.name,
-                                            did_type=rule.did_type,
-                                            rse_id=rse_id).save(flush=False, session=session)
-        elif rule.did_type == DIDType.CONTAINER:
-            # Resolve to all child datasets
-            for dataset in rucio.core.did.list_child_datasets(scope=rule.scope, name=rule.name, session=session):
-                models.UpdatedCollectionReplica(scope=dataset['scope'],
-                                                name=dataset['name'],
-                                                did_type=dataset['type'],
-                                                rse_id=rse_id).save(flush=False, session=session)
-
-        # Update the rule state
-        if rule.state == RuleState.SUSPENDED:
-            pass
-        elif rule.locks_stuck_cnt > 0:
-            pass
-        elif rule.locks_replicating_cnt == 0 and rule.state == RuleState.REPLICATING:
-            rule.state = RuleState.OK
-            # Try to update the DatasetLocks
-            if rule.grouping != RuleGrouping.NONE:
-                ds_locks = session.query(models.DatasetLock).with_for_update(nowait=nowait).filter_by(rule_id=rule.id)
-                for ds_lock in ds_locks:
-                    ds_lock.state = LockState.OK
-                session.flush()
-                rucio.core.rule.generate_message_for_dataset_ok_callback(rule=rule, session=session)
-            if rule.notification == RuleNotification.YES:
-                rucio.core.rule.generate_email_for_rule_ok_notification(rule=rule, session=session)
-            # Try to release potential parent rules
-            rucio.core.rule.release_parent_rule(child_rule_id=rule.id, session=session)
-
-        # Insert rule history
-        rucio.core.rule.insert_rule_history(rule=rule, recent=True, longterm=False, session=session)
-        session.flush()
+    finished_transfers([{'scope': scope, 'name': name, 'rse_id': rse_id, 'state': ReplicaState.AVAILABLE}], nowait=nowait, session=session)
 
 
 @transactional_session
@@ -321,47 +270,131 @@ def failed_transfer(scope, name, rse_id, error_message=None, broken_rule_id=None
     :param nowait:          Nowait parameter for the for_update queries.
     :param session:         The database session in use.
     """
+    finished_transfers([{'scope': scope, 'name': name, 'rse_id': rse_id, 'state': ReplicaState.UNAVAILABLE,
+                         'error_message': error_message, 'broken_rule_id': broken_rule_id, 'broken_message': broken_message}],
+                       nowait=nowait, session=session)
+
 
-    locks = session.query(models.ReplicaLock).with_for_update(nowait=nowait).filter_by(scope=scope, name=name, rse_id=rse_id)
-    for lock in locks:
-        if lock.state == LockState.STUCK:
-            continue
-        logging.debug('Marking lock %s:%s for rule %s on rse %s as STUCK' % (lock.scope, lock.name, str(lock.rule_id), str(lock.rse_id)))
-        # Update the rule counters
-        rule = session.query(models.ReplicationRule).with_for_update(nowait=nowait).filter_by(id=lock.rule_id).one()
-        logging.debug('Updating rule counters for rule %s [%d/%d/%d]' % (str(rule.id), rule.locks_ok_cnt, rule.locks_replicating_cnt, rule.locks_stuck_cnt))
-        if lock.state == LockState.REPLICATING:
-            rule.locks_replicating_cnt -= 1
-        elif lock.state == LockState.OK:
-            rule.locks_ok_cnt -= 1
-        rule.locks_stuck_cnt += 1
-        lock.state = LockState.STUCK
-        logging.debug('Finished updating rule counters for rule %s [%d/%d/%d]' % (str(rule.id), rule.locks_ok_cnt, rule.locks_replicating_cnt, rule.locks_stuck_cnt))
-
-        # Update the rule state
-        if rule.state == RuleState.SUSPENDED:
-            pass
-        elif lock.rule_id == broken_rule_id:
-            rule.state = RuleState.SUSPENDED
-            rule.error = (broken_message[:245] + '...') if len(broken_message) > 245 else broken_message
-            # Try to update the DatasetLocks
-            if rule.grouping != RuleGrouping.NONE:
-                ds_locks = session.query(models.DatasetLock).with_for_update(nowait=nowait).filter_by(rule_id=rule.id)
-                for ds_lock in ds_locks:
-                    ds_lock.state = LockState.STUCK
-        elif rule.locks_stuck_cnt > 0:
-            if rule.state != RuleState.STUCK:
-                rule.state = RuleState.STUCK
+@transactional_session
+def finished_transfers(transfers, nowait=True, session=None):
+    """
+    Update the state of the replica locks, and the counters and states of their rules, for a batch of finished transfers.
+    The counter deltas are aggregated per rule, so that each rule is locked and updated once for the whole batch.
+
+    :param transfers:  List of dictionaries {'scope', 'name', 'rse_id', 'state'} with state ReplicaState.AVAILABLE for a
+                       successful transfer or ReplicaState.UNAVAILABLE for a failed one. Failed transfers can also have
+                       'error_message', 'broken_rule_id' and 'broken_message' (see failed_transfer).
+    :param nowait:     Nowait parameter for the for_update queries.
+    :param session:    The database session in use.
+    """
+    # The RSE ids are compared in the format returned by the database
+    outcomes = {}
+    for transfer in transfers:
+        outcomes[(transfer['scope'], transfer['name'], UUID(str(transfer['rse_id'])).hex)] = transfer
+
+    # Update the locks and aggregate the counter deltas per rule
+    rules = {}
+    for chunk in chunks(outcomes.keys(), 100):
+        condition = or_(*[and_(models.ReplicaLock.scope == scope,
+                               models.ReplicaLock.name == name,
+                               models.ReplicaLock.rse_id == rse_id) for scope, name, rse_id in chunk])
+        for lock in session.query(models.ReplicaLock).with_for_update(nowait=nowait).filter(condition):
+            transfer = outcomes[(lock.scope, lock.name, UUID(str(lock.rse_id)).hex)]
+            new_state = LockState.OK if transfer['state'] == ReplicaState.AVAILABLE else LockState.STUCK
+            if lock.state == new_state:
+                continue
+            logging.debug('Marking lock %s:%s for rule %s on rse %s as %s' % (lock.scope, lock.name, str(lock.rule_id), str(lock.rse_id), str(new_state)))
+            rule = rules.setdefault(lock.rule_id, {'ok': 0, 'replicating': 0, 'stuck': 0, 'rse_ids': set(), 'failure': None, 'broken_message': None})
+            if lock.state == LockState.REPLICATING:
+                rule['replicating'] -= 1
+            elif lock.state == LockState.STUCK:
+                rule['stuck'] -= 1
+            elif lock.state == LockState.OK:
+                rule['ok'] -= 1
+            if new_state == LockState.OK:
+                rule['ok'] += 1
+                rule['rse_ids'].add(lock.rse_id)
+            else:
+                rule['stuck'] += 1
+                rule['failure'] = transfer
+                if transfer.get('broken_rule_id') == lock.rule_id:
+                    rule['broken_message'] = transfer.get('broken_message')
+            lock.state = new_state
+
+    # Apply the deltas and the state transitions, once per rule
+    collection_replicas, child_datasets = set(), {}
+    for chunk in chunks(rules.keys(), 100):
+        for rule in session.query(models.ReplicationRule).with_for_update(nowait=nowait).filter(models.ReplicationRule.id.in_(chunk)):
+            deltas = rules[rule.id]
+            logging.debug('Updating rule counters for rule %s [%d/%d/%d]' % (str(rule.id), rule.locks_ok_cnt, rule.locks_replicating_cnt, rule.locks_stuck_cnt))
+            rule.locks_ok_cnt += deltas['ok']
+            rule.locks_replicating_cnt += deltas['replicating']
+            rule.locks_stuck_cnt += deltas['stuck']
+            logging.debug('Finished updating rule counters for rule %s [%d/%d/%d]' % (str(rule.id), rule.locks_ok_cnt, rule.locks_replicating_cnt, rule.locks_stuck_cnt))
+
+            # Collect the UpdatedCollectionReplica
+            if deltas['rse_ids']:
+                if rule.did_type == DIDType.DATASET:
+                    datasets = [{'scope': rule.scope, 'name': rule.name, 'type': rule.did_type}]
+                elif rule.did_type == DIDType.CONTAINER:
+                    # Resolve to all child datasets
+                    if (rule.scope, rule.name) not in child_datasets:
+                        child_datasets[(rule.scope, rule.name)] = rucio.core.did.list_child_datasets(scope=rule.scope, name=rule.name, session=session)
+                    datasets = child_datasets[(rule.scope, rule.name)]
+                else:
+                    datasets = []
+                for dataset in datasets:
+                    for rse_id in deltas['rse_ids']:
+                        collection_replicas.add((dataset['scope'], dataset['name'], dataset['type'], rse_id))
+
+            # Update the rule state
+            failure = deltas['failure']
+            if rule.state == RuleState.SUSPENDED:
+                pass
+            elif deltas['broken_message'] is not None:
+                broken_message = deltas['broken_message']
+                rule.state = RuleState.SUSPENDED
+                rule.error = (broken_message[:245] + '...') if len(broken_message) > 245 else broken_message
                 # Try to update the DatasetLocks
                 if rule.grouping != RuleGrouping.NONE:
                     ds_locks = session.query(models.DatasetLock).with_for_update(nowait=nowait).filter_by(rule_id=rule.id)
                     for ds_lock in ds_locks:
                         ds_lock.state = LockState.STUCK
-            if rule.error != error_message:
-                rule.error = (error_message[:245] + '...') if len(error_message) > 245 else error_message
-
-        # Insert rule history
-        rucio.core.rule.insert_rule_history(rule=rule, recent=True, longterm=False, session=session)
+            elif rule.locks_stuck_cnt > 0:
+                if failure:
+                    if rule.state != RuleState.STUCK:
+                        rule.state = RuleState.STUCK
+                        # Try to update the DatasetLocks
+                        if rule.grouping != RuleGrouping.NONE:
+                            ds_locks = session.query(models.DatasetLock).with_for_update(nowait=nowait).filter_by(rule_id=rule.id)
+                            for ds_lock in ds_locks:
+                                ds_lock.state = LockState.STUCK
+                    error_message = failure.get('error_message')
+                    if rule.error != error_message:
+                        rule.error = (error_message[:245] + '...') if error_message and len(error_message) > 245 else error_message
+            elif rule.locks_replicating_cnt == 0 and rule.state == RuleState.REPLICATING:
+                rule.state = RuleState.OK
+                # Try to update the DatasetLocks
+                if rule.grouping != RuleGrouping.NONE:
+                    ds_locks = session.query(models.DatasetLock).with_for_update(nowait=nowait).filter_by(rule_id=rule.id)
+                    for ds_lock in ds_locks:
+                        ds_lock.state = LockState.OK
+                    session.flush()
+                    rucio.core.rule.generate_message_for_dataset_ok_callback(rule=rule, session=session)
+                if rule.notification == RuleNotification.YES:
+                    rucio.core.rule.generate_email_for_rule_ok_notification(rule=rule, session=session)
+                # Try to release potential parent rules
+                rucio.core.rule.release_parent_rule(child_rule_id=rule.id, session=session)
+
+            # Insert rule history
+            rucio.core.rule.insert_rule_history(rule=rule, recent=True, longterm=False, session=session)
+
+    for scope, name, did_type, rse_id in collection_replicas:
+        models.UpdatedCollectionReplica(scope=scope,
+                                        name=name,
+                                        did_type=did_type,
+                                        rse_id=rse_id).save(flush=False, session=session)
+    session.flush()
 
 
 @transactional_session
@@ -15,15 +15,21 @@
 import json
 import re
 
-from sqlalchemy import or_
-from sqlalchemy.exc import DatabaseError, IntegrityError
-from sqlalchemy.sql.expression import bindparam, text
+from ConfigParser import NoOptionError, NoSectionError
 
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import DatabaseError, IntegrityError
 
+from rucio.common.config import config_get
 from rucio.common.exception import InvalidObject, RucioException
-from rucio.db.sqla.models import Message, MessageHistory
+from rucio.common.utils import chunks, generate_uuid
+from rucio.db.sqla.models import MESSAGE_BUCKETS, Message, MessageHistory
 from rucio.db.sqla.session import transactional_session
 
+DELETE_CHUNK_SIZE = 1000
+
+__ARCHIVERS = {}
+
 
 @transactional_session
 def add_message(event_type, payload, session=None):
@@ -46,58 +52,92 @@ def add_message(event_type, payload, session=None):
     new_message.save(session=session, flush=False)
 
 
+@transactional_session
+def add_messages(messages, session=None):
+    """
+    Add several messages, to be submitted asynchronously to a message broker, in a single insert.
+
+    :param messages: The messages as a list of dictionaries {'event_type', 'payload'}.
+    :param session: The database session to use.
+    """
+    try:
+        new_messages = [{'id': generate_uuid(),
+                         'event_type': message['event_type'],
+                         'payload': json.dumps(message['payload'])} for message in messages]
+    except TypeError, e:
+        raise InvalidObject('Invalid JSON for payload: %(e)s' % locals())
+
+    try:
+        if new_messages:
+            session.bulk_insert_mappings(Message, new_messages)
+    except DatabaseError, e:
+        if re.match('.*ORA-12899.*', e.args[0]) \
+           or re.match('.*1406.*', e.args[0]):
+            raise RucioException('Could not persist messages, payload too large')
+        raise RucioException(e.args)
+
+
+def get_buckets(thread=None, total_threads=None):
+    """
+    Return the message buckets consumed by a thread.
+
+    :param thread: Identifier of the caller thread as an integer.
+    :param total_threads: Maximum number of threads as an integer.
+
+    :returns: List of bucket numbers, or None for all buckets. Empty for the threads beyond the number of buckets.
+    """
+    if not total_threads or total_threads <= 1:
+        return None
+    return [bucket for bucket in xrange(MESSAGE_BUCKETS) if bucket % total_threads == thread]
+
+
 @transactional_session
 def retrieve_messages(bulk=1000, thread=None, total_threads=None, event_type=None,
-                      lock=False, session=None):
+                      lock=False, buckets=None, cursor=None, session=None):
     """
-    Retrieve up to $bulk messages.
+    Retrieve up to $bulk messages, in (created_at, id) order.
 
     :param bulk: Number of messages as an integer.
     :param thread: Identifier of the caller thread as an integer.
     :param total_threads: Maximum number of threads as an integer.
     :param event_type: Return only specified event_type. If None, returns everything except email.
     :param lock: Select exclusively some rows.
+    :param buckets: Return only messages of these buckets. Overrides thread and total_threads.
+    :param cursor: Return only messages after this (created_at, id) position, e.g. the last message of the previous call.
     :param session: The database session to use.
 
     :returns messages: List of dictionaries {id, created_at, event_type, payload}
     """
     messages = []
     try:
-        subquery = session.query(Message.id)
-        if total_threads and (total_threads - 1) > 0:
-            if session.bind.dialect.name == 'oracle':
-                bindparams = [bindparam('thread_number', thread), bindparam('total_threads', total_threads - 1)]
-                subquery = subquery.filter(text('ORA_HASH(id, :total_threads) = :thread_number', bindparams=bindparams))
-            elif session.bind.dialect.name == 'mysql':
-                subquery = subquery.filter('mod(md5(id), %s) = %s' % (total_threads - 1, thread))
-            elif session.bind.dialect.name == 'postgresql':
-                subquery = subquery.filter('mod(abs((\'x\'||md5(id))::bit(32)::int), %s) = %s' % (total_threads - 1, thread))
+        if buckets is None:
+            buckets = get_buckets(thread=thread, total_threads=total_threads)
+        if buckets == []:
+            return messages
+
+        query = session.query(Message.id,
+                              Message.created_at,
+                              Message.event_type,
+                              Message.payload)
+
+        if buckets is not None:
+            query = query.with_hint(Message, "index(messages MESSAGES_BUCKET_CREATED_IDX)", 'oracle')\
+                .filter(Message.bucket.in_(buckets))
 
         if event_type:
-            subquery = subquery.filter_by(event_type=event_type)
+            query = query.filter_by(event_type=event_type)
         else:
-            subquery = subquery.filter(Message.event_type != 'email')
+            query = query.filter(Message.event_type != 'email')
 
-        # Step 1:
-        # MySQL does not support limits in nested queries, limit on the outer query instead.
-        # This is not as performant, but the best we can get from MySQL.
-        if session.bind.dialect.name == 'mysql':
-            subquery = subquery.order_by(Message.created_at)
-        else:
-            subquery = subquery.order_by(Message.created_at).limit(bulk)
+        if cursor:
+            created_at, id = cursor
+            query = query.filter(or_(Message.created_at > created_at,
+                                     and_(Message.created_at == created_at, Message.id > id)))
 
-        query = session.query(Message.id,
-                              Message.created_at,
-                              Message.event_type,
-                              Message.payload)\
-            .filter(Message.id.in_(subquery))\
-            .with_for_update(nowait=True)
+        query = query.order_by(Message.created_at, Message.id).limit(bulk)
 
-        # Step 2:
-        # MySQL does not support limits in nested queries, limit on the outer query instead.
-        # This is not as performant, but the best we can get from MySQL.
-        if session.bind.dialect.name == 'mysql':
-            query = query.limit(bulk)
+        if lock:
+            query = query.with_for_update(nowait=True)
 
         for id, created_at, event_type, payload in query:
             messages.append({'id': id,
@@ -110,25 +150,61 @@ def retrieve_messages(bulk=1000, thread=None, total_threads=None, event_type=Non
         raise RucioException(e.args)
 
 
+@transactional_session
+def archive_messages(messages, session=None):
+    """
+    Archive messages to the history table.
+
+    :param messages: The messages to archive as a list of dictionaries.
+    :param session: The database session to use.
+    """
+    for chunk in chunks(messages, DELETE_CHUNK_SIZE):
+        session.bulk_insert_mappings(MessageHistory, chunk)
+
+
+def get_archiver():
+    """
+    Return the function archiving the delivered messages, set by messaging-hermes/archiver:
+    'database' for the history table (default), 'none' to drop them, or the dotted path of a
+    function accepting the messages and a session.
+
+    :returns: The archiver function, or None.
+    """
+    try:
+        archiver = config_get('messaging-hermes', 'archiver')
+    except (NoOptionError, NoSectionError):
+        archiver = 'database'
+
+    if archiver not in __ARCHIVERS:
+        if archiver == 'database':
+            __ARCHIVERS[archiver] = archive_messages
+        elif archiver == 'none':
+            __ARCHIVERS[archiver] = None
+        else:
+            module_path, function_name = archiver.rsplit('.', 1)
+            module = __import__(module_path, globals(), locals(), [function_name])
+            __ARCHIVERS[archiver] = getattr(module, function_name)
+    return __ARCHIVERS[archiver]
+
+
 @transactional_session
 def delete_messages(messages, session=None):
     """
     Delete all messages with the given IDs, and archive them to the history.
 
     :param messages: The messages to delete as a list of dictionaries.
+    :param session: The database session to use.
     """
-    message_condition = []
-    for message in messages:
-        message_condition.append(Message.id == message['id'])
-
     try:
-        if message_condition:
+        for chunk in chunks([message['id'] for message in messages], DELETE_CHUNK_SIZE):
             session.query(Message).\
                 with_hint(Message, "index(messages MESSAGES_ID_PK)", 'oracle').\
-                filter(or_(*message_condition)).\
+                filter(Message.id.in_(chunk)).\
                 delete(synchronize_session=False)
 
-            session.bulk_insert_mappings(MessageHistory, messages)
+        archiver = get_archiver()
+        if messages and archiver is not None:
+            archiver(messages, session=session)
     except IntegrityError, e:
         raise RucioException(e.args)
 
@@ -11,19 +11,293 @@
 
 """
 Graphite counters
+
+By default the metrics are aggregated in the process and flushed every
+monitor/flush_interval seconds by a background thread, in packets holding
+several metrics. Counters are summed, gauges keep their last value and
+timers keep a bounded random sample, sent with its sample rate so that
+statsd still computes the right counts and percentiles.
 """
 
+import atexit
+import logging
+import os
+import random
+import threading
 import time
 
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from ConfigParser import NoOptionError, NoSectionError
+
 from pystatsd import Client
 
-from rucio.common.config import config_get
+from rucio.common.config import config_get, config_get_bool, config_get_int
 
 SERVER = config_get('monitor', 'carbon_server')
 PORT = config_get('monitor', 'carbon_port')
 SCOPE = config_get('monitor', 'user_scope')
 CLIENT = Client(host=SERVER, port=PORT, prefix=SCOPE)
 
+try:
+    AGGREGATE = config_get_bool('monitor', 'aggregate')
+except (NoOptionError, NoSectionError, ValueError):
+    AGGREGATE = True
+
+try:
+    FLUSH_INTERVAL = config_get_int('monitor', 'flush_interval')
+except (NoOptionError, NoSectionError, ValueError):
+    FLUSH_INTERVAL = 10
+
+try:
+    SKETCH_SIZE = config_get_int('monitor', 'timer_sample_size')
+except (NoOptionError, NoSectionError, ValueError):
+    SKETCH_SIZE = 200
+
+MAX_PACKET_SIZE = 1400
+
+
+class TimerSketch(object):
+    """
+    Summary of the values of a timer over a flush interval: count, sum, min, max
+    and a uniform random sample of bounded size to estimate the percentiles.
+    """
+
+    def __init__(self, size=SKETCH_SIZE):
+        self.size = size
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.sample = []
+
+    def add(self, value):
+        """
+        Add a value to the sketch.
+
+        :param value: The value.
+        """
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if len(self.sample) < self.size:
+            self.sample.append(value)
+        else:
+            index = random.randint(0, self.count - 1)
+            if index < self.size:
+                self.sample[index] = value
+
+    def percentile(self, percent):
+        """
+        Estimate a percentile of the values.
+
+        :param percent: The percentile, between 0 and 100.
+        :returns: The estimated value, None if the sketch is empty.
+        """
+        if not self.sample:
+            return None
+        sample = sorted(self.sample)
+        return sample[min(len(sample) - 1, int(len(sample) * percent / 100.0))]
+
+    def summary(self):
+        """
+        :returns: Dictionary with the count, mean, min, max, p50, p90 and p99 of the values.
+        """
+        return {'count': self.count,
+                'mean': self.sum / self.count if self.count else None,
+                'min': self.min,
+                'max': self.max,
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99)}
+
+
+class MetricsAggregator(object):
+    """
+    Aggregate the metrics of the process and flush them periodically to statsd.
+    """
+
+    def __init__(self, client, flush_interval=FLUSH_INTERVAL, sketch_size=SKETCH_SIZE, max_packet_size=MAX_PACKET_SIZE):
+        """
+        :param client: The pystatsd client used to send the metrics.
+        :param flush_interval: Interval in seconds between the flushes.
+        :param sketch_size: Number of values sampled per timer and interval.
+        :param max_packet_size: Maximum size of the UDP packets in bytes.
+        """
+        self.client = client
+        self.flush_interval = flush_interval
+        self.sketch_size = sketch_size
+        self.max_packet_size = max_packet_size
+        self.__lock = threading.Lock()
+        self.__pid = None
+        self.__thread = None
+        self.__stop = threading.Event()
+        self.__reset()
+        # Totals exposed through the pull endpoint
+        self.totals = {'counters': {}, 'gauges': {}, 'timers': {}}
+
+    def __reset(self):
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+
+    def __ensure_started(self):
+        # The flush thread does not survive a fork, and the metrics of the parent must not be sent twice
+        if self.__pid != os.getpid():
+            with self.__lock:
+                if self.__pid != os.getpid():
+                    self.__reset()
+                    self.__pid = os.getpid()
+                    self.__stop.clear()
+                    self.__thread = threading.Thread(target=self.__run, name='monitor-flush')
+                    self.__thread.daemon = True
+                    self.__thread.start()
+
+    def __run(self):
+        while not self.__stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logging.exception('Cannot flush the metrics')
+
+    def counter(self, stats, delta=1):
+        """
+        Update one or more counters.
+
+        :param stats: The counter or a list of counters.
+        :param delta: The increment.
+        """
+        self.__ensure_started()
+        if not isinstance(stats, list):
+            stats = [stats]
+        with self.__lock:
+            for stat in stats:
+                self.counters[stat] = self.counters.get(stat, 0) + delta
+
+    def gauge(self, stat, value):
+        """
+        Set a gauge.
+
+        :param stat: The gauge.
+        :param value: The value.
+        """
+        self.__ensure_started()
+        with self.__lock:
+            self.gauges[stat] = value
+
+    def timer(self, stat, value):
+        """
+        Add a timing.
+
+        :param stat: The timer.
+        :param value: The time in milliseconds.
+        """
+        self.__ensure_started()
+        with self.__lock:
+            sketch = self.timers.get(stat)
+            if sketch is None:
+                sketch = self.timers[stat] = TimerSketch(size=self.sketch_size)
+            sketch.add(value)
+
+    def flush(self):
+        """
+        Send the metrics aggregated since the last flush.
+        """
+        with self.__lock:
+            counters, gauges, timers = self.counters, self.gauges, self.timers
+            self.__reset()
+            for stat, delta in counters.iteritems():
+                self.totals['counters'][stat] = self.totals['counters'].get(stat, 0) + delta
+            self.totals['gauges'].update(gauges)
+            for stat, sketch in timers.iteritems():
+                self.totals['timers'][stat] = sketch.summary()
+
+        lines = []
+        for stat, delta in counters.iteritems():
+            lines.append('%s:%s|c' % (self.__name(stat), delta))
+        for stat, value in gauges.iteritems():
+            lines.append('%s:%f|g' % (self.__name(stat), value))
+        for stat, sketch in timers.iteritems():
+            rate = ''
+            if sketch.count > len(sketch.sample):
+                rate = '|@%f' % (float(len(sketch.sample)) / sketch.count)
+            for value in sketch.sample:
+                lines.append('%s:%f|ms%s' % (self.__name(stat), value, rate))
+
+        packet = ''
+        for line in lines:
+            if packet and len(packet) + len(line) + 1 > self.max_packet_size:
+                self.__send(packet)
+                packet = ''
+            packet = '%s\n%s' % (packet, line) if packet else line
+        if packet:
+            self.__send(packet)
+
+    def __name(self, stat):
+        return '%s.%s' % (self.client.prefix, stat) if self.client.prefix else stat
+
+    def __send(self, packet):
+        try:
+            self.client.udp_sock.sendto(packet, self.client.addr)
+        except Exception:
+            logging.exception('Cannot send the metrics')
+
+    def stop(self):
+        """
+        Stop the flush thread and send the remaining metrics.
+        """
+        self.__stop.set()
+        if self.__pid == os.getpid():
+            if self.__thread.is_alive() and self.__thread is not threading.current_thread():
+                self.__thread.join(1)
+            self.flush()
+
+    def render(self):
+        """
+        Render the totals of the flushed metrics, one metric per line.
+
+        :returns: The metrics as text.
+        """
+        with self.__lock:
+            lines = ['%s %s' % (stat, value) for stat, value in sorted(self.totals['counters'].iteritems())]
+            lines += ['%s %s' % (stat, value) for stat, value in sorted(self.totals['gauges'].iteritems())]
+            for stat, summary in sorted(self.totals['timers'].iteritems()):
+                lines += ['%s.%s %s' % (stat, key, value) for key, value in sorted(summary.iteritems())]
+        return '\n'.join(lines) + '\n'
+
+
+AGGREGATOR = MetricsAggregator(CLIENT)
+atexit.register(AGGREGATOR.stop)
+
+
+def start_pull_server(port, host='localhost'):
+    """
+    Expose the metrics of the process over HTTP, as plain text, from a background thread.
+
+    :param port: The port to listen on, 0 for any free port.
+    :param host: The address to listen on.
+    :returns: The HTTPServer.
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = AGGREGATOR.render()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='monitor-pull')
+    thread.daemon = True
+    thread.start()
+    return server
+
 
 def record_counter(counters, delta=1):
     """
@@ -32,7 +306,10 @@ def record_counter(counters, delta=1):
     :param counters: The counter or a list of counters to be updated.
     :param delta: The increment for the counter, by default increment by 1.
     """
-    CLIENT.update_stats(counters, delta)
+    if AGGREGATE:
+        AGGREGATOR.counter(counters, delta)
+    else:
+        CLIENT.update_stats(counters, delta)
 
 
 def record_gauge(stat, value):
@@ -42,7 +319,10 @@ def record_gauge(stat, value):
     :param stat: The name of the stat to be updated.
     :param value: The value to log.
     """
-    CLIENT.gauge(stat, value)
+    if AGGREGATE:
+        AGGREGATOR.gauge(stat, value)
+    else:
+        CLIENT.gauge(stat, value)
 
 
 def record_timer(stat, time):
@@ -52,7 +332,10 @@ def record_timer(stat, time):
     :param stat: The name of the stat to be updated.
     :param value: The time to log.
     """
-    CLIENT.timing(stat, time)
+    if AGGREGATE:
+        AGGREGATOR.timer(stat, time)
+    else:
+        CLIENT.timing(stat, time)
 
 
 class record_timer_block(object):
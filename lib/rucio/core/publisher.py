@@ -0,0 +1,314 @@
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+Asynchronous STOMP publisher.
+
+Messages are put in a bounded in-memory queue and sent by one background
+thread per broker. Each thread keeps its connection open, reconnects with a
+backoff when the broker fails, and sends the queued messages in batches, so
+that the callers never wait on broker I/O. A message that cannot be sent is
+put back in the queue for another broker, up to max_attempts times.
+"""
+
+import logging
+import os
+import ssl
+import threading
+import time
+
+from Queue import Empty, Full, Queue
+
+import stomp
+
+from rucio.core.monitor import record_counter, record_gauge
+
+logging.getLogger('stomp').setLevel(logging.CRITICAL)
+
+MAX_BACKOFF = 60
+
+
+class PublisherListener(stomp.ConnectionListener):
+    """
+    Log the errors sent by a broker.
+    """
+
+    def __init__(self, broker):
+        self.__broker = broker
+
+    def on_error(self, headers, body):
+        logging.error('[publisher] [%s]: %s', self.__broker, body)
+
+
+class BrokerConnection(object):
+    """
+    Connection to one broker, reconnected on demand with an exponential backoff.
+    """
+
+    def __init__(self, broker, port, username=None, password=None, use_ssl=False,
+                 ssl_key_file=None, ssl_cert_file=None, timeout=3):
+        """
+        :param broker: The broker host.
+        :param port: The broker port.
+        :param username: The user name, for username/password authentication.
+        :param password: The password, for username/password authentication.
+        :param use_ssl: Authenticate with a SSL key and certificate.
+        :param ssl_key_file: The SSL key file.
+        :param ssl_cert_file: The SSL certificate file.
+        :param timeout: The socket timeout in seconds.
+        """
+        self.broker = broker
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.failures = 0
+        self.retry_at = 0
+        if use_ssl:
+            self.conn = stomp.Connection12(host_and_ports=[(broker, port)],
+                                           use_ssl=True,
+                                           ssl_key_file=ssl_key_file,
+                                           ssl_cert_file=ssl_cert_file,
+                                           ssl_version=ssl.PROTOCOL_TLSv1,
+                                           keepalive=True,
+                                           timeout=timeout)
+        else:
+            self.conn = stomp.Connection12(host_and_ports=[(broker, port)],
+                                           keepalive=True,
+                                           timeout=timeout)
+        self.conn.set_listener('rucio-publisher', PublisherListener(broker))
+
+    def is_available(self):
+        """
+        Check if the connection can be used, i.e. it is not waiting for a reconnection attempt.
+        """
+        return time.time() >= self.retry_at
+
+    def ensure_connected(self, name):
+        """
+        Connect to the broker if the connection is down.
+
+        :param name: The name of the publisher, used for the metrics.
+        """
+        if self.conn.is_connected():
+            return
+        record_counter('%s.reconnect.%s' % (name, self.broker.split('.')[0]))
+        logging.info('[publisher] connecting to %s', self.broker)
+        self.conn.start()
+        if self.use_ssl:
+            self.conn.connect(wait=True)
+        else:
+            self.conn.connect(self.username, self.password, wait=True)
+
+    def send(self, body, destination, headers):
+        """
+        Send a message on the connection.
+        """
+        self.conn.send(body=body, destination=destination, headers=headers)
+        self.failures = 0
+
+    def failed(self):
+        """
+        Close the connection after a failure and delay the next attempt.
+        """
+        self.failures += 1
+        self.retry_at = time.time() + min(2 ** self.failures, MAX_BACKOFF)
+        try:
+            self.conn.disconnect()
+        except Exception:
+            pass
+
+    def disconnect(self):
+        """
+        Close the connection.
+        """
+        try:
+            if self.conn.is_connected():
+                self.conn.disconnect()
+        except Exception:
+            pass
+
+
+class Publisher(object):
+    """
+    Publish messages to a set of brokers from background threads.
+    """
+
+    def __init__(self, brokers, port, destination, username=None, password=None, use_ssl=False,
+                 ssl_key_file=None, ssl_cert_file=None, timeout=3, queue_size=10000, batch_size=100,
+                 max_attempts=3, name='publisher'):
+        """
+        :param brokers: List of broker hosts.
+        :param port: The broker port.
+        :param destination: The default destination of the messages.
+        :param username: The user name, for username/password authentication.
+        :param password: The password, for username/password authentication.
+        :param use_ssl: Authenticate with a SSL key and certificate.
+        :param ssl_key_file: The SSL key file.
+        :param ssl_cert_file: The SSL certificate file.
+        :param timeout: The socket timeout in seconds.
+        :param queue_size: Maximum number of queued messages.
+        :param batch_size: Maximum number of messages sent by a thread per wake-up.
+        :param max_attempts: Number of brokers a message is tried on before it is dropped.
+        :param name: The name of the publisher, used for the metrics.
+        """
+        self.destination = destination
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.name = name
+        self.connections = [BrokerConnection(broker, port, username=username, password=password, use_ssl=use_ssl,
+                                             ssl_key_file=ssl_key_file, ssl_cert_file=ssl_cert_file, timeout=timeout)
+                            for broker in brokers]
+        self.__queue = Queue(maxsize=queue_size)
+        self.__lock = threading.Lock()
+        self.__pid = None
+        self.__threads = []
+        self.__stop = threading.Event()
+
+    def __ensure_started(self):
+        # The sender threads do not survive a fork
+        if self.__pid != os.getpid():
+            with self.__lock:
+                if self.__pid != os.getpid():
+                    self.__pid = os.getpid()
+                    self.__stop.clear()
+                    self.__threads = []
+                    for connection in self.connections:
+                        thread = threading.Thread(target=self.__run, args=(connection,),
+                                                  name='%s-%s' % (self.name, connection.broker))
+                        thread.daemon = True
+                        thread.start()
+                        self.__threads.append(thread)
+
+    def publish(self, body, headers=None, destination=None, block=False, timeout=None, callback=None):
+        """
+        Queue a message. The message is dropped if the queue is full or there is no broker.
+
+        :param body: The message body as a string.
+        :param headers: Dictionary of STOMP headers.
+        :param destination: The destination, if different from the default one.
+        :param block: Wait for room in the queue instead of dropping the message.
+        :param timeout: Maximum time to wait for room in the queue, in seconds.
+        :param callback: Function called from a sender thread with True once the message is sent,
+                         or with False if it is dropped.
+        :returns: True if the message was queued, False if it was dropped.
+        """
+        if not self.connections:
+            record_counter('%s.dropped' % self.name)
+            self.__notify(callback, False)
+            return False
+        self.__ensure_started()
+        try:
+            self.__queue.put((body, headers or {}, destination or self.destination, callback, 0),
+                             block=block, timeout=timeout)
+        except Full:
+            record_counter('%s.dropped' % self.name)
+            self.__notify(callback, False)
+            return False
+        return True
+
+    def flush(self, timeout=None):
+        """
+        Wait until all queued messages are sent or dropped.
+
+        :param timeout: Maximum time to wait, in seconds.
+        :returns: True if the queue was drained, False on timeout.
+        """
+        end = time.time() + timeout if timeout is not None else None
+        with self.__queue.all_tasks_done:
+            while self.__queue.unfinished_tasks:
+                if end is None:
+                    self.__queue.all_tasks_done.wait(1)
+                else:
+                    remaining = end - time.time()
+                    if remaining <= 0:
+                        return False
+                    self.__queue.all_tasks_done.wait(remaining)
+        return True
+
+    def discard(self):
+        """
+        Drop the queued messages.
+        """
+        while True:
+            try:
+                body, headers, destination, callback, attempts = self.__queue.get_nowait()
+            except Empty:
+                return
+            record_counter('%s.dropped' % self.name)
+            self.__notify(callback, False)
+            self.__queue.task_done()
+
+    def qsize(self):
+        """
+        Return the approximate number of queued messages.
+        """
+        return self.__queue.qsize()
+
+    def stop(self, timeout=None):
+        """
+        Send the queued messages, then stop the sender threads and close the connections.
+
+        :param timeout: Maximum time to wait for the queued messages to be sent, in seconds.
+        """
+        if self.__pid == os.getpid():
+            self.flush(timeout=timeout)
+            self.__stop.set()
+            for thread in self.__threads:
+                thread.join()
+        for connection in self.connections:
+            connection.disconnect()
+
+    def __notify(self, callback, success):
+        if callback is not None:
+            try:
+                callback(success)
+            except Exception:
+                logging.exception('[publisher] callback failed')
+
+    def __run(self, connection):
+        while not self.__stop.is_set():
+            if not connection.is_available():
+                self.__stop.wait(min(connection.retry_at - time.time(), 1))
+                continue
+
+            try:
+                batch = [self.__queue.get(timeout=0.5)]
+            except Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.__queue.get_nowait())
+                except Empty:
+                    break
+            record_gauge('%s.queue' % self.name, self.__queue.qsize())
+
+            sent = 0
+            try:
+                connection.ensure_connected(self.name)
+                for body, headers, destination, callback, attempts in batch:
+                    connection.send(body, destination, headers)
+                    sent += 1
+                    self.__notify(callback, True)
+            except Exception as error:
+                logging.warn('[publisher] could not send to %s: %s', connection.broker, str(error))
+                connection.failed()
+                for body, headers, destination, callback, attempts in batch[sent:]:
+                    self.__retry(body, headers, destination, callback, attempts + 1)
+            finally:
+                record_counter('%s.sent' % self.name, sent)
+                for _ in batch:
+                    self.__queue.task_done()
+
+    def __retry(self, body, headers, destination, callback, attempts):
+        if attempts < self.max_attempts:
+            try:
+                self.__queue.put_nowait((body, headers, destination, callback, attempts))
+                return
+            except Full:
+                pass
+        record_counter('%s.failed' % self.name)
+        self.__notify(callback, False)
@@ -19,6 +19,7 @@
 from collections import defaultdict
 from curses.ascii import isprint
 from datetime import datetime, timedelta
+from itertools import islice
 from json import dumps
 from re import match
 from traceback import format_exc
@@ -717,106 +718,156 @@ def _list_replicas_for_files(file_clause, state_clause, files, rse_clause, sessi
         #    raise exception.DataIdentifierNotFound("Files not found %s", str(files))
 
 
-def _list_replicas(dataset_clause, file_clause, state_clause, show_pfns, schemes, files, rse_clause, client_location, session):
+def _list_pfns_for_replicas(replicas, schemes, client_location, tmp_protocols, rse_info, space_tokens, session):
+    """
+    Generate the PFNs of a chunk of replica rows, in bulk per RSE and protocol.
 
-    files = [dataset_clause and _list_replicas_for_datasets(dataset_clause, state_clause, rse_clause, session),
-             file_clause and _list_replicas_for_files(file_clause, state_clause, files, rse_clause, session)]
+    :param replicas: List of replica rows.
+    :param schemes: A list of schemes to filter the replicas.
+    :param client_location: Client location dictionary for PFN modification {'ip', 'fqdn', 'site'}
+    :param tmp_protocols: Dictionary of protocols per RSE, filled on demand.
+    :param rse_info: Dictionary of RSE settings per RSE, filled on demand.
+    :param space_tokens: Dictionary of SRM space tokens per RSE, filled on demand.
+    :param session: The database session in use.
+    :returns: Dictionary with the row index as key and the list of PFNs as value.
+    """
+    rows_per_rse = defaultdict(list)
+    for i, replica in enumerate(replicas):
+        if replica[7]:
+            rows_per_rse[replica[7]].append(i)
 
-    file, tmp_protocols, rse_info, pfns_cache = {}, {}, {}, {}
-    for replicas in filter(None, files):
-        for scope, name, bytes, md5, adler32, path, state, rse, rse_type, volatile in replicas:
-
-            pfns = []
-            if show_pfns and rse:
-
-                if rse not in rse_info:
-                    rse_info[rse] = rsemgr.get_rse_info(rse, session=session)
-
-                if rse not in tmp_protocols:
-
-                    rse_schemes = schemes or []
-                    if not rse_schemes:
-                        try:
-                            rse_schemes = [rsemgr.select_protocol(rse_settings=rse_info[rse],
-                                                                  operation='read')['scheme']]
-                        except:
-                            print format_exc()
-
-                    protocols = []
-                    for s in rse_schemes:
-                        try:
-                            protocols.append(rsemgr.create_protocol(rse_settings=rse_info[rse],
-                                                                    operation='read',
-                                                                    scheme=s))
-                        except exception.RSEProtocolNotSupported:
-                            pass  # no need to be verbose
-                        except:
-                            print format_exc()
-                    tmp_protocols[rse] = protocols
-
-                # get pfns
-                for protocol in tmp_protocols[rse]:
-                    if 'determinism_type' in protocol.attributes:  # PFN is cachable
-                        try:
-                            path = pfns_cache['%s:%s:%s' % (protocol.attributes['determinism_type'], scope, name)]
-                        except KeyError:  # No cache entry scope:name found for this protocol
-                            path = protocol._get_path(scope, name)
-                            pfns_cache['%s:%s:%s' % (protocol.attributes['determinism_type'], scope, name)] = path
+    pfns, paths_cache = defaultdict(list), {}
+    for rse, rows in rows_per_rse.iteritems():
+
+        if rse not in rse_info:
+            rse_info[rse] = rsemgr.get_rse_info(rse, session=session)
 
+        if rse not in tmp_protocols:
+
+            rse_schemes = schemes or []
+            if not rse_schemes:
+                try:
+                    rse_schemes = [rsemgr.select_protocol(rse_settings=rse_info[rse],
+                                                          operation='read')['scheme']]
+                except:
+                    print format_exc()
+
+            protocols = []
+            for s in rse_schemes:
+                try:
+                    protocols.append(rsemgr.create_protocol(rse_settings=rse_info[rse],
+                                                            operation='read',
+                                                            scheme=s))
+                except exception.RSEProtocolNotSupported:
+                    pass  # no need to be verbose
+                except:
+                    print format_exc()
+            tmp_protocols[rse] = protocols
+
+        scopes = [replicas[i][0] for i in rows]
+        names = [replicas[i][1] for i in rows]
+
+        # get pfns
+        for protocol in tmp_protocols[rse]:
+            if 'determinism_type' in protocol.attributes:  # PFN is cachable
+                paths = []
+                for scope, name in zip(scopes, names):
+                    key = '%s:%s:%s' % (protocol.attributes['determinism_type'], scope, name)
+                    if key not in paths_cache:
+                        paths_cache[key] = protocol._get_path(scope, name)
+                    paths.append(paths_cache[key])
+            else:
+                paths = [replicas[i][5] for i in rows]
+
+            try:
+                rse_pfns = protocol.lfns2pfns_bulk(scopes=scopes, names=names, paths=paths)
+            except:
+                # isolate the failing files
+                rse_pfns = []
+                for scope, name, path in zip(scopes, names, paths):
                     try:
-                        pfn = protocol.lfns2pfns(lfns={'scope': scope,
-                                                       'name': name,
-                                                       'path': path}).\
-                            values()[0]
-
-                        # server side root proxy handling if location is set.
-                        # cannot be pushed into protocols because we need to lookup rse attributes.
-                        # ultra-conservative implementation.
-                        if protocol.attributes['scheme'] == 'root' and client_location:
-                            if 'site' in client_location and client_location['site']:
-                                replica_site = get_rse_attribute('site', rse_info[rse]['id'], session=session)[0]
-                                if client_location['site'] != replica_site:
-                                    root_proxy_internal = get_rses_with_attribute_value('site', client_location['site'],
-                                                                                        'root-proxy-internal',
-                                                                                        session=session)
-                                    # assume all RSEs at site have same proxy, just prepend the first one
-                                    if root_proxy_internal and 'value' in root_proxy_internal[0]:
-                                        pfn = root_proxy_internal[0]['value'] + '//' + pfn
-
-                        pfns.append(pfn)
+                        rse_pfns.append(protocol.lfns2pfns_bulk(scopes=[scope], names=[name], paths=[path])[0])
                     except:
                         # temporary protection
                         print format_exc()
+                        rse_pfns.append(None)
+
+            try:
+                # server side root proxy handling if location is set.
+                # cannot be pushed into protocols because we need to lookup rse attributes.
+                # ultra-conservative implementation.
+                if protocol.attributes['scheme'] == 'root' and client_location:
+                    if 'site' in client_location and client_location['site']:
+                        replica_site = get_rse_attribute('site', rse_info[rse]['id'], session=session)[0]
+                        if client_location['site'] != replica_site:
+                            root_proxy_internal = get_rses_with_attribute_value('site', client_location['site'],
+                                                                                'root-proxy-internal',
+                                                                                session=session)
+                            # assume all RSEs at site have same proxy, just prepend the first one
+                            if root_proxy_internal and 'value' in root_proxy_internal[0]:
+                                rse_pfns = [root_proxy_internal[0]['value'] + '//' + pfn if pfn is not None else None for pfn in rse_pfns]
+
+                for i, pfn in zip(rows, rse_pfns):
+                    if pfn is not None:
+                        pfns[i].append(pfn)
+            except:
+                # temporary protection
+                print format_exc()
+
+            if protocol.attributes['scheme'] == 'srm':
+                try:
+                    space_tokens[rse] = protocol.attributes['extended_attributes']['space_token']
+                except KeyError:
+                    space_tokens[rse] = None
+
+    return pfns
 
-                    if protocol.attributes['scheme'] == 'srm':
-                        try:
-                            file['space_token'] = protocol.attributes['extended_attributes']['space_token']
-                        except KeyError:
-                            file['space_token'] = None
-
-            if 'scope' in file and 'name' in file:
-                if file['scope'] == scope and file['name'] == name:
-                    file['rses'][rse] += pfns
-                    file['states'][rse] = str(state)
-                    for pfn in pfns:
-                        file['pfns'][pfn] = {'rse': rse,
-                                             'type': str(rse_type),
-                                             'volatile': volatile}
-                else:
-                    yield file
-                    file = {}
-
-            if not ('scope' in file and 'name' in file):
-                file = {'scope': scope, 'name': name, 'bytes': bytes,
-                        'md5': md5, 'adler32': adler32,
-                        'pfns': {}, 'rses': defaultdict(list),
-                        'states': {rse: str(state)}}
-                if rse:
-                    file['rses'][rse] = pfns
-                    for pfn in pfns:
-                        file['pfns'][pfn] = {'rse': rse,
-                                             'type': str(rse_type),
-                                             'volatile': volatile}
+
+def _list_replicas(dataset_clause, file_clause, state_clause, show_pfns, schemes, files, rse_clause, client_location, session):
+
+    files = [dataset_clause and _list_replicas_for_datasets(dataset_clause, state_clause, rse_clause, session),
+             file_clause and _list_replicas_for_files(file_clause, state_clause, files, rse_clause, session)]
+
+    file, tmp_protocols, rse_info, space_tokens = {}, {}, {}, {}
+    for replicas in filter(None, files):
+        while True:
+            replica_chunk = list(islice(replicas, 1000))
+            if not replica_chunk:
+                break
+
+            chunk_pfns = {}
+            if show_pfns:
+                chunk_pfns = _list_pfns_for_replicas(replica_chunk, schemes, client_location, tmp_protocols, rse_info, space_tokens, session)
+
+            for i, (scope, name, bytes, md5, adler32, path, state, rse, rse_type, volatile) in enumerate(replica_chunk):
+
+                pfns = chunk_pfns.get(i, [])
+                if show_pfns and rse in space_tokens:
+                    file['space_token'] = space_tokens[rse]
+
+                if 'scope' in file and 'name' in file:
+                    if file['scope'] == scope and file['name'] == name:
+                        file['rses'][rse] += pfns
+                        file['states'][rse] = str(state)
+                        for pfn in pfns:
+                            file['pfns'][pfn] = {'rse': rse,
+                                                 'type': str(rse_type),
+                                                 'volatile': volatile}
+                    else:
+                        yield file
+                        file = {}
+
+                if not ('scope' in file and 'name' in file):
+                    file = {'scope': scope, 'name': name, 'bytes': bytes,
+                            'md5': md5, 'adler32': adler32,
+                            'pfns': {}, 'rses': defaultdict(list),
+                            'states': {rse: str(state)}}
+                    if rse:
+                        file['rses'][rse] = pfns
+                        for pfn in pfns:
+                            file['pfns'][pfn] = {'rse': rse,
+                                                 'type': str(rse_type),
+                                                 'volatile': volatile}
 
     if 'scope' in file and 'name' in file:
         yield file
@@ -1086,9 +1137,10 @@ def delete_replicas(rse, files, ignore_availability=True, session=None):
         raise exception.ResourceTemporaryUnavailable('%s is temporary unavailable for deleting' % rse)
 
     replica_condition, parent_condition, did_condition = [], [], []
-    clt_replica_condition, dst_replica_condition = [], []
+    clt_replica_condition, dst_replica_condition, candidate_condition = [], [], []
     for file in files:
         replica_condition.append(and_(models.RSEFileAssociation.scope == file['scope'], models.RSEFileAssociation.name == file['name']))
+        candidate_condition.append(and_(models.DeletionCandidate.scope == file['scope'], models.DeletionCandidate.name == file['name']))
 
         dst_replica_condition.\
             append(and_(models.DataIdentifierAssociation.child_scope == file['scope'],
@@ -1119,6 +1171,10 @@ def delete_replicas(rse, files, ignore_availability=True, session=None):
     if rowcount != len(files):
         raise exception.ReplicaNotFound("One or several replicas don't exist.")
 
+    # Remove the deleted replicas from the deletion candidates
+    for chunk in chunks(candidate_condition, 10):
+        session.query(models.DeletionCandidate).filter(models.DeletionCandidate.rse_id == replica_rse.id).filter(or_(*chunk)).delete(synchronize_session=False)
+
     # Get all collection_replicas at RSE, insert them into UpdatedCollectionReplica
     if dst_replica_condition:
         query = session.query(models.DataIdentifierAssociation.scope, models.DataIdentifierAssociation.name).\
@@ -1313,6 +1369,7 @@ def update_replicas_states(replicas, nowait=False, session=None):
     :param session:  The database session in use.
     """
     rse_ids = {}
+    transfers = []
     for replica in replicas:
         if 'rse_id' not in replica:
             if replica['rse'] not in rse_ids:
@@ -1339,14 +1396,14 @@ def update_replicas_states(replicas, nowait=False, session=None):
                                           models.RSEFileAssociation.rse_id == models.Source.rse_id))
             query = query.filter(not_(stmt))
             values['tombstone'] = OBSOLETE
-        elif replica['state'] == ReplicaState.AVAILABLE:
-            rucio.core.lock.successful_transfer(scope=replica['scope'], name=replica['name'], rse_id=replica['rse_id'], nowait=nowait, session=session)
-        elif replica['state'] == ReplicaState.UNAVAILABLE:
-            rucio.core.lock.failed_transfer(scope=replica['scope'], name=replica['name'], rse_id=replica['rse_id'],
-                                            error_message=replica.get('error_message', None),
-                                            broken_rule_id=replica.get('broken_rule_id', None),
-                                            broken_message=replica.get('broken_message', None),
-                                            nowait=nowait, session=session)
+        elif replica['state'] in (ReplicaState.AVAILABLE, ReplicaState.UNAVAILABLE):
+            transfers.append({'scope': replica['scope'],
+                              'name': replica['name'],
+                              'rse_id': replica['rse_id'],
+                              'state': replica['state'],
+                              'error_message': replica.get('error_message', None),
+                              'broken_rule_id': replica.get('broken_rule_id', None),
+                              'broken_message': replica.get('broken_message', None)})
 
         if 'path' in replica and replica['path']:
             values['path'] = replica['path']
@@ -1355,6 +1412,10 @@ def update_replicas_states(replicas, nowait=False, session=None):
             if 'rse' not in replica:
                 replica['rse'] = get_rse_name(rse_id=replica['rse_id'], session=session)
             raise exception.UnsupportedOperation('State %(state)s for replica %(scope)s:%(name)s on %(rse)s cannot be updated' % replica)
+
+    # Update the locks and rules of all the finished transfers at once
+    if transfers:
+        rucio.core.lock.finished_transfers(transfers, nowait=nowait, session=session)
     return True
 
 
@@ -1406,6 +1467,94 @@ def touch_replica(replica, session=None):
     return True
 
 
+@transactional_session
+def touch_replicas(replicas, session=None):
+    """
+    Update the accessed_at timestamp of the given file replicas/dids in bulk but don't wait if rows are locked.
+    Duplicated replicas are coalesced to their latest access and locked rows are skipped.
+
+    :param replicas: the list of dictionaries with the information of the affected replicas.
+    :param session: The database session in use.
+
+    :returns: the list of replicas which were not updated because their rows were locked.
+    """
+    rse_ids, latest_replicas, now = {}, {}, datetime.utcnow()
+    for replica in replicas:
+        if 'rse_id' not in replica:
+            if replica['rse'] not in rse_ids:
+                try:
+                    rse_ids[replica['rse']] = get_rse_id(rse=replica['rse'], session=session)
+                except exception.RSENotFound:
+                    rse_ids[replica['rse']] = None
+            replica['rse_id'] = rse_ids[replica['rse']]
+        if replica['rse_id'] is None:
+            continue
+        accessed_at = replica.get('accessed_at') or now
+        key = (replica['scope'], replica['name'], replica['rse_id'])
+        if key not in latest_replicas or latest_replicas[key][0] < accessed_at:
+            latest_replicas[key] = (accessed_at, replica)
+
+    none_value = None
+    replica_stmt = models.RSEFileAssociation.__table__.update().\
+        where(and_(models.RSEFileAssociation.scope == bindparam('b_scope'),
+                   models.RSEFileAssociation.name == bindparam('b_name'),
+                   models.RSEFileAssociation.rse_id == bindparam('b_rse_id'))).\
+        values(accessed_at=bindparam('b_accessed_at'),
+               tombstone=case([(and_(models.RSEFileAssociation.tombstone != none_value,
+                                     models.RSEFileAssociation.tombstone != OBSOLETE),
+                                bindparam('b_accessed_at'))],
+                              else_=models.RSEFileAssociation.tombstone))
+    did_stmt = models.DataIdentifier.__table__.update().\
+        where(and_(models.DataIdentifier.scope == bindparam('b_scope'),
+                   models.DataIdentifier.name == bindparam('b_name'),
+                   models.DataIdentifier.did_type == DIDType.FILE)).\
+        values(accessed_at=bindparam('b_accessed_at'))
+
+    locked_keys = set()
+    for keys in chunks(latest_replicas.keys(), 100):
+        condition = [and_(models.RSEFileAssociation.scope == scope,
+                          models.RSEFileAssociation.name == name,
+                          models.RSEFileAssociation.rse_id == rse_id) for scope, name, rse_id in keys]
+        query = session.query(models.RSEFileAssociation.scope,
+                              models.RSEFileAssociation.name,
+                              models.RSEFileAssociation.rse_id).\
+            with_hint(models.RSEFileAssociation, "index(REPLICAS REPLICAS_PK)", 'oracle').\
+            filter(or_(*condition))
+        acquired_keys = set(tuple(row) for row in query.with_for_update(skip_locked=True))
+        if len(acquired_keys) < len(keys):
+            # Rows not acquired either do not exist or are locked by another transaction
+            locked_keys.update(set(tuple(row) for row in query) - acquired_keys)
+        if not acquired_keys:
+            continue
+
+        dids = {}
+        for scope, name, rse_id in acquired_keys:
+            accessed_at = latest_replicas[(scope, name, rse_id)][0]
+            if (scope, name) not in dids or dids[(scope, name)] < accessed_at:
+                dids[(scope, name)] = accessed_at
+
+        condition = [and_(models.DataIdentifier.scope == scope,
+                          models.DataIdentifier.name == name) for scope, name in dids]
+        query = session.query(models.DataIdentifier.scope,
+                              models.DataIdentifier.name).\
+            with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle').\
+            filter(or_(*condition)).\
+            filter_by(did_type=DIDType.FILE)
+        acquired_dids = set(tuple(row) for row in query.with_for_update(skip_locked=True))
+        if len(acquired_dids) < len(dids):
+            locked_dids = set(tuple(row) for row in query) - acquired_dids
+            locked_keys.update(key for key in acquired_keys if key[:2] in locked_dids)
+
+        session.execute(replica_stmt, [{'b_scope': scope, 'b_name': name, 'b_rse_id': rse_id,
+                                        'b_accessed_at': latest_replicas[(scope, name, rse_id)][0]}
+                                       for scope, name, rse_id in acquired_keys])
+        if acquired_dids:
+            session.execute(did_stmt, [{'b_scope': scope, 'b_name': name, 'b_accessed_at': dids[(scope, name)]}
+                                       for scope, name in acquired_dids])
+
+    return [latest_replicas[locked_key][1] for locked_key in locked_keys]
+
+
 @transactional_session
 def update_replica_state(rse, scope, name, state, session=None):
     """
@@ -32,6 +32,7 @@ from sqlalchemy.sql.expression import or_, false
 import rucio.core.account_counter
 
 from rucio.core.rse_counter import add_counter
+from rucio.core.rse_index import refresh_rse
 
 from rucio.common import exception, utils
 from rucio.db.sqla import models
@@ -295,6 +296,7 @@ def add_rse_attribute(rse, key, value, session=None):
         new_rse_attr.save(session=session)
     except IntegrityError:
         raise exception.Duplicate("RSE attribute '%(key)s-%(value)s\' for RSE '%(rse)s' already exists!" % locals())
+    refresh_rse(rse_id=rse_id, session=session)
     return True
 
 
@@ -313,6 +315,7 @@ def del_rse_attribute(rse, key, session=None):
     query = session.query(models.RSEAttrAssociation).filter_by(rse_id=rse_id).filter(models.RSEAttrAssociation.key == key)
     rse_attr = query.one()
     rse_attr.delete(session=session)
+    refresh_rse(rse_id=rse_id, session=session)
     return True
 
 
@@ -996,3 +999,4 @@ def update_rse(rse, parameters, session=None):
         query = session.query(models.RSEAttrAssociation).filter_by(rse_id=rse_id).filter(models.RSEAttrAssociation.key == rse)
         rse_attr = query.one()
         rse_attr.delete(session=session)
+    refresh_rse(rse_id=rse_id, session=session)
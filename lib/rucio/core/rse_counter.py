@@ -10,13 +10,18 @@
 # - Mario Lassnig, <mario.lassnig@cern.ch>, 2013-2014
 # - Martin Barisits, <martin.barisits@cern.ch>, 2014
 
+from sqlalchemy import func
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql.expression import bindparam, text
 
 from rucio.common.exception import CounterNotFound
+from rucio.common.utils import chunks
 from rucio.db.sqla import models
 from rucio.db.sqla.session import read_session, transactional_session
 
+# Maximum number of ids per IN clause
+CHUNK_SIZE = 1000
+
 
 @transactional_session
 def add_counter(rse_id, session=None):
@@ -104,16 +109,7 @@ def get_updated_rse_counters(total_workers, worker_number, session=None):
     """
     query = session.query(models.UpdatedRSECounter.rse_id).\
         distinct(models.UpdatedRSECounter.rse_id)
-
-    if total_workers > 0:
-        if session.bind.dialect.name == 'oracle':
-            bindparams = [bindparam('worker_number', worker_number),
-                          bindparam('total_workers', total_workers)]
-            query = query.filter(text('ORA_HASH(rse_id, :total_workers) = :worker_number', bindparams=bindparams))
-        elif session.bind.dialect.name == 'mysql':
-            query = query.filter('mod(md5(rse_id), %s) = %s' % (total_workers + 1, worker_number))
-        elif session.bind.dialect.name == 'postgresql':
-            query = query.filter('mod(abs((\'x\'||md5(rse_id))::bit(32)::int), %s) = %s' % (total_workers + 1, worker_number))
+    query = __filter_worker(query, total_workers, worker_number, session)
 
     results = query.all()
     return [result.rse_id for result in results]
@@ -128,15 +124,86 @@ def update_rse_counter(rse_id, session=None):
     :param session:  Database session in use.
     """
 
-    updated_rse_counters = session.query(models.UpdatedRSECounter).\
-        filter_by(rse_id=rse_id).all()
+    query = session.query(models.UpdatedRSECounter.id).filter_by(rse_id=rse_id)
+    __apply_updates([id for id, in query], session=session)
+
+
+@transactional_session
+def update_rse_counters(total_workers, worker_number, limit=1000, session=None):
+    """
+    Apply a batch of the updated_rse_counters of a worker to the rse_counters.
+
+    The updates are summed per rse_id in the database, each rse_counter is
+    incremented in place and the consumed updates are deleted.
+
+    :param total_workers:      Number of total workers.
+    :param worker_number:      id of the executing worker.
+    :param limit:              Maximum number of updates to apply.
+    :param session:            Database session in use.
+    :returns:                  The number of applied updates.
+    """
+    query = session.query(models.UpdatedRSECounter.id)
+    query = __filter_worker(query, total_workers, worker_number, session)
+    ids = [id for id, in query.limit(limit)]
+    __apply_updates(ids, session=session)
+    return len(ids)
 
-    try:
-        rse_counter = session.query(models.RSEUsage).filter_by(rse_id=rse_id, source='rucio').one()
-        rse_counter.used += sum([updated_rse_counter.bytes for updated_rse_counter in updated_rse_counters])
-        rse_counter.files += sum([updated_rse_counter.files for updated_rse_counter in updated_rse_counters])
-    except NoResultFound:
-        pass
 
-    for update in updated_rse_counters:
-        update.delete(flush=False, session=session)
+@read_session
+def get_updated_rse_counters_lag(total_workers, worker_number, session=None):
+    """
+    Get the backlog of updated_rse_counters of a worker.
+
+    :param total_workers:      Number of total workers.
+    :param worker_number:      id of the executing worker.
+    :param session:            Database session in use.
+    :returns:                  Dictionary with the number of pending updates and the creation date of the oldest one.
+    """
+    query = session.query(func.count(models.UpdatedRSECounter.id), func.min(models.UpdatedRSECounter.created_at))
+    query = __filter_worker(query, total_workers, worker_number, session)
+    rows, oldest = query.one()
+    return {'rows': rows, 'oldest': oldest}
+
+
+def __filter_worker(query, total_workers, worker_number, session):
+    """
+    Restrict a query on the updated_rse_counters to the rse_ids of a worker.
+    """
+    if total_workers > 0:
+        if session.bind.dialect.name == 'oracle':
+            bindparams = [bindparam('worker_number', worker_number),
+                          bindparam('total_workers', total_workers)]
+            query = query.filter(text('ORA_HASH(rse_id, :total_workers) = :worker_number', bindparams=bindparams))
+        elif session.bind.dialect.name == 'mysql':
+            query = query.filter('mod(md5(rse_id), %s) = %s' % (total_workers + 1, worker_number))
+        elif session.bind.dialect.name == 'postgresql':
+            query = query.filter('mod(abs((\'x\'||md5(rse_id))::bit(32)::int), %s) = %s' % (total_workers + 1, worker_number))
+    return query
+
+
+def __apply_updates(ids, session):
+    """
+    Add the given updated_rse_counters to the rse_counters and delete them.
+    Updates of RSEs without a counter are dropped.
+    """
+    deltas = {}
+    for chunk in chunks(ids, CHUNK_SIZE):
+        query = session.query(models.UpdatedRSECounter.rse_id,
+                              func.sum(models.UpdatedRSECounter.files),
+                              func.sum(models.UpdatedRSECounter.bytes)).\
+            filter(models.UpdatedRSECounter.id.in_(chunk)).\
+            group_by(models.UpdatedRSECounter.rse_id)
+        for rse_id, files, bytes in query:
+            total_files, total_bytes = deltas.get(rse_id, (0, 0))
+            deltas[rse_id] = (total_files + (files or 0), total_bytes + (bytes or 0))
+
+    for rse_id, (files, bytes) in deltas.items():
+        session.query(models.RSEUsage).filter_by(rse_id=rse_id, source='rucio').\
+            update({models.RSEUsage.files: models.RSEUsage.files + files,
+                    models.RSEUsage.used: models.RSEUsage.used + bytes},
+                   synchronize_session=False)
+
+    for chunk in chunks(ids, CHUNK_SIZE):
+        session.query(models.UpdatedRSECounter).\
+            filter(models.UpdatedRSECounter.id.in_(chunk)).\
+            delete(synchronize_session=False)
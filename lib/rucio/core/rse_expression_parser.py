@@ -15,14 +15,13 @@
 import abc
 import re
 import string
-
-from dogpile.cache import make_region
-from dogpile.cache.api import NoValue
-from hashlib import sha256
+import threading
 
 from rucio.common import schema
 from rucio.common.exception import InvalidRSEExpression, RSEBlacklisted
-from rucio.core.rse import list_rses, get_rses_with_attribute, get_rse_attribute
+from rucio.core.rse import list_rses
+from rucio.core.rse_index import get_index
+from rucio.db.sqla import models
 from rucio.db.sqla.session import transactional_session
 
 
@@ -36,10 +35,10 @@ COMPLEMENT = r'(\\%s)' % (PRIMITIVE)
 
 PATTERN = r'^%s(%s|%s|%s)*' % (PRIMITIVE, UNION, INTERSECTION, COMPLEMENT)
 
+COMPILED_CACHE_SIZE = 10000
 
-REGION = make_region().configure('dogpile.cache.memcached',
-                                 expiration_time=3600,
-                                 arguments={'url': "127.0.0.1:11211", 'distributed_lock': True})
+__COMPILED_LOCK = threading.Lock()
+__COMPILED = {}
 
 
 @transactional_session
@@ -53,34 +52,10 @@ def parse_expression(expression, filter=None, session=None):
     :returns:             A list of rse dictionaries.
     :raises:              InvalidRSEExpression, RSENotFound, RSEBlacklisted
     """
-    result = REGION.get(sha256(expression).hexdigest())
-    if type(result) is NoValue:
-        # Evaluate the correctness of the parentheses
-        parantheses_open_count = 0
-        parantheses_close_count = 0
-        for char in expression:
-            if (char == '('):
-                parantheses_open_count += 1
-            elif (char == ')'):
-                parantheses_close_count += 1
-            if (parantheses_close_count > parantheses_open_count):
-                raise InvalidRSEExpression('Problem with parantheses.')
-        if (parantheses_open_count != parantheses_close_count):
-            raise InvalidRSEExpression('Problem with parantheses.')
-
-        # Check the expression pattern
-        match = re.match(PATTERN, expression)
-        if match is None:
-            raise InvalidRSEExpression('Expression does not comply to RSE Expression syntax')
-        else:
-            if match.group() != expression:
-                raise InvalidRSEExpression('Expression does not comply to RSE Expression syntax')
-        result_tuple = __resolve_term_expression(expression)[0].resolve_elements(session=session)
-        # result_tuple = ([rse_ids], {rse_id: {rse_info}})
-        result = []
-        for rse in list(result_tuple[0]):
-            result.append(result_tuple[1][rse])
-        REGION.set(sha256(expression).hexdigest(), result)
+    compiled_expression = compile_expression(expression)
+    # The index is a snapshot which is not modified, the resolution runs without lock
+    index = get_index(session=session)
+    result = index.get_rses(compiled_expression.resolve_elements(index=index, session=session))
 
     if not result:
         raise InvalidRSEExpression('RSE Expression resulted in an empty set.')
@@ -101,6 +76,48 @@ def parse_expression(expression, filter=None, session=None):
     return final_result
 
 
+def compile_expression(expression):
+    """
+    Validate a RSE expression and return its expression tree.
+    Compiled expressions are cached per process.
+
+    :param expression:    RSE expression, e.g: 'CERN|BNL'.
+    :returns:             The root BaseExpressionElement.
+    :raises:              InvalidRSEExpression
+    """
+    compiled_expression = __COMPILED.get(expression)
+    if compiled_expression is not None:
+        return compiled_expression
+
+    # Evaluate the correctness of the parentheses
+    parantheses_open_count = 0
+    parantheses_close_count = 0
+    for char in expression:
+        if (char == '('):
+            parantheses_open_count += 1
+        elif (char == ')'):
+            parantheses_close_count += 1
+        if (parantheses_close_count > parantheses_open_count):
+            raise InvalidRSEExpression('Problem with parantheses.')
+    if (parantheses_open_count != parantheses_close_count):
+        raise InvalidRSEExpression('Problem with parantheses.')
+
+    # Check the expression pattern
+    match = re.match(PATTERN, expression)
+    if match is None:
+        raise InvalidRSEExpression('Expression does not comply to RSE Expression syntax')
+    else:
+        if match.group() != expression:
+            raise InvalidRSEExpression('Expression does not comply to RSE Expression syntax')
+    compiled_expression = __resolve_term_expression(expression)[0]
+
+    with __COMPILED_LOCK:
+        if len(__COMPILED) >= COMPILED_CACHE_SIZE:
+            __COMPILED.clear()
+        __COMPILED[expression] = compiled_expression
+    return compiled_expression
+
+
 def __resolve_term_expression(expression):
     """
     Resolves a Term Expression and returns an object of type BaseExpressionElement
@@ -201,13 +218,14 @@ class BaseExpressionElement:
     __metaclass__ = abc.ABCMeta
 
     @abc.abstractmethod
-    def resolve_elements(self, session):
+    def resolve_elements(self, index, session):
         """
-        Resolve the ExpressionElement and return a set of RSE ids
+        Resolve the ExpressionElement and return the bitmap of the matching RSEs
 
+        :param index:    RSEIndex in use
         :param session:  Database session in use
-        :returns:        (Set of RSE ids, Dictionary of RSE dicts)
-        :rtype:          (Set of Strings, Dictionary of RSE dicts organized by rse_id)
+        :returns:        Bitmap of RSEs
+        :rtype:          Integer
         """
         pass
 
@@ -227,17 +245,14 @@ class RSEAttributeEqualCheck(BaseExpressionElement):
         self.key = key
         self.value = value
 
-    def resolve_elements(self, session):
+    def resolve_elements(self, index, session):
         """
         Inherited from :py:func:`BaseExpressionElement.resolve_elements`
         """
-        output = list_rses({self.key: self.value}, session=session)
-        if not output:
-            return (set(), {})
-        rse_dict = {}
-        for rse in output:
-            rse_dict[rse['id']] = rse
-        return (set([rse['id'] for rse in output]), rse_dict)
+        if hasattr(models.RSE, self.key):
+            # RSE columns are not part of the index
+            return index.get_bitmap_from_ids([rse['id'] for rse in list_rses({self.key: self.value}, session=session)])
+        return index.get_bitmap(self.key, self.value)
 
 
 class RSEAttributeSmallerCheck(BaseExpressionElement):
@@ -255,24 +270,18 @@ class RSEAttributeSmallerCheck(BaseExpressionElement):
         self.key = key
         self.value = value
 
-    def resolve_elements(self, session):
+    def resolve_elements(self, index, session):
         """
         Inherited from :py:func:`BaseExpressionElement.resolve_elements`
         """
-        rse_list = get_rses_with_attribute(key=self.key, session=session)
-        if not rse_list:
-            return (set(), {})
-
-        output = []
-        rse_dict = {}
-        for rse in rse_list:
+        output = 0
+        for value, bitmap in index.get_key_values(self.key).iteritems():
             try:
-                if float(get_rse_attribute(key=self.key, rse_id=rse['id'], session=session)[0]) < float(self.value):
-                    rse_dict[rse['id']] = rse
-                    output.append(rse['id'])
+                if float(value) < float(self.value):
+                    output |= bitmap
             except ValueError:
                 continue
-        return (set(output), rse_dict)
+        return output
 
 
 class RSEAttributeLargerCheck(BaseExpressionElement):
@@ -290,24 +299,18 @@ class RSEAttributeLargerCheck(BaseExpressionElement):
         self.key = key
         self.value = value
 
-    def resolve_elements(self, session):
+    def resolve_elements(self, index, session):
         """
         Inherited from :py:func:`BaseExpressionElement.resolve_elements`
         """
-        rse_list = get_rses_with_attribute(key=self.key, session=session)
-        if not rse_list:
-            return (set(), {})
-
-        output = []
-        rse_dict = {}
-        for rse in rse_list:
+        output = 0
+        for value, bitmap in index.get_key_values(self.key).iteritems():
             try:
-                if float(get_rse_attribute(key=self.key, rse_id=rse['id'], session=session)[0]) > float(self.value):
-                    rse_dict[rse['id']] = rse
-                    output.append(rse['id'])
+                if float(value) > float(self.value):
+                    output |= bitmap
             except ValueError:
                 continue
-        return (set(output), rse_dict)
+        return output
 
 
 class BaseRSEOperator(BaseExpressionElement):
@@ -357,13 +360,11 @@ class ComplementOperator(BaseRSEOperator):
         """
         self.right_term = right_term
 
-    def resolve_elements(self, session):
+    def resolve_elements(self, index, session):
         """
         Inherited from :py:func:`BaseExpressionElement.resolve_elements`
         """
-        left_term_tuple = self.left_term.resolve_elements(session=session)
-        right_term_tuple = self.right_term.resolve_elements(session=session)
-        return (left_term_tuple[0] - right_term_tuple[0], dict(left_term_tuple[1].items() + right_term_tuple[1].items()))
+        return self.left_term.resolve_elements(index=index, session=session) & ~self.right_term.resolve_elements(index=index, session=session)
 
 
 class UnionOperator(BaseRSEOperator):
@@ -391,13 +392,11 @@ class UnionOperator(BaseRSEOperator):
         """
         self.right_term = right_term
 
-    def resolve_elements(self, session):
+    def resolve_elements(self, index, session):
         """
         Inherited from :py:func:`BaseExpressionElement.resolve_elements`
         """
-        left_term_tuple = self.left_term.resolve_elements(session=session)
-        right_term_tuple = self.right_term.resolve_elements(session=session)
-        return (left_term_tuple[0] | right_term_tuple[0], dict(left_term_tuple[1].items() + right_term_tuple[1].items()))
+        return self.left_term.resolve_elements(index=index, session=session) | self.right_term.resolve_elements(index=index, session=session)
 
 
 class IntersectOperator(BaseRSEOperator):
@@ -425,10 +424,8 @@ class IntersectOperator(BaseRSEOperator):
         """
         self.right_term = right_term
 
-    def resolve_elements(self, session):
+    def resolve_elements(self, index, session):
         """
         Inherited from :py:func:`BaseExpressionElement.resolve_elements`
         """
-        left_term_tuple = self.left_term.resolve_elements(session=session)
-        right_term_tuple = self.right_term.resolve_elements(session=session)
-        return (left_term_tuple[0] & right_term_tuple[0], dict(left_term_tuple[1].items() + right_term_tuple[1].items()))
+        return self.left_term.resolve_elements(index=index, session=session) & self.right_term.resolve_elements(index=index, session=session)
@@ -0,0 +1,300 @@
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+In-process index of the RSEs and their attributes.
+
+Every RSE gets a fixed bit position; every attribute key/value pair maps to
+an integer bitmap of the RSEs carrying it. RSE expressions are evaluated
+against these bitmaps without database round trips. The index is rebuilt
+from the database when it is older than its lifetime and refreshed per RSE
+by the write paths of :py:mod:`rucio.core.rse` once their transaction is
+committed. A published index is never modified, a refresh publishes a
+modified copy, so the readers use it without locking.
+"""
+
+import threading
+import time
+
+from ConfigParser import NoOptionError, NoSectionError
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import false
+
+from rucio.common.config import config_get_int
+from rucio.db.sqla import models
+from rucio.db.sqla.session import read_session
+from rucio.db.sqla.types import BooleanString
+
+try:
+    INDEX_LIFETIME = config_get_int('rse-expression', 'index_lifetime')
+except (NoOptionError, NoSectionError, ValueError):
+    INDEX_LIFETIME = 600
+
+__LOCK = threading.RLock()
+__INDEX = {'index': None, 'generation': 0}
+__VALUE_TYPE = BooleanString()
+__PENDING_KEY = 'rse_index_refresh'
+
+
+def normalize_value(value):
+    """
+    Normalize an attribute value the way it is compared in the database.
+
+    :param value: The attribute value (True, False, number or string).
+    :returns:     The string representation stored in the database.
+    """
+    return __VALUE_TYPE.process_bind_param(value, None)
+
+
+def iter_bits(bitmap):
+    """
+    Iterate over the positions of the bits set in a bitmap.
+
+    :param bitmap: Integer bitmap.
+    :returns:      Generator of bit positions.
+    """
+    position = 0
+    while bitmap:
+        if bitmap & 1:
+            yield position
+        bitmap >>= 1
+        position += 1
+
+
+class RSEIndex(object):
+    """
+    Bitmap index of the RSEs and their attributes.
+    """
+
+    def __init__(self):
+        self.created_at = time.time()
+        self.rses = {}          # rse_id -> rse dictionary
+        self.positions = {}     # rse_id -> bit position
+        self.rse_ids = []       # bit position -> rse_id
+        self.attributes = {}    # rse_id -> {key: normalized value}
+        self.values = {}        # key -> {normalized value: bitmap}
+        self.all_rses = 0
+
+    def expired(self):
+        """
+        Indicates whether the index is older than its lifetime.
+        """
+        return time.time() - self.created_at > INDEX_LIFETIME
+
+    def copy(self):
+        """
+        Return a copy of the index which can be modified without affecting this one.
+        """
+        index = RSEIndex()
+        index.created_at = self.created_at
+        index.rses = dict(self.rses)
+        index.positions = dict(self.positions)
+        index.rse_ids = list(self.rse_ids)
+        index.attributes = dict(self.attributes)
+        index.values = dict((key, dict(bitmaps)) for key, bitmaps in self.values.iteritems())
+        index.all_rses = self.all_rses
+        return index
+
+    def set_rse(self, rse, attributes):
+        """
+        Add or replace a RSE and its attributes in the index.
+
+        :param rse:        The RSE dictionary.
+        :param attributes: Dictionary of the RSE attributes.
+        """
+        rse_id = rse['id']
+        if rse_id not in self.positions:
+            self.positions[rse_id] = len(self.rse_ids)
+            self.rse_ids.append(rse_id)
+        else:
+            self.del_rse(rse_id)
+        bit = 1 << self.positions[rse_id]
+        self.rses[rse_id] = rse
+        self.attributes[rse_id] = {}
+        for key, value in attributes.iteritems():
+            value = normalize_value(value)
+            self.attributes[rse_id][key] = value
+            bitmaps = self.values.setdefault(key, {})
+            bitmaps[value] = bitmaps.get(value, 0) | bit
+        self.all_rses |= bit
+
+    def del_rse(self, rse_id):
+        """
+        Remove a RSE and its attributes from the index. The bit position is kept.
+
+        :param rse_id: The RSE id.
+        """
+        if rse_id not in self.positions:
+            return
+        mask = ~(1 << self.positions[rse_id])
+        for key, value in self.attributes.pop(rse_id, {}).iteritems():
+            bitmaps = self.values[key]
+            bitmaps[value] &= mask
+            if not bitmaps[value]:
+                del bitmaps[value]
+                if not bitmaps:
+                    del self.values[key]
+        self.rses.pop(rse_id, None)
+        self.all_rses &= mask
+
+    def get_bitmap(self, key, value=True):
+        """
+        Return the bitmap of the RSEs having an attribute with the given value.
+
+        :param key:   The attribute key.
+        :param value: The attribute value.
+        :returns:     Integer bitmap.
+        """
+        return self.values.get(key, {}).get(normalize_value(value), 0)
+
+    def get_key_values(self, key):
+        """
+        Return the values of an attribute key with the bitmap of the RSEs having it.
+
+        :param key: The attribute key.
+        :returns:   Dictionary {normalized value: bitmap}.
+        """
+        return self.values.get(key, {})
+
+    def get_bitmap_from_ids(self, rse_ids):
+        """
+        Return the bitmap of a collection of RSE ids.
+
+        :param rse_ids: Iterable of RSE ids.
+        :returns:       Integer bitmap.
+        """
+        bitmap = 0
+        for rse_id in rse_ids:
+            if rse_id in self.rses:
+                bitmap |= 1 << self.positions[rse_id]
+        return bitmap
+
+    def get_rses(self, bitmap):
+        """
+        Return the RSE dictionaries of a bitmap.
+
+        :param bitmap: Integer bitmap.
+        :returns:      List of RSE dictionaries.
+        """
+        return [dict(self.rses[self.rse_ids[position]]) for position in iter_bits(bitmap & self.all_rses)]
+
+
+def __row_to_dict(row):
+    """
+    Convert a RSE row to a dictionary, the same way list_rses does.
+    """
+    d = {}
+    for column in row.__table__.columns:
+        d[column.name] = getattr(row, column.name)
+    return d
+
+
+@read_session
+def build_index(session=None):
+    """
+    Build a new RSE index from the database.
+
+    :param session: The database session in use.
+    :returns:       The RSEIndex.
+    """
+    index = RSEIndex()
+    attributes = {}
+    for rse_id, key, value in session.query(models.RSEAttrAssociation.rse_id,
+                                            models.RSEAttrAssociation.key,
+                                            models.RSEAttrAssociation.value):
+        attributes.setdefault(rse_id, {})[key] = value
+    for row in session.query(models.RSE).filter(models.RSE.deleted == false()).order_by(models.RSE.rse):
+        index.set_rse(__row_to_dict(row), attributes.get(row.id, {}))
+    return index
+
+
+@read_session
+def get_index(session=None):
+    """
+    Return the process-wide RSE index, building it if missing or expired.
+    The returned index must not be modified.
+
+    :param session: The database session in use.
+    :returns:       The RSEIndex.
+    """
+    index = __INDEX['index']
+    if index is None or index.expired():
+        generation = __INDEX['generation']
+        index = build_index(session=session)
+        with __LOCK:
+            # A refresh committed during the build may be missing from it
+            if __INDEX['generation'] == generation:
+                __INDEX['index'] = index
+                __INDEX['generation'] += 1
+    return index
+
+
+@read_session
+def refresh_rse(rse_id, session=None):
+    """
+    Reload one RSE and its attributes into the process-wide index once the
+    transaction of the session is committed. Nothing is reloaded on rollback.
+
+    :param rse_id:  The RSE id.
+    :param session: The database session in use.
+    """
+    rse, attributes = None, None
+    if __INDEX['index'] is not None:
+        session.flush()
+        row = session.query(models.RSE).filter_by(id=rse_id, deleted=False).first()
+        attributes = {}
+        if row:
+            rse = __row_to_dict(row)
+            for key, value in session.query(models.RSEAttrAssociation.key,
+                                            models.RSEAttrAssociation.value).filter_by(rse_id=rse_id):
+                attributes[key] = value
+    session.info.setdefault(__PENDING_KEY, {})[rse_id] = (rse, attributes)
+
+
+@event.listens_for(Session, 'after_commit')
+def __apply_refresh(session):
+    """
+    Apply the RSE refreshes of a committed transaction to the process-wide index.
+    """
+    pending = session.info.pop(__PENDING_KEY, None)
+    if not pending:
+        return
+    with __LOCK:
+        __INDEX['generation'] += 1
+        index = __INDEX['index']
+        if index is None:
+            return
+        if [rse_id for rse_id, (rse, attributes) in pending.iteritems() if attributes is None]:
+            # The index was built after the change was read, the change may be missing from it
+            __INDEX['index'] = None
+            return
+        index = index.copy()
+        for rse_id, (rse, attributes) in pending.iteritems():
+            if rse:
+                index.set_rse(rse, attributes)
+            else:
+                index.del_rse(rse_id)
+        __INDEX['index'] = index
+
+
+@event.listens_for(Session, 'after_rollback')
+def __discard_refresh(session):
+    """
+    Discard the RSE refreshes of a rolled back transaction.
+    """
+    session.info.pop(__PENDING_KEY, None)
+
+
+def invalidate_index():
+    """
+    Drop the process-wide RSE index; it is rebuilt on next use.
+    """
+    with __LOCK:
+        __INDEX['index'] = None
+        __INDEX['generation'] += 1
@@ -0,0 +1,199 @@
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+Process-wide snapshot of the RSE topology used to resolve transfer sources.
+
+The snapshot holds the RSE names, attributes, protocol settings, read
+availability and the matching schemes between RSE pairs. It is tagged with a
+version computed from the RSE, attribute and protocol tables, checked at most
+every SNAPSHOT_CHECK_INTERVAL seconds, and rebuilt when the version changes.
+The snapshot is shared by all threads and must be treated as read-only.
+"""
+
+import threading
+import time
+
+from ConfigParser import NoOptionError, NoSectionError
+
+from sqlalchemy import func
+
+from rucio.common.config import config_get_int
+from rucio.common.exception import RSEProtocolNotSupported
+from rucio.core.rse import get_rse_name, get_rse_protocols, list_rse_attributes, list_rses
+from rucio.db.sqla import models
+from rucio.db.sqla.session import read_session
+from rucio.rse import rsemanager as rsemgr
+
+try:
+    SNAPSHOT_CHECK_INTERVAL = config_get_int('conveyor', 'topology_check_interval')
+except (NoOptionError, NoSectionError, ValueError):
+    SNAPSHOT_CHECK_INTERVAL = 30
+
+__LOCK = threading.Lock()
+__SNAPSHOT = {'topology': None}
+
+
+class RSETopology(object):
+    """
+    Snapshot of the RSE topology.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.checked_at = time.time()
+        self.names = {}                 # rse_id -> rse name
+        self.attributes = {}            # rse_id -> {key: value}
+        self.unavailable_read = set()   # rse_ids not available for read
+        self.__rses_info = {}           # rse_id -> rse settings, loaded on first use
+        self.__matching_schemes = {}    # (dest rse_id, src rse_id, schemes) -> (dest scheme, src scheme) or exception
+        self.__lock = threading.Lock()
+
+    @read_session
+    def get_rse_name(self, rse_id, session=None):
+        """
+        Return the name of a RSE. RSEs added after the snapshot are looked up in the database.
+
+        :param rse_id:  The RSE id.
+        :param session: The database session in use.
+        :returns:       The RSE name.
+        """
+        rse = self.names.get(rse_id)
+        if rse is None:
+            rse = get_rse_name(rse_id=rse_id, session=session)
+        return rse
+
+    @read_session
+    def get_rse_attributes(self, rse_id, session=None):
+        """
+        Return the attributes of a RSE. RSEs added after the snapshot are looked up in the database.
+
+        :param rse_id:  The RSE id.
+        :param session: The database session in use.
+        :returns:       Dictionary of the RSE attributes.
+        """
+        attributes = self.attributes.get(rse_id)
+        if attributes is None:
+            attributes = list_rse_attributes(None, rse_id=rse_id, session=session)
+        return attributes
+
+    @read_session
+    def get_rse_info(self, rse_id, session=None):
+        """
+        Return the protocol related settings of a RSE, as returned by rsemanager.get_rse_info.
+
+        :param rse_id:  The RSE id.
+        :param session: The database session in use.
+        :returns:       The RSE settings.
+        """
+        rse_info = self.__rses_info.get(rse_id)
+        if rse_info is None:
+            rse_info = get_rse_protocols(self.get_rse_name(rse_id, session=session), session=session)
+            with self.__lock:
+                self.__rses_info[rse_id] = rse_info
+        return rse_info
+
+    @read_session
+    def find_matching_scheme(self, dest_rse_id, src_rse_id, schemes=None, session=None):
+        """
+        Find the best matching scheme to write on a destination RSE from a source RSE.
+
+        :param dest_rse_id: The destination RSE id.
+        :param src_rse_id:  The source RSE id.
+        :param schemes:     List or comma separated string of allowed schemes.
+        :param session:     The database session in use.
+        :returns:           Tuple of matching schemes (dest_scheme, src_scheme).
+        :raises RSEProtocolNotSupported: If no matching scheme exists.
+        """
+        key = (dest_rse_id, src_rse_id, tuple(schemes) if isinstance(schemes, list) else schemes)
+        result = self.__matching_schemes.get(key)
+        if result is None:
+            try:
+                result = rsemgr.find_matching_scheme(rse_settings_dest=self.get_rse_info(dest_rse_id, session=session),
+                                                     rse_settings_src=self.get_rse_info(src_rse_id, session=session),
+                                                     operation_src='read',
+                                                     operation_dest='write',
+                                                     domain=None,
+                                                     scheme=list(schemes) if isinstance(schemes, list) else schemes)
+            except RSEProtocolNotSupported, error:
+                result = error
+            with self.__lock:
+                self.__matching_schemes[key] = result
+        if isinstance(result, RSEProtocolNotSupported):
+            raise result
+        return result
+
+
+@read_session
+def get_topology_version(session=None):
+    """
+    Compute the version of the RSE topology from the row counts and last update times of the RSE tables.
+
+    :param session: The database session in use.
+    :returns:       The version as a tuple.
+    """
+    version = []
+    for model in (models.RSE, models.RSEAttrAssociation, models.RSEProtocols):
+        version.append(tuple(session.query(func.count(), func.max(model.updated_at)).one()))
+    return tuple(version)
+
+
+@read_session
+def build_topology(version=None, session=None):
+    """
+    Build a new RSE topology snapshot from the database.
+
+    :param version: The version of the topology, computed if None.
+    :param session: The database session in use.
+    :returns:       The RSETopology.
+    """
+    if version is None:
+        version = get_topology_version(session=session)
+    topology = RSETopology(version)
+    for rse in list_rses(session=session):
+        topology.names[rse['id']] = rse['rse']
+        topology.attributes[rse['id']] = {}
+        if not rse['availability'] & 4:
+            topology.unavailable_read.add(rse['id'])
+    for rse_id, key, value in session.query(models.RSEAttrAssociation.rse_id,
+                                            models.RSEAttrAssociation.key,
+                                            models.RSEAttrAssociation.value):
+        if rse_id in topology.attributes:
+            topology.attributes[rse_id][key] = value
+    return topology
+
+
+@read_session
+def get_topology(session=None):
+    """
+    Return the process-wide RSE topology snapshot, rebuilding it if the database changed.
+
+    :param session: The database session in use.
+    :returns:       The RSETopology.
+    """
+    topology = __SNAPSHOT['topology']
+    if topology is not None and time.time() - topology.checked_at < SNAPSHOT_CHECK_INTERVAL:
+        return topology
+    with __LOCK:
+        topology = __SNAPSHOT['topology']
+        if topology is not None and time.time() - topology.checked_at < SNAPSHOT_CHECK_INTERVAL:
+            return topology
+        version = get_topology_version(session=session)
+        if topology is None or topology.version != version:
+            topology = build_topology(version=version, session=session)
+            __SNAPSHOT['topology'] = topology
+        else:
+            topology.checked_at = time.time()
+    return topology
+
+
+def invalidate_topology():
+    """
+    Drop the process-wide RSE topology snapshot; it is rebuilt on next use.
+    """
+    with __LOCK:
+        __SNAPSHOT['topology'] = None
@@ -41,7 +41,7 @@ from rucio.common.exception import (InvalidRSEExpression, InvalidReplicationRule
                                     InvalidObject, RSEBlacklisted, RuleReplaceFailed, RequestNotFound,
                                     ManualRuleApprovalBlocked, UnsupportedOperation)
 from rucio.common.schema import validate_schema
-from rucio.common.utils import str_to_date, sizefmt
+from rucio.common.utils import chunks, str_to_date, sizefmt
 from rucio.core import account_counter, rse_counter, request as request_core
 from rucio.core.account import get_account
 from rucio.core.lifetime_exception import define_eol
@@ -1322,35 +1322,40 @@ def re_evaluate_did(scope, name, rule_evaluation_action, session=None):
     """
     Re-Evaluates a did.
 
+    All the pending updated_dids of the did for the given actions are evaluated at once and
+    deleted in the same transaction.
+
     :param scope:                   The scope of the did to be re-evaluated.
     :param name:                    The name of the did to be re-evaluated.
-    :param rule_evaluation_action:  The Rule evaluation action.
+    :param rule_evaluation_action:  The Rule evaluation action, or a list of actions.
     :param session:                 The database session in use.
     :raises:                        DataIdentifierNotFound
     """
 
+    if isinstance(rule_evaluation_action, (list, tuple, set)):
+        rule_evaluation_actions = set(rule_evaluation_action)
+    else:
+        rule_evaluation_actions = set([rule_evaluation_action])
+
     try:
         did = session.query(models.DataIdentifier).filter(models.DataIdentifier.scope == scope,
                                                           models.DataIdentifier.name == name).one()
     except NoResultFound:
         raise DataIdentifierNotFound()
 
-    if rule_evaluation_action == DIDReEvaluation.ATTACH:
-        __evaluate_did_attach(did, session=session)
-    else:
+    # The updated_dids committed before this point are covered by the evaluation, the later ones are kept
+    updated_did_ids = [updated_did.id for updated_did in session.query(models.UpdatedDID.id).filter(
+        models.UpdatedDID.scope == scope,
+        models.UpdatedDID.name == name,
+        models.UpdatedDID.rule_evaluation_action.in_(list(rule_evaluation_actions)))]
+
+    if DIDReEvaluation.DETACH in rule_evaluation_actions:
         __evaluate_did_detach(did, session=session)
+    if DIDReEvaluation.ATTACH in rule_evaluation_actions:
+        __evaluate_did_attach(did, session=session)
 
-    # Update size and length of did
-    if session.bind.dialect.name == 'oracle':
-        stmt = session.query(func.sum(models.DataIdentifierAssociation.bytes),
-                             func.count(1)).\
-            with_hint(models.DataIdentifierAssociation,
-                      "index(CONTENTS CONTENTS_PK)", 'oracle').\
-            filter(models.DataIdentifierAssociation.scope == scope,
-                   models.DataIdentifierAssociation.name == name)
-        for bytes, length in stmt:
-            did.bytes = bytes
-            did.length = length
+    for chunk in chunks(updated_did_ids, 1000):
+        session.query(models.UpdatedDID).filter(models.UpdatedDID.id.in_(chunk)).delete(synchronize_session=False)
 
     # Add an updated_col_rep
     if did.did_type == DIDType.DATASET:
@@ -2198,11 +2203,13 @@ def __evaluate_did_detach(eval_did, session=None):
         # Iterate rules and delete locks
         transfers_to_delete = []  # [{'scope': , 'name':, 'rse_id':}]
         account_counter_decreases = {}  # {'rse_id': [file_size, file_size, file_size]}
+        did_files = {}  # {(scope, name): {(file_scope, file_name): True}}, shared by the rules of the same did
+        did_child_datasets = {}  # {(scope, name): {(ds_scope, ds_name): True}}
         for rule in rules:
             # Get all the files covering this rule
-            files = {}
-            for file in rucio.core.did.list_files(scope=rule.scope, name=rule.name, session=session):
-                files[(file['scope'], file['name'])] = True
+            if (rule.scope, rule.name) not in did_files:
+                did_files[(rule.scope, rule.name)] = dict(((file['scope'], file['name']), True) for file in rucio.core.did.list_files(scope=rule.scope, name=rule.name, session=session))
+            files = did_files[(rule.scope, rule.name)]
             logging.debug("Removing locks for rule %s [%d/%d/%d]" % (str(rule.id), rule.locks_ok_cnt, rule.locks_replicating_cnt, rule.locks_stuck_cnt))
             rule_locks_ok_cnt_before = rule.locks_ok_cnt
             query = session.query(models.ReplicaLock).filter_by(rule_id=rule.id)
@@ -2223,9 +2230,9 @@ def __evaluate_did_detach(eval_did, session=None):
 
             if eval_did.did_type == DIDType.CONTAINER:
                 # Get all datasets of eval_did
-                child_datasets = {}
-                for ds in rucio.core.did.list_child_datasets(scope=rule.scope, name=rule.name, session=session):
-                    child_datasets[(ds['scope'], ds['name'])] = True
+                if (rule.scope, rule.name) not in did_child_datasets:
+                    did_child_datasets[(rule.scope, rule.name)] = dict(((ds['scope'], ds['name']), True) for ds in rucio.core.did.list_child_datasets(scope=rule.scope, name=rule.name, session=session))
+                child_datasets = did_child_datasets[(rule.scope, rule.name)]
                 logging.debug("Removing dataset_locks for rule %s [%d/%d/%d]" % (str(rule.id), rule.locks_ok_cnt, rule.locks_replicating_cnt, rule.locks_stuck_cnt))
                 query = session.query(models.DatasetLock).filter_by(rule_id=rule.id)
                 for ds_lock in query:
@@ -2329,6 +2336,7 @@ def __evaluate_did_attach(eval_did, session=None):
 
                 # Evaluate the replication rules
                 with record_timer_block('rule.evaluate_did_attach.evaluate_rules'):
+                    brother_locks = None
                     for rule in rules:
                         rule_locks_ok_cnt_before = rule.locks_ok_cnt
 
@@ -2375,17 +2383,19 @@ def __evaluate_did_attach(eval_did, session=None):
                         preferred_rse_ids = []
                         # 3.1 Check if the dids in question are files added to a dataset with DATASET/ALL grouping
                         if new_child_dids[0].child_type == DIDType.FILE and rule.grouping != RuleGrouping.NONE:
-                            # Are there any existing did's in this dataset
-                            brother_did = session.query(models.DataIdentifierAssociation).filter(
-                                models.DataIdentifierAssociation.scope == eval_did.scope,
-                                models.DataIdentifierAssociation.name == eval_did.name).order_by(models.DataIdentifierAssociation.created_at).first()
-                            if brother_did is not None:
-                                # There are other files in the dataset
-                                brother_locks = rucio.core.lock.get_replica_locks(scope=brother_did.child_scope,
-                                                                                  name=brother_did.child_name,
-                                                                                  nowait=True,
-                                                                                  session=session)
-                                preferred_rse_ids = [lock['rse_id'] for lock in brother_locks if lock['rse_id'] in [rse['id'] for rse in rses] and lock['rule_id'] == rule.id]
+                            if brother_locks is None:
+                                # Are there any existing did's in this dataset, resolved once for all the rules
+                                brother_locks = []
+                                brother_did = session.query(models.DataIdentifierAssociation).filter(
+                                    models.DataIdentifierAssociation.scope == eval_did.scope,
+                                    models.DataIdentifierAssociation.name == eval_did.name).order_by(models.DataIdentifierAssociation.created_at).first()
+                                if brother_did is not None:
+                                    # There are other files in the dataset
+                                    brother_locks = rucio.core.lock.get_replica_locks(scope=brother_did.child_scope,
+                                                                                      name=brother_did.child_name,
+                                                                                      nowait=True,
+                                                                                      session=session)
+                            preferred_rse_ids = [lock['rse_id'] for lock in brother_locks if lock['rse_id'] in [rse['id'] for rse in rses] and lock['rule_id'] == rule.id]
                         locks_stuck_before = rule.locks_stuck_cnt
                         try:
                             __create_locks_replicas_transfers(datasetfiles=datasetfiles,
@@ -19,9 +19,9 @@ import logging
 import traceback
 
 from rucio.common.exception import InvalidRSEExpression
-from rucio.common.rse_attributes import get_rse_attributes
-from rucio.core import request, rse as rse_core
+from rucio.core import request
 from rucio.core.rse_expression_parser import parse_expression
+from rucio.core.rse_topology import get_topology
 from rucio.db.sqla.constants import RequestType
 from rucio.db.sqla.session import read_session
 from rucio.rse import rsemanager as rsemgr
@@ -61,6 +61,8 @@ def get_stagein_requests_and_source_replicas(process=None, total_processes=None,
                                                                     rses=rses,
                                                                     session=session)
 
+    topology = get_topology(session=session)
+
     transfers, rses_info, protocols, rse_attrs, reqs_no_source = {}, {}, {}, {}, []
     for id, rule_id, scope, name, md5, adler32, bytes, activity, attributes, dest_rse_id, source_rse_id, rse, deterministic, rse_type, path, staging_buffer, retry_count, previous_attempt_id, src_url, ranking in req_sources:
         try:
@@ -84,8 +86,7 @@ def get_stagein_requests_and_source_replicas(process=None, total_processes=None,
 
                     # Get destination rse information and protocol
                     if dest_rse_id not in rses_info:
-                        dest_rse = rse_core.get_rse_name(rse_id=dest_rse_id, session=session)
-                        rses_info[dest_rse_id] = rsemgr.get_rse_info(dest_rse, session=session)
+                        rses_info[dest_rse_id] = topology.get_rse_info(dest_rse_id, session=session)
 
                     if staging_buffer != rses_info[dest_rse_id]['rse']:
                         continue
@@ -93,7 +94,7 @@ def get_stagein_requests_and_source_replicas(process=None, total_processes=None,
                     attr = None
                     if attributes:
                         if type(attributes) is dict:
-                            attr = json.loads(json.dumps(attributes))
+                            attr = attributes
                         else:
                             attr = json.loads(str(attributes))
 
@@ -110,11 +111,9 @@ def get_stagein_requests_and_source_replicas(process=None, total_processes=None,
                                 continue
 
                     if source_rse_id not in rses_info:
-                        # source_rse = rse_core.get_rse_name(rse_id=source_rse_id, session=session)
-                        source_rse = rse
-                        rses_info[source_rse_id] = rsemgr.get_rse_info(source_rse, session=session)
+                        rses_info[source_rse_id] = topology.get_rse_info(source_rse_id, session=session)
                     if source_rse_id not in rse_attrs:
-                        rse_attrs[source_rse_id] = get_rse_attributes(source_rse_id, session=session)
+                        rse_attrs[source_rse_id] = topology.get_rse_attributes(source_rse_id, session=session)
 
                     if source_rse_id not in protocols:
                         protocols[source_rse_id] = rsemgr.create_protocol(rses_info[source_rse_id], 'write', current_schemes)
@@ -138,17 +137,15 @@ def get_stagein_requests_and_source_replicas(process=None, total_processes=None,
                     attr = None
                     if attributes:
                         if type(attributes) is dict:
-                            attr = json.loads(json.dumps(attributes))
+                            attr = attributes
                         else:
                             attr = json.loads(str(attributes))
 
                     # to get space token and fts attribute
                     if source_rse_id not in rses_info:
-                        # source_rse = rse_core.get_rse_name(rse_id=source_rse_id, session=session)
-                        source_rse = rse
-                        rses_info[source_rse_id] = rsemgr.get_rse_info(source_rse, session=session)
+                        rses_info[source_rse_id] = topology.get_rse_info(source_rse_id, session=session)
                     if source_rse_id not in rse_attrs:
-                        rse_attrs[source_rse_id] = get_rse_attributes(source_rse_id, session=session)
+                        rse_attrs[source_rse_id] = topology.get_rse_attributes(source_rse_id, session=session)
 
                     if source_rse_id not in protocols:
                         protocols[source_rse_id] = rsemgr.create_protocol(rses_info[source_rse_id], 'write', current_schemes)
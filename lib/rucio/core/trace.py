@@ -13,16 +13,16 @@
 Core tracer module
 """
 
+import atexit
 import json
 import logging
 import logging.handlers
-import random
 
 import dns.resolver
-import stomp
 
 from rucio.common.config import config_get, config_get_int
 from rucio.core.monitor import record_counter
+from rucio.core.publisher import Publisher
 
 ERRLOG = logging.getLogger('errlog')
 ERRLOG.setLevel(logging.ERROR)
@@ -48,8 +48,6 @@ TOPIC = config_get('trace', 'topic')
 USERNAME = config_get('trace', 'username')
 PASSWORD = config_get('trace', 'password')
 
-logging.getLogger("stomp").setLevel(logging.CRITICAL)
-
 BROKERSRESOLVED = []
 for broker in BROKERSALIAS:
     try:
@@ -58,10 +56,8 @@ for broker in BROKERSALIAS:
     except:
         pass
 
-CONNS = []
-
-for broker in BROKERSRESOLVED:
-    CONNS.append(stomp.Connection(host_and_ports=[(broker, PORT)], reconnect_attempts_max=3))
+PUBLISHER = Publisher(brokers=BROKERSRESOLVED, port=PORT, destination=TOPIC, username=USERNAME, password=PASSWORD, name='trace')
+atexit.register(PUBLISHER.stop, timeout=3)
 
 
 def date_handler(obj):
@@ -71,7 +67,7 @@ def date_handler(obj):
 
 def trace(payload):
     """
-    Write a trace to log file and send it to active mq.
+    Write a trace to log file and queue it for active mq. Traces are dropped if the brokers cannot keep up.
 
     :param payload: Python dictionary with trace report.
     """
@@ -80,30 +76,5 @@ def trace(payload):
     report = json.dumps(payload, default=date_handler)
     LOGGER.debug(report)
 
-    t_conns = CONNS[:]
-
-    try:
-        for i in xrange(len(t_conns)):
-            try:
-                conn = random.sample(t_conns, 1)[0]
-                if not conn.is_connected():
-                    logging.info('reconnect to ' + conn.transport._Transport__host_and_ports[0][0])
-                    conn.start()
-                    conn.connect(USERNAME, PASSWORD)
-            except stomp.exception.NotConnectedException, error:
-                logging.warn('Could not connect to broker %s, try another one' %
-                             conn.transport._Transport__host_and_ports[0][0])
-                t_conns.remove(conn)
-                continue
-            except stomp.exception.ConnectFailedException as error:
-                logging.warn('Could not connect to broker %s, try another one' %
-                             conn.transport._Transport__host_and_ports[0][0])
-                t_conns.remove(conn)
-                continue
-
-        if conn.is_connected:
-            conn.send(body=report, destination=TOPIC, headers={'persistent': 'true', 'appversion': 'rucio'})
-        else:
-            logging.error("Unable to connect to broker. Could not send trace: %s" % report)
-    except Exception, error:
-        logging.error(error)
+    if not PUBLISHER.publish(report, headers={'persistent': 'true', 'appversion': 'rucio'}):
+        logging.error("Could not queue trace, no broker available or queue full: %s" % report)
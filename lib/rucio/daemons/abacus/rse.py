@@ -17,48 +17,72 @@ import threading
 import time
 import traceback
 
+from datetime import datetime
+
 from rucio.common.config import config_get
-from rucio.core.rse_counter import get_updated_rse_counters, update_rse_counter
+from rucio.core.monitor import record_gauge
+from rucio.core.rse_counter import get_updated_rse_counters_lag, update_rse_counters
 
 graceful_stop = threading.Event()
 
+# Minimum time between two reports of the backlog of a worker, in seconds
+LAG_REPORT_INTERVAL = 60
+
 logging.basicConfig(stream=sys.stdout,
                     level=getattr(logging, config_get('common', 'loglevel').upper()),
                     format='%(asctime)s\t%(process)d\t%(levelname)s\t%(message)s')
 
 
-def rse_update(once=False, process=0, total_processes=1, thread=0, threads_per_process=1):
+def report_lag(total_workers, worker_number):
+    """
+    Send the number of pending updates of the worker and the age of the oldest one.
+    """
+    lag = get_updated_rse_counters_lag(total_workers=total_workers, worker_number=worker_number)
+    age = (datetime.utcnow() - lag['oldest']).total_seconds() if lag['oldest'] else 0
+    record_gauge('abacus.rse.pending.%s' % worker_number, lag['rows'])
+    record_gauge('abacus.rse.lag.%s' % worker_number, age)
+    logging.info('rse_update[%s/%s]: %s pending updates, oldest %.0f seconds' % (worker_number, total_workers, lag['rows'], age))
+
+
+def rse_update(once=False, process=0, total_processes=1, thread=0, threads_per_process=1, bulk=1000):
     """
     Main loop to check and update the RSE Counters.
+    With once, the batches are applied until the pending updates of the worker are drained.
     """
 
     logging.info('rse_update: starting')
 
     logging.info('rse_update: started')
 
+    total_workers = total_processes * threads_per_process - 1
+    worker_number = process * threads_per_process + thread
+    last_report = 0
+
     while not graceful_stop.is_set():
         try:
-            # Select a bunch of rses for to update for this worker
-            start = time.time()  # NOQA
-            rse_ids = get_updated_rse_counters(total_workers=total_processes * threads_per_process - 1,
-                                               worker_number=process * threads_per_process + thread)
-            logging.debug('Index query time %f size=%d' % (time.time() - start, len(rse_ids)))
-
-            # If the list is empty, sent the worker to sleep
-            if not rse_ids and not once:
-                logging.info('rse_update[%s/%s] did not get any work' % (process * threads_per_process + thread, total_processes * threads_per_process - 1))
+            if time.time() - last_report > LAG_REPORT_INTERVAL:
+                last_report = time.time()
+                try:
+                    report_lag(total_workers=total_workers, worker_number=worker_number)
+                except Exception:
+                    logging.warning('rse_update[%s/%s]: cannot report the pending updates: %s' % (worker_number, total_workers, traceback.format_exc()))
+
+            # Apply a batch of the pending updates of this worker
+            start = time.time()
+            updates = update_rse_counters(total_workers=total_workers, worker_number=worker_number, limit=bulk)
+            logging.debug('rse_update[%s/%s]: applied %d updates in %f' % (worker_number, total_workers, updates, time.time() - start))
+
+            # Continue without delay while there is a backlog
+            if updates < bulk:
+                if once:
+                    break
+                if not updates:
+                    logging.info('rse_update[%s/%s] did not get any work' % (worker_number, total_workers))
                 time.sleep(10)
-            else:
-                for rse_id in rse_ids:
-                    if graceful_stop.is_set():
-                        break
-                    start_time = time.time()
-                    update_rse_counter(rse_id=rse_id)
-                    logging.debug('rse_update[%s/%s]: update of rse "%s" took %f' % (process * threads_per_process + thread, total_processes * threads_per_process - 1, rse_id, time.time() - start_time))
         except Exception:
             logging.error(traceback.format_exc())
-        if once:
-            break
+            if once:
+                break
 
     logging.info('rse_update: graceful stop requested')
 
@@ -73,16 +97,16 @@ def stop(signum=None, frame=None):
     graceful_stop.set()
 
 
-def run(once=False, process=0, total_processes=1, threads_per_process=11):
+def run(once=False, process=0, total_processes=1, threads_per_process=11, bulk=1000):
     """
     Starts up the Abacus-RSE threads.
     """
     if once:
         logging.info('main: executing one iteration only')
-        rse_update(once)
+        rse_update(once, bulk=bulk)
     else:
         logging.info('main: starting threads')
-        threads = [threading.Thread(target=rse_update, kwargs={'process': process, 'total_processes': total_processes, 'once': once, 'thread': i, 'threads_per_process': threads_per_process}) for i in xrange(0, threads_per_process)]
+        threads = [threading.Thread(target=rse_update, kwargs={'process': process, 'total_processes': total_processes, 'once': once, 'thread': i, 'threads_per_process': threads_per_process, 'bulk': bulk}) for i in xrange(0, threads_per_process)]
         [t.start() for t in threads]
         logging.info('main: waiting for interrupts')
         # Interruptible joins require a timeout.
@@ -22,7 +22,7 @@ from rucio.common import config
 from rucio.common.dumper import LogPipeHandler
 from rucio.common.dumper import mkdir
 from rucio.common.dumper import temp_file
-from rucio.common.dumper.consistency import Consistency
+from rucio.common.dumper.consistency import Consistency, SORT_BUFFER_SIZE
 from rucio.daemons.auditor.hdfs import ReplicaFromHDFS
 from rucio.daemons.auditor import srmdumps
 
@@ -32,7 +32,7 @@ def total_seconds(td):
     return (td.microseconds + (td.seconds + td.days * 24 * 3600) * (10 ** 6)) / float(10 ** 6)
 
 
-def consistency(rse, delta, configuration, cache_dir, results_dir):
+def consistency(rse, delta, configuration, cache_dir, results_dir, sort_buffer_size=SORT_BUFFER_SIZE):
     logger = logging.getLogger('auditor-worker')
     rsedump, rsedate = srmdumps.download_rse_dump(rse, configuration, destdir=cache_dir)
     results_path = '{0}/{1}_{2}'.format(results_dir, rse, rsedate.strftime('%Y%m%d'))  # pylint: disable=no-member
@@ -51,6 +51,7 @@ def consistency(rse, delta, configuration, cache_dir, results_dir):
         rrdump_next,
         date=rsedate,
         cache_dir=cache_dir,
+        sort_buffer_size=sort_buffer_size,
     )
     mkdir(results_dir)
     with temp_file(results_dir, results_path) as (output, _):
@@ -58,7 +59,8 @@ def consistency(rse, delta, configuration, cache_dir, results_dir):
             output.write('{0}\n'.format(result.csv()))
 
 
-def check(queue, retry, terminate, logpipe, cache_dir, results_dir, keep_dumps, delta_in_days):
+def check(queue, retry, terminate, logpipe, cache_dir, results_dir, keep_dumps, delta_in_days,
+          sort_buffer_size=SORT_BUFFER_SIZE):
     logger = logging.getLogger('auditor-worker')
     lib_logger = logging.getLogger('dumper')
 
@@ -88,7 +90,7 @@ def check(queue, retry, terminate, logpipe, cache_dir, results_dir, keep_dumps,
         start = datetime.now()
         try:
             logger.debug('Checking "%s"', rse)
-            consistency(rse, delta, configuration, cache_dir, results_dir)
+            consistency(rse, delta, configuration, cache_dir, results_dir, sort_buffer_size)
         except:
             success = False
         else:
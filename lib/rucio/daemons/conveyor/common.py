@@ -42,7 +42,23 @@ def submit_transfer(external_host, job, submitter='submitter', process=0, thread
     :param timeout:         Timeout
     """
 
-    # prepare submitting
+    if not prepare_transfer(external_host, job, process=process, thread=thread):
+        return
+    eid = submit_job(external_host, job, submitter=submitter, process=process, thread=thread, timeout=timeout)
+    register_transfer(external_host, job, eid, process=process, thread=thread)
+
+
+def prepare_transfer(external_host, job, process=0, thread=0):
+    """
+    Set the requests of a job to SUBMITTING state and prepare their sources.
+
+    :param external_host:   FTS server to submit to.
+    :param job:             Job dictionary.
+    :param process:         Process which submits.
+    :param thread:          Thread which submits.
+    :returns:               True if the job can be submitted, False otherwise.
+    """
+
     xfers_ret = {}
     try:
         for file in job['files']:
@@ -64,9 +80,23 @@ def submit_transfer(external_host, job, submitter='submitter', process=0, thread
         logging.debug("%s:%s finished to prepare transfer" % (process, thread))
     except:
         logging.error("%s:%s Failed to prepare requests %s state to SUBMITTING(Will not submit jobs but return directly) with error: %s" % (process, thread, xfers_ret.keys(), traceback.format_exc()))
-        return
+        return False
+    return True
+
+
+def submit_job(external_host, job, submitter='submitter', process=0, thread=0, timeout=None):
+    """
+    Submit a prepared job to the transfertool.
+
+    :param external_host:   FTS server to submit to.
+    :param job:             Job dictionary.
+    :param submitter:       Name of the submitting entity.
+    :param process:         Process which submits.
+    :param thread:          Thread which submits.
+    :param timeout:         Timeout
+    :returns:               The external id of the job, or None if the submission failed.
+    """
 
-    # submit the job
     eid = None
     try:
         ts = time.time()
@@ -79,8 +109,20 @@ def submit_transfer(external_host, job, submitter='submitter', process=0, thread
         record_timer('daemons.conveyor.%s.submit_bulk_transfer.files' % submitter, len(job['files']))
     except Exception, ex:
         logging.error("Failed to submit a job with error %s: %s" % (str(ex), traceback.format_exc()))
+    return eid
+
+
+def register_transfer(external_host, job, eid, process=0, thread=0):
+    """
+    Register the state of the requests of a submitted job.
+
+    :param external_host:   FTS server the job was submitted to.
+    :param job:             Job dictionary.
+    :param eid:             External id of the job, or None if the submission failed.
+    :param process:         Process which submits.
+    :param thread:          Thread which submits.
+    """
 
-    # register transfer
     xfers_ret = {}
     try:
         for file in job['files']:
@@ -27,12 +27,14 @@ import traceback
 
 from collections import defaultdict
 from ConfigParser import NoOptionError
+from Queue import Queue, Empty
 from threadpool import ThreadPool, makeRequests
 
 from rucio.common.config import config_get
 from rucio.core import heartbeat, request as request_core, transfer as transfer_core
-from rucio.core.monitor import record_counter, record_timer
-from rucio.daemons.conveyor.common import submit_transfer, bulk_group_transfer, get_conveyor_rses
+from rucio.core.monitor import record_counter, record_gauge, record_timer
+from rucio.daemons.conveyor.common import (submit_transfer, prepare_transfer, submit_job, register_transfer,
+                                           bulk_group_transfer, get_conveyor_rses)
 from rucio.db.sqla.constants import RequestState
 
 logging.basicConfig(stream=sys.stdout,
@@ -42,18 +44,12 @@ logging.basicConfig(stream=sys.stdout,
 graceful_stop = threading.Event()
 
 
-def submitter(once=False, rses=[], mock=False,
-              process=0, total_processes=1, total_threads=1,
-              bulk=100, group_bulk=1, group_policy='rule', fts_source_strategy='auto',
-              activities=None, sleep_time=600, max_sources=4, retry_other_fts=False):
+def __get_config():
     """
-    Main loop to submit a new transfer primitive to a transfertool.
-    """
-
-    logging.info('Transfer submitter starting - process (%i/%i) threads (%i)' % (process,
-                                                                                 total_processes,
-                                                                                 total_threads))
+    Read the submitter configuration.
 
+    :returns: scheme, failover_scheme, timeout, bring_online, max_time_in_queue
+    """
     try:
         scheme = config_get('conveyor', 'scheme')
     except NoOptionError:
@@ -87,6 +83,23 @@ def submitter(once=False, rses=[], mock=False,
         max_time_in_queue['default'] = 168
     logging.debug("Maximum time in queue for different activities: %s" % max_time_in_queue)
 
+    return scheme, failover_scheme, timeout, bring_online, max_time_in_queue
+
+
+def submitter(once=False, rses=[], mock=False,
+              process=0, total_processes=1, total_threads=1,
+              bulk=100, group_bulk=1, group_policy='rule', fts_source_strategy='auto',
+              activities=None, sleep_time=600, max_sources=4, retry_other_fts=False):
+    """
+    Main loop to submit a new transfer primitive to a transfertool.
+    """
+
+    logging.info('Transfer submitter starting - process (%i/%i) threads (%i)' % (process,
+                                                                                 total_processes,
+                                                                                 total_threads))
+
+    scheme, failover_scheme, timeout, bring_online, max_time_in_queue = __get_config()
+
     executable = ' '.join(sys.argv)
     hostname = socket.getfqdn()
     pid = os.getpid()
@@ -178,6 +191,212 @@ def submitter(once=False, rses=[], mock=False,
     return
 
 
+def __get(queue, upstream_done):
+    """
+    Get the next item of a pipeline queue.
+
+    :param queue:          The queue to read.
+    :param upstream_done:  Event set by the stage feeding the queue once it has put its last item.
+    :returns:              The next item, or None once the queue is drained and the upstream stage is done.
+    """
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Empty:
+            if upstream_done.is_set():
+                try:
+                    return queue.get_nowait()
+                except Empty:
+                    return None
+
+
+def pipelined_submitter(once=False, rses=[], mock=False,
+                        process=0, total_processes=1, total_threads=1,
+                        bulk=100, group_bulk=1, group_policy='rule', fts_source_strategy='auto',
+                        activities=None, sleep_time=600, max_sources=4, retry_other_fts=False,
+                        queue_size=10):
+    """
+    Pipelined variant of the submitter. Fetching the requests, grouping them in jobs, submitting
+    the jobs and registering the transfers run as separate stages connected by bounded queues,
+    so that the database work does not wait for the transfertool and vice versa.
+    Every FTS host gets its own job queue served by total_threads submitting threads.
+    The requests fetched but not yet registered are kept in flight, so that the fetching stage
+    does not pick them up again while they are still queued in the database.
+
+    :param queue_size:  Maximum number of items waiting in each queue between two stages.
+    """
+
+    logging.info('Pipelined transfer submitter starting - process (%i/%i) threads (%i)' % (process,
+                                                                                           total_processes,
+                                                                                           total_threads))
+
+    scheme, failover_scheme, timeout, bring_online, max_time_in_queue = __get_config()
+
+    executable = ' '.join(sys.argv)
+    hostname = socket.getfqdn()
+    pid = os.getpid()
+    hb_thread = threading.current_thread()
+    heartbeat.sanity_check(executable=executable, hostname=hostname)
+    hb = heartbeat.live(executable, hostname, pid, hb_thread)
+
+    logging.info('Pipelined transfer submitter started - process (%i/%i) threads (%i/%i) timeout (%s)' % (process, total_processes,
+                                                                                                          hb['assign_thread'], hb['nr_threads'],
+                                                                                                          timeout))
+
+    transfers_queue = Queue(queue_size)
+    register_queue = Queue(queue_size)
+    jobs_queues = {}
+    fetch_done, group_done, submit_done = threading.Event(), threading.Event(), threading.Event()
+    submit_threads = []
+    in_flight, in_flight_lock = set(), threading.Lock()
+
+    def release(request_ids):
+        with in_flight_lock:
+            in_flight.difference_update(request_ids)
+
+    def job_request_ids(job):
+        return [file['metadata']['request_id'] for file in job['files']]
+
+    def group_stage():
+        while True:
+            item = __get(transfers_queue, fetch_done)
+            if item is None:
+                break
+            activity, transfers = item
+            request_ids = set(transfers)
+            try:
+                ts = time.time()
+                grouped_jobs = bulk_group_transfer(transfers, group_policy, group_bulk, fts_source_strategy, max_time_in_queue)
+                record_timer('daemons.conveyor.transfer_submitter.bulk_group_transfer', (time.time() - ts) * 1000 / (len(transfers) if len(transfers) else 1))
+
+                for external_host in grouped_jobs:
+                    for job in grouped_jobs[external_host]:
+                        if not prepare_transfer(external_host, job, process=process, thread=hb['assign_thread']):
+                            continue
+                        # Released by the register stage
+                        request_ids.difference_update(job_request_ids(job))
+                        if external_host not in jobs_queues:
+                            jobs_queues[external_host] = Queue(queue_size)
+                            for i in xrange(total_threads):
+                                thread = threading.Thread(target=submit_stage, args=(external_host, jobs_queues[external_host]))
+                                thread.start()
+                                submit_threads.append(thread)
+                        jobs_queues[external_host].put(job)
+                        record_counter('daemons.conveyor.transfer_submitter.pipeline.grouped')
+            except:
+                logging.critical('%s:%s %s' % (process, hb['assign_thread'], traceback.format_exc()))
+            release(request_ids)
+        group_done.set()
+
+    def submit_stage(external_host, jobs_queue):
+        while True:
+            job = __get(jobs_queue, group_done)
+            if job is None:
+                break
+            try:
+                eid = submit_job(external_host, job, submitter='transfer_submitter', process=process, thread=hb['assign_thread'], timeout=timeout)
+                register_queue.put((external_host, job, eid))
+                record_counter('daemons.conveyor.transfer_submitter.pipeline.submitted')
+            except:
+                logging.critical('%s:%s %s' % (process, hb['assign_thread'], traceback.format_exc()))
+                release(job_request_ids(job))
+
+    def register_stage():
+        while True:
+            item = __get(register_queue, submit_done)
+            if item is None:
+                break
+            external_host, job, eid = item
+            try:
+                ts = time.time()
+                register_transfer(external_host, job, eid, process=process, thread=hb['assign_thread'])
+                record_timer('daemons.conveyor.transfer_submitter.pipeline.register.per_file', (time.time() - ts) * 1000 / len(job['files']))
+                record_counter('daemons.conveyor.transfer_submitter.pipeline.registered')
+            except:
+                logging.critical('%s:%s %s' % (process, hb['assign_thread'], traceback.format_exc()))
+            finally:
+                release(job_request_ids(job))
+
+    group_thread = threading.Thread(target=group_stage)
+    register_thread = threading.Thread(target=register_stage)
+    group_thread.start()
+    register_thread.start()
+
+    activity_next_exe_time = defaultdict(time.time)
+
+    while not graceful_stop.is_set():
+
+        try:
+            hb = heartbeat.live(executable, hostname, pid, hb_thread, older_than=3600)
+
+            if activities is None:
+                activities = [None]
+            if rses:
+                rse_ids = [rse['id'] for rse in rses]
+            else:
+                rse_ids = None
+
+            for activity in activities:
+                if activity_next_exe_time[activity] > time.time():
+                    graceful_stop.wait(1)
+                    continue
+
+                ts = time.time()
+                transfers = __get_transfers(process=process,
+                                            total_processes=total_processes,
+                                            thread=hb['assign_thread'],
+                                            total_threads=hb['nr_threads'],
+                                            failover_schemes=failover_scheme,
+                                            limit=bulk,
+                                            activity=activity,
+                                            rses=rse_ids,
+                                            schemes=scheme,
+                                            mock=mock,
+                                            max_sources=max_sources,
+                                            bring_online=bring_online,
+                                            retry_other_fts=retry_other_fts)
+                nr_fetched = len(transfers)
+                # Skip the requests of the previous batches which are still in the pipeline
+                with in_flight_lock:
+                    for request_id in [request_id for request_id in transfers if request_id in in_flight]:
+                        del transfers[request_id]
+                    in_flight.update(transfers)
+                record_timer('daemons.conveyor.transfer_submitter.get_transfers.per_transfer', (time.time() - ts) * 1000 / (len(transfers) if len(transfers) else 1))
+                record_counter('daemons.conveyor.transfer_submitter.get_transfers', len(transfers))
+                logging.info("%s:%s Got %s transfers for %s" % (process, hb['assign_thread'], len(transfers), activity))
+
+                if transfers:
+                    transfers_queue.put((activity, transfers))
+                record_gauge('daemons.conveyor.transfer_submitter.pipeline.transfers_queue', transfers_queue.qsize())
+                record_gauge('daemons.conveyor.transfer_submitter.pipeline.register_queue', register_queue.qsize())
+
+                # Back off only when the queue is short, not when its requests are still in the pipeline
+                if nr_fetched < group_bulk:
+                    logging.info('%i:%i - only %s transfers for %s which is less than group bulk %s, sleep %s seconds' % (process, hb['assign_thread'], nr_fetched, activity, group_bulk, sleep_time))
+                    if activity_next_exe_time[activity] < time.time():
+                        activity_next_exe_time[activity] = time.time() + sleep_time
+                elif not transfers:
+                    graceful_stop.wait(1)
+        except:
+            logging.critical('%s:%s %s' % (process, hb['assign_thread'], traceback.format_exc()))
+
+        if once:
+            break
+
+    logging.info('%s:%s graceful stop requested, draining the pipeline' % (process, hb['assign_thread']))
+
+    fetch_done.set()
+    group_thread.join()
+    [thread.join() for thread in submit_threads]
+    submit_done.set()
+    register_thread.join()
+
+    heartbeat.die(executable, hostname, pid, hb_thread)
+
+    logging.info('%s:%s graceful stop done' % (process, hb['assign_thread']))
+    return
+
+
 def stop(signum=None, frame=None):
     """
     Graceful exit.
@@ -188,7 +407,7 @@ def stop(signum=None, frame=None):
 def run(once=False,
         process=0, total_processes=1, total_threads=1, group_bulk=1, group_policy='rule',
         mock=False, rses=[], include_rses=None, exclude_rses=None, bulk=100, fts_source_strategy='auto',
-        activities=None, sleep_time=600, max_sources=4, retry_other_fts=False):
+        activities=None, sleep_time=600, max_sources=4, retry_other_fts=False, pipeline=False, queue_size=10):
     """
     Starts up the conveyer threads.
     """
@@ -206,20 +425,25 @@ def run(once=False,
         logging.info("RSE selection: automatic")
 
     logging.info('starting submitter threads')
-    threads = [threading.Thread(target=submitter, kwargs={'once': once,
-                                                          'process': process,
-                                                          'total_processes': total_processes,
-                                                          'total_threads': total_threads,
-                                                          'rses': working_rses,
-                                                          'bulk': bulk,
-                                                          'group_bulk': group_bulk,
-                                                          'group_policy': group_policy,
-                                                          'activities': activities,
-                                                          'mock': mock,
-                                                          'sleep_time': sleep_time,
-                                                          'max_sources': max_sources,
-                                                          'fts_source_strategy': fts_source_strategy,
-                                                          'retry_other_fts': retry_other_fts})]
+    kwargs = {'once': once,
+              'process': process,
+              'total_processes': total_processes,
+              'total_threads': total_threads,
+              'rses': working_rses,
+              'bulk': bulk,
+              'group_bulk': group_bulk,
+              'group_policy': group_policy,
+              'activities': activities,
+              'mock': mock,
+              'sleep_time': sleep_time,
+              'max_sources': max_sources,
+              'fts_source_strategy': fts_source_strategy,
+              'retry_other_fts': retry_other_fts}
+    if pipeline:
+        kwargs['queue_size'] = queue_size
+        threads = [threading.Thread(target=pipelined_submitter, kwargs=kwargs)]
+    else:
+        threads = [threading.Thread(target=submitter, kwargs=kwargs)]
 
     [t.start() for t in threads]
 
@@ -18,25 +18,23 @@
 import json
 import logging
 import os
-import random
 import smtplib
 import socket
-import ssl
 import sys
 import threading
 import time
 import traceback
 
 from email.mime.text import MIMEText
+from functools import partial
 from sqlalchemy.orm.exc import NoResultFound
 
 import dns.resolver
-import stomp
 
 from rucio.common.config import config_get, config_get_int, config_get_bool
 from rucio.core.heartbeat import live, die, sanity_check
-from rucio.core.message import retrieve_messages, delete_messages
-from rucio.core.monitor import record_counter
+from rucio.core.message import get_buckets, retrieve_messages, delete_messages
+from rucio.core.publisher import Publisher
 
 
 logging.getLogger('requests').setLevel(logging.CRITICAL)
@@ -76,6 +74,10 @@ def deliver_emails(once=False, send_email=True, thread=0, bulk=1000, delay=10):
 
         t_start = time.time()
 
+        if get_buckets(thread=heartbeat['assign_thread'], total_threads=heartbeat['nr_threads']) == []:
+            logging.warning('[email] %i:%i - no message bucket left for this thread, more threads than buckets',
+                            heartbeat['assign_thread'], heartbeat['nr_threads'])
+
         messages = retrieve_messages(bulk=bulk,
                                      thread=heartbeat['assign_thread'],
                                      total_threads=heartbeat['nr_threads'],
@@ -83,32 +85,43 @@ def deliver_emails(once=False, send_email=True, thread=0, bulk=1000, delay=10):
 
         if messages != []:
             to_delete = []
-            for message in messages:
-                logging.debug('[email] %i:%i - submitting: %s', heartbeat['assign_thread'],
-                              heartbeat['nr_threads'], str(message))
-
-                msg = MIMEText(message['payload']['body'].encode('utf-8'))
-
-                msg['From'] = email_from
-                msg['To'] = ', '.join(message['payload']['to'])
-                msg['Subject'] = message['payload']['subject'].encode('utf-8')
-
-                if send_email:
-                    smtp = smtplib.SMTP()
-                    smtp.connect()
-                    smtp.sendmail(msg['From'], message['payload']['to'], msg.as_string())
+            smtp = None
+            try:
+                for message in messages:
+                    logging.debug('[email] %i:%i - submitting: %s', heartbeat['assign_thread'],
+                                  heartbeat['nr_threads'], str(message))
+
+                    msg = MIMEText(message['payload']['body'].encode('utf-8'))
+
+                    msg['From'] = email_from
+                    msg['To'] = ', '.join(message['payload']['to'])
+                    msg['Subject'] = message['payload']['subject'].encode('utf-8')
+
+                    if send_email:
+                        # One SMTP connection is used for the whole batch
+                        if smtp is None:
+                            smtp = smtplib.SMTP()
+                            smtp.connect()
+                        try:
+                            smtp.sendmail(msg['From'], message['payload']['to'], msg.as_string())
+                        except smtplib.SMTPServerDisconnected:
+                            smtp = smtplib.SMTP()
+                            smtp.connect()
+                            smtp.sendmail(msg['From'], message['payload']['to'], msg.as_string())
+
+                    to_delete.append({'id': message['id'],
+                                      'created_at': message['created_at'],
+                                      'updated_at': message['created_at'],
+                                      'payload': str(message['payload']),
+                                      'event_type': 'email'})
+
+                    logging.debug('[email] %i:%i - submitting done: %s',
+                                  heartbeat['assign_thread'], heartbeat['nr_threads'],
+                                  str(message['id']))
+            finally:
+                if smtp is not None:
                     smtp.quit()
 
-                to_delete.append({'id': message['id'],
-                                  'created_at': message['created_at'],
-                                  'updated_at': message['created_at'],
-                                  'payload': str(message['payload']),
-                                  'event_type': 'email'})
-
-                logging.debug('[email] %i:%i - submitting done: %s',
-                              heartbeat['assign_thread'], heartbeat['nr_threads'],
-                              str(message['id']))
-
             delete_messages(to_delete)
             logging.info('[email] %i:%i - submitted %i messages',
                          heartbeat['assign_thread'],
@@ -133,23 +146,6 @@ def deliver_emails(once=False, send_email=True, thread=0, bulk=1000, delay=10):
                   heartbeat['nr_threads'])
 
 
-class HermesListener(stomp.ConnectionListener):
-    '''
-    Hermes Listener
-    '''
-    def __init__(self, broker):
-        '''
-        __init__
-        '''
-        self.__broker = broker
-
-    def on_error(self, headers, body):
-        '''
-        Error handler
-        '''
-        logging.error('[broker] [%s]: %s', self.__broker, body)
-
-
 def deliver_messages(once=False, brokers_resolved=None, thread=0, bulk=1000, delay=10,
                      broker_timeout=3, broker_retry=3):
     '''
@@ -169,33 +165,29 @@ def deliver_messages(once=False, brokers_resolved=None, thread=0, bulk=1000, del
         logging.info('[broker] could not find use_ssl in configuration -- please update your rucio.cfg')
 
     port = config_get_int('messaging-hermes', 'port')
+    username, password, ssl_key_file, ssl_cert_file = None, None, None, None
     if not use_ssl:
+        logging.info('[broker] setting up username/password authentication: %s', brokers_resolved)
         username = config_get('messaging-hermes', 'username')
         password = config_get('messaging-hermes', 'password')
         port = config_get_int('messaging-hermes', 'nonssl_port')
-
-    conns = []
-    for broker in brokers_resolved:
-        if not use_ssl:
-            logging.info('[broker] setting up username/password authentication: %s' % broker)
-            con = stomp.Connection12(host_and_ports=[(broker, port)],
-                                     keepalive=True,
-                                     timeout=broker_timeout)
-        else:
-            logging.info('[broker] setting up ssl cert/key authentication: %s' % broker)
-            con = stomp.Connection12(host_and_ports=[(broker, port)],
-                                     use_ssl=True,
-                                     ssl_key_file=config_get('messaging-hermes', 'ssl_key_file'),
-                                     ssl_cert_file=config_get('messaging-hermes', 'ssl_cert_file'),
-                                     ssl_version=ssl.PROTOCOL_TLSv1,
-                                     keepalive=True,
-                                     timeout=broker_timeout)
-
-        con.set_listener('rucio-hermes',
-                         HermesListener(con.transport._Transport__host_and_ports[0]))
-
-        conns.append(con)
-    destination = config_get('messaging-hermes', 'destination')
+    else:
+        logging.info('[broker] setting up ssl cert/key authentication: %s', brokers_resolved)
+        ssl_key_file = config_get('messaging-hermes', 'ssl_key_file')
+        ssl_cert_file = config_get('messaging-hermes', 'ssl_cert_file')
+
+    publisher = Publisher(brokers=brokers_resolved,
+                          port=port,
+                          destination=config_get('messaging-hermes', 'destination'),
+                          username=username,
+                          password=password,
+                          use_ssl=use_ssl,
+                          ssl_key_file=ssl_key_file,
+                          ssl_cert_file=ssl_cert_file,
+                          timeout=broker_timeout,
+                          queue_size=bulk,
+                          max_attempts=broker_retry,
+                          name='daemons.hermes')
 
     executable = 'hermes [broker]'
     hostname = socket.getfqdn()
@@ -206,56 +198,58 @@ def deliver_messages(once=False, brokers_resolved=None, thread=0, bulk=1000, del
     sanity_check(executable=executable, hostname=hostname, pid=pid, thread=heartbeat_thread)
     GRACEFUL_STOP.wait(1)
 
+    # Position of the last retrieved message, only valid for the same thread assignment
+    cursor, assignment = None, None
+
     while not GRACEFUL_STOP.is_set():
+        # Only a full batch which was delivered and deleted goes on without sleeping
+        backlog = False
         try:
             t_start = time.time()
 
             heartbeat = live(executable=executable, hostname=hostname, pid=pid,
                              thread=heartbeat_thread)
 
+            if assignment != (heartbeat['assign_thread'], heartbeat['nr_threads']):
+                cursor, assignment = None, (heartbeat['assign_thread'], heartbeat['nr_threads'])
+
             logging.debug('[broker] %i:%i - using: %s', heartbeat['assign_thread'],
-                          heartbeat['nr_threads'],
-                          [conn.transport._Transport__host_and_ports[0][0] for conn in conns])
+                          heartbeat['nr_threads'], brokers_resolved)
+
+            if get_buckets(thread=heartbeat['assign_thread'], total_threads=heartbeat['nr_threads']) == []:
+                logging.warning('[broker] %i:%i - no message bucket left for this thread, more threads than buckets',
+                                heartbeat['assign_thread'], heartbeat['nr_threads'])
 
             messages = retrieve_messages(bulk=bulk,
                                          thread=heartbeat['assign_thread'],
-                                         total_threads=heartbeat['nr_threads'])
+                                         total_threads=heartbeat['nr_threads'],
+                                         cursor=cursor)
+
+            # Continue after the last message while the backlog is drained, otherwise start over
+            # from the oldest message to pick up undelivered or late committed messages
+            if len(messages) < bulk:
+                cursor = None
+            else:
+                cursor = (messages[-1]['created_at'], messages[-1]['id'])
 
             if messages:
 
                 logging.debug('[broker] %i:%i - retrieved %i messages',
                               heartbeat['assign_thread'], heartbeat['nr_threads'],
                               len(messages))
-                to_delete = []
+                to_delete, delivered, delivered_lock, closed = [], [], threading.Lock(), threading.Event()
+
+                def on_delivery(sent, history, delivered=delivered, delivered_lock=delivered_lock, closed=closed):
+                    # A confirmation after the end of the cycle is ignored, the message is delivered again
+                    with delivered_lock:
+                        if sent and not closed.is_set():
+                            delivered.append(history)
+
                 for message in messages:
                     try:
-                        conn = random.sample(conns, 1)[0]
-                        if not conn.is_connected():
-                            host_and_ports = conn.transport._Transport__host_and_ports[0][0]
-                            record_counter('daemons.hermes.reconnect.%s' % host_and_ports.split('.')[0])
-                            conn.start()
-                            if not use_ssl:
-                                logging.info('[broker] %i:%i - connecting with USERPASS to %s',
-                                             heartbeat['assign_thread'],
-                                             heartbeat['nr_threads'],
-                                             host_and_ports)
-                                conn.connect(username, password, wait=True)
-                            else:
-                                logging.info('[broker] %i:%i - connecting with SSL to %s',
-                                             heartbeat['assign_thread'],
-                                             heartbeat['nr_threads'],
-                                             host_and_ports)
-                                conn.connect(wait=True)
-                        conn.send(body=json.dumps({'event_type': str(message['event_type']).lower(),
-                                                   'payload': message['payload'],
-                                                   'created_at': str(message['created_at'])}),
-                                  destination=destination,
-                                  headers={'persistent': 'true'})
-                        to_delete.append({'id': message['id'],
-                                          'created_at': message['created_at'],
-                                          'updated_at': message['created_at'],
-                                          'payload': json.dumps(message['payload']),
-                                          'event_type': message['event_type']})
+                        body = json.dumps({'event_type': str(message['event_type']).lower(),
+                                           'payload': message['payload'],
+                                           'created_at': str(message['created_at'])})
                     except ValueError:
                         logging.warn('Cannot serialize payload to JSON: %s',
                                      str(message['payload']))
@@ -265,18 +259,17 @@ def deliver_messages(once=False, brokers_resolved=None, thread=0, bulk=1000, del
                                           'payload': str(message['payload']),
                                           'event_type': message['event_type']})
                         continue
-                    except stomp.exception.NotConnectedException as error:
-                        logging.warn('Could not deliver message due to NotConnectedException: %s',
-                                     str(error))
-                        continue
-                    except stomp.exception.ConnectFailedException as error:
-                        logging.warn('Could not deliver message due to ConnectFailedException: %s',
-                                     str(error))
-                        continue
-                    except Exception as error:
-                        logging.warn('Could not deliver message: %s', str(error))
-                        logging.critical(traceback.format_exc())
-                        continue
+
+                    # The message is deleted once a sender thread confirms it was sent
+                    history = {'id': message['id'],
+                               'created_at': message['created_at'],
+                               'updated_at': message['created_at'],
+                               'payload': json.dumps(message['payload']),
+                               'event_type': message['event_type']}
+                    publisher.publish(body,
+                                      headers={'persistent': 'true'},
+                                      block=True,
+                                      callback=partial(on_delivery, history=history))
 
                     if str(message['event_type']).lower().startswith('transfer') or str(message['event_type']).lower().startswith('stagein'):
                         logging.debug('[broker] %i:%i - event_type: %s, scope: %s, name: %s, rse: %s, request-id: %s, transfer-id: %s, created_at: %s',
@@ -317,11 +310,21 @@ def deliver_messages(once=False, brokers_resolved=None, thread=0, bulk=1000, del
                                       heartbeat['assign_thread'], heartbeat['nr_threads'],
                                       message)
 
+                if not publisher.flush(timeout=broker_timeout * broker_retry * 10):
+                    logging.warn('[broker] %i:%i - could not deliver %i messages in time',
+                                 heartbeat['assign_thread'], heartbeat['nr_threads'], publisher.qsize())
+                    publisher.discard()
+                # Messages still being sent by the publisher may be confirmed at any time
+                with delivered_lock:
+                    closed.set()
+                    to_delete.extend(delivered)
+
                 delete_messages(to_delete)
                 logging.info('[broker] %i:%i - submitted %i messages',
                              heartbeat['assign_thread'],
                              heartbeat['nr_threads'],
                              len(to_delete))
+                backlog = len(messages) >= bulk and len(to_delete) == len(messages)
 
                 if once:
                     break
@@ -332,6 +335,9 @@ def deliver_messages(once=False, brokers_resolved=None, thread=0, bulk=1000, del
         except:
             logging.critical(traceback.format_exc())
 
+        if backlog:
+            continue
+
         t_delay = delay - (time.time() - t_start)
         t_delay = t_delay if t_delay > 0 else 0
         if t_delay:
@@ -342,6 +348,7 @@ def deliver_messages(once=False, brokers_resolved=None, thread=0, bulk=1000, del
     logging.debug('[broker] %i:%i - graceful stop requested',
                   heartbeat['assign_thread'], heartbeat['nr_threads'])
 
+    publisher.stop(timeout=broker_timeout)
     die(executable, hostname, pid, heartbeat_thread)
 
     logging.debug('[broker] %i:%i - graceful stop done', heartbeat['assign_thread'],
@@ -78,32 +78,28 @@ def re_evaluator(once=False):
                 logging.debug('re_evaluator[%s/%s] did not get any work (paused_dids=%s)' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, str(len(paused_dids))))
                 graceful_stop.wait(30)
             else:
-                done_dids = {}
+                # Coalesce the updates of the same did into one evaluation
+                updated_dids = {}  # {(scope, name): [updated_did, ...]}
                 for did in dids:
+                    updated_dids.setdefault((did.scope, did.name), []).append(did)
+
+                for (scope, name), did_updates in updated_dids.iteritems():
                     if graceful_stop.is_set():
                         break
 
-                    # Check if this did has already been operated on
-                    if '%s:%s' % (did.scope, did.name) in done_dids:
-                        if did.rule_evaluation_action in done_dids['%s:%s' % (did.scope, did.name)]:
-                            logging.debug('re_evaluator[%s/%s]: evaluation of %s:%s already done' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, did.scope, did.name))
-                            delete_updated_did(id=did.id)
-                            continue
-                    else:
-                        done_dids['%s:%s' % (did.scope, did.name)] = []
-
+                    rule_evaluation_actions = list(set(did.rule_evaluation_action for did in did_updates))
                     try:
                         start_time = time.time()
-                        re_evaluate_did(scope=did.scope, name=did.name, rule_evaluation_action=did.rule_evaluation_action)
-                        logging.debug('re_evaluator[%s/%s]: evaluation of %s:%s took %f' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, did.scope, did.name, time.time() - start_time))
-                        delete_updated_did(id=did.id)
-                        done_dids['%s:%s' % (did.scope, did.name)].append(did.rule_evaluation_action)
+                        # Deletes all the pending updates of the did for these actions, not only the fetched ones
+                        re_evaluate_did(scope=scope, name=name, rule_evaluation_action=rule_evaluation_actions)
+                        logging.debug('re_evaluator[%s/%s]: evaluation of %s:%s (%d updates) took %f' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, scope, name, len(did_updates), time.time() - start_time))
                     except DataIdentifierNotFound, e:
-                        delete_updated_did(id=did.id)
+                        for did in did_updates:
+                            delete_updated_did(id=did.id)
                     except (DatabaseException, DatabaseError), e:
                         if match('.*ORA-00054.*', str(e.args[0])):
-                            paused_dids[(did.scope, did.name)] = datetime.utcnow() + timedelta(seconds=randint(60, 600))
-                            logging.warning('re_evaluator[%s/%s]: Locks detected for %s:%s' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, did.scope, did.name))
+                            paused_dids[(scope, name)] = datetime.utcnow() + timedelta(seconds=randint(60, 600))
+                            logging.warning('re_evaluator[%s/%s]: Locks detected for %s:%s' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, scope, name))
                             record_counter('rule.judge.exceptions.LocksDetected')
                         elif match('.*QueuePool.*', str(e.args[0])):
                             logging.warning(traceback.format_exc())
@@ -116,10 +112,10 @@ def re_evaluator(once=False):
                             record_counter('rule.judge.exceptions.%s' % e.__class__.__name__)
                     except ReplicationRuleCreationTemporaryFailed, e:
                         record_counter('rule.judge.exceptions.%s' % e.__class__.__name__)
-                        logging.warning('re_evaluator[%s/%s]: Replica Creation temporary failed, retrying later for %s:%s' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, did.scope, did.name))
+                        logging.warning('re_evaluator[%s/%s]: Replica Creation temporary failed, retrying later for %s:%s' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, scope, name))
                     except FlushError, e:
                         record_counter('rule.judge.exceptions.%s' % e.__class__.__name__)
-                        logging.warning('re_evaluator[%s/%s]: Flush error for %s:%s' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, did.scope, did.name))
+                        logging.warning('re_evaluator[%s/%s]: Flush error for %s:%s' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, scope, name))
         except (DatabaseException, DatabaseError), e:
             if match('.*QueuePool.*', str(e.args[0])):
                 logging.warning(traceback.format_exc())
@@ -0,0 +1,149 @@
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+'''
+Reaper candidates is a daemon to queue the deletion candidates of the RSEs.
+
+Each pass queues the replicas whose tombstone expired since the previous pass,
+the ones updated since, e.g. which lost their last lock, and the obsolete ones.
+The queue of a RSE is rebuilt periodically to take into account the tombstones
+moved backwards and the replicas locked again.
+'''
+
+import hashlib
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+
+from datetime import datetime, timedelta
+
+from rucio.common.config import config_get
+from rucio.common.exception import DatabaseException
+from rucio.core import monitor
+from rucio.core import rse as rse_core
+from rucio.core.deletion_candidate import add_deletion_candidates, count_deletion_candidates, prune_deletion_candidates
+from rucio.core.heartbeat import live, die, sanity_check
+from rucio.core.rse_expression_parser import parse_expression
+
+
+logging.basicConfig(stream=sys.stdout,
+                    level=getattr(logging, config_get('common', 'loglevel').upper()),
+                    format='%(asctime)s\t%(process)d\t%(levelname)s\t%(message)s')
+
+GRACEFUL_STOP = threading.Event()
+
+# The tombstones set shortly before the previous pass are considered again, for the transactions committed late
+SAFETY_MARGIN = 600
+
+
+def candidates(rses, once=False, sleep_time=60, rebuild_interval=3600):
+    """
+    Main loop to queue the deletion candidates.
+
+    :param rses: List of RSEs the daemon should work against.
+    :param once: If True, only runs one iteration of the main loop.
+    :param sleep_time: Minimum time between two passes on a RSE, in seconds.
+    :param rebuild_interval: Time between two rebuilds of the queue of a RSE, in seconds.
+    """
+    logging.info('Reaper candidates: starting')
+
+    pid = os.getpid()
+    thread = threading.current_thread()
+    hostname = socket.gethostname()
+    executable = ' '.join(sys.argv)
+    hash_executable = hashlib.sha256(sys.argv[0] + ''.join([rse['rse'] for rse in rses])).hexdigest()
+    sanity_check(executable=None, hostname=hostname)
+
+    last_pass, last_rebuild = {}, {}
+    while not GRACEFUL_STOP.is_set():
+        try:
+            heartbeat = live(executable=executable, hostname=hostname, pid=pid, thread=thread, hash_executable=hash_executable)
+            prefix = 'Reaper candidates %s/%s:' % (heartbeat['assign_thread'], heartbeat['nr_threads'])
+            start_time = time.time()
+
+            for rse in rses[heartbeat['assign_thread']::heartbeat['nr_threads']]:
+                if GRACEFUL_STOP.is_set():
+                    break
+                try:
+                    start = datetime.utcnow()
+                    if rse['id'] not in last_rebuild or last_rebuild[rse['id']] + timedelta(seconds=rebuild_interval) < start:
+                        pruned = prune_deletion_candidates(rse_id=rse['id'])
+                        added = add_deletion_candidates(rse_id=rse['id'])
+                        last_rebuild[rse['id']] = start
+                        logging.info('%s rebuilt the queue of %s: %s added, %s removed in %s seconds', prefix, rse['rse'], added, pruned, (datetime.utcnow() - start).total_seconds())
+                    else:
+                        added = add_deletion_candidates(rse_id=rse['id'], since=last_pass[rse['id']] - timedelta(seconds=SAFETY_MARGIN))
+                        logging.debug('%s updated the queue of %s: %s added in %s seconds', prefix, rse['rse'], added, (datetime.utcnow() - start).total_seconds())
+                    last_pass[rse['id']] = start
+                    monitor.record_gauge('reaper.candidates.%s' % rse['rse'], count_deletion_candidates(rse_id=rse['id']))
+                except DatabaseException as error:
+                    logging.warning('%s DatabaseException on %s: %s', prefix, rse['rse'], str(error))
+                except:
+                    logging.critical(traceback.format_exc())
+
+            if once:
+                break
+
+            duration = time.time() - start_time
+            if duration < sleep_time:
+                GRACEFUL_STOP.wait(sleep_time - duration)
+        except:
+            logging.critical(traceback.format_exc())
+            if once:
+                break
+
+    die(executable=executable, hostname=hostname, pid=pid, thread=thread, hash_executable=hash_executable)
+    logging.info('Graceful stop requested')
+    logging.info('Graceful stop done')
+
+
+def stop(signum=None, frame=None):
+    """
+    Graceful exit.
+    """
+    GRACEFUL_STOP.set()
+
+
+def run(threads=1, once=False, rses=[], exclude_rses=None, include_rses=None, sleep_time=60, rebuild_interval=3600):
+    """
+    Starts up the reaper candidates threads.
+
+    :param threads: The number of threads.
+    :param once: If True, only runs one iteration of the main loop.
+    :param rses: List of RSEs the daemon should work against. If empty, it considers all RSEs.
+    :param exclude_rses: RSE expression to exclude RSEs.
+    :param include_rses: RSE expression to include RSEs.
+    :param sleep_time: Minimum time between two passes on a RSE, in seconds.
+    :param rebuild_interval: Time between two rebuilds of the queue of a RSE, in seconds.
+    """
+    rses_list = rse_core.list_rses()
+    if rses:
+        rses = [rse for rse in rses_list if rse['rse'] in rses]
+    else:
+        rses = rses_list
+
+    if exclude_rses:
+        excluded_rses = parse_expression(exclude_rses)
+        rses = [rse for rse in rses if rse not in excluded_rses]
+
+    if include_rses:
+        included_rses = parse_expression(include_rses)
+        rses = [rse for rse in rses if rse in included_rses]
+
+    logging.info('Reaper candidates: This instance will work on RSEs: ' + ', '.join([rse['rse'] for rse in rses]))
+
+    kwargs = {'rses': rses, 'once': once, 'sleep_time': sleep_time, 'rebuild_interval': rebuild_interval}
+    if once:
+        candidates(**kwargs)
+    else:
+        thread_list = [threading.Thread(target=candidates, kwargs=kwargs, name='Reaper candidates: %s' % i) for i in xrange(threads)]
+        [t.start() for t in thread_list]
+        while thread_list[0].is_alive():
+            [t.join(timeout=3.14) for t in thread_list]
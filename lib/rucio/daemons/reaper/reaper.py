@@ -36,8 +36,9 @@ from rucio.common.exception import (SourceNotFound, ServiceUnavailable, RSEAcces
 from rucio.common.utils import chunks
 from rucio.core import monitor
 from rucio.core import rse as rse_core
+from rucio.core.deletion_candidate import claim_deletion_candidates
 from rucio.core.heartbeat import live, die, sanity_check
-from rucio.core.message import add_message
+from rucio.core.message import add_messages
 from rucio.core.replica import (list_unlocked_replicas, update_replicas_states,
                                 delete_replicas)
 from rucio.core.rse import get_rse_attribute, sort_rses
@@ -53,6 +54,11 @@ logging.basicConfig(stream=sys.stdout,
 
 GRACEFUL_STOP = threading.Event()
 
+PROTOCOL_POOL_LIFETIME = 3600
+PROTOCOL_POOLS = {}
+PROTOCOL_POOLS_LOCK = threading.Lock()
+RSE_SEMAPHORES = {}
+
 
 def __check_rse_usage(rse, rse_id):
     """
@@ -109,8 +115,187 @@ def __check_rse_usage(rse, rse_id):
     return max_being_deleted_files, needed_free_space, used, free
 
 
+def __get_protocol(rse_info, scheme):
+    """
+    Internal method to get a connected deletion protocol for a RSE, reusing a pooled one if available.
+
+    :param rse_info: the RSE settings.
+    :param scheme: the scheme to use, or None for the default one.
+
+    :returns : the connected protocol.
+    """
+    with PROTOCOL_POOLS_LOCK:
+        pool = PROTOCOL_POOLS.setdefault((rse_info['rse'], scheme), [])
+        while pool:
+            prot, created_at = pool.pop()
+            if created_at + PROTOCOL_POOL_LIFETIME > time.time():
+                return prot
+            prot.close()
+    prot = rsemgr.create_protocol(rse_info, 'delete', scheme=scheme)
+    prot.connect()
+    prot.created_at = time.time()
+    return prot
+
+
+def __release_protocol(rse_info, scheme, prot, pool_size):
+    """
+    Internal method to give back a connected deletion protocol to the pool of its RSE.
+
+    :param rse_info: the RSE settings.
+    :param scheme: the scheme to use, or None for the default one.
+    :param prot: the connected protocol.
+    :param pool_size: the maximum number of connected protocols kept for the RSE.
+    """
+    with PROTOCOL_POOLS_LOCK:
+        pool = PROTOCOL_POOLS.setdefault((rse_info['rse'], scheme), [])
+        if len(pool) < pool_size:
+            pool.append((prot, prot.created_at))
+            return
+    prot.close()
+
+
+def __close_protocols(rse=None):
+    """
+    Internal method to close the pooled deletion protocols.
+
+    :param rse: the rse name. If None, the protocols of all RSEs are closed.
+    """
+    with PROTOCOL_POOLS_LOCK:
+        for key in PROTOCOL_POOLS.keys():
+            if rse is None or key[0] == rse:
+                for prot, _ in PROTOCOL_POOLS.pop(key):
+                    try:
+                        prot.close()
+                    except:
+                        logging.warning(traceback.format_exc())
+
+
+def __get_rse_semaphore(rse_id, threads_per_rse):
+    """
+    Internal method to get the semaphore bounding the concurrent deletions on a RSE for this process.
+
+    :param rse_id: the rse id.
+    :param threads_per_rse: the maximum number of concurrent deletions on the RSE.
+
+    :returns : the semaphore.
+    """
+    with PROTOCOL_POOLS_LOCK:
+        if rse_id not in RSE_SEMAPHORES:
+            RSE_SEMAPHORES[rse_id] = threading.BoundedSemaphore(threads_per_rse)
+        return RSE_SEMAPHORES[rse_id]
+
+
+def __delete_files(rse, rse_info, files, scheme, threads_per_rse, prefix):
+    """
+    Internal method to physically delete a chunk of files on a RSE.
+    The chunk is split in as many batches as concurrent deletions allowed on the RSE.
+    Each batch uses a pooled connected protocol and its bulk deletion.
+
+    :param rse: the rse dictionary.
+    :param rse_info: the RSE settings.
+    :param files: the list of replicas to delete, with their pfn.
+    :param scheme: the scheme to use, or None for the default one.
+    :param threads_per_rse: the maximum number of concurrent deletions on the RSE.
+    :param prefix: the logging prefix.
+
+    :returns : the list of deleted files and the list of messages to send.
+    """
+    deleted_files, messages = [], []
+    lock = threading.Lock()
+
+    def __message(event_type, replica, **kwargs):
+        payload = {'scope': replica['scope'],
+                   'name': replica['name'],
+                   'rse': rse_info['rse'],
+                   'file-size': replica['bytes'],
+                   'bytes': replica['bytes'],
+                   'url': replica['pfn']}
+        payload.update(kwargs)
+        with lock:
+            messages.append({'event_type': event_type, 'payload': payload})
+
+    def __deleted(replica):
+        with lock:
+            deleted_files.append({'scope': replica['scope'], 'name': replica['name']})
+
+    def __delete_batch(batch):
+        with __get_rse_semaphore(rse['id'], threads_per_rse):
+            try:
+                prot = __get_protocol(rse_info, scheme)
+            except (ServiceUnavailable, RSEAccessDenied, ResourceTemporaryUnavailable) as error:
+                for replica in batch:
+                    logging.warning('%s Deletion NOACCESS of %s:%s as %s on %s: %s', prefix, replica['scope'], replica['name'], replica['pfn'], rse['rse'], str(error))
+                    __message('deletion-failed', replica, reason=str(error))
+                return
+
+            broken = False
+            try:
+                for replica in batch:
+                    logging.info('%s Deletion ATTEMPT of %s:%s as %s on %s', prefix, replica['scope'], replica['name'], replica['pfn'], rse['rse'])
+                start = time.time()
+                try:
+                    errors = prot.bulk_delete([replica['pfn'] for replica in batch])
+                except (ServiceUnavailable, RSEAccessDenied, ResourceTemporaryUnavailable) as error:
+                    broken = True
+                    errors = dict((replica['pfn'], error) for replica in batch)
+                duration = (time.time() - start) / len(batch)
+                monitor.record_timer('daemons.reaper.delete.%s.%s' % (prot.attributes['scheme'], rse['rse']), duration * 1000)
+
+                for replica in batch:
+                    error = errors.get(replica['pfn'])
+                    if error is None:
+                        __deleted(replica)
+                        __message('deletion-done', replica, duration=duration)
+                        logging.info('%s Deletion SUCCESS of %s:%s as %s on %s in %s seconds', prefix, replica['scope'], replica['name'], replica['pfn'], rse['rse'], duration)
+                    elif isinstance(error, SourceNotFound):
+                        err_msg = '%s Deletion NOTFOUND of %s:%s as %s on %s' % (prefix, replica['scope'], replica['name'], replica['pfn'], rse['rse'])
+                        logging.warning(err_msg)
+                        __deleted(replica)
+                        if replica['state'] == ReplicaState.AVAILABLE:
+                            __message('deletion-failed', replica, reason=str(err_msg))
+                    elif isinstance(error, (ServiceUnavailable, RSEAccessDenied, ResourceTemporaryUnavailable)):
+                        logging.warning('%s Deletion NOACCESS of %s:%s as %s on %s: %s', prefix, replica['scope'], replica['name'], replica['pfn'], rse['rse'], str(error))
+                        __message('deletion-failed', replica, reason=str(error))
+                    else:
+                        logging.critical('%s Deletion CRITICAL of %s:%s as %s on %s: %s', prefix, replica['scope'], replica['name'], replica['pfn'], rse['rse'], str(error))
+                        __message('deletion-failed', replica, reason=str(error))
+            except:
+                broken = True
+                logging.critical(traceback.format_exc())
+            finally:
+                if broken:
+                    prot.close()
+                else:
+                    __release_protocol(rse_info, scheme, prot, threads_per_rse)
+
+    to_delete = []
+    for replica in files:
+        if rse['staging_area'] or rse['rse'].endswith("STAGING"):
+            logging.warning('%s Deletion STAGING of %s:%s as %s on %s, will only delete the catalog and not do physical deletion',
+                            prefix, replica['scope'], replica['name'], replica['pfn'], rse['rse'])
+            __deleted(replica)
+            __message('deletion-done', replica, duration=0)
+        elif not replica['pfn']:
+            logging.warning('%s Deletion UNAVAILABLE of %s:%s as %s on %s', prefix, replica['scope'], replica['name'], replica['pfn'], rse['rse'])
+            __deleted(replica)
+            __message('deletion-done', replica, duration=0)
+        else:
+            to_delete.append(replica)
+
+    if to_delete:
+        batches = [to_delete[i::threads_per_rse] for i in xrange(min(threads_per_rse, len(to_delete)))]
+        if len(batches) == 1:
+            __delete_batch(batches[0])
+        else:
+            threads = [threading.Thread(target=__delete_batch, args=(batch,)) for batch in batches]
+            [t.start() for t in threads]
+            [t.join() for t in threads]
+
+    return deleted_files, messages
+
+
 def reaper(rses, worker_number=1, child_number=1, total_children=1, chunk_size=100,
-           once=False, greedy=False, scheme=None, delay_seconds=0):
+           once=False, greedy=False, scheme=None, delay_seconds=0, threads_per_rse=1, deletion_candidates=False):
     """
     Main loop to select and delete files.
 
@@ -123,6 +308,9 @@ def reaper(rses, worker_number=1, child_number=1, total_children=1, chunk_size=1
     :param greedy: If True, delete right away replicas with tombstone.
     :param scheme: Force the reaper to use a particular protocol, e.g., mock.
     :param exclude_rses: RSE expression to exclude RSEs from the Reaper.
+    :param delay_seconds: The delay to retry failed deletions.
+    :param threads_per_rse: The maximum number of concurrent deletions and connections per RSE.
+    :param deletion_candidates: If True, claim the replicas from the deletion candidates queue instead of listing them.
     """
     logging.info('Starting Reaper: Worker %(worker_number)s, '
                  'child %(child_number)s will work on RSEs: ' % locals() + ', '.join([rse['rse'] for rse in rses]))
@@ -162,6 +350,7 @@ def reaper(rses, worker_number=1, child_number=1, total_children=1, chunk_size=1
 
                     if not rse_protocol['availability_delete']:
                         logging.info('Reaper %s-%s: RSE %s is not available for deletion', worker_number, child_number, rse_info['rse'])
+                        __close_protocols(rse=rse['rse'])
                         nothing_to_do[rse['id']] = datetime.datetime.now() + datetime.timedelta(minutes=30)
                         continue
 
@@ -186,14 +375,24 @@ def reaper(rses, worker_number=1, child_number=1, total_children=1, chunk_size=1
                                 needed_free_space_per_child = needed_free_space / float(total_children)
 
                     start = time.time()
-                    with monitor.record_timer_block('reaper.list_unlocked_replicas'):
-                        replicas = list_unlocked_replicas(rse=rse['rse'], rse_id=rse['id'],
-                                                          bytes=needed_free_space_per_child,
-                                                          limit=max_being_deleted_files,
-                                                          worker_number=child_number,
-                                                          total_workers=total_children,
-                                                          delay_seconds=delay_seconds)
-                    logging.debug('Reaper %s-%s: list_unlocked_replicas on %s for %s bytes in %s seconds: %s replicas', worker_number, child_number, rse['rse'], needed_free_space_per_child, time.time() - start, len(replicas))
+                    if deletion_candidates:
+                        with monitor.record_timer_block('reaper.claim_deletion_candidates'):
+                            replicas = claim_deletion_candidates(rse_id=rse['id'],
+                                                                 bytes=needed_free_space_per_child,
+                                                                 limit=max_being_deleted_files,
+                                                                 worker_number=child_number,
+                                                                 total_workers=total_children,
+                                                                 delay_seconds=delay_seconds)
+                        logging.debug('Reaper %s-%s: claim_deletion_candidates on %s for %s bytes in %s seconds: %s replicas', worker_number, child_number, rse['rse'], needed_free_space_per_child, time.time() - start, len(replicas))
+                    else:
+                        with monitor.record_timer_block('reaper.list_unlocked_replicas'):
+                            replicas = list_unlocked_replicas(rse=rse['rse'], rse_id=rse['id'],
+                                                              bytes=needed_free_space_per_child,
+                                                              limit=max_being_deleted_files,
+                                                              worker_number=child_number,
+                                                              total_workers=total_children,
+                                                              delay_seconds=delay_seconds)
+                        logging.debug('Reaper %s-%s: list_unlocked_replicas on %s for %s bytes in %s seconds: %s replicas', worker_number, child_number, rse['rse'], needed_free_space_per_child, time.time() - start, len(replicas))
 
                     if not replicas:
                         nothing_to_do[rse['id']] = datetime.datetime.now() + datetime.timedelta(minutes=30)
@@ -209,9 +408,7 @@ def reaper(rses, worker_number=1, child_number=1, total_children=1, chunk_size=1
                             update_replicas_states(replicas=[dict(replica.items() + [('state', ReplicaState.BEING_DELETED), ('rse_id', rse['id'])]) for replica in files], nowait=True)
                             for replica in files:
                                 try:
-                                    replica['pfn'] = str(rsemgr.lfns2pfns(rse_settings=rse_info,
-                                                                          lfns=[{'scope': replica['scope'], 'name': replica['name'], 'path': replica['path']}],
-                                                                          operation='delete', scheme=scheme).values()[0])
+                                    replica['pfn'] = str(prot.lfns2pfns(lfns=[{'scope': replica['scope'], 'name': replica['name'], 'path': replica['path']}]).values()[0])
                                 except (ReplicaUnAvailable, ReplicaNotFound) as error:
                                     err_msg = 'Failed to get pfn UNAVAILABLE replica %s:%s on %s with error %s' % (replica['scope'], replica['name'], rse['rse'], str(error))
                                     logging.warning('Reaper %s-%s: %s', worker_number, child_number, err_msg)
@@ -219,79 +416,11 @@ def reaper(rses, worker_number=1, child_number=1, total_children=1, chunk_size=1
 
                             monitor.record_counter(counters='reaper.deletion.being_deleted', delta=len(files))
 
-                            try:
-                                deleted_files = []
-                                prot.connect()
-                                for replica in files:
-                                    try:
-                                        logging.info('Reaper %s-%s: Deletion ATTEMPT of %s:%s as %s on %s', worker_number, child_number, replica['scope'], replica['name'], replica['pfn'], rse['rse'])
-                                        start = time.time()
-                                        if rse['staging_area'] or rse['rse'].endswith("STAGING"):
-                                            logging.warning('Reaper %s-%s: Deletion STAGING of %s:%s as %s on %s, will only delete the catalog and not do physical deletion',
-                                                            worker_number, child_number, replica['scope'], replica['name'], replica['pfn'], rse['rse'])
-                                        else:
-                                            if replica['pfn']:
-                                                prot.delete(replica['pfn'])
-                                            else:
-                                                logging.warning('Reaper %s-%s: Deletion UNAVAILABLE of %s:%s as %s on %s', worker_number, child_number, replica['scope'], replica['name'], replica['pfn'], rse['rse'])
-                                        monitor.record_timer('daemons.reaper.delete.%s.%s' % (prot.attributes['scheme'], rse['rse']), (time.time() - start) * 1000)
-                                        duration = time.time() - start
-
-                                        deleted_files.append({'scope': replica['scope'], 'name': replica['name']})
-
-                                        add_message('deletion-done', {'scope': replica['scope'],
-                                                                      'name': replica['name'],
-                                                                      'rse': rse_info['rse'],
-                                                                      'file-size': replica['bytes'],
-                                                                      'bytes': replica['bytes'],
-                                                                      'url': replica['pfn'],
-                                                                      'duration': duration})
-                                        logging.info('Reaper %s-%s: Deletion SUCCESS of %s:%s as %s on %s in %s seconds', worker_number, child_number, replica['scope'], replica['name'], replica['pfn'], rse['rse'], duration)
-                                    except SourceNotFound:
-                                        err_msg = 'Reaper %s-%s: Deletion NOTFOUND of %s:%s as %s on %s' % (worker_number, child_number, replica['scope'], replica['name'], replica['pfn'], rse['rse'])
-                                        logging.warning(err_msg)
-                                        deleted_files.append({'scope': replica['scope'], 'name': replica['name']})
-                                        if replica['state'] == ReplicaState.AVAILABLE:
-                                            add_message('deletion-failed', {'scope': replica['scope'],
-                                                                            'name': replica['name'],
-                                                                            'rse': rse_info['rse'],
-                                                                            'file-size': replica['bytes'],
-                                                                            'bytes': replica['bytes'],
-                                                                            'url': replica['pfn'],
-                                                                            'reason': str(err_msg)})
-                                    except (ServiceUnavailable, RSEAccessDenied, ResourceTemporaryUnavailable) as error:
-                                        logging.warning('Reaper %s-%s: Deletion NOACCESS of %s:%s as %s on %s: %s', worker_number, child_number, replica['scope'], replica['name'], replica['pfn'], rse['rse'], str(error))
-                                        add_message('deletion-failed', {'scope': replica['scope'],
-                                                                        'name': replica['name'],
-                                                                        'rse': rse_info['rse'],
-                                                                        'file-size': replica['bytes'],
-                                                                        'bytes': replica['bytes'],
-                                                                        'url': replica['pfn'],
-                                                                        'reason': str(error)})
-                                    except Exception as error:
-                                        logging.critical('Reaper %s-%s: Deletion CRITICAL of %s:%s as %s on %s: %s', worker_number, child_number, replica['scope'], replica['name'], replica['pfn'], rse['rse'], str(traceback.format_exc()))
-                                        add_message('deletion-failed', {'scope': replica['scope'],
-                                                                        'name': replica['name'],
-                                                                        'rse': rse_info['rse'],
-                                                                        'file-size': replica['bytes'],
-                                                                        'bytes': replica['bytes'],
-                                                                        'url': replica['pfn'],
-                                                                        'reason': str(error)})
-                                    except:
-                                        logging.critical('Reaper %s-%s: Deletion CRITICAL of %s:%s as %s on %s: %s', worker_number, child_number, replica['scope'], replica['name'], replica['pfn'], rse['rse'], str(traceback.format_exc()))
-                            except (ServiceUnavailable, RSEAccessDenied, ResourceTemporaryUnavailable) as error:
-                                for replica in files:
-                                    logging.warning('Reaper %s-%s: Deletion NOACCESS of %s:%s as %s on %s: %s', worker_number, child_number, replica['scope'], replica['name'], replica['pfn'], rse['rse'], str(error))
-                                    add_message('deletion-failed', {'scope': replica['scope'],
-                                                                    'name': replica['name'],
-                                                                    'rse': rse_info['rse'],
-                                                                    'file-size': replica['bytes'],
-                                                                    'bytes': replica['bytes'],
-                                                                    'url': replica['pfn'],
-                                                                    'reason': str(error)})
-                                    break
-                            finally:
-                                prot.close()
+                            deleted_files, messages = __delete_files(rse=rse, rse_info=rse_info, files=files, scheme=scheme,
+                                                                     threads_per_rse=threads_per_rse,
+                                                                     prefix='Reaper %s-%s:' % (worker_number, child_number))
+                            add_messages(messages)
+
                             start = time.time()
                             with monitor.record_timer_block('reaper.delete_replicas'):
                                 delete_replicas(rse=rse['rse'], files=deleted_files)
@@ -321,6 +450,7 @@ def reaper(rses, worker_number=1, child_number=1, total_children=1, chunk_size=1
         except:
             logging.critical(traceback.format_exc())
 
+    __close_protocols()
     die(executable=executable, hostname=hostname, pid=pid, thread=thread, hash_executable=hash_executable)
     logging.info('Graceful stop requested')
     logging.info('Graceful stop done')
@@ -334,7 +464,7 @@ def stop(signum=None, frame=None):
     GRACEFUL_STOP.set()
 
 
-def run(total_workers=1, chunk_size=100, threads_per_worker=None, once=False, greedy=False, rses=[], scheme=None, exclude_rses=None, include_rses=None, delay_seconds=0):
+def run(total_workers=1, chunk_size=100, threads_per_worker=None, once=False, greedy=False, rses=[], scheme=None, exclude_rses=None, include_rses=None, delay_seconds=0, threads_per_rse=1, deletion_candidates=False):
     """
     Starts up the reaper threads.
 
@@ -347,6 +477,9 @@ def run(total_workers=1, chunk_size=100, threads_per_worker=None, once=False, gr
     :param scheme: Force the reaper to use a particular protocol/scheme, e.g., mock.
     :param exclude_rses: RSE expression to exclude RSEs from the Reaper.
     :param include_rses: RSE expression to include RSEs.
+    :param delay_seconds: The delay to retry failed deletions.
+    :param threads_per_rse: The maximum number of concurrent deletions and connections per RSE.
+    :param deletion_candidates: If True, claim the replicas from the deletion candidates queue instead of listing them.
     """
     logging.info('main: starting processes')
 
@@ -383,6 +516,8 @@ def run(total_workers=1, chunk_size=100, threads_per_worker=None, once=False, gr
                       'greedy': greedy,
                       'rses': rses_list,
                       'delay_seconds': delay_seconds,
+                      'threads_per_rse': threads_per_rse,
+                      'deletion_candidates': deletion_candidates,
                       'scheme': scheme}
             threads.append(threading.Thread(target=reaper, kwargs=kwargs, name='Worker: %s, child: %s' % (worker, child + 1)))
     [t.start() for t in threads]
@@ -34,7 +34,7 @@ from rucio.core.monitor import record_counter, record_timer
 from rucio.core.did import touch_dids, list_parent_dids
 from rucio.core.heartbeat import live, die, sanity_check
 from rucio.core.lock import touch_dataset_locks
-from rucio.core.replica import touch_replica, touch_collection_replicas
+from rucio.core.replica import touch_replicas, touch_collection_replicas
 from rucio.db.sqla.constants import DIDType
 
 logging.getLogger("stomp").setLevel(logging.CRITICAL)
@@ -47,7 +47,7 @@ graceful_stop = Event()
 
 
 class AMQConsumer(object):
-    def __init__(self, broker, conn, queue, chunksize, subscription_id, excluded_usrdns, dataset_queue):
+    def __init__(self, broker, conn, queue, chunksize, subscription_id, excluded_usrdns, dataset_queue, parent_dids_lifetime=600):
         self.__broker = broker
         self.__conn = conn
         self.__queue = queue
@@ -60,6 +60,10 @@ class AMQConsumer(object):
         # exclude specific usrdns like GangaRBT
         self.__excluded_usrdns = excluded_usrdns
         self.__dataset_queue = dataset_queue
+        # parent datasets of the files, resolved once per lifetime window
+        self.__parent_dids = {}
+        self.__parent_dids_lifetime = parent_dids_lifetime
+        self.__parent_dids_expiration = time() + parent_dids_lifetime
 
     def on_error(self, headers, message):
         record_counter('daemons.tracer.kronos.error')
@@ -107,6 +111,30 @@ class AMQConsumer(object):
             self.__reports = []
             self.__ids = []
 
+    def __get_parent_datasets(self, scope, name):
+        """
+        Get the parent datasets of a file, cached for the lifetime window.
+        """
+        if time() > self.__parent_dids_expiration:
+            self.__parent_dids = {}
+            self.__parent_dids_expiration = time() + self.__parent_dids_lifetime
+
+        if (scope, name) in self.__parent_dids:
+            record_counter('daemons.tracer.kronos.parent_dids_cache.hit')
+            return self.__parent_dids[(scope, name)]
+
+        record_counter('daemons.tracer.kronos.parent_dids_cache.miss')
+        datasets = []
+        for did in list_parent_dids(scope, name):
+            if did['type'] != DIDType.DATASET:
+                continue
+            # do not update _dis datasets
+            if did['scope'] == 'panda' and '_dis' in did['name']:
+                continue
+            datasets.append(did)
+        self.__parent_dids[(scope, name)] = datasets
+        return datasets
+
     def __update_atime(self):
         """
         Bulk update atime.
@@ -195,12 +223,7 @@ class AMQConsumer(object):
                 record_counter('daemons.tracer.kronos.report_error')
                 continue
 
-            for did in list_parent_dids(report['scope'], report['filename']):
-                if did['type'] != DIDType.DATASET:
-                    continue
-                # do not update _dis datasets
-                if did['scope'] == 'panda' and '_dis' in did['name']:
-                    continue
+            for did in self.__get_parent_datasets(report['scope'], report['filename']):
                 for rse in rses:
                     self.__dataset_queue.put({'scope': did['scope'], 'name': did['name'], 'did_type': did['type'], 'rse': rse, 'accessed_at': datetime.utcfromtimestamp(report['traceTimeentryUnix'])})
 
@@ -208,14 +231,15 @@ class AMQConsumer(object):
 
         try:
             ts = time()
-            for replica in replicas:
-                # if touch replica hits a locked row put the trace back into queue for later retry
-                if not touch_replica(replica):
-                    resubmit = {'filename': replica['name'], 'scope': replica['scope'], 'remoteSite': replica['rse'], 'traceTimeentryUnix': replica['traceTimeentryUnix'],
-                                'eventType': 'get', 'usrdn': 'someuser', 'clientState': 'DONE', 'eventVersion': replica['eventVersion']}
-                    self.__conn.send(body=jdumps(resubmit), destination=self.__queue, headers={'appversion': 'rucio', 'resubmitted': '1'})
-                    record_counter('daemons.tracer.kronos.sent_resubmitted')
-                    logging.warning('(kronos_file) hit locked row, resubmitted to queue')
+            # if touch replicas hits locked rows put the traces back into queue for later retry
+            for replica in touch_replicas(replicas):
+                if 'traceTimeentryUnix' not in replica:
+                    continue
+                resubmit = {'filename': replica['name'], 'scope': replica['scope'], 'remoteSite': replica['rse'], 'traceTimeentryUnix': replica['traceTimeentryUnix'],
+                            'eventType': 'get', 'usrdn': 'someuser', 'clientState': 'DONE', 'eventVersion': replica['eventVersion']}
+                self.__conn.send(body=jdumps(resubmit), destination=self.__queue, headers={'appversion': 'rucio', 'resubmitted': '1'})
+                record_counter('daemons.tracer.kronos.sent_resubmitted')
+                logging.warning('(kronos_file) hit locked row, resubmitted to queue')
             record_timer('daemons.tracer.kronos.update_atime', (time() - ts) * 1000)
         except:
             logging.error(format_exc())
@@ -251,6 +275,12 @@ def kronos_file(once=False, thread=0, brokers_resolved=None, dataset_queue=None)
 
     excluded_usrdns = set(config_get('tracer-kronos', 'excluded_usrdns').split(','))
 
+    parent_dids_lifetime = 600
+    try:
+        parent_dids_lifetime = config_get_int('tracer-kronos', 'parent_dids_lifetime')
+    except:
+        pass
+
     conns = []
     for broker in brokers_resolved:
         if not use_ssl:
@@ -280,7 +310,8 @@ def kronos_file(once=False, thread=0, brokers_resolved=None, dataset_queue=None)
                                                                      chunksize=chunksize,
                                                                      subscription_id=subscription_id,
                                                                      excluded_usrdns=excluded_usrdns,
-                                                                     dataset_queue=dataset_queue))
+                                                                     dataset_queue=dataset_queue,
+                                                                     parent_dids_lifetime=parent_dids_lifetime))
                 conn.start()
                 if not use_ssl:
                     conn.connect(username, password)
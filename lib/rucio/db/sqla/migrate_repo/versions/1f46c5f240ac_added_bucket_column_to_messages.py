@@ -0,0 +1,54 @@
+'''
+ Copyright European Organization for Nuclear Research (CERN)
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ You may not use this file except in compliance with the License.
+ You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+added column bucket to table messages
+
+Revision ID: 1f46c5f240ac
+Revises: b4293a99f344
+Create Date: 2017-09-12 11:24:36.503112
+
+'''
+from alembic.op import add_column, create_index, drop_column, drop_index, get_bind
+
+import sqlalchemy as sa
+
+from rucio.common.utils import chunks
+from rucio.db.sqla.models import get_message_bucket
+from rucio.db.sqla.types import GUID
+
+
+# revision identifiers, used by Alembic.
+revision = '1f46c5f240ac'  # pylint: disable=invalid-name
+down_revision = 'b4293a99f344'  # pylint: disable=invalid-name
+
+
+def upgrade():
+    '''
+    upgrade method
+    '''
+    add_column('messages', sa.Column('bucket', sa.Integer, server_default='0'))
+    create_index('MESSAGES_BUCKET_CREATED_IDX', 'messages', ['bucket', 'created_at'])
+
+    # Spread the queued messages over the buckets as on insert,
+    # otherwise they are all consumed by the thread of bucket 0
+    messages = sa.sql.table('messages', sa.sql.column('id', GUID()), sa.sql.column('bucket', sa.Integer))
+    bind = get_bind()
+    buckets = {}
+    for message_id, in bind.execute(sa.select([messages.c.id])):
+        buckets.setdefault(get_message_bucket(message_id), []).append(message_id)
+    for bucket, message_ids in buckets.items():
+        if bucket:
+            for chunk in chunks(message_ids, 1000):
+                bind.execute(messages.update().where(messages.c.id.in_(chunk)).values(bucket=bucket))
+
+
+def downgrade():
+    '''
+    downgrade method
+    '''
+    drop_index('MESSAGES_BUCKET_CREATED_IDX', 'messages')
+    drop_column('messages', 'bucket')
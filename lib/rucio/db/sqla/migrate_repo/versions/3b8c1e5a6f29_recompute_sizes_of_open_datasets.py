@@ -0,0 +1,53 @@
+'''
+ Copyright European Organization for Nuclear Research (CERN)
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ You may not use this file except in compliance with the License.
+ You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+recompute the sizes of the open datasets
+
+Revision ID: 3b8c1e5a6f29
+Revises: 7c3e2b9a51d4
+Create Date: 2017-09-26 14:08:51.302117
+
+'''
+from alembic.op import get_bind
+
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8c1e5a6f29'  # pylint: disable=invalid-name
+down_revision = '7c3e2b9a51d4'  # pylint: disable=invalid-name
+
+
+def upgrade():
+    '''
+    upgrade method
+    '''
+    # The length, bytes and events of the open datasets are now increased when
+    # contents are attached. Except on Oracle, they were only counted when the
+    # dataset was closed, so they are counted once for the datasets still open.
+    dids = sa.sql.table('dids', sa.sql.column('scope', sa.String), sa.sql.column('name', sa.String),
+                        sa.sql.column('did_type', sa.String), sa.sql.column('is_open', sa.Boolean),
+                        sa.sql.column('length', sa.BigInteger), sa.sql.column('bytes', sa.BigInteger),
+                        sa.sql.column('events', sa.BigInteger))
+    contents = sa.sql.table('contents', sa.sql.column('scope', sa.String), sa.sql.column('name', sa.String),
+                            sa.sql.column('bytes', sa.BigInteger), sa.sql.column('events', sa.BigInteger))
+
+    def of_contents(column):
+        return sa.select([column]).where(sa.and_(contents.c.scope == dids.c.scope, contents.c.name == dids.c.name)).as_scalar()
+
+    get_bind().execute(dids.update().
+                       where(sa.and_(dids.c.did_type == 'D', dids.c.is_open == sa.true())).
+                       values(length=of_contents(sa.func.count(contents.c.name)),
+                              bytes=of_contents(sa.func.sum(contents.c.bytes)),
+                              events=of_contents(sa.func.sum(contents.c.events))))
+
+
+def downgrade():
+    '''
+    downgrade method
+    '''
+    pass
@@ -0,0 +1,56 @@
+'''
+ Copyright European Organization for Nuclear Research (CERN)
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ You may not use this file except in compliance with the License.
+ You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+create deletion candidates table
+
+Revision ID: 7c3e2b9a51d4
+Revises: 1f46c5f240ac
+Create Date: 2017-09-19 10:12:43.118274
+
+'''
+from alembic.op import (create_table, create_primary_key, create_foreign_key,
+                        create_index, drop_constraint, drop_index, drop_table)
+from alembic import context
+import sqlalchemy as sa
+
+from rucio.db.sqla.types import GUID
+
+
+# revision identifiers, used by Alembic.
+revision = '7c3e2b9a51d4'  # pylint: disable=invalid-name
+down_revision = '1f46c5f240ac'  # pylint: disable=invalid-name
+
+
+def upgrade():
+    '''
+    upgrade method
+    '''
+    create_table('deletion_candidates',
+                 sa.Column('rse_id', GUID()),
+                 sa.Column('scope', sa.String(25)),
+                 sa.Column('name', sa.String(255)),
+                 sa.Column('bytes', sa.BigInteger),
+                 sa.Column('path', sa.String(1024)),
+                 sa.Column('tombstone', sa.DateTime),
+                 sa.Column('claimed_at', sa.DateTime),
+                 sa.Column('updated_at', sa.DateTime),
+                 sa.Column('created_at', sa.DateTime))
+    if context.get_context().dialect.name != 'sqlite':
+        create_primary_key('DELETION_CANDIDATES_PK', 'deletion_candidates', ['rse_id', 'scope', 'name'])
+        create_foreign_key('DELETION_CANDIDATES_RSE_ID_FK', 'deletion_candidates', 'rses', ['rse_id'], ['id'])
+        create_index('DELETION_CANDIDATES_TOMBSTONE_IDX', 'deletion_candidates', ['rse_id', 'tombstone'])
+
+
+def downgrade():
+    '''
+    downgrade method
+    '''
+    if context.get_context().dialect.name == 'postgresql':
+        drop_constraint('DELETION_CANDIDATES_PK', 'deletion_candidates', type_='primary')
+        drop_constraint('DELETION_CANDIDATES_RSE_ID_FK', 'deletion_candidates')
+        drop_index('DELETION_CANDIDATES_TOMBSTONE_IDX', 'deletion_candidates')
+    drop_table('deletion_candidates')
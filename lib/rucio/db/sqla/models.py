@@ -455,6 +455,21 @@ class QuarantinedReplica(BASE, ModelBase, Versioned):
                    ForeignKeyConstraint(['rse_id'], ['rses.id'], name='QURD_REPLICAS_RSE_ID_FK'))
 
 
+class DeletionCandidate(BASE, ModelBase):
+    """Represents the replicas queued for deletion, ordered by tombstone"""
+    __tablename__ = 'deletion_candidates'
+    rse_id = Column(GUID())
+    scope = Column(String(25))
+    name = Column(String(255))
+    bytes = Column(BigInteger)
+    path = Column(String(1024))
+    tombstone = Column(DateTime)
+    claimed_at = Column(DateTime)
+    _table_args = (PrimaryKeyConstraint('rse_id', 'scope', 'name', name='DELETION_CANDIDATES_PK'),
+                   ForeignKeyConstraint(['rse_id'], ['rses.id'], name='DELETION_CANDIDATES_RSE_ID_FK'),
+                   Index('DELETION_CANDIDATES_TOMBSTONE_IDX', 'rse_id', 'tombstone'))
+
+
 class DIDKey(BASE, ModelBase):
     """Represents Data IDentifier property keys"""
     __tablename__ = 'did_keys'
@@ -1085,15 +1100,30 @@ class Token(BASE, ModelBase):
                    Index('TOKENS_ACCOUNT_EXPIRED_AT_IDX', 'account', 'expired_at'))
 
 
+MESSAGE_BUCKETS = 64
+
+
+def get_message_bucket(message_id):
+    """Derive the consumer bucket of a message from its id."""
+    return int(str(message_id).replace('-', '')[:8], 16) % MESSAGE_BUCKETS
+
+
+def message_bucket(context):
+    """Derive the consumer bucket of an inserted message."""
+    return get_message_bucket(context.current_parameters['id'])
+
+
 class Message(BASE, ModelBase):
     """Represents the event messages"""
     __tablename__ = 'messages'
     id = Column(GUID(), default=utils.generate_uuid)
+    bucket = Column(Integer, default=message_bucket, server_default='0')
     event_type = Column(String(1024))
     payload = Column(String(4000))
     _table_args = (PrimaryKeyConstraint('id', name='MESSAGES_ID_PK'),
                    CheckConstraint('EVENT_TYPE IS NOT NULL', name='MESSAGES_EVENT_TYPE_NN'),
-                   CheckConstraint('PAYLOAD IS NOT NULL', name='MESSAGES_PAYLOAD_NN'),)
+                   CheckConstraint('PAYLOAD IS NOT NULL', name='MESSAGES_PAYLOAD_NN'),
+                   Index('MESSAGES_BUCKET_CREATED_IDX', 'bucket', 'created_at'))
 
 
 class MessageHistory(BASE, ModelBase):
@@ -1205,6 +1235,7 @@ def register_models(engine):
               DIDKeyValueAssociation,
               DataIdentifier,
               DeletedDataIdentifier,
+              DeletionCandidate,
               Heartbeats,
               Identity,
               IdentityAccountAssociation,
@@ -1260,6 +1291,7 @@ def unregister_models(engine):
               DIDKeyValueAssociation,
               DataIdentifier,
               DeletedDataIdentifier,
+              DeletionCandidate,
               Heartbeats,
               Identity,
               IdentityAccountAssociation,
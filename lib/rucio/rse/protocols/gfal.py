@@ -249,6 +249,32 @@ class Default(protocol.RSEProtocol):
         except Exception as error:
             raise exception.ServiceUnavailable(error)
 
+    def bulk_delete(self, pfns):
+        """
+        Deletes a list of files from the connected RSE with a single gfal2 bulk unlink.
+
+        :param pfns: list of PFNs of the to be deleted files
+
+        :returns: dict with the PFN as key and None, or the exception raised for this PFN, as value
+        """
+        ret = {}
+        try:
+            errors = self.__ctx.unlink([str(pfn) for pfn in pfns])
+        except gfal2.GError as error:  # pylint: disable=no-member
+            raise exception.ServiceUnavailable(error)
+
+        if not isinstance(errors, list):
+            return super(Default, self).bulk_delete(pfns)
+
+        for pfn, error in zip(pfns, errors):
+            if not error:
+                ret[pfn] = None
+            elif error.code == errno.ENOENT or 'No such file' in error.message:
+                ret[pfn] = exception.SourceNotFound(error)
+            else:
+                ret[pfn] = exception.ServiceUnavailable(error)
+        return ret
+
     def rename(self, path, new_path):
         """
         Allows to rename a file stored inside the connected RSE.
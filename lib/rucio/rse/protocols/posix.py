@@ -80,6 +80,39 @@ class Default(protocol.RSEProtocol):
             else:
                 raise exception.ServiceUnavailable(e)
 
+    def stream(self, pfn, offset=0, chunksize=1024 * 1024):
+        """ Iterates over the content of a file stored inside the connected RSE.
+
+            :param pfn: Physical file name of requested file
+            :param offset: Position in bytes from which the content is returned
+            :param chunksize: Size of the returned chunks in bytes
+
+            :returns: iterator over the chunks of the file
+
+            :raises ServiceUnavailable: if some generic error occured in the library.
+            :raises SourceNotFound: if the source file was not found on the referred storage.
+        """
+        try:
+            source = open(self.pfn2path(pfn), 'rb')
+            source.seek(offset)
+        except IOError as e:
+            if e.errno == 2:
+                raise exception.SourceNotFound(e)
+            else:
+                raise exception.ServiceUnavailable(e)
+
+        def chunks():
+            with source:
+                while True:
+                    try:
+                        chunk = source.read(chunksize)
+                    except IOError as e:
+                        raise exception.ServiceUnavailable(e)
+                    if not chunk:
+                        return
+                    yield chunk
+        return chunks()
+
     def put(self, source, target, source_dir=None):
         """
             Allows to store files inside the referred RSE.
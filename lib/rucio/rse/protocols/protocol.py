@@ -85,6 +85,39 @@ class RSEProtocol(object):
                                                          ])
         return pfns
 
+    def lfns2pfns_bulk(self, scopes, names, paths=None):
+        """
+            Returns fully qualified PFNs for a batch of files given as columns.
+            The protocol specific prefix is only computed once per batch.
+
+            :param scopes: List of scopes.
+            :param names:  List of names, in the same order as scopes.
+            :param paths:  Optional list of paths, in the same order as scopes. None entries are generated.
+
+            :returns: List of PFNs, in the same order as the input.
+        """
+        paths = paths or [None] * len(scopes)
+        if 'lfns2pfns' in self.__dict__ or type(self).lfns2pfns.im_func is not RSEProtocol.lfns2pfns.im_func:
+            # Protocol specific PFN construction, done in one call for the whole batch
+            pfns = self.lfns2pfns([{'scope': scope, 'name': name, 'path': path} for scope, name, path in zip(scopes, names, paths)])
+            return [pfns['%s:%s' % (scope, name)] for scope, name in zip(scopes, names)]
+
+        prefix = self.attributes['prefix']
+        if not prefix.startswith('/'):
+            prefix = ''.join(['/', prefix])
+        if not prefix.endswith('/'):
+            prefix = ''.join([prefix, '/'])
+        prefix = ''.join([self.attributes['scheme'], '://', self.attributes['hostname'], ':', str(self.attributes['port']), prefix])
+
+        get_path = self._get_path
+        pfns = []
+        for scope, name, path in zip(scopes, names, paths):
+            if path is not None:
+                pfns.append(''.join([prefix, path if not path.startswith('/') else path[1:]]))
+            else:
+                pfns.append(''.join([prefix, get_path(scope=scope, name=name)]))
+        return pfns
+
     def __lfns2pfns_client(self, lfns):
         """ Provides the path of a replica for non-deterministic sites. Will be assigned to get path by the __init__ method if neccessary.
 
@@ -223,6 +256,22 @@ class RSEProtocol(object):
          """
         raise NotImplementedError
 
+    def stream(self, path, offset=0):
+        """
+            Iterates over the content of a file stored inside the connected RSE, so that it can be
+            processed while it is downloaded. Protocols supporting it override this method.
+
+            :param path: Physical file name of requested file
+            :param offset: Position in bytes from which the content is returned, e.g. to resume a download
+
+            :returns: iterator over the chunks of the file
+
+            :raises NotImplementedError: if the protocol does not support streaming.
+            :raises ServiceUnavailable: if some generic error occured in the library.
+            :raises SourceNotFound: if the source file was not found on the referred storage.
+        """
+        raise NotImplementedError
+
     def put(self, source, target, source_dir):
         """
             Allows to store files inside the referred RSE.
@@ -248,6 +297,24 @@ class RSEProtocol(object):
         """
         raise NotImplementedError
 
+    def bulk_delete(self, pfns):
+        """
+            Deletes a list of files from the connected RSE.
+            Protocols supporting a native bulk operation override this method.
+
+            :param pfns: list of PFNs of the to be deleted files
+
+            :returns: dict with the PFN as key and None, or the exception raised for this PFN, as value
+        """
+        ret = {}
+        for pfn in pfns:
+            try:
+                self.delete(pfn)
+                ret[pfn] = None
+            except Exception as error:
+                ret[pfn] = error
+        return ret
+
     def rename(self, path, new_path):
         """ Allows to rename a file stored inside the connected RSE.
 
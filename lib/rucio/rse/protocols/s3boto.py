@@ -268,6 +268,37 @@ class Default(protocol.RSEProtocol):
         except Exception as e:
             raise exception.ServiceUnavailable(e)
 
+    def bulk_delete(self, pfns):
+        """
+            Deletes a list of files from the connected RSE with one multi-object delete per bucket.
+
+            :param pfns: list of PFNs of the to be deleted files
+
+            :returns: dict with the PFN as key and None, or the exception raised for this PFN, as value
+        """
+        ret, keys = {}, {}
+        for pfn in pfns:
+            try:
+                bucket_name, key_name = self.get_bucket_key_name(pfn)
+                keys.setdefault(bucket_name, {})[key_name] = pfn
+            except exception.RucioException as e:
+                ret[pfn] = e
+
+        for bucket_name, bucket_keys in keys.iteritems():
+            try:
+                bucket = self.__conn.get_bucket(bucket_name, validate=False)
+                result = bucket.delete_keys(bucket_keys.keys(), quiet=False)
+            except Exception as e:
+                raise exception.ServiceUnavailable(e)
+            for key in result.deleted:
+                ret[bucket_keys[key.key]] = None
+            for error in result.errors:
+                if error.code == 'NoSuchKey':
+                    ret[bucket_keys[error.key]] = exception.SourceNotFound(error.message)
+                else:
+                    ret[bucket_keys[error.key]] = exception.ServiceUnavailable(error.message)
+        return ret
+
     def rename(self, pfn, new_pfn):
         """ Allows to rename a file stored inside the connected RSE.
 
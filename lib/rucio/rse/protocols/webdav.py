@@ -15,8 +15,11 @@
 import os
 import ssl
 import sys
+import threading
 
 import xml.etree.ElementTree as ET
+from ConfigParser import NoOptionError, NoSectionError
+from Queue import Queue, Empty
 from xml.parsers import expat
 
 import requests
@@ -25,20 +28,62 @@ from requests.adapters import HTTPAdapter
 from urllib3.poolmanager import PoolManager
 
 from rucio.common import exception
+from rucio.common.config import config_get_int
 from rucio.rse.protocols import protocol
 
 
+def _config_get_int(option, default):
+    try:
+        return config_get_int('webdav', option)
+    except (NoOptionError, NoSectionError, ValueError):
+        return default
+
+
+# Size of the chunks read from the responses and from the uploaded files, in bytes
+BUFFER_SIZE = _config_get_int('buffer_size', 4 * 1024 * 1024)
+# Number of connections used to download a large file with range requests
+PARALLEL_STREAMS = _config_get_int('parallel_streams', 4)
+# Number of files transferred at the same time by the process, e.g. by the worker threads of rsemanager
+CONCURRENT_TRANSFERS = _config_get_int('concurrent_transfers', 4)
+# Size from which a file is downloaded with parallel range requests, in bytes
+RANGE_THRESHOLD = _config_get_int('range_threshold', 64 * 1024 * 1024)
+# Size of the range requests, in bytes. At most two segments per stream are kept in memory
+SEGMENT_SIZE = _config_get_int('segment_size', 16 * 1024 * 1024)
+
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
 class TLSv1HttpAdapter(HTTPAdapter):
     '''
     Class to force the SSL protocol to TLSv1
     '''
-    def init_poolmanager(self, connections, maxsize, block=False):
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
         self.poolmanager = PoolManager(num_pools=connections,
                                        maxsize=maxsize,
                                        block=block,
                                        ssl_version=ssl.PROTOCOL_TLSv1)
 
 
+def get_session(cert, pool_size):
+    '''
+    Get the HTTP session shared by the WebDAV protocols of the process using the same certificate,
+    so their connections are reused across files instead of being opened for each file.
+
+    :param cert: The client certificate, as given to requests.
+    :param pool_size: The number of connections kept per host.
+    :returns: The session.
+    '''
+    key = (cert, pool_size)
+    with _SESSIONS_LOCK:
+        if key not in _SESSIONS:
+            session = requests.session()
+            session.mount('https://', TLSv1HttpAdapter(pool_maxsize=pool_size))
+            session.mount('http://', HTTPAdapter(pool_maxsize=pool_size))
+            _SESSIONS[key] = session
+        return _SESSIONS[key]
+
+
 class UploadInChunks(object):
     '''
     Class to upload by chunks.
@@ -149,7 +194,9 @@ class Default(protocol.RSEProtocol):
 
             :param credentials Provides information to establish a connection
                 to the referred storage system. For WebDAV connections these are
-                ca_cert, cert, auth_type, timeout
+                ca_cert, cert, auth_type, timeout, and buffer_size, parallel_streams,
+                concurrent_transfers, range_threshold and segment_size to override the ones
+                of the configuration
 
             :raises RSEAccessDenied
         """
@@ -170,6 +217,9 @@ class Default(protocol.RSEProtocol):
 
         try:
             self.cert = credentials['cert']
+            # The certificate and key pair of the credentials can be a JSON list
+            if isinstance(self.cert, list):
+                self.cert = tuple(self.cert)
         except KeyError:
             x509 = os.getenv('X509_USER_PROXY')
             if not x509:
@@ -185,8 +235,14 @@ class Default(protocol.RSEProtocol):
             self.timeout = credentials['timeout']
         except KeyError:
             self.timeout = 300
-        self.session = requests.session()
-        self.session.mount('https://', TLSv1HttpAdapter())
+
+        self.buffer_size = credentials.get('buffer_size', BUFFER_SIZE)
+        self.parallel_streams = max(1, credentials.get('parallel_streams', PARALLEL_STREAMS))
+        self.concurrent_transfers = max(1, credentials.get('concurrent_transfers', CONCURRENT_TRANSFERS))
+        self.range_threshold = credentials.get('range_threshold', RANGE_THRESHOLD)
+        self.segment_size = credentials.get('segment_size', SEGMENT_SIZE)
+        # One more connection per transfer for the response of the first segment
+        self.session = get_session(self.cert, self.concurrent_transfers * (self.parallel_streams + 1))
 
         # "ping" to see if the server is available
         try:
@@ -199,7 +255,8 @@ class Default(protocol.RSEProtocol):
             raise exception.ServiceUnavailable(error)
 
     def close(self):
-        self.session.close()
+        # The session is shared, its connections are kept for the next files
+        pass
 
     def path2pfn(self, path):
         """
@@ -210,7 +267,7 @@ class Default(protocol.RSEProtocol):
             :returns: Fully qualified PFN.
 
         """
-        if not path.startswith('https'):
+        if not path.startswith(('https://', 'http://')):
             return '%s://%s:%s%s%s' % (self.attributes['scheme'], self.attributes['hostname'], str(self.attributes['port']), self.attributes['prefix'], path)
         else:
             return path
@@ -248,41 +305,204 @@ class Default(protocol.RSEProtocol):
             :raises DestinationNotAccessible, ServiceUnavailable, SourceNotFound, RSEAccessDenied
         """
         path = self.path2pfn(pfn)
-        chunksize = 1024
+        length, chunks = self.__chunks(path, self.__request(path))
         try:
-            result = self.session.get(path, verify=False, stream=True, timeout=self.timeout, cert=self.cert)
-            if result and result.status_code in [200, ]:
-                length = None
-                if 'content-length' in result.headers:
-                    length = int(result.headers['content-length'])
-                    totnchunk = int(length / chunksize) + 1
-                with open(dest, 'wb') as file_out:
-                    nchunk = 0
-                    try:
-                        if length:
-                            pbar = ProgressBar(maxval=totnchunk).start()
-                        else:
-                            print('Malformed HTTP response (missing content-length header). Cannot show progress bar.')
-                        for chunk in result.iter_content(chunksize):
-                            file_out.write(chunk)
-                            if length:
-                                nchunk += 1
-                                pbar.update(nchunk)
-                    finally:
+            with open(dest, 'wb') as file_out:
+                if length:
+                    pbar = ProgressBar(maxval=length).start()
+                else:
+                    print('Malformed HTTP response (missing content-length header). Cannot show progress bar.')
+                try:
+                    received = 0
+                    for chunk in chunks:
+                        file_out.write(chunk)
                         if length:
-                            pbar.finish()
+                            received += len(chunk)
+                            pbar.update(received)
+                finally:
+                    if length:
+                        pbar.finish()
+        except requests.exceptions.ConnectionError as error:
+            raise exception.ServiceUnavailable(error)
+        except requests.exceptions.ReadTimeout as error:
+            raise exception.ServiceUnavailable(error)
 
-            elif result.status_code in [404, ]:
-                raise exception.SourceNotFound()
-            elif result.status_code in [401, 403]:
-                raise exception.RSEAccessDenied()
-            else:
-                # catchall exception
-                raise exception.RucioException(result.status_code, result.text)
+    def stream(self, pfn, offset=0, chunksize=None):
+        """ Iterates over the content of a file stored inside the connected RSE.
+            A range request is used if an offset is given. Large files are read with
+            parallel range requests, and their content is returned in order.
+
+            :param pfn Physical file name of requested file
+            :param offset Position in bytes from which the content is returned
+            :param chunksize Size of the returned chunks in bytes, the buffer size by default
+
+            :returns: iterator over the chunks of the file
+
+            :raises ServiceUnavailable, SourceNotFound, RSEAccessDenied
+        """
+        path = self.path2pfn(pfn)
+        return self.__chunks(path, self.__request(path, offset), offset, chunksize)[1]
+
+    def __request(self, path, offset=0):
+        """ Sends the GET request of the content of a file from an offset.
+
+            :param path Fully qualified PFN of the file
+            :param offset Position in bytes from which the content is requested
+
+            :returns: the streamed response
+
+            :raises ServiceUnavailable, SourceNotFound, RSEAccessDenied
+        """
+        headers = {'Range': 'bytes=%d-' % offset} if offset else {}
+        try:
+            result = self.session.get(path, verify=False, stream=True, timeout=self.timeout, cert=self.cert, headers=headers)
         except requests.exceptions.ConnectionError as error:
             raise exception.ServiceUnavailable(error)
         except requests.exceptions.ReadTimeout as error:
             raise exception.ServiceUnavailable(error)
+        if result.status_code in [404, ]:
+            raise exception.SourceNotFound()
+        elif result.status_code in [401, 403]:
+            raise exception.RSEAccessDenied()
+        elif result.status_code not in [200, 206]:
+            # catchall exception
+            raise exception.RucioException(result.status_code, result.text)
+        return result
+
+    def __chunks(self, path, result, offset=0, chunksize=None):
+        """ Iterates over the content of a response from an offset. If the content is large and the server
+            accepts range requests, the rest of the file is read with parallel range requests.
+
+            :param path Fully qualified PFN of the file
+            :param result The streamed response
+            :param offset Position in bytes from which the content was requested
+            :param chunksize Size of the returned chunks in bytes, the buffer size by default
+
+            :returns: tuple (size of the content from the offset or None, iterator over the chunks)
+        """
+        chunksize = chunksize or self.buffer_size
+        # The server ignored the range, skip the beginning of the content
+        skip = offset if result.status_code == 200 else 0
+        length = int(result.headers['content-length']) - skip if 'content-length' in result.headers else None
+        ranges = result.status_code == 206 or result.headers.get('accept-ranges', '').lower() == 'bytes'
+        if not skip and ranges and length is not None and self.parallel_streams > 1 and length >= max(self.range_threshold, 2 * self.segment_size):
+            return length, self.__parallel_chunks(path, result, offset, length, chunksize)
+
+        def chunks(skip):
+            try:
+                for chunk in result.iter_content(chunksize):
+                    if skip:
+                        if len(chunk) <= skip:
+                            skip -= len(chunk)
+                            continue
+                        chunk, skip = chunk[skip:], 0
+                    yield chunk
+            except requests.exceptions.RequestException as error:
+                raise exception.ServiceUnavailable(error)
+            finally:
+                result.close()
+        return length, chunks(skip)
+
+    def __parallel_chunks(self, path, result, offset, length, chunksize):
+        """ Iterates over the content of a file with parallel range requests.
+
+            The content is split in segments. The first one is read from the response already
+            received, the others are fetched by a pool of threads and returned in order. The threads
+            are at most two segments per stream ahead of the returned content, which bounds the memory.
+
+            :param path Fully qualified PFN of the file
+            :param result The streamed response, from the offset
+            :param offset Position in bytes of the beginning of the response
+            :param length Size of the response in bytes
+            :param chunksize Size of the returned chunks in bytes
+
+            :returns: iterator over the chunks
+        """
+        segments = [(begin, min(begin + self.segment_size, offset + length)) for begin in xrange(offset, offset + length, self.segment_size)]
+        queue = Queue()
+        for index in xrange(1, len(segments)):
+            queue.put(index)
+        fetched = {}
+        condition = threading.Condition()
+        window = threading.Semaphore(2 * self.parallel_streams)
+        stop = threading.Event()
+
+        def fetch(index):
+            begin, end = segments[index]
+            response = self.session.get(path, verify=False, stream=True, timeout=self.timeout, cert=self.cert,
+                                        headers={'Range': 'bytes=%d-%d' % (begin, end - 1)})
+            try:
+                if response.status_code != 206:
+                    raise exception.RucioException(response.status_code, 'Range %d-%d of %s not served' % (begin, end - 1, path))
+                data, size = [], 0
+                for chunk in response.iter_content(chunksize):
+                    if stop.is_set():
+                        return
+                    data.append(chunk)
+                    size += len(chunk)
+                if size != end - begin:
+                    raise exception.ServiceUnavailable('Range %d-%d of %s incomplete: %d bytes received' % (begin, end - 1, path, size))
+                return data
+            finally:
+                response.close()
+
+        def worker():
+            while True:
+                # The permit is taken before the segment, so the next segment to return is always being fetched
+                window.acquire()
+                if stop.is_set():
+                    return
+                try:
+                    index = queue.get_nowait()
+                except Empty:
+                    window.release()
+                    return
+                try:
+                    data = fetch(index)
+                except Exception as error:
+                    data = error
+                with condition:
+                    fetched[index] = data
+                    condition.notify_all()
+
+        def chunks():
+            threads = [threading.Thread(target=worker) for _ in xrange(min(self.parallel_streams, len(segments) - 1))]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            try:
+                remaining = segments[0][1] - segments[0][0]
+                try:
+                    for chunk in result.iter_content(chunksize):
+                        if len(chunk) >= remaining:
+                            yield chunk[:remaining]
+                            remaining = 0
+                            break
+                        remaining -= len(chunk)
+                        yield chunk
+                finally:
+                    result.close()
+                if remaining:
+                    raise exception.ServiceUnavailable('Range %d-%d of %s incomplete' % (segments[0][0], segments[0][1] - 1, path))
+                for index in xrange(1, len(segments)):
+                    with condition:
+                        while index not in fetched:
+                            condition.wait(1)
+                        data = fetched.pop(index)
+                    window.release()
+                    if isinstance(data, Exception):
+                        raise data
+                    for chunk in data:
+                        yield chunk
+            except requests.exceptions.RequestException as error:
+                raise exception.ServiceUnavailable(error)
+            finally:
+                stop.set()
+                for thread in threads:
+                    window.release()
+                for thread in threads:
+                    thread.join()
+        return chunks()
 
     def put(self, source, target, source_dir=None, progressbar=False):
         """ Allows to store files inside the referred RSE.
@@ -300,7 +520,7 @@ class Default(protocol.RSEProtocol):
         try:
             if not os.path.exists(full_name):
                 raise exception.SourceNotFound()
-            it = UploadInChunks(full_name, 10000000, progressbar)
+            it = UploadInChunks(full_name, self.buffer_size, progressbar)
             result = self.session.put(path, data=IterableToFileAdapter(it), verify=False, allow_redirects=True, timeout=self.timeout, cert=self.cert)
             if result.status_code in [200, 201]:
                 return
@@ -314,7 +534,7 @@ class Default(protocol.RSEProtocol):
                 try:
                     if not os.path.exists(full_name):
                         raise exception.SourceNotFound()
-                    it = UploadInChunks(full_name, 10000000, progressbar)
+                    it = UploadInChunks(full_name, self.buffer_size, progressbar)
                     result = self.session.put(path, data=IterableToFileAdapter(it), verify=False, allow_redirects=True, timeout=self.timeout, cert=self.cert)
                     if result.status_code in [200, 201]:
                         return
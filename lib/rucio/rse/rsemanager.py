@@ -18,12 +18,18 @@
 
 import copy
 import os
+import threading
+import time
 
+from Queue import Queue, Empty
 from urlparse import urlparse
 
 from rucio.common import exception, utils, constants
+from rucio.common.checksum import Checksummer, checksum_during
 
 DEFAULT_PROTOCOL = 1
+DOWNLOAD_THREADS = 3
+UPLOAD_THREADS = 4
 
 
 def get_rse_info(rse, session=None):
@@ -215,35 +221,8 @@ def download(rse_settings, files, dest_dir=None, force_scheme=None, ignore_check
         pfn = f['pfn'] if 'pfn' in f else protocol.lfns2pfns(f).values()[0]
         target_dir = "./%s" % f['scope'] if dest_dir is None else dest_dir
         try:
-            if not os.path.exists(target_dir):
-                os.makedirs(target_dir)
-            # Each scope is stored into a separate folder
-            finalfile = '%s/%s' % (target_dir, f['name'])
-            # Check if the file already exists, if not download and validate it
-            if not os.path.isfile(finalfile):
-                if 'adler32' in f:
-                    tempfile = '%s/%s.part' % (target_dir, f['name'])
-                    if os.path.isfile(tempfile):
-                        if printstatements:
-                            print '%s already exists, probably from a failed attempt. Will remove it' % (tempfile)
-                        os.unlink(tempfile)
-                    protocol.get(pfn, tempfile)
-                    if printstatements:
-                        print 'File downloaded. Will be validated'
-
-                    localchecksum = f['adler32'] if ignore_checksum else utils.adler32(tempfile)
-                    if localchecksum == f['adler32']:
-                        if printstatements:
-                            print 'File validated'
-                        os.rename(tempfile, finalfile)
-                    else:
-                        os.unlink(tempfile)
-                        raise exception.FileConsistencyMismatch('Checksum mismatch : local %s vs recorded %s' % (str(localchecksum), str(f['adler32'])))
-                else:
-                    protocol.get(pfn, '%s/%s' % (target_dir, f['name']))
-                ret['%s:%s' % (f['scope'], f['name'])] = True
-            else:
-                ret['%s:%s' % (f['scope'], f['name'])] = True
+            _download_file(protocol, pfn, f, target_dir, ignore_checksum=ignore_checksum, printstatements=printstatements)
+            ret['%s:%s' % (f['scope'], f['name'])] = True
         except Exception as e:
             gs = False
             ret['%s:%s' % (f['scope'], f['name'])] = e
@@ -258,6 +237,241 @@ def download(rse_settings, files, dest_dir=None, force_scheme=None, ignore_check
     return [gs, ret]
 
 
+def _download_file(protocol, pfn, f, target_dir, ignore_checksum=False, printstatements=False):
+    """
+        Download a single file with a connected protocol, through a .part file validated against the adler32,
+        or the md5 if there is no adler32, of the file.
+
+        The checksum is computed while the file is written. If the protocol supports streaming, a .part
+        file left by a failed attempt is resumed. Otherwise the file is downloaded with protocol.get.
+
+        :param protocol:        the connected protocol
+        :param pfn:             the PFN of the replica
+        :param f:               dict with 'scope', 'name' and optionally 'adler32', 'md5' and 'bytes'
+        :param target_dir:      path to the directory where the file is stored
+        :param ignore_checksum: do not verify the checksum
+
+        :raises FileConsistencyMismatch: the checksum of the downloaded file does not match the provided one
+    """
+    if not os.path.exists(target_dir):
+        os.makedirs(target_dir)
+    # Each scope is stored into a separate folder
+    finalfile = '%s/%s' % (target_dir, f['name'])
+    # Check if the file already exists, if not download and validate it
+    if os.path.isfile(finalfile):
+        return
+
+    tempfile = '%s/%s.part' % (target_dir, f['name'])
+    algorithm = 'adler32' if f.get('adler32') else 'md5' if f.get('md5') else None
+    if ignore_checksum:
+        algorithm = None
+    offset = 0
+    if os.path.isfile(tempfile):
+        offset = os.path.getsize(tempfile)
+        if f.get('bytes') is not None and offset >= f['bytes']:
+            offset = 0
+    try:
+        chunks = protocol.stream(pfn, offset=offset)
+    except NotImplementedError:
+        chunks = None
+
+    if chunks is not None:
+        checksummer = Checksummer([algorithm] if algorithm else [])
+        if offset:
+            if printstatements:
+                print '%s already exists, probably from a failed attempt. Will resume it' % (tempfile)
+            if algorithm:
+                with open(tempfile, 'rb') as part:
+                    checksummer.update_from(part)
+        with open(tempfile, 'ab' if offset else 'wb') as part:
+            for chunk in chunks:
+                part.write(chunk)
+                checksummer.update(chunk)
+        localchecksum = checksummer.hexdigests().get(algorithm)
+    elif f.get('adler32') or f.get('md5'):
+        if os.path.isfile(tempfile):
+            if printstatements:
+                print '%s already exists, probably from a failed attempt. Will remove it' % (tempfile)
+            os.unlink(tempfile)
+        if algorithm:
+            localchecksum = checksum_during(tempfile, lambda: protocol.get(pfn, tempfile), algorithms=[algorithm], expected={algorithm: f[algorithm]})[algorithm]
+        else:
+            protocol.get(pfn, tempfile)
+    else:
+        protocol.get(pfn, finalfile)
+        return
+
+    if printstatements:
+        print 'File downloaded. Will be validated'
+    if algorithm and localchecksum != f[algorithm]:
+        os.unlink(tempfile)
+        raise exception.FileConsistencyMismatch('Checksum mismatch : local %s vs recorded %s' % (str(localchecksum), str(f[algorithm])))
+    if printstatements:
+        print 'File validated'
+    os.rename(tempfile, finalfile)
+
+
+class _ProtocolPool(object):
+    """
+        Connected protocols, reused by the download and upload workers for the files of the same RSE, operation and scheme.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__idle = {}
+        self.__protocols = []
+
+    def acquire(self, rse_settings, scheme, operation='read'):
+        with self.__lock:
+            idle = self.__idle.get((rse_settings['rse'], operation, scheme))
+            if idle:
+                return idle.pop()
+        protocol = create_protocol(rse_settings, operation, scheme=scheme)
+        protocol.connect()
+        with self.__lock:
+            self.__protocols.append(protocol)
+        return protocol
+
+    def release(self, rse_settings, scheme, protocol, operation='read'):
+        with self.__lock:
+            self.__idle.setdefault((rse_settings['rse'], operation, scheme), []).append(protocol)
+
+    def discard(self, protocol):
+        with self.__lock:
+            self.__protocols.remove(protocol)
+        try:
+            protocol.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self.__lock:
+            protocols, self.__protocols, self.__idle = self.__protocols, [], {}
+        for protocol in protocols:
+            try:
+                protocol.close()
+            except Exception:
+                pass
+
+
+def download_files(files, dest_dir=None, threads=DOWNLOAD_THREADS, scheme=None, ignore_checksum=False,
+                   attempts=2, rses_settings=None, callback=None, failover=True):
+    """
+        Download files from their replicas with a pool of worker threads.
+
+        The replicas of a file are tried in the order of its 'rses' dictionary, as returned by list_replicas,
+        and on each RSE the read protocols in their order of priority, each PFN up to `attempts` times, until
+        the file is downloaded. The protocol connections are
+        reused by the workers for the files of the same RSE, and an interrupted download is resumed
+        from the next replica if the protocol supports it.
+
+        :param files:           list of dicts with 'scope', 'name', 'rses' ({rse: [pfns]}) and optionally 'adler32',
+                                'bytes' and 'dest_dir', the directory where the file is stored.
+        :param dest_dir:        default directory where the files are stored. If not given, each scope is represented by its own directory.
+        :param threads:         number of worker threads.
+        :param scheme:          optional scheme or list of schemes of the PFNs to use.
+        :param ignore_checksum: do not verify the checksum.
+        :param attempts:        number of attempts per PFN.
+        :param rses_settings:   optional dict {rse: rse_settings} of the already known RSE settings.
+        :param callback:        optional function called from the workers after each attempt with the file and a dict
+                                {'rse', 'pfn', 'scheme', 'attempt', 'start', 'end', 'error'}.
+        :param failover:        also try the read protocols of deterministic RSEs for which no PFN is given, with the
+                                PFNs generated from the LFN. If False, only the given PFNs are used.
+
+        :returns: dict with 'scope:name' as keys and True or the last exception as values.
+    """
+    if scheme and not isinstance(scheme, list):
+        scheme = scheme.split(',')
+    rses_settings = dict(rses_settings or {})
+    settings_lock = threading.Lock()
+    pool = _ProtocolPool()
+    results = {}
+    queue = Queue()
+    for f in files:
+        queue.put(f)
+
+    def get_settings(rse):
+        with settings_lock:
+            if rse not in rses_settings:
+                try:
+                    rses_settings[rse] = get_rse_info(rse)
+                except exception.RSENotFound as error:
+                    rses_settings[rse] = error
+            return rses_settings[rse]
+
+    def get_pfns(rse_settings, f, pfns):
+        """ The PFNs of the file on an RSE, in the order of priority of the read protocols """
+        pfns = [pfn for pfn in pfns if not scheme or pfn.split(':')[0] in scheme]
+        try:
+            schemes = [protocol['scheme'] for protocol in get_protocols_ordered(rse_settings, operation='read', scheme=scheme)]
+        except exception.RSEProtocolNotSupported:
+            return pfns
+        if failover and rse_settings.get('deterministic', True):
+            for protocol_scheme in schemes:
+                if protocol_scheme in [pfn.split(':')[0] for pfn in pfns]:
+                    continue
+                try:
+                    pfns.extend(lfns2pfns(rse_settings, [{'scope': f['scope'], 'name': f['name']}], operation='read', scheme=protocol_scheme).values())
+                except Exception:
+                    continue
+        # The given PFNs of unknown schemes are tried last
+        return sorted(pfns, key=lambda pfn: schemes.index(pfn.split(':')[0]) if pfn.split(':')[0] in schemes else len(schemes))
+
+    def download_one(f):
+        target_dir = f.get('dest_dir') or dest_dir or './%s' % f['scope']
+        error = exception.SourceNotFound('No replica found for %s:%s' % (f['scope'], f['name']))
+        for rse, pfns in f.get('rses', {}).items():
+            rse_settings = get_settings(rse)
+            if isinstance(rse_settings, Exception):
+                error = rse_settings
+                continue
+            if not rse_settings['availability_read']:
+                error = exception.RSEBlacklisted('%s is blacklisted for reading' % rse)
+                continue
+            for pfn in get_pfns(rse_settings, f, pfns):
+                pfn_scheme = pfn.split(':')[0]
+                for attempt in xrange(1, attempts + 1):
+                    trace = {'rse': rse, 'pfn': pfn, 'scheme': pfn_scheme, 'attempt': attempt, 'start': time.time(), 'error': None}
+                    protocol = None
+                    try:
+                        protocol = pool.acquire(rse_settings, pfn_scheme)
+                        _download_file(protocol, pfn, f, target_dir, ignore_checksum=ignore_checksum)
+                        pool.release(rse_settings, pfn_scheme, protocol)
+                    except Exception as err:
+                        trace['error'] = err
+                        if protocol:
+                            pool.discard(protocol)
+                    trace['end'] = time.time()
+                    if callback:
+                        callback(f, trace)
+                    if trace['error'] is None:
+                        return True
+                    error = trace['error']
+                    if isinstance(error, (exception.RSEProtocolNotSupported, exception.SourceNotFound)):
+                        break
+        return error
+
+    def worker():
+        while True:
+            try:
+                f = queue.get_nowait()
+            except Empty:
+                return
+            results['%s:%s' % (f['scope'], f['name'])] = download_one(f)
+
+    workers = [threading.Thread(target=worker) for _ in xrange(max(1, min(threads, len(files))))]
+    try:
+        for thread in workers:
+            thread.daemon = True
+            thread.start()
+        for thread in workers:
+            while thread.is_alive():
+                thread.join(1)
+    finally:
+        pool.close()
+    return results
+
+
 def exists(rse_settings, files):
     """
         Checks if a file is present at the connected storage.
@@ -324,99 +538,15 @@ def upload(rse_settings, lfns, source_dir=None, force_pfn=None):
     protocol_delete = create_protocol(rse_settings, 'delete')
     protocol_delete.connect()
 
+    pfn = None
     lfns = [lfns] if not type(lfns) is list else lfns
     for lfn in lfns:
-        name = lfn['name']
-        scope = lfn['scope']
-        if 'adler32' not in lfn:
-            gs = False
-            ret['%s:%s' % (scope, name)] = exception.RucioException('Missing checksum for file %s:%s' % (lfn['scope'], lfn['name']))
-            continue
-        if 'filesize' not in lfn:
+        try:
+            pfn = _upload_file(protocol, lfn, source_dir, force_pfn=force_pfn, delete_protocol=lambda: protocol_delete)
+            ret['%s:%s' % (lfn['scope'], lfn['name'])] = True
+        except Exception as e:
             gs = False
-            ret['%s:%s' % (scope, name)] = exception.RucioException('Missing filesize for file %s:%s' % (lfn['scope'], lfn['name']))
-            continue
-
-        if force_pfn:
-            pfn = force_pfn
-        else:
-            pfn = protocol.lfns2pfns(lfn).values()[0]
-
-        # First check if renaming operation is supported
-        if protocol.renaming:
-
-            # Check if file replica is already on the storage system
-            if protocol.overwrite is False and protocol.exists(pfn):
-                ret['%s:%s' % (scope, name)] = exception.FileReplicaAlreadyExists('File %s in scope %s already exists on storage' % (name, scope))
-                gs = False
-            else:
-                if protocol.exists('%s.rucio.upload' % pfn):  # Check for left over of previous unsuccessful attempts
-                    try:
-                        protocol_delete.delete('%s.rucio.upload', protocol_delete.lfns2pfns(lfn).values()[0])
-                    except Exception as e:
-                        ret['%s:%s' % (scope, name)] = exception.RSEOperationNotSupported('Unable to remove temporary file %s.rucio.upload: %s' % (pfn, str(e)))
-                try:  # Try uploading file
-                    protocol.put(name, '%s.rucio.upload' % pfn, source_dir)
-                except Exception as e:
-                    gs = False
-                    ret['%s:%s' % (scope, name)] = e
-                    continue
-
-                valid = None
-                try:  # Get metadata of file to verify if upload was successful
-                    stats = protocol.stat('%s.rucio.upload' % pfn)
-                    if ('adler32' in stats) and ('adler32' in lfn):
-                        valid = stats['adler32'] == lfn['adler32']
-                    if (valid is None) and ('filesize' in stats) and ('filesize' in lfn):
-                        valid = stats['filesize'] == lfn['filesize']
-                except NotImplementedError:
-                    valid = False
-                except Exception as e:
-                    gs = False
-                    ret['%s:%s' % (scope, name)] = e
-                    continue
-
-                if valid:  # The upload finished successful and the file can be renamed
-                    try:
-                        protocol.rename('%s.rucio.upload' % pfn, pfn)
-                        ret['%s:%s' % (scope, name)] = True
-                    except Exception as e:
-                        gs = False
-                        ret['%s:%s' % (scope, name)] = e
-                else:
-                    gs = False
-                    ret['%s:%s' % (scope, name)] = exception.RucioException('Replica %s is corrupted.' % pfn)
-        else:
-
-            # Check if file replica is already on the storage system
-            if protocol.overwrite is False and protocol.exists(pfn):
-                ret['%s:%s' % (scope, name)] = exception.FileReplicaAlreadyExists('File %s in scope %s already exists on storage' % (name, scope))
-                gs = False
-            else:
-                try:  # Try uploading file
-                    protocol.put(name, pfn, source_dir)
-                except Exception as e:
-                    gs = False
-                    ret['%s:%s' % (scope, name)] = e
-                    continue
-
-                valid = None
-                try:  # Get metadata of file to verify if upload was successful
-                    stats = protocol.stat(pfn)
-                    if ('adler32' in stats) and ('adler32' in lfn):
-                        valid = stats['adler32'] == lfn['adler32']
-                    if (valid is None) and ('filesize' in stats) and ('filesize' in lfn):
-                        valid = stats['filesize'] == lfn['filesize']
-                except NotImplementedError:
-                    valid = True  # If the protocol doesn't support stat of a file, we agreed on assuming that the file was uploaded without error
-                except Exception as e:
-                    gs = False
-                    ret['%s:%s' % (scope, name)] = e
-                    continue
-
-                if not valid:
-                    gs = False
-                    ret['%s:%s' % (scope, name)] = exception.RucioException('Replica %s is corrupted.' % pfn)
+            ret['%s:%s' % (lfn['scope'], lfn['name'])] = e
 
     protocol.close()
     protocol_delete.close()
@@ -430,6 +560,129 @@ def upload(rse_settings, lfns, source_dir=None, force_pfn=None):
     return [gs, ret]
 
 
+def _upload_file(protocol, lfn, source_dir=None, force_pfn=None, delete_protocol=None):
+    """
+        Upload a file with a connected write protocol, then verify it.
+
+        If the protocol supports renaming, the file is uploaded with a .rucio.upload suffix
+        and renamed once verified.
+
+        :param protocol:        the connected write protocol.
+        :param lfn:             dict with 'scope', 'name', 'adler32' and 'filesize'.
+        :param source_dir:      path to the local directory including the source file.
+        :param force_pfn:       use the given PFN instead of the one of the protocol.
+        :param delete_protocol: function returning a connected delete protocol, to remove the left over of a previous attempt.
+
+        :returns: the PFN of the uploaded file.
+
+        :raises FileReplicaAlreadyExists: the file is already on the storage and the protocol does not overwrite.
+        :raises RucioException: the checksum or size is missing, or the uploaded file is corrupted.
+    """
+    name = lfn['name']
+    scope = lfn['scope']
+    if 'adler32' not in lfn:
+        raise exception.RucioException('Missing checksum for file %s:%s' % (scope, name))
+    if 'filesize' not in lfn:
+        raise exception.RucioException('Missing filesize for file %s:%s' % (scope, name))
+
+    pfn = force_pfn or protocol.lfns2pfns(lfn).values()[0]
+
+    # Check if file replica is already on the storage system
+    if protocol.overwrite is False and protocol.exists(pfn):
+        raise exception.FileReplicaAlreadyExists('File %s in scope %s already exists on storage' % (name, scope))
+
+    target = '%s.rucio.upload' % pfn if protocol.renaming else pfn
+    if protocol.renaming and delete_protocol is not None and protocol.exists(target):  # Check for left over of previous unsuccessful attempts
+        try:
+            delete_protocol().delete(target)
+        except Exception:
+            pass  # The upload may still overwrite it
+
+    protocol.put(name, target, source_dir)
+
+    valid = None
+    try:  # Get metadata of file to verify if upload was successful
+        stats = protocol.stat(target)
+        if ('adler32' in stats) and ('adler32' in lfn):
+            valid = stats['adler32'] == lfn['adler32']
+        if (valid is None) and ('filesize' in stats) and ('filesize' in lfn):
+            valid = stats['filesize'] == lfn['filesize']
+    except NotImplementedError:
+        # Without renaming, we agreed on assuming that the file was uploaded without error
+        valid = not protocol.renaming
+    if not valid:
+        raise exception.RucioException('Replica %s is corrupted.' % pfn)
+
+    if protocol.renaming:  # The upload finished successful and the file can be renamed
+        protocol.rename(target, pfn)
+    return pfn
+
+
+def upload_files(rse_settings, lfns, source_dir=None, threads=UPLOAD_THREADS, scheme=None, callback=None):
+    """
+        Upload files to a RSE with a pool of worker threads.
+
+        The write protocol connections are reused by the workers, instead of being
+        created for each file.
+
+        :param rse_settings: RSE settings, as returned by get_rse_info.
+        :param lfns:         list of dicts with 'scope', 'name', 'adler32', 'filesize' and optionally 'source_dir',
+                             the directory of the source file.
+        :param source_dir:   default directory of the source files.
+        :param threads:      number of worker threads.
+        :param scheme:       optional scheme of the protocol to use.
+        :param callback:     optional function called from the workers after each file with the lfn and a dict
+                             {'pfn', 'start', 'end', 'error'}.
+
+        :returns: dict with 'scope:name' as keys and the PFN or the exception as values.
+    """
+    pool = _ProtocolPool()
+    results = {}
+    queue = Queue()
+    for lfn in lfns:
+        queue.put(lfn)
+
+    def worker():
+        delete_protocols = []
+
+        def delete_protocol():
+            if not delete_protocols:
+                delete_protocols.append(pool.acquire(rse_settings, None, operation='delete'))
+            return delete_protocols[0]
+
+        while True:
+            try:
+                lfn = queue.get_nowait()
+            except Empty:
+                return
+            trace = {'pfn': None, 'start': time.time(), 'error': None}
+            protocol = None
+            try:
+                protocol = pool.acquire(rse_settings, scheme, operation='write')
+                trace['pfn'] = _upload_file(protocol, lfn, lfn.get('source_dir') or source_dir, delete_protocol=delete_protocol)
+                pool.release(rse_settings, scheme, protocol, operation='write')
+            except Exception as error:
+                trace['error'] = error
+                if protocol:
+                    pool.discard(protocol)
+            trace['end'] = time.time()
+            results['%s:%s' % (lfn['scope'], lfn['name'])] = trace['error'] or trace['pfn']
+            if callback:
+                callback(lfn, trace)
+
+    workers = [threading.Thread(target=worker) for _ in xrange(max(1, min(threads, len(lfns))))]
+    try:
+        for thread in workers:
+            thread.daemon = True
+            thread.start()
+        for thread in workers:
+            while thread.is_alive():
+                thread.join(1)
+    finally:
+        pool.close()
+    return results
+
+
 def delete(rse_settings, lfns):
     """
         Delete a file from the connected storage.
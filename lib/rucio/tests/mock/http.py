@@ -0,0 +1,150 @@
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+'''
+A local HTTP server with range requests and keep-alive connections, to test the WebDAV protocol
+'''
+
+import os
+import re
+import shutil
+import threading
+import urllib
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+BUFFER_SIZE = 1024 * 1024
+
+
+class RangeHTTPRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Serves the files of a directory, with the HEAD, GET, PUT, MKCOL and DELETE methods.
+    The method, path and range of the requests are recorded in the requests list.
+    '''
+    protocol_version = 'HTTP/1.1'
+    root = None
+    requests = None
+
+    def parse_request(self):
+        if not BaseHTTPRequestHandler.parse_request(self):
+            return False
+        self.requests.append((self.command, self.path, self.headers.get('Range')))
+        return True
+
+    def log_message(self, format, *args):
+        pass
+
+    def translate_path(self, path):
+        return os.path.join(self.root, urllib.unquote(path.split('?')[0]).lstrip('/'))
+
+    def send_empty(self, code):
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_content(self, body):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            return self.send_empty(200)
+        if not os.path.isfile(path):
+            return self.send_empty(404)
+        size = os.path.getsize(path)
+        begin, end = 0, size - 1
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if match:
+            begin = int(match.group(1))
+            if begin >= size:
+                return self.send_empty(416)
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (begin, end, size))
+        else:
+            self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - begin + 1))
+        self.end_headers()
+        if body:
+            with open(path, 'rb') as source:
+                source.seek(begin)
+                remaining = end - begin + 1
+                while remaining:
+                    data = source.read(min(BUFFER_SIZE, remaining))
+                    if not data:
+                        # The file was truncated, the client gets an incomplete response
+                        self.close_connection = 1
+                        return
+                    self.wfile.write(data)
+                    remaining -= len(data)
+
+    def do_HEAD(self):
+        self.send_content(body=False)
+
+    def do_GET(self):
+        self.send_content(body=True)
+
+    def do_PUT(self):
+        path = self.translate_path(self.path)
+        remaining = int(self.headers['Content-Length'])
+        if os.path.exists(path):
+            self.rfile.read(remaining)
+            return self.send_empty(409)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as target:
+            while remaining:
+                data = self.rfile.read(min(BUFFER_SIZE, remaining))
+                target.write(data)
+                remaining -= len(data)
+        self.send_empty(201)
+
+    def do_MKCOL(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            return self.send_empty(405)
+        os.makedirs(path)
+        self.send_empty(201)
+
+    def do_DELETE(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.isfile(path):
+            os.unlink(path)
+        else:
+            return self.send_empty(404)
+        self.send_empty(204)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The clients close the connections of the responses they do not read completely
+        pass
+
+
+def start_http_server(root):
+    '''
+    Serve a directory on a free port of localhost, from a background thread.
+
+    :param root: The directory.
+    :returns: The server, whose server_port attribute is the port and requests attribute the list of
+              the requests received. It is stopped with shutdown().
+    '''
+    requests = []
+
+    class RootedRangeHTTPRequestHandler(RangeHTTPRequestHandler):
+        pass
+    RootedRangeHTTPRequestHandler.root = root
+    RootedRangeHTTPRequestHandler.requests = requests
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RootedRangeHTTPRequestHandler)
+    server.requests = requests
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
@@ -20,7 +20,8 @@ from rucio.rse import rsemanager as mgr
 
 
 class MgrTestCases():
-    files_local = ["1_rse_local_put.raw", "2_rse_local_put.raw", "3_rse_local_put.raw", "4_rse_local_put.raw"]
+    files_local = ["1_rse_local_put.raw", "2_rse_local_put.raw", "3_rse_local_put.raw", "4_rse_local_put.raw",
+                   "5_rse_local_put.raw", "6_rse_local_put.raw"]
     files_remote = ['1_rse_remote_get.raw', '2_rse_remote_get.raw', '3_rse_remote_get.raw', '4_rse_remote_get.raw',
                     '1_rse_remote_delete.raw', '2_rse_remote_delete.raw', '3_rse_remote_delete.raw', '4_rse_remote_delete.raw',
                     '1_rse_remote_exists.raw', '2_rse_remote_exists.raw',
@@ -129,6 +130,22 @@ class MgrTestCases():
         """(RSE/PROTOCOLS): Put a single file to storage (SourceNotFound)"""
         mgr.upload(self.rse_settings, {'name': 'not_existing_data2.raw', 'scope': 'user.%s' % self.user, 'adler32': 'random_stuff', 'filesize': 0}, self.tmpdir)
 
+    def test_put_mgr_upload_files(self):
+        """(RSE/PROTOCOLS): Put multiple files to storage with concurrent workers (Success and FileReplicaAlreadyExists)"""
+        transfers = []
+        lfns = [{'name': name, 'scope': 'user.%s' % self.user,
+                 'adler32': adler32('%s/%s' % (self.tmpdir, name)), 'filesize': os.stat('%s/%s' % (self.tmpdir, name))[os.path.stat.ST_SIZE]}
+                for name in ('5_rse_local_put.raw', '6_rse_local_put.raw')]
+        lfns.append({'name': '4_rse_remote_get.raw', 'scope': 'user.%s' % self.user, 'adler32': 'bla-bla', 'filesize': 4711})
+        details = mgr.upload_files(self.rse_settings, lfns, self.tmpdir, threads=2, callback=lambda lfn, transfer: transfers.append(transfer))
+        if len(transfers) != 3 or not isinstance(details['user.%s:4_rse_remote_get.raw' % self.user], Exception):
+            raise Exception('Return not as expected: %s, %s' % (transfers, details))
+        for name in ('5_rse_local_put.raw', '6_rse_local_put.raw'):
+            pfn = details['user.%s:%s' % (self.user, name)]
+            if isinstance(pfn, Exception) or not mgr.exists(self.rse_settings, {'name': pfn}):
+                raise Exception('Return not as expected: %s' % details)
+        raise details['user.%s:4_rse_remote_get.raw' % self.user]
+
     def test_put_mgr_FileReplicaAlreadyExists_multi(self):
         """(RSE/PROTOCOLS): Put multiple files to storage (FileReplicaAlreadyExists)"""
         status, details = mgr.upload(self.rse_settings, [{'name': '1_rse_remote_get.raw', 'scope': 'user.%s' % self.user, 'adler32': "bla-bla", 'filesize': 4711},
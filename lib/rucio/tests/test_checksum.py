@@ -0,0 +1,111 @@
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#              http://www.apache.org/licenses/LICENSE-2.0
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import zlib
+
+from nose.tools import eq_, raises
+
+from rucio.common.checksum import Checksummer, checksum_during, checksum_files, file_checksums, is_supported
+from rucio.common.exception import RucioException
+from rucio.common.utils import adler32
+
+
+def reference(data):
+    """ The checksums computed with zlib and hashlib in one call """
+    return {'adler32': '%08x' % (zlib.adler32(data) & 0xffffffff), 'md5': hashlib.md5(data).hexdigest()}
+
+
+class TestChecksum(object):
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = os.urandom(100000) + '\n' * 1000 + os.urandom(1000)
+        self.path = os.path.join(self.tmpdir, 'data.raw')
+        with open(self.path, 'wb') as out:
+            out.write(self.data)
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_file_checksums(self):
+        """ CHECKSUM (COMMON): The checksums of a file do not depend on the buffer size """
+        for buffer_size in (1, 4096, 65536, len(self.data), 1024 * 1024):
+            eq_(file_checksums(self.path, buffer_size=buffer_size), reference(self.data))
+        eq_(adler32(self.path), reference(self.data)['adler32'])
+        eq_(file_checksums(self.path, algorithms=('sha256',)), {'sha256': hashlib.sha256(self.data).hexdigest()})
+
+        empty = os.path.join(self.tmpdir, 'empty.raw')
+        open(empty, 'wb').close()
+        eq_(file_checksums(empty), reference(''))
+
+    def test_checksummer(self):
+        """ CHECKSUM (COMMON): The checksums of data added in parts, with a size limit for the files """
+        checksummer = Checksummer()
+        checksummer.update(self.data[:10])
+        with open(self.path, 'rb') as fileobj:
+            fileobj.seek(10)
+            eq_(checksummer.update_from(fileobj, size=50000, buffer_size=4096), 50000)
+            checksummer.update(fileobj.read())
+        eq_(checksummer.bytes, len(self.data))
+        eq_(checksummer.hexdigests(), reference(self.data))
+
+    @raises(RucioException)
+    def test_unsupported_algorithm(self):
+        """ CHECKSUM (COMMON): An unknown algorithm is refused """
+        eq_(is_supported('adler32'), True)
+        eq_(is_supported('unknown'), False)
+        Checksummer(['unknown'])
+
+    def test_checksum_files(self):
+        """ CHECKSUM (COMMON): Many files are checksummed in parallel, a missing file does not stop the others """
+        paths = []
+        for index in xrange(5):
+            paths.append(os.path.join(self.tmpdir, 'file_%s' % index))
+            with open(paths[-1], 'wb') as out:
+                out.write(self.data[index:])
+        missing = os.path.join(self.tmpdir, 'missing')
+        for processes in (1, 3):
+            checksums = checksum_files(paths + [missing], processes=processes)
+            for index, path in enumerate(paths):
+                eq_(checksums[path], reference(self.data[index:]))
+            eq_(isinstance(checksums[missing], RucioException), True)
+
+    def test_checksum_during(self):
+        """ CHECKSUM (COMMON): A file is checksummed while it is written """
+        path = os.path.join(self.tmpdir, 'written.raw')
+
+        def write():
+            with open(path, 'wb') as out:
+                for index in xrange(0, len(self.data), 10000):
+                    out.write(self.data[index:index + 10000])
+                    out.flush()
+                    time.sleep(0.01)
+        eq_(checksum_during(path, write, poll_interval=0.001), reference(self.data))
+
+        # Written out of order, the checksums are computed again from the file when they do not match
+        def write_backwards():
+            with open(path, 'wb') as out:
+                out.seek(50000)
+                out.write(self.data[50000:])
+                out.flush()
+                time.sleep(0.05)
+                out.seek(0)
+                out.write(self.data[:50000])
+        os.unlink(path)
+        eq_(checksum_during(path, write_backwards, expected=reference(self.data), poll_interval=0.001), reference(self.data))
+
+    @raises(IOError)
+    def test_checksum_during_error(self):
+        """ CHECKSUM (COMMON): The error of the write is raised """
+        def write():
+            raise IOError('transfer failed')
+        checksum_during(os.path.join(self.tmpdir, 'failed.raw'), write)
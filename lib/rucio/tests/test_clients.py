@@ -12,15 +12,17 @@
  - Cedric Serfon, <cedric.serfon@cern.ch>, 2017
 '''
 
-from os import remove
+from os import makedirs, path, remove
+from threading import Lock
+from time import sleep
 
-from nose.tools import raises
+from nose.tools import assert_equal, assert_raises, raises
 
 from rucio.client.baseclient import BaseClient
 from rucio.client.client import Client
 from rucio.common.config import config_get
 from rucio.common.utils import get_tmp_dir
-from rucio.common.exception import CannotAuthenticate, ClientProtocolNotSupported
+from rucio.common.exception import CannotAuthenticate, ClientProtocolNotSupported, DataIdentifierNotFound
 
 
 class TestBaseClient(object):
@@ -73,6 +75,91 @@ class TestBaseClient(object):
         BaseClient(rucio_host='localhost', auth_host='junk://localhost', account='root', auth_type='userpass', creds=creds)
 
 
+class FakeResponse(object):
+    """ HTTP response of FakeSession """
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession(object):
+    """ Session answering 401 to the requests without the current token, and the given status codes to the others """
+
+    def __init__(self, client, status_codes=()):
+        self.client = client
+        self.status_codes = list(status_codes)
+        self.responses = []
+        self.lock = Lock()
+
+    def get(self, url, headers, **kwargs):
+        if headers['X-Rucio-Auth-Token'] != self.client.token:
+            response = FakeResponse(401)
+        else:
+            with self.lock:
+                response = FakeResponse(self.status_codes.pop(0) if self.status_codes else 200)
+        with self.lock:
+            self.responses.append(response)
+        return response
+
+
+class TestConcurrentBaseClient(object):
+    """ To test the concurrent requests of the clients, without server """
+
+    def setup(self):
+        '''
+        setup
+        '''
+        token_path = get_tmp_dir() + '/.rucio_concurrent'
+        if not path.isdir(token_path):
+            makedirs(token_path)
+        with open(token_path + '/auth_token_concurrent', 'w') as token_file:
+            token_file.write('expired')
+        self.client = BaseClient(account='concurrent', auth_type='userpass', creds={'username': 'ddmlab', 'password': 'secret'})
+        self.client.token = None
+        self.client.session = FakeSession(self.client)
+        self.client.RETRY_BACKOFF = 0
+        self.tokens = []
+
+        def get_token():
+            sleep(0.1)
+            self.tokens.append(1)
+            self.client.token = self.client.auth_token = 'token%s' % len(self.tokens)
+        self.client._BaseClient__get_token = get_token
+
+    def test_execute_concurrently(self):
+        """ CLIENTS (BASECLIENT): Execute calls concurrently and keep their order """
+        assert_equal(self.client.execute_concurrently(lambda item: item * 2, xrange(20), max_workers=5), [item * 2 for item in xrange(20)])
+
+        def fail(item):
+            if item % 7 == 3:
+                raise DataIdentifierNotFound(item)
+            return item
+        with assert_raises(DataIdentifierNotFound) as context:
+            self.client.execute_concurrently(fail, xrange(20), max_workers=5)
+        assert_equal(context.exception.args[0], (3,))
+
+    def test_token_refreshed_once(self):
+        """ CLIENTS (BASECLIENT): Refresh the token once for concurrent unauthorized requests """
+        results = self.client.execute_concurrently(lambda item: self.client._send_request('https://localhost/ping').status_code, xrange(10), max_workers=10)
+        assert_equal(results, [200] * 10)
+        assert_equal(len(self.tokens), 1)
+
+    def test_retry_server_errors(self):
+        """ CLIENTS (BASECLIENT): Retry GET requests after server errors """
+        self.client.token = self.client.auth_token
+        self.client.session.status_codes = [503, 502]
+        assert_equal(self.client._send_request('https://localhost/ping').status_code, 200)
+        assert_equal([response.closed for response in self.client.session.responses], [True, True, False])
+        self.client.session.status_codes = [503] * 10
+        assert_equal(self.client._send_request('https://localhost/ping').status_code, 503)
+        assert_equal(len(self.client.session.status_codes), 10 - self.client.request_retries - 1)
+
+
 class TestRucioClients(object):
     """ To test Clients"""
 
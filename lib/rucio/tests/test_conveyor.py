@@ -10,8 +10,11 @@
   - Wen Guan, <wen.guan@cern.ch>, 2015
 '''
 
+import threading
 import time
 
+from nose.tools import assert_greater
+
 from rucio.daemons.mock.conveyorinjector import request_transfer
 from rucio.daemons.conveyor import submitter, poller, finisher, throttler
 
@@ -31,3 +34,47 @@ class TestConveyorSubmitter:
         time.sleep(5)
         poller.run(once=True)
         finisher.run(once=True)
+
+    def test_conveyor_pipelined_submitter(self):
+        """ CONVEYOR (DAEMON): Test the conveyor submitter daemon in pipeline mode."""
+        src = 'ATLASSCRATCHDISK://ccsrm.in2p3.fr:8443/srm/managerv2?SFN=/pnfs/in2p3.fr/data/atlas/atlasscratchdisk/rucio/'
+        dest = 'ATLASSCRATCHDISK://dcache-se-atlas.desy.de:8443/srm/managerv2?SFN=/pnfs/desy.de/atlas/dq2/atlasscratchdisk/rucio/'
+        request_transfer(loop=10, src=src, dst=dest, upload=False, same_src=True, same_dst=True)
+
+        throttler.run(once=True)
+        submitter.run(once=True, pipeline=True, queue_size=2)
+        time.sleep(5)
+        poller.run(once=True)
+        finisher.run(once=True)
+
+    def test_pipelined_submitter_in_flight(self):
+        """ CONVEYOR (DAEMON): Test the pipelined submitter does not back off when the fetched requests are still in flight."""
+        fetches = []
+        grouping = threading.Event()
+
+        def get_transfers(**kwargs):
+            fetches.append(time.time())
+            return dict(('request_%s' % i, {}) for i in xrange(5))
+
+        def group_transfer(transfers, *args):
+            # Keep the first batch in the pipeline
+            grouping.wait(10)
+            return {}
+
+        get_transfers_orig, group_transfer_orig = getattr(submitter, '__get_transfers'), submitter.bulk_group_transfer
+        setattr(submitter, '__get_transfers', get_transfers)
+        submitter.bulk_group_transfer = group_transfer
+        thread = threading.Thread(target=submitter.pipelined_submitter, kwargs={'bulk': 5, 'group_bulk': 2, 'sleep_time': 600})
+        try:
+            thread.start()
+            time.sleep(4)
+        finally:
+            submitter.graceful_stop.set()
+            grouping.set()
+            thread.join(10)
+            submitter.graceful_stop.clear()
+            setattr(submitter, '__get_transfers', get_transfers_orig)
+            submitter.bulk_group_transfer = group_transfer_orig
+
+        # Every fetch after the first one returns only requests in flight
+        assert_greater(len(fetches), 2)
@@ -9,12 +9,15 @@
 # - Vincent Garonne, <vincent.garonne@cern.ch>, 2013
 # - Martin Barisits, <martin.barisits@cern.ch>, 2014
 
-from nose.tools import assert_equal
+from nose.tools import assert_equal, assert_true
 
+from rucio.common.exception import DatabaseException
 from rucio.core import account_counter, rse_counter
 from rucio.core.rse import get_rse
+from rucio.daemons.abacus import account as abacus_account
 from rucio.daemons.abacus.rse import rse_update
 from rucio.daemons.abacus.account import account_update
+from rucio.tests.common import stubbed
 
 
 class TestCoreRSECounter():
@@ -116,3 +119,44 @@ class TestCoreAccountCounter():
             cnt = account_counter.get_counter(rse_id=rse_id, account=account)
             del cnt['updated_at']
             assert_equal(cnt, {'files': count, 'bytes': sum})
+
+    def test_update_counters_in_batches(self):
+        """ACCOUNT COUNTER (CORE): Apply the pending updates in batches and report the backlog """
+        account_update(once=True)
+        rse_id = get_rse('MOCK').id
+        account = 'jdoe'
+        before = account_counter.get_counter(rse_id=rse_id, account=account)
+        assert_equal(account_counter.get_updated_account_counters_lag(total_workers=0, worker_number=0), {'rows': 0, 'oldest': None})
+
+        for i in xrange(5):
+            account_counter.increase(rse_id=rse_id, account=account, files=2, bytes=10)
+        account_counter.decrease(rse_id=rse_id, account=account, files=1, bytes=5)
+        lag = account_counter.get_updated_account_counters_lag(total_workers=0, worker_number=0)
+        assert_equal(lag['rows'], 6)
+        assert_true(lag['oldest'] is not None)
+
+        assert_equal(account_counter.update_account_counters(total_workers=0, worker_number=0, limit=4), 4)
+        assert_equal(account_counter.get_updated_account_counters_lag(total_workers=0, worker_number=0)['rows'], 2)
+        assert_equal(account_counter.update_account_counters(total_workers=0, worker_number=0, limit=4), 2)
+        assert_equal(account_counter.update_account_counters(total_workers=0, worker_number=0, limit=4), 0)
+
+        cnt = account_counter.get_counter(rse_id=rse_id, account=account)
+        assert_equal(cnt['files'], before['files'] + 9)
+        assert_equal(cnt['bytes'], before['bytes'] + 45)
+
+    def test_update_counters_without_lag_report(self):
+        """ACCOUNT COUNTER (CORE): Apply the pending updates when the backlog cannot be reported """
+        def report_lag(total_workers, worker_number):
+            raise DatabaseException('lag query failed')
+
+        account_update(once=True)
+        rse_id = get_rse('MOCK').id
+        account = 'jdoe'
+        before = account_counter.get_counter(rse_id=rse_id, account=account)
+
+        account_counter.increase(rse_id=rse_id, account=account, files=1, bytes=10)
+        with stubbed(abacus_account.report_lag, report_lag):
+            account_update(once=True)
+        cnt = account_counter.get_counter(rse_id=rse_id, account=account)
+        assert_equal(cnt['files'], before['files'] + 1)
+        assert_equal(cnt['bytes'], before['bytes'] + 10)
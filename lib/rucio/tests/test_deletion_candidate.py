@@ -0,0 +1,99 @@
+'''
+  Copyright European Organization for Nuclear Research (CERN)
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  You may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+  http://www.apache.org/licenses/LICENSE-2.0
+'''
+import time
+
+from datetime import datetime, timedelta
+
+from nose.tools import assert_equal, assert_in, assert_not_in
+
+from rucio.common.utils import generate_uuid
+from rucio.core import replica as replica_core
+from rucio.core.deletion_candidate import (add_deletion_candidates, claim_deletion_candidates,
+                                           prune_deletion_candidates)
+from rucio.core.rse import add_rse, get_rse_id
+from rucio.db.sqla import models
+from rucio.db.sqla.session import transactional_session
+
+
+@transactional_session
+def set_tombstone(rse_id, scope, name, tombstone, session=None):
+    session.query(models.RSEFileAssociation).filter_by(rse_id=rse_id, scope=scope, name=name).\
+        update({'tombstone': tombstone}, synchronize_session=False)
+
+
+class TestDeletionCandidates():
+
+    def setup(self):
+        self.rse = 'MOCK_' + generate_uuid()[:8].upper()
+        add_rse(self.rse)
+        self.rse_id = get_rse_id(self.rse)
+        self.scope = 'mock'
+        now = datetime.utcnow()
+        self.names = ['lfn' + generate_uuid() for i in xrange(6)]
+        for i, name in enumerate(self.names):
+            replica_core.add_replica(rse=self.rse, scope=self.scope, name=name, bytes=10, account='root',
+                                     tombstone=now - timedelta(days=len(self.names) - i))
+
+    def test_claim_by_tombstone_and_bytes(self):
+        """ DELETION CANDIDATES (CORE): Claim the oldest candidates up to the needed space """
+        assert_equal(add_deletion_candidates(rse_id=self.rse_id), 6)
+        assert_equal(add_deletion_candidates(rse_id=self.rse_id), 0)
+
+        replicas = claim_deletion_candidates(rse_id=self.rse_id, limit=10, bytes=25, delay_seconds=600)
+        assert_equal([replica['name'] for replica in replicas], self.names[:2])
+        replicas = claim_deletion_candidates(rse_id=self.rse_id, limit=3, delay_seconds=600)
+        assert_equal([replica['name'] for replica in replicas], self.names[2:5])
+        replicas = claim_deletion_candidates(rse_id=self.rse_id, limit=10, delay_seconds=600)
+        assert_equal([replica['name'] for replica in replicas], self.names[5:])
+        assert_equal(claim_deletion_candidates(rse_id=self.rse_id, limit=10, delay_seconds=600), [])
+
+    def test_claimed_until_deleted(self):
+        """ DELETION CANDIDATES (CORE): The claimed candidates are claimed again after the delay until their replica is deleted """
+        add_deletion_candidates(rse_id=self.rse_id)
+        replicas = claim_deletion_candidates(rse_id=self.rse_id, limit=2, delay_seconds=600)
+        assert_equal([replica['name'] for replica in replicas], self.names[:2])
+        # The deletion of the first one succeeded, the one of the second failed
+        replica_core.delete_replicas(rse=self.rse, files=[{'scope': self.scope, 'name': self.names[0]}])
+
+        replicas = claim_deletion_candidates(rse_id=self.rse_id, limit=10, delay_seconds=600)
+        assert_equal([replica['name'] for replica in replicas], self.names[2:])
+        replicas = claim_deletion_candidates(rse_id=self.rse_id, limit=10, delay_seconds=0)
+        assert_equal([replica['name'] for replica in replicas], self.names[1:])
+
+    def test_incremental_and_prune(self):
+        """ DELETION CANDIDATES (CORE): Queue the new tombstones and prune the changed ones """
+        since = datetime.utcnow()
+        assert_equal(add_deletion_candidates(rse_id=self.rse_id, since=since), 0)
+
+        # As when the last lock of a replica is removed, the tombstone is in the past
+        set_tombstone(self.rse_id, self.scope, self.names[0], datetime.utcnow() - timedelta(days=30))
+        assert_equal(add_deletion_candidates(rse_id=self.rse_id, since=since), 1)
+        assert_equal(add_deletion_candidates(rse_id=self.rse_id), 5)
+
+        # A replica which is protected again is removed from the queue
+        set_tombstone(self.rse_id, self.scope, self.names[1], None)
+        assert_equal(prune_deletion_candidates(rse_id=self.rse_id), 1)
+
+        # The candidates are checked when they are claimed
+        set_tombstone(self.rse_id, self.scope, self.names[2], datetime.utcnow() + timedelta(days=1))
+        names = [replica['name'] for replica in claim_deletion_candidates(rse_id=self.rse_id, limit=10, delay_seconds=600)]
+        assert_not_in(self.names[1], names)
+        assert_not_in(self.names[2], names)
+        assert_in(self.names[0], names)
+        assert_equal(len(names), 4)
+        assert_equal(claim_deletion_candidates(rse_id=self.rse_id, limit=10, delay_seconds=600), [])
+
+    def test_incremental_expired_tombstone(self):
+        """ DELETION CANDIDATES (CORE): Queue the tombstones which expired between two passes """
+        set_tombstone(self.rse_id, self.scope, self.names[0], datetime.utcnow() + timedelta(seconds=2))
+        since = datetime.utcnow()
+        assert_equal(add_deletion_candidates(rse_id=self.rse_id, since=since), 0)
+
+        time.sleep(3)
+        assert_equal(add_deletion_candidates(rse_id=self.rse_id, since=since), 1)
@@ -47,6 +47,42 @@ class TestDIDCore:
         for d in list_dids(scope='data13_hip', filters={'name': '*'}, type='collection'):
             print d
 
+    def test_list_dids_pagination(self):
+        """ DATA IDENTIFIERS (CORE): List dids with marker, offset and name range """
+        tmp_scope = 'mock'
+        prefix = 'dsn_%s_' % generate_uuid()
+        names = ['%s%s' % (prefix, i) for i in xrange(10)]
+        for name in names:
+            add_did(scope=tmp_scope, name=name, type='DATASET', account='root')
+        filters = {'name': prefix + '*'}
+
+        dids = [d for d in list_dids(scope=tmp_scope, filters=filters, type='dataset', offset=2, limit=3)]
+        assert_equal(dids, names[2:5])
+        dids = [d for d in list_dids(scope=tmp_scope, filters=filters, type='dataset', marker=names[4])]
+        assert_equal(dids, names[5:])
+        dids = [d for d in list_dids(scope=tmp_scope, filters=filters, type='dataset', name_range=(names[3], names[7]))]
+        assert_equal(dids, names[3:7])
+        dids = [d for d in list_dids(scope=tmp_scope, filters=filters, type='dataset', name_range=(None, names[2]))]
+        assert_equal(dids, names[:2])
+
+    def test_list_dids_limit_marker(self):
+        """ DATA IDENTIFIERS (CORE): Page through dids with limit and marker """
+        tmp_scope = 'mock'
+        prefix = 'dsn_%s_' % generate_uuid()
+        names = ['%s%s' % (prefix, i) for i in xrange(10)]
+        for name in reversed(names):
+            add_did(scope=tmp_scope, name=name, type='DATASET', account='root')
+        filters = {'name': prefix + '*'}
+
+        dids, marker = [], None
+        while True:
+            page = [d for d in list_dids(scope=tmp_scope, filters=filters, type='dataset', limit=3, marker=marker)]
+            if not page:
+                break
+            dids.extend(page)
+            marker = page[-1]
+        assert_equal(dids, names)
+
     def test_delete_dids(self):
         """ DATA IDENTIFIERS (CORE): Delete dids """
         tmp_scope = 'mock'
@@ -21,9 +21,11 @@ from nose.tools import eq_
 from nose.tools import ok_
 
 from rucio.common import dumper
+from rucio.common.dumper import data_models
 from rucio.common.dumper.consistency import Consistency
 from rucio.common.dumper.consistency import _try_to_advance
 from rucio.common.dumper.consistency import compare3
+from rucio.common.dumper.consistency import external_sort
 from rucio.common.dumper.consistency import gnu_sort
 from rucio.common.dumper.consistency import min3
 from rucio.common.dumper.consistency import parse_and_filter_file
@@ -161,6 +163,32 @@ class TestConsistency(object):
         eq_(consistency[0].apparent_status, 'DARK')
         eq_(consistency[0].path, 'user/someuser/aa/bb/user.someuser.filename2')
 
+    def test_consistency_manual_uses_index_of_unsorted_rucio_dumps(self):
+        ''' DUMPER '''
+        rucio_dump = 'MOCK_SCRATCHDISK\tuser.someuser\tuser.someuser.filename2\t19028d77\t189468\t2015-09-20 21:22:04\tuser/someuser/aa/bb/user.someuser.filename2\t2015-09-20 21:22:17\tA\n'
+        rucio_dump += 'MOCK_SCRATCHDISK\tuser.someuser\tuser.someuser.filename\t19028d77\t189468\t2015-09-20 21:22:04\tuser/someuser/aa/bb/user.someuser.filename\t2015-09-20 21:22:17\tA\n'
+        storage_dump = 'user/someuser/aa/bb/user.someuser.filename\n'
+
+        rrdf1 = make_temp_file(self.tmp_dir, rucio_dump)
+        rrdf2 = make_temp_file(self.tmp_dir, rucio_dump)
+        sdf = make_temp_file(self.tmp_dir, storage_dump)
+        data_models.Replica.build_index(rrdf1, cache_dir=self.tmp_dir)
+        data_models.Replica.build_index(rrdf2, cache_dir=self.tmp_dir)
+
+        with stubbed(dumper.agis_endpoints_data, self.fake_agis_data):
+            consistency = Consistency.dump(
+                'consistency-manual',
+                'MOCK_SCRATCHDISK',
+                sdf,
+                prev_date_fname=rrdf1,
+                next_date_fname=rrdf2,
+                cache_dir=self.tmp_dir,
+            )
+            consistency = list(consistency)
+        eq_(len(consistency), 1)
+        eq_(consistency[0].apparent_status, 'LOST')
+        eq_(consistency[0].path, 'user/someuser/aa/bb/user.someuser.filename2')
+
     def test_consistency_manual_multiple_slashes_in_storage_dump_do_not_generate_false_positive(self):
         ''' DUMPER '''
         rucio_dump = 'MOCK_SCRATCHDISK\tuser.someuser\tuser.someuser.filename\t19028d77\t189468\t2015-09-20 21:22:04\tuser/someuser/aa/bb/user.someuser.filename\t2015-09-20 21:22:17\tA\n'
@@ -417,3 +445,25 @@ class TestConsistency(object):
 
         os.unlink(path)
         os.unlink(sorted_file)
+
+    def test_external_sort_in_memory(self):
+        ''' DUMPER '''
+        eq_(list(external_sort(['z', 'a', '\xc3\xb1'], cache_dir=self.tmp_dir)), ['a', 'z', '\xc3\xb1'])
+        eq_(os.listdir(self.tmp_dir), [])
+
+    def test_external_sort_merges_runs(self):
+        ''' DUMPER '''
+        data = ['path%d,%s' % (i * 7919 % 1000, 'AU'[i % 2]) for i in xrange(1000)]
+        for compress in (False, True):
+            sorted_data = external_sort(iter(data), buffer_size=1000, compress=compress, cache_dir=self.tmp_dir)
+            eq_(sorted_data.next(), min(data))
+            ok_(len(os.listdir(self.tmp_dir)) > 1)
+            eq_([min(data)] + list(sorted_data), sorted(data))
+            eq_(os.listdir(self.tmp_dir), [])
+
+        def key(line):
+            return line.split(',')[1]
+
+        sorted_data = list(external_sort(data, key=key, buffer_size=1000, cache_dir=self.tmp_dir))
+        eq_([key(line) for line in sorted_data], sorted([key(line) for line in data]))
+        eq_(sorted(sorted_data), sorted(data))
@@ -0,0 +1,88 @@
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_
+from nose.tools import ok_
+from nose.tools import assert_raises
+
+from rucio.common.dumper import data_models
+from rucio.common.dumper.dump_index import DumpIndex
+from rucio.common.dumper.dump_index import INDEX_SUFFIX
+from rucio.common.dumper.dump_index import InvalidDumpIndex
+from rucio.common.dumper.dump_index import build_index
+from rucio.tests.common import make_temp_file
+from rucio.tests.common import stubbed
+
+
+class TestDumpIndex(object):
+    REPLICA_DUMP = '''\
+CERN-PROD_DATADISK	data12_8TeV	ESD.04972924._000218.pool.root.1	a6152bbc	2498690922	2015-03-10 14:00:24	/data12_8TeV/7a/a6/ESD.04972924._000218.pool.root.1	2015-03-10 14:00:35	A
+CERN-PROD_DATADISK	data12_8TeV	AOD.04972924._000218.pool.root.1	1045a406	127508132	2015-03-10 14:00:24	data12_8TeV/5b/ea/AOD.04972924._000218.pool.root.1	2015-03-15 08:33:09	U
+'''
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_lookup_and_range_scans(self):
+        ''' DUMPER (DUMP INDEX): Look up keys and scan ranges of an index '''
+        records = [('path%04d' % (i * 7919 % 3000), 'value\t%d' % i) for i in xrange(3000)]
+        path = build_index(os.path.join(self.tmp_dir, 'test.idx'), records, block_size=1024, sort_buffer_size=10000, cache_dir=self.tmp_dir)
+
+        with DumpIndex(path) as index:
+            eq_(len(index), 3000)
+            eq_(list(index), sorted(records))
+            for key, value in records[::97]:
+                eq_(index.get(key), value)
+                ok_(key in index)
+            ok_('path' not in index)
+            ok_('path9999' not in index)
+            eq_(index.get('path3000', 'missing'), 'missing')
+            eq_(list(index.range('path0998', 'path1003')), [record for record in sorted(records) if 'path0998' <= record[0] < 'path1003'])
+            eq_([key for key, _ in index.prefix('path250')], ['path250%d' % i for i in xrange(10)])
+            eq_(list(index.range('path2999')), [record for record in records if record[0] == 'path2999'])
+
+    def test_empty_and_invalid_index(self):
+        ''' DUMPER (DUMP INDEX): Open an empty index and reject other files '''
+        path = build_index(os.path.join(self.tmp_dir, 'empty.idx'), [], presorted=True)
+        with DumpIndex(path) as index:
+            eq_(len(index), 0)
+            eq_(list(index), [])
+            eq_(index.get('path'), None)
+
+        assert_raises(InvalidDumpIndex, DumpIndex, make_temp_file(self.tmp_dir, 'not an index\n'))
+
+    def test_replica_dump_index(self):
+        ''' DUMPER (DUMP INDEX): Index a replica dump by path '''
+        dump = make_temp_file(self.tmp_dir, self.REPLICA_DUMP)
+        index_path = data_models.Replica.build_index(dump, cache_dir=self.tmp_dir)
+        eq_(index_path, dump + INDEX_SUFFIX)
+
+        with DumpIndex(index_path) as index:
+            eq_([key for key, _ in index], ['data12_8TeV/5b/ea/AOD.04972924._000218.pool.root.1',
+                                            'data12_8TeV/7a/a6/ESD.04972924._000218.pool.root.1'])
+            replicas = list(data_models.Replica.each_indexed(index, prefix='data12_8TeV/7a/'))
+            eq_(len(replicas), 1)
+            eq_(replicas[0].name, 'ESD.04972924._000218.pool.root.1')
+            eq_(replicas[0].state, 'A')
+
+    def test_replica_dump_prefix(self):
+        ''' DUMPER (DUMP INDEX): Dump the replicas of a prefix and close the index '''
+        dump = make_temp_file(self.tmp_dir, self.REPLICA_DUMP)
+        data_models.Replica.build_index(dump, cache_dir=self.tmp_dir)
+        closed = []
+
+        with stubbed(data_models.Replica.download, lambda *args, **kwargs: dump):
+            with stubbed(DumpIndex.close, lambda index: closed.append(index.path)):
+                replicas = data_models.Replica.dump('CERN-PROD_DATADISK', prefix='data12_8TeV/5b/')
+                eq_([replica.name for replica in replicas], ['AOD.04972924._000218.pool.root.1'])
+        eq_(closed, [dump + INDEX_SUFFIX])
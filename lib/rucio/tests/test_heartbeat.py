@@ -13,7 +13,7 @@ import threading
 
 from nose.tools import assert_equal
 
-from rucio.core.heartbeat import live, die, cardiac_arrest
+from rucio.core.heartbeat import live, live_ring, die, cardiac_arrest, HashRing
 
 
 class TestHeartbeat:
@@ -70,5 +70,33 @@ class TestHeartbeat:
         die('test0', 'host2', pids[2], threads[2])
         assert_equal(live('test0', 'host3', pids[3], threads[3]), {'assign_thread': 1, 'nr_threads': 2})
 
+    def test_heartbeat_ring(self):
+        """ HEARTBEAT (CORE): Consistent hashing assignment """
+
+        pids = [self.__pid() for _ in xrange(4)]
+        threads = [self.__thread() for _ in xrange(4)]
+        keys = ['key_%s' % i for i in xrange(1000)]
+        for i in xrange(3):
+            live_ring('test0', 'host%s' % i, pids[i], threads[i])
+        rings = [live_ring('test0', 'host%s' % i, pids[i], threads[i]) for i in xrange(3)]
+        assert_equal([len(ring) for ring in rings], [3, 3, 3])
+        # every key is owned by exactly one thread
+        for key in keys:
+            assert_equal(len([ring for ring in rings if ring.is_assigned(key)]), 1)
+
+        # a new thread only takes keys over, the others keep their keys
+        owners = dict((key, rings[0].get_member(key)) for key in keys)
+        ring = live_ring('test0', 'host3', pids[3], threads[3])
+        assert_equal(len(ring), 4)
+        moved = [key for key in keys if ring.get_member(key) != owners[key]]
+        assert_equal(all(ring.is_assigned(key) for key in moved), True)
+        assert_equal(0 < len(moved) < len(keys) / 2, True)
+
+        # the ring is cached until the membership changes
+        assert_equal(live_ring('test0', 'host3', pids[3], threads[3]) is ring, True)
+        die('test0', 'host0', pids[0], threads[0])
+        assert_equal(len(live_ring('test0', 'host3', pids[3], threads[3])), 3)
+        assert_equal(HashRing([]).get_member('key'), None)
+
     def tearDown(self):
         cardiac_arrest()
@@ -12,10 +12,10 @@
 from rucio.common.utils import generate_uuid as uuid
 from rucio.core.account_counter import get_counter
 from rucio.core.account_limit import set_account_limit
-from rucio.core.did import add_did, attach_dids, detach_dids
+from rucio.core.did import add_did, attach_dids, detach_dids, get_did
 from rucio.core.lock import get_replica_locks, get_dataset_locks
 from rucio.core.rse import add_rse_attribute, get_rse
-from rucio.core.rule import add_rule, get_rule
+from rucio.core.rule import add_rule, get_rule, get_updated_dids
 from rucio.daemons.judge.evaluator import re_evaluator
 from rucio.daemons.abacus.account import account_update
 from rucio.db.sqla.constants import DIDType
@@ -85,6 +85,52 @@ class TestJudgeEvaluator():
         for file in files:
             assert(len(get_replica_locks(scope=file['scope'], name=file['name'])) == 2)
 
+    def test_judge_coalesce_attachments(self):
+        """ JUDGE EVALUATOR: Test the judge when attaching and detaching files to a dataset in many small batches"""
+        scope = 'mock'
+        dataset = 'dataset_' + str(uuid())
+        add_did(scope, dataset, DIDType.from_sym('DATASET'), 'jdoe')
+        add_rule(dids=[{'scope': scope, 'name': dataset}], account='jdoe', copies=1, rse_expression=self.rse1, grouping='DATASET', weight=None, lifetime=None, locked=False, subscription_id=None)
+
+        files = create_files(2, scope, self.rse1, bytes=100)
+        attach_dids(scope, dataset, files, 'jdoe')
+        # Fake judge, the size of the dataset is counted once
+        re_evaluator(once=True)
+        assert(get_did(scope, dataset)['length'] == 2)
+
+        batches = [create_files(2, scope, self.rse1, bytes=100) for _ in xrange(5)]
+        for batch in batches:
+            attach_dids(scope, dataset, batch, 'jdoe')
+            files.extend(batch)
+        detach_dids(scope, dataset, [files[0]])
+        assert(len([did for did in get_updated_dids(total_workers=0, worker_number=0, limit=None) if did.name == dataset]) == 6)
+
+        # Fake judge, all the updates are evaluated at once and the size is updated from the new content
+        re_evaluator(once=True)
+        assert(len([did for did in get_updated_dids(total_workers=0, worker_number=0, limit=None) if did.name == dataset]) == 0)
+        did = get_did(scope, dataset)
+        assert(did['length'] == 11)
+        assert(did['bytes'] == 11 * 100)
+        assert(len(get_replica_locks(scope=files[0]['scope'], name=files[0]['name'])) == 0)
+        for file in files[1:]:
+            assert(len(get_replica_locks(scope=file['scope'], name=file['name'])) == 1)
+
+    def test_judge_attach_to_dataset_with_contents(self):
+        """ JUDGE EVALUATOR: Test the size of a dataset created with contents when attaching files"""
+        scope = 'mock'
+        files = create_files(3, scope, self.rse1, bytes=100)
+        dataset = 'dataset_' + str(uuid())
+        add_did(scope, dataset, DIDType.from_sym('DATASET'), 'jdoe', dids=files)
+        did = get_did(scope, dataset)
+        assert(did['length'] == 3)
+        assert(did['bytes'] == 3 * 100)
+
+        attach_dids(scope, dataset, create_files(2, scope, self.rse1, bytes=100), 'jdoe')
+        re_evaluator(once=True)
+        did = get_did(scope, dataset)
+        assert(did['length'] == 5)
+        assert(did['bytes'] == 5 * 100)
+
     def test_judge_add_dataset_to_container(self):
         """ JUDGE EVALUATOR: Test the judge when adding dataset to container"""
         scope = 'mock'
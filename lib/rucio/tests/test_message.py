@@ -14,8 +14,12 @@
 
 from nose.tools import assert_equal, assert_in, assert_is_instance, assert_raises
 
-from rucio.core.message import add_message, retrieve_messages, delete_messages, truncate_messages
+from rucio.core import message as message_core
+from rucio.core.message import add_message, add_messages, get_buckets, retrieve_messages, delete_messages, truncate_messages
 from rucio.common.exception import InvalidObject
+from rucio.db.sqla import models
+from rucio.db.sqla.models import MESSAGE_BUCKETS
+from rucio.db.sqla.session import get_session
 
 
 class TestMessagesCore():
@@ -59,3 +63,56 @@ class TestMessagesCore():
         delete_messages(to_delete)
 
         assert_equal(retrieve_messages(), [])
+
+    def test_retrieve_messages_cursor(self):
+        """ MESSAGE (CORE): Test retrieve messages by bucket and cursor """
+
+        truncate_messages()
+        add_messages([{'event_type': 'TEST', 'payload': {'number': i}} for i in xrange(50)])
+
+        # The buckets of two threads partition the messages
+        numbers = []
+        for thread in xrange(2):
+            numbers.extend([msg['payload']['number'] for msg in retrieve_messages(bulk=100, thread=thread, total_threads=2)])
+        assert_equal(sorted(numbers), range(50))
+        assert_equal(get_buckets(thread=0, total_threads=1), None)
+
+        # The threads beyond the number of buckets do not get any message
+        assert_equal(get_buckets(thread=MESSAGE_BUCKETS, total_threads=MESSAGE_BUCKETS + 1), [])
+        assert_equal(retrieve_messages(bulk=100, thread=MESSAGE_BUCKETS, total_threads=MESSAGE_BUCKETS + 1), [])
+
+        # Consume all messages in batches with a cursor
+        retrieved, cursor = [], None
+        while True:
+            messages = retrieve_messages(bulk=7, cursor=cursor)
+            if not messages:
+                break
+            retrieved.extend(messages)
+            cursor = (messages[-1]['created_at'], messages[-1]['id'])
+        assert_equal(len(set([msg['id'] for msg in retrieved])), 50)
+        assert_equal(retrieved, retrieve_messages(bulk=100))
+
+    def test_delete_messages_archiver(self):
+        """ MESSAGE (CORE): Test delete messages with and without archiving """
+
+        truncate_messages()
+        add_messages([{'event_type': 'TEST', 'payload': {'number': i}} for i in xrange(4)])
+        messages = [{'id': msg['id'],
+                     'created_at': msg['created_at'],
+                     'updated_at': msg['created_at'],
+                     'payload': str(msg['payload']),
+                     'event_type': msg['event_type']} for msg in retrieve_messages()]
+
+        archiver = message_core.get_archiver
+        message_core.get_archiver = lambda: None
+        try:
+            delete_messages(messages[:2])
+        finally:
+            message_core.get_archiver = archiver
+        delete_messages(messages[2:])
+        assert_equal(retrieve_messages(), [])
+
+        session = get_session()
+        archived = [row[0] for row in session.query(models.MessageHistory.id).filter(models.MessageHistory.id.in_([msg['id'] for msg in messages]))]
+        session.commit()
+        assert_equal(sorted(archived), sorted([msg['id'] for msg in messages[2:]]))
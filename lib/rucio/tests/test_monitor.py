@@ -9,6 +9,13 @@
 # - Luis Rodrigues, <luis.rodrigues@cern.ch>, 2013
 # - Martin Barisits, <martin.barisits@cern.ch>, 2017
 
+import socket
+import urllib2
+
+from nose.tools import assert_equal, assert_in
+
+from pystatsd import Client
+
 from rucio.core import monitor
 
 
@@ -51,3 +58,45 @@ class TestMonitor(object):
         with monitor.record_timer_block(['test.context_timer', ('test.context_timer_normal10', 10)]):
             var_a = 2 * 100
             var_a = var_a * 1
+
+    @staticmethod
+    def test_aggregated_metrics():
+        """MONITOR (CORE): Aggregate metrics and flush them in multi-metric packets """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.settimeout(5)
+        aggregator = monitor.MetricsAggregator(Client(host='127.0.0.1', port=sock.getsockname()[1], prefix='rucio'),
+                                               flush_interval=3600, sketch_size=10, max_packet_size=200)
+        for i in xrange(100):
+            aggregator.counter(['test.counter', 'test.other_counter'])
+            aggregator.timer('test.timer', i)
+        aggregator.gauge('test.gauge', 1)
+        aggregator.gauge('test.gauge', 2)
+        aggregator.flush()
+
+        lines = []
+        while len(lines) < 13:
+            lines += sock.recv(2048).split('\n')
+        sock.close()
+        assert_in('rucio.test.counter:100|c', lines)
+        assert_in('rucio.test.other_counter:100|c', lines)
+        assert_in('rucio.test.gauge:2.000000|g', lines)
+        timers = [line for line in lines if line.startswith('rucio.test.timer:')]
+        assert_equal(len(timers), 10)
+        assert_equal(all(line.endswith('|ms|@0.100000') for line in timers), True)
+
+        summary = aggregator.totals['timers']['test.timer']
+        assert_equal((summary['count'], summary['min'], summary['max'], summary['mean']), (100, 0, 99, 49.5))
+        assert_in('test.counter 100', aggregator.render().split('\n'))
+
+    @staticmethod
+    def test_pull_server():
+        """MONITOR (CORE): Expose the metrics through the pull endpoint """
+        monitor.AGGREGATOR.counter('test.pull_counter', 3)
+        monitor.AGGREGATOR.flush()
+        server = monitor.start_pull_server(0)
+        try:
+            body = urllib2.urlopen('http://localhost:%s/' % server.server_address[1]).read()
+            assert_in('test.pull_counter 3', body.split('\n'))
+        finally:
+            server.shutdown()
@@ -9,13 +9,49 @@
 # - Wen Guan, <wen.guan@cern.ch>, 2016
 
 import commands
-from nose.tools import raises
+import threading
+import urlparse
+
+import boto
+from boto.s3.bucket import Bucket
+from boto.s3.key import Key
+from nose.tools import assert_equal, assert_true, raises
 
 from rucio.client.objectstoreclient import ObjectStoreClient
 from rucio.common import objectstore
 from rucio.common import exception
 
 
+class MockBucket(Bucket):
+    """ Bucket answering the HEAD and delete requests from memory """
+
+    def __init__(self, connection, name, sizes):
+        super(MockBucket, self).__init__(connection, name)
+        self.sizes = sizes
+        self.heads = []
+        self.deletes = []
+        self.lock = threading.Lock()
+
+    def get_key(self, key_name, headers=None, version_id=None, response_headers=None, validate=True):
+        with self.lock:
+            self.heads.append(key_name)
+        if key_name not in self.sizes:
+            return None
+        key = Key(self, key_name)
+        key.size = self.sizes[key_name]
+        return key
+
+    def delete_keys(self, keys, quiet=False, mfa_token=None, headers=None):
+        self.deletes.append(list(keys))
+        result = boto.s3.multidelete.MultiDeleteResult(self)
+        for key in keys:
+            if key in self.sizes:
+                result.deleted.append(boto.s3.multidelete.Deleted(key=key))
+            else:
+                result.errors.append(boto.s3.multidelete.Error(key=key, message='NoSuchKey'))
+        return result
+
+
 class TestObjectStoreCommon:
 
     def setup(self):
@@ -164,6 +200,67 @@ class TestObjectStoreCommon:
             raise Exception(output)
 
 
+class TestObjectStoreBulk:
+
+    def setup(self):
+        self.rse = 'MOCK_ES'
+        self.endpoint = 's3+https://localhost:8443'
+        self.connection = boto.connect_s3(aws_access_key_id='access', aws_secret_access_key='secret', host='localhost', port=8443,
+                                          calling_format=boto.s3.connection.OrdinaryCallingFormat())
+        self.buckets = {}
+        for name in ('bucket_1', 'bucket_2'):
+            self.buckets[name] = MockBucket(self.connection, name, dict(('key_%i' % i, i) for i in xrange(50)))
+            objectstore.CONNECTIONS.set('%s:%s:%s' % (self.rse, self.endpoint, name), self.buckets[name])
+        objectstore.CONNECTIONS.set('connection:%s_%s' % (self.rse, self.endpoint), self.connection)
+
+    def teardown(self):
+        for name in self.buckets:
+            objectstore.CONNECTIONS.delete('%s:%s:%s' % (self.rse, self.endpoint, name))
+        objectstore.CONNECTIONS.delete('connection:%s_%s' % (self.rse, self.endpoint))
+
+    def urls(self, bucket, keys):
+        return ['%s/%s/key_%i' % (self.endpoint, bucket, i) for i in keys]
+
+    def test_get_signed_urls_bulk(self):
+        """ OBJECTSTORE (COMMON): Sign many urls, with one HEAD request per url to read only if checked """
+        urls = self.urls('bucket_1', xrange(60)) + self.urls('bucket_2', xrange(10))
+        checked = objectstore.get_signed_urls(urls, rse=self.rse, operation='read')
+        assert_equal(sorted(self.buckets['bucket_1'].heads), sorted('key_%i' % i for i in xrange(60)))
+        assert_equal(len(self.buckets['bucket_2'].heads), 10)
+        for url in urls[50:60]:
+            assert_true(isinstance(checked[url], exception.SourceNotFound))
+
+        unchecked = objectstore.get_signed_urls(urls, rse=self.rse, operation='read', check=False)
+        written = objectstore.get_signed_urls(urls, rse=self.rse, operation='write')
+        assert_equal(len(self.buckets['bucket_1'].heads), 60)
+        for url in urls:
+            path = '/%s' % url.split('/', 3)[3]
+            for signed in (unchecked[url], written[url]):
+                parsed = urlparse.urlparse(signed)
+                assert_equal(parsed.path, path)
+                assert_true('Signature' in urlparse.parse_qs(parsed.query))
+            if not isinstance(checked[url], Exception):
+                assert_equal(urlparse.urlparse(checked[url]).path, path)
+
+    def test_get_metadata_bulk(self):
+        """ OBJECTSTORE (COMMON): Get the metadata of many urls """
+        urls = self.urls('bucket_1', xrange(55)) + ['not a url']
+        ret = objectstore.get_metadata(urls, rse=self.rse)
+        for i, url in enumerate(urls[:50]):
+            assert_equal(ret[url], {'filesize': i})
+        for url in urls[50:]:
+            assert_true(isinstance(ret[url], exception.RucioException))
+
+    def test_delete_bulk(self):
+        """ OBJECTSTORE (COMMON): Delete many urls with one request per bucket """
+        urls = self.urls('bucket_1', xrange(55)) + self.urls('bucket_2', xrange(5))
+        ret = objectstore.delete(urls, rse=self.rse)
+        assert_equal([len(keys) for keys in self.buckets['bucket_1'].deletes], [55])
+        assert_equal([len(keys) for keys in self.buckets['bucket_2'].deletes], [5])
+        for url in urls:
+            assert_equal(ret[url]['status'], -1 if url.endswith(tuple('_%i' % i for i in xrange(50, 55))) else 0)
+
+
 class TestObjectStoreClients:
 
     def setup(self):
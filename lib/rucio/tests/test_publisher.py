@@ -0,0 +1,75 @@
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+from nose.tools import assert_equal
+
+from rucio.core.publisher import Publisher
+
+
+class FakeConnection(object):
+    """ Record the messages instead of sending them to a broker. """
+
+    def __init__(self, broker, fail=False):
+        self.broker = broker
+        self.fail = fail
+        self.available = True
+        self.retry_at = 0
+        self.sent = []
+
+    def is_available(self):
+        return self.available
+
+    def ensure_connected(self, name):
+        if self.fail:
+            raise Exception('Broker %s is down' % self.broker)
+
+    def send(self, body, destination, headers):
+        self.sent.append((body, destination, headers))
+
+    def failed(self):
+        self.available = False
+
+    def disconnect(self):
+        pass
+
+
+class TestPublisher(object):
+
+    def test_publish(self):
+        """ PUBLISHER (CORE): Publish messages asynchronously """
+        publisher = Publisher(brokers=[], port=61613, destination='/topic/test', name='tests.publisher')
+        connection = FakeConnection('broker1')
+        publisher.connections = [connection]
+
+        results = []
+        for i in xrange(250):
+            assert_equal(publisher.publish(str(i), headers={'persistent': 'true'}, callback=results.append), True)
+        assert_equal(publisher.flush(timeout=10), True)
+        publisher.stop()
+
+        assert_equal(sorted([int(body) for body, _, _ in connection.sent]), range(250))
+        assert_equal(set([destination for _, destination, _ in connection.sent]), set(['/topic/test']))
+        assert_equal(results, [True] * 250)
+
+    def test_publish_failover(self):
+        """ PUBLISHER (CORE): Retry messages on another broker and drop them without broker """
+        publisher = Publisher(brokers=[], port=61613, destination='/topic/test', queue_size=10, max_attempts=2, name='tests.publisher')
+        down, up = FakeConnection('broker1', fail=True), FakeConnection('broker2')
+        publisher.connections = [down, up]
+
+        results = []
+        for i in xrange(10):
+            publisher.publish(str(i), block=True, callback=results.append)
+        assert_equal(publisher.flush(timeout=10), True)
+        assert_equal(sorted([int(body) for body, _, _ in up.sent]), range(10))
+        assert_equal(results, [True] * 10)
+
+        # Without broker, the messages are dropped
+        publisher.stop()
+        empty = Publisher(brokers=[], port=61613, destination='/topic/test', name='tests.publisher')
+        assert_equal(empty.publish('dropped', callback=results.append), False)
+        assert_equal(results[-1], False)
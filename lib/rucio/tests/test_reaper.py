@@ -9,10 +9,19 @@
   Authors:
   - Vincent Garonne, <vincent.garonne@cern.ch>, 2013-2017
 '''
+from datetime import datetime, timedelta
+
+from nose.tools import assert_in, assert_not_in
+
+from rucio.common.exception import ServiceUnavailable
 from rucio.common.utils import generate_uuid
 from rucio.core import rse as rse_core
 from rucio.core import replica as replica_core
+from rucio.core.message import retrieve_messages
+from rucio.daemons.reaper.candidates import candidates
 from rucio.daemons.reaper.reaper import reaper
+from rucio.rse.protocols import mock
+from rucio.tests.common import stubbed
 
 
 def test_reaper():
@@ -29,3 +38,61 @@ def test_reaper():
     rses = [rse_core.get_rse('MOCK'), ]
     reaper(once=True, rses=rses)
     reaper(once=True, rses=rses)
+
+
+def test_reaper_concurrent_deletion():
+    """ REAPER (DAEMON): Test the reaper daemon with concurrent deletions."""
+    nb_files = 30
+    file_size = 2147483648L  # 2G
+    names = ['lfn' + generate_uuid() for i in xrange(nb_files)]
+    for name in names:
+        replica_core.add_replica(rse='MOCK', scope='data13_hip', name=name, bytes=file_size, account='root', adler32=None, md5=None, tombstone=datetime.utcnow() - timedelta(days=1))
+
+    rses = [rse_core.get_rse('MOCK'), ]
+    reaper(once=True, rses=rses, greedy=True, scheme='mock', chunk_size=20, threads_per_rse=4)
+
+    remaining = [replica['name'] for replica in replica_core.list_unlocked_replicas(rse='MOCK', limit=10000)]
+    for name in names:
+        assert_not_in(name, remaining)
+    deleted = [message['payload']['name'] for message in retrieve_messages(bulk=10000, event_type='deletion-done')]
+    for name in names:
+        assert_in(name, deleted)
+
+
+def test_reaper_deletion_candidates():
+    """ REAPER (DAEMON): Test the reaper daemon with the deletion candidates queue."""
+    nb_files = 10
+    file_size = 2147483648L  # 2G
+    names = ['lfn' + generate_uuid() for i in xrange(nb_files)]
+    for name in names:
+        replica_core.add_replica(rse='MOCK', scope='data13_hip', name=name, bytes=file_size, account='root', adler32=None, md5=None, tombstone=datetime.utcnow() - timedelta(days=1))
+
+    rses = [rse_core.get_rse('MOCK'), ]
+    candidates(once=True, rses=rses)
+    reaper(once=True, rses=rses, greedy=True, scheme='mock', deletion_candidates=True)
+
+    remaining = [replica['name'] for replica in replica_core.list_unlocked_replicas(rse='MOCK', limit=10000)]
+    for name in names:
+        assert_not_in(name, remaining)
+
+
+def test_reaper_connection_failure():
+    """ REAPER (DAEMON): Test that the reaper reports every replica when it cannot connect."""
+    nb_files = 10
+    file_size = 2147483648L  # 2G
+    names = ['lfn' + generate_uuid() for i in xrange(nb_files)]
+    for name in names:
+        replica_core.add_replica(rse='MOCK', scope='data13_hip', name=name, bytes=file_size, account='root', adler32=None, md5=None, tombstone=datetime.utcnow() - timedelta(days=1))
+
+    def connect(self):
+        raise ServiceUnavailable('Cannot connect')
+
+    rses = [rse_core.get_rse('MOCK'), ]
+    with stubbed(mock.Default.connect, connect):
+        reaper(once=True, rses=rses, greedy=True, scheme='mock', chunk_size=100, threads_per_rse=2)
+
+    remaining = [replica['name'] for replica in replica_core.list_unlocked_replicas(rse='MOCK', limit=10000)]
+    failed = [message['payload']['name'] for message in retrieve_messages(bulk=10000, event_type='deletion-failed')]
+    for name in names:
+        assert_in(name, remaining)
+        assert_in(name, failed)
@@ -11,6 +11,8 @@
 # - Cedric Serfon, <cedric.serfon@cern.ch>, 2014-2016
 # - Thomas Beermann, <thomas.beermann@cern.ch>, 2014
 
+import zlib
+
 import xmltodict
 
 from datetime import datetime, timedelta
@@ -25,13 +27,14 @@ from rucio.client.didclient import DIDClient
 from rucio.client.replicaclient import ReplicaClient
 from rucio.common.config import config_get
 from rucio.common.exception import DataIdentifierNotFound, AccessDenied, UnsupportedOperation
+from rucio.common.streaming import COMPACT_JSON_STREAM, JSON_STREAM, iter_compact_json
 from rucio.common.utils import generate_uuid
 from rucio.core.did import add_did, attach_dids, get_did, set_status, list_files, get_did_atime
 from rucio.core.replica import (add_replica, add_replicas, delete_replicas,
                                 update_replica_lock_counter, get_replica, list_replicas,
                                 declare_bad_file_replicas, list_bad_replicas,
                                 update_replicas_paths, update_replica_state,
-                                get_replica_atime, touch_replica)
+                                get_replica_atime, touch_replica, touch_replicas)
 from rucio.daemons.necromancer import run
 from rucio.rse import rsemanager as rsemgr
 from rucio.web.rest.authentication import APP as auth_app
@@ -225,6 +228,29 @@ class TestReplicaCore:
         for i in range(0, nbfiles - 1):
             assert_equal(None, get_replica_atime({'scope': files2[i]['scope'], 'name': files2[i]['name'], 'rse': 'MOCK'}))
 
+    def test_touch_replicas_bulk(self):
+        """ REPLICA (CORE): Touch replicas accessed_at timestamp in bulk"""
+        tmp_scope = 'mock'
+        nbfiles = 5
+        files = [{'scope': tmp_scope, 'name': 'file_%s' % generate_uuid(), 'bytes': 1L, 'adler32': '0cc737eb', 'meta': {'events': 10}} for i in xrange(nbfiles)]
+        add_replicas(rse='MOCK', files=files, account='root', ignore_availability=True)
+
+        now = datetime.utcnow()
+        now -= timedelta(microseconds=now.microsecond)
+        before = now - timedelta(hours=1)
+
+        replicas = [{'scope': f['scope'], 'name': f['name'], 'rse': 'MOCK', 'accessed_at': before} for f in files[:-1]]
+        replicas.append({'scope': files[0]['scope'], 'name': files[0]['name'], 'rse': 'MOCK', 'accessed_at': now})
+        replicas.append({'scope': files[0]['scope'], 'name': files[0]['name'], 'rse': 'NOT_AN_RSE', 'accessed_at': now})
+        assert_equal([], touch_replicas(replicas))
+
+        assert_equal(now, get_replica_atime({'scope': files[0]['scope'], 'name': files[0]['name'], 'rse': 'MOCK'}))
+        assert_equal(now, get_did_atime(scope=tmp_scope, name=files[0]['name']))
+        for f in files[1:-1]:
+            assert_equal(before, get_replica_atime({'scope': f['scope'], 'name': f['name'], 'rse': 'MOCK'}))
+            assert_equal(before, get_did_atime(scope=tmp_scope, name=f['name']))
+        assert_equal(None, get_replica_atime({'scope': files[-1]['scope'], 'name': files[-1]['name'], 'rse': 'MOCK'}))
+
     def test_list_replicas_all_states(self):
         """ REPLICA (CORE): list file replicas with all_states"""
         tmp_scope = 'mock'
@@ -246,6 +272,29 @@ class TestReplicaCore:
 
         assert_equal(nbfiles, replica_cpt)
 
+    def test_list_replicas_bulk_pfns(self):
+        """ REPLICA (CORE): list file replicas with PFNs generated in bulk"""
+        tmp_scope = 'mock'
+        nbfiles = 1005
+        files = [{'scope': tmp_scope, 'name': 'file_%s' % generate_uuid(), 'bytes': 1L, 'adler32': '0cc737eb'} for i in xrange(nbfiles)]
+        for i in xrange(0, nbfiles, 100):
+            add_replicas(rse='MOCK', files=files[i:i + 100], account='root', ignore_availability=True)
+        dataset = 'dataset_%s' % generate_uuid()
+        add_did(scope=tmp_scope, name=dataset, type=DIDType.DATASET, account='root')
+        for i in xrange(0, nbfiles, 100):
+            attach_dids(scope=tmp_scope, name=dataset, dids=files[i:i + 100], account='root')
+
+        protocol = rsemgr.create_protocol(rsemgr.get_rse_info('MOCK'), 'read', scheme='srm')
+        replica_cpt = 0
+        for replica in list_replicas(dids=[{'scope': tmp_scope, 'name': dataset}], schemes=['srm']):
+            assert_equal(replica['rses']['MOCK'], protocol.lfns2pfns({'scope': tmp_scope, 'name': replica['name']}).values())
+            replica_cpt += 1
+        assert_equal(nbfiles, replica_cpt)
+
+        pfns = protocol.lfns2pfns_bulk(scopes=[tmp_scope, tmp_scope], names=[files[0]['name'], files[1]['name']], paths=[None, '/does/not/really/matter/where'])
+        assert_equal(pfns[0], protocol.lfns2pfns({'scope': tmp_scope, 'name': files[0]['name']}).values()[0])
+        assert_equal(pfns[1], 'srm://mock.com:8443/srm/managerv2?SFN=/rucio/tmpdisk/rucio_tests/does/not/really/matter/where')
+
 
 class TestReplicaClients:
 
@@ -374,6 +423,10 @@ class TestReplicaClients:
                 tot_files.append(dumps(line))
         nb_tot_files = len(tot_files)
 
+        data = dumps({'limit': 'all'})
+        r2 = TestApp(rep_app.wsgifunc(*mw)).get('/bad/states', headers=headers2, params=data, expect_errors=True)
+        assert_equal(r2.status, 400)
+
         data = dumps({'state': 'B'})
         r2 = TestApp(rep_app.wsgifunc(*mw)).get('/bad/states', headers=headers2, params=data, expect_errors=True)
         assert_equal(r2.status, 200)
@@ -415,6 +468,26 @@ class TestReplicaClients:
                 nb_tot_bad_files2 += int(line['BAD'])
         assert_equal(nb_tot_bad_files1, nb_tot_bad_files2)
 
+    def test_list_replicas_compressed(self):
+        """ REPLICA (REST): List replicas with a compact encoding and a compressed stream """
+        files = [{'scope': 'mock', 'name': 'file_%s' % generate_uuid(), 'bytes': 1L, 'adler32': '0cc737eb'} for _ in xrange(3)]
+        add_replicas(rse='MOCK', files=files, account='root', ignore_availability=True)
+
+        mw = []
+        headers1 = {'X-Rucio-Account': 'root', 'X-Rucio-Username': 'ddmlab', 'X-Rucio-Password': 'secret'}
+        r1 = TestApp(auth_app.wsgifunc(*mw)).get('/userpass', headers=headers1, expect_errors=True)
+        assert_equal(r1.status, 200)
+        headers2 = {'X-Rucio-Auth-Token': str(r1.header('X-Rucio-Auth-Token')),
+                    'Accept': '%s, %s' % (COMPACT_JSON_STREAM, JSON_STREAM),
+                    'Accept-Encoding': 'gzip'}
+        data = dumps({'dids': [{'scope': f['scope'], 'name': f['name']} for f in files]})
+        r2 = TestApp(rep_app.wsgifunc(*mw)).post('/list', headers=headers2, params=data, expect_errors=True)
+        assert_equal(r2.status, 200)
+        assert_equal(r2.header('Content-Type'), COMPACT_JSON_STREAM)
+        assert_equal(r2.header('Content-Encoding'), 'gzip')
+        replicas = list(iter_compact_json([zlib.decompress(r2.body, 16 + zlib.MAX_WBITS)], fields=['name', 'bytes']))
+        assert_equal(sorted((replica.name, replica.bytes) for replica in replicas), sorted((f['name'], 1) for f in files))
+
     def test_add_list_replicas(self):
         """ REPLICA (CLIENT): Add, change state and list file replicas """
         tmp_scope = 'mock'
@@ -17,6 +17,7 @@ from rucio.core import rse
 from rucio.core import rse_expression_parser
 from rucio.client.rseclient import RSEClient
 from rucio.common.exception import InvalidRSEExpression, RSEBlacklisted
+from rucio.db.sqla.session import get_session
 
 
 def rse_name_generator(size=10):
@@ -164,6 +165,37 @@ class TestRSEExpressionParserCore(object):
         assert_raises(InvalidRSEExpression, rse_expression_parser.parse_expression, "%s>51" % self.attribute_numeric)
         assert_equal(sorted([t_rse['id'] for t_rse in rse_expression_parser.parse_expression("%s>30" % self.attribute_numeric)]), sorted([self.rse4_id, self.rse5_id]))
 
+    def test_compiled_expression_cache(self):
+        """ RSE_EXPRESSION_PARSER (CORE) Test that compiled expressions are reused """
+        expression = "%s|%s" % (self.tag1, self.tag2)
+        assert_equal(rse_expression_parser.compile_expression(expression), rse_expression_parser.compile_expression(expression))
+        assert_raises(InvalidRSEExpression, rse_expression_parser.compile_expression, "%s|" % self.tag1)
+
+    def test_attribute_changes(self):
+        """ RSE_EXPRESSION_PARSER (CORE) Test that attribute changes are visible to evaluated expressions """
+        tag = tag_generator()
+        rse.add_rse_attribute(self.rse1, self.tag2, True)
+        rse.add_rse_attribute(self.rse1, tag, True)
+        assert_equal(sorted([t_rse['id'] for t_rse in rse_expression_parser.parse_expression(self.tag2)]), sorted([self.rse1_id, self.rse4_id, self.rse5_id]))
+        assert_equal([t_rse['id'] for t_rse in rse_expression_parser.parse_expression(tag)], [self.rse1_id])
+        rse.del_rse_attribute(self.rse1, self.tag2)
+        rse.del_rse_attribute(self.rse1, tag)
+        assert_equal(sorted([t_rse['id'] for t_rse in rse_expression_parser.parse_expression(self.tag2)]), sorted([self.rse4_id, self.rse5_id]))
+        assert_raises(InvalidRSEExpression, rse_expression_parser.parse_expression, tag)
+
+    def test_uncommitted_attribute_changes(self):
+        """ RSE_EXPRESSION_PARSER (CORE) Test that attribute changes are only visible to evaluated expressions once committed """
+        tag = tag_generator()
+        rse_expression_parser.parse_expression(self.tag1)
+        session = get_session()
+        try:
+            rse.add_rse_attribute(self.rse1, tag, True, session=session)
+            assert_raises(InvalidRSEExpression, rse_expression_parser.parse_expression, tag, session=session)
+            session.rollback()
+        finally:
+            session.remove()
+        assert_raises(InvalidRSEExpression, rse_expression_parser.parse_expression, tag)
+
 
 class TestRSEExpressionParserClient(object):
 
@@ -16,10 +16,11 @@ import json
 import os
 import shutil
 import tempfile
+import zlib
 
 from uuid import uuid4 as uuid
 
-from nose.tools import raises
+from nose.tools import assert_equal, assert_true, raises
 
 from rucio.common import exception
 from rucio.rse import rsemanager as mgr
@@ -127,6 +128,11 @@ class TestRsePOSIX(object):
         """POSIX (RSE/PROTOCOLS): Put a single file to storage (SourceNotFound)"""
         self.mtc.test_put_mgr_SourceNotFound_single()
 
+    @raises(exception.FileReplicaAlreadyExists)
+    def test_put_mgr_upload_files(self):
+        """POSIX (RSE/PROTOCOLS): Put multiple files to storage with concurrent workers (Success and FileReplicaAlreadyExists)"""
+        self.mtc.test_put_mgr_upload_files()
+
     @raises(exception.FileReplicaAlreadyExists)
     def test_put_mgr_FileReplicaAlreadyExists_multi(self):
         """POSIX (RSE/PROTOCOLS): Put multiple files to storage (FileReplicaAlreadyExists)"""
@@ -231,3 +237,96 @@ class TestRsePOSIX(object):
     def test_change_scope_mgr_ok_single_pfn(self):
         """POSIX (RSE/PROTOCOLS): Change the scope of a single file on storage using PFN (Success)"""
         self.mtc.test_change_scope_mgr_ok_single_pfn()
+
+
+class TestRsePOSIXDownload(object):
+    """
+    Test the download engine of the rsemanager with the posix protocol
+    """
+
+    def setup(self):
+        self.prefix = tempfile.mkdtemp()
+        self.dest_dir = tempfile.mkdtemp()
+        self.data = os.urandom(3 * 1024 * 1024 + 17)
+        self.adler32 = '%08x' % (zlib.adler32(self.data, 1) & 0xffffffff)
+        with open('%s/data.raw' % self.prefix, 'wb') as out:
+            out.write(self.data)
+        self.rse_settings = {'rse': 'MOCK-POSIX-DOWNLOAD',
+                             'deterministic': True,
+                             'domain': ['lan'],
+                             'read_protocol': mgr.DEFAULT_PROTOCOL,
+                             'availability_read': True,
+                             'protocols': [{'scheme': 'file',
+                                            'hostname': 'localhost',
+                                            'port': 0,
+                                            'prefix': self.prefix,
+                                            'impl': 'rucio.rse.protocols.posix.Default',
+                                            'extended_attributes': None,
+                                            'domains': {'lan': {'read': 1, 'write': 1, 'delete': 1},
+                                                        'wan': {'read': 1, 'write': 1, 'delete': 1}}}]}
+
+    def teardown(self):
+        shutil.rmtree(self.prefix)
+        shutil.rmtree(self.dest_dir)
+
+    def __file(self, name, pfns, adler32=None):
+        return {'scope': 'user.jdoe',
+                'name': name,
+                'bytes': len(self.data),
+                'adler32': adler32 or self.adler32,
+                'rses': pfns}
+
+    def test_download_files(self):
+        """POSIX (RSE/PROTOCOLS): Download files with failover, resume and validation """
+        good_pfn = 'file://localhost%s/data.raw' % self.prefix
+        bad_pfn = 'file://localhost%s/missing.raw' % self.prefix
+        blacklisted = dict(self.rse_settings, availability_read=False)
+        # Left by a failed attempt, to be resumed
+        with open('%s/file_1.part' % self.dest_dir, 'wb') as out:
+            out.write(self.data[:1000])
+
+        files = [self.__file('file_1', {'MOCK-POSIX-DOWNLOAD': [bad_pfn, good_pfn]}),
+                 self.__file('file_2', {'MOCK-POSIX-BLACKLISTED': [good_pfn]}),
+                 self.__file('file_3', {'MOCK-POSIX-DOWNLOAD': [good_pfn]}, adler32='deadbeef')]
+        attempts = []
+        results = mgr.download_files(files, dest_dir=self.dest_dir, threads=2,
+                                     rses_settings={'MOCK-POSIX-DOWNLOAD': self.rse_settings, 'MOCK-POSIX-BLACKLISTED': blacklisted},
+                                     callback=lambda f, attempt: attempts.append((f['name'], attempt['pfn'], attempt['error'])))
+
+        assert_equal(results['user.jdoe:file_1'], True)
+        with open('%s/file_1' % self.dest_dir, 'rb') as downloaded:
+            assert_equal(downloaded.read(), self.data)
+        assert_true(isinstance(results['user.jdoe:file_2'], exception.RSEBlacklisted))
+        assert_true(isinstance(results['user.jdoe:file_3'], exception.FileConsistencyMismatch))
+        assert_equal(sorted(os.listdir(self.dest_dir)), ['file_1'])
+
+        file_1_attempts = [attempt for attempt in attempts if attempt[0] == 'file_1']
+        assert_equal([attempt[1] for attempt in file_1_attempts], [bad_pfn, good_pfn])
+        assert_true(isinstance(file_1_attempts[0][2], exception.SourceNotFound))
+        assert_equal(len([attempt for attempt in attempts if attempt[0] == 'file_3']), 2)
+
+    def test_download_files_protocol_failover(self):
+        """POSIX (RSE/PROTOCOLS): Download files with the other read protocols of the RSE, unless a scheme is given """
+        rse_settings = dict(self.rse_settings, protocols=self.rse_settings['protocols'] + [dict(self.rse_settings['protocols'][0], scheme='root', port=1094)])
+        rse_settings['protocols'][1]['domains'] = {'lan': {'read': 2, 'write': 2, 'delete': 2}, 'wan': {'read': 2, 'write': 2, 'delete': 2}}
+        lfn_pfn = mgr.lfns2pfns(rse_settings, [{'scope': 'user.jdoe', 'name': 'file_4'}], operation='read', scheme='file').values()[0]
+        path = mgr.create_protocol(rse_settings, 'read', 'file').pfn2path(lfn_pfn)
+        os.makedirs(os.path.dirname(path))
+        shutil.copy('%s/data.raw' % self.prefix, path)
+        # Only the PFN of the default scheme is listed, and it is not readable
+        bad_pfn = 'root://localhost:1094%s/missing.raw' % self.prefix
+
+        attempts = []
+        results = mgr.download_files([self.__file('file_4', {'MOCK-POSIX-DOWNLOAD': [bad_pfn]})], dest_dir=self.dest_dir,
+                                     rses_settings={'MOCK-POSIX-DOWNLOAD': rse_settings},
+                                     callback=lambda f, attempt: attempts.append(attempt['pfn']))
+        assert_equal(results['user.jdoe:file_4'], True)
+        assert_equal(attempts, [lfn_pfn])
+        os.unlink('%s/file_4' % self.dest_dir)
+
+        attempts = []
+        results = mgr.download_files([self.__file('file_4', {'MOCK-POSIX-DOWNLOAD': [bad_pfn]})], dest_dir=self.dest_dir, scheme='root',
+                                     rses_settings={'MOCK-POSIX-DOWNLOAD': rse_settings},
+                                     callback=lambda f, attempt: attempts.append(attempt['pfn']))
+        assert_true(isinstance(results['user.jdoe:file_4'], exception.SourceNotFound))
+        assert_equal(attempts, [bad_pfn])
@@ -15,13 +15,16 @@ Test the WebDAV protocol
 
 import json
 import os
+import shutil
 import tempfile
 
 import requests
-from nose.tools import raises
+from nose.tools import assert_equal, assert_true, raises
 
 from rucio.common import exception
 from rucio.rse import rsemanager
+from rucio.rse.protocols import webdav
+from rucio.tests.mock.http import start_http_server
 from rucio.tests.rsemgr_api_test import MgrTestCases
 from rucio.common.exception import FileReplicaAlreadyExists
 
@@ -249,3 +252,79 @@ class TestRseWebDAV(object):
     def test_change_scope_mgr_ok_single_pfn(self):
         """WebDAV (RSE/PROTOCOLS): Change the scope of a single file on storage using PFN (Success)"""
         self.mtc.test_change_scope_mgr_ok_single_pfn()
+
+
+class TestRseWebDAVRanges(object):
+    """
+    Test the transfers of the WebDAV protocol with a local HTTP server
+    """
+
+    @classmethod
+    def setupClass(cls):
+        """WebDAV (RSE/PROTOCOLS): Starting a local HTTP server """
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.data = os.urandom(1000000)
+        with open('%s/data.raw' % cls.tmpdir, 'wb') as out:
+            out.write(cls.data)
+        cls.server = start_http_server(cls.tmpdir)
+
+    @classmethod
+    def tearDownClass(cls):
+        """WebDAV (RSE/PROTOCOLS): Stopping the local HTTP server """
+        # Close the connections kept by the shared session
+        webdav.get_session(None, webdav.CONCURRENT_TRANSFERS * 4).close()
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.tmpdir)
+
+    def setup(self):
+        """WebDAV (RSE/PROTOCOLS): Connecting to the local HTTP server with small segments """
+        self.storage = webdav.Default({'scheme': 'http', 'hostname': '127.0.0.1', 'port': self.server.server_port, 'prefix': '/'},
+                                      {'deterministic': True})
+        self.storage.connect({'cert': None, 'buffer_size': 10000, 'parallel_streams': 3, 'range_threshold': 200000, 'segment_size': 100000})
+        del self.server.requests[:]
+
+    def test_get_parallel_ranges(self):
+        """WebDAV (RSE/PROTOCOLS): Get a large file with parallel range requests (Success)"""
+        self.storage.get('data.raw', '%s/get.raw' % self.tmpdir)
+        with open('%s/get.raw' % self.tmpdir, 'rb') as f_file:
+            assert_equal(f_file.read(), self.data)
+        ranges = sorted(request[2] for request in self.server.requests if request[0] == 'GET')
+        assert_equal(len(ranges), 10)
+        assert_true('bytes=900000-999999' in ranges)
+
+    def test_stream_offset(self):
+        """WebDAV (RSE/PROTOCOLS): Stream a file from an offset, in order (Success)"""
+        assert_equal(''.join(self.storage.stream('data.raw', offset=123)), self.data[123:])
+        self.storage.range_threshold = 10 ** 9
+        assert_equal(''.join(self.storage.stream('data.raw', offset=123)), self.data[123:])
+
+    def test_connections_reused(self):
+        """WebDAV (RSE/PROTOCOLS): The connections are shared by the protocols (Success)"""
+        storage = webdav.Default(self.storage.attributes, self.storage.rse)
+        storage.connect({'cert': None, 'parallel_streams': 3})
+        assert_true(storage.session is self.storage.session)
+        # Every concurrent transfer keeps its connections
+        assert_equal(storage.session.get_adapter('http://127.0.0.1')._pool_maxsize, webdav.CONCURRENT_TRANSFERS * 4)
+
+    def test_connect_cert_list(self):
+        """WebDAV (RSE/PROTOCOLS): The certificate and key given as a JSON list are shared (Success)"""
+        cert, key = '%s/usercert.pem' % self.tmpdir, '%s/userkey.pem' % self.tmpdir
+        open(cert, 'w').close()
+        open(key, 'w').close()
+        storage = webdav.Default(self.storage.attributes, self.storage.rse)
+        storage.connect(json.loads(json.dumps({'cert': [cert, key], 'concurrent_transfers': 2})))
+        assert_equal(storage.cert, (cert, key))
+        assert_equal(storage.session.get_adapter('http://127.0.0.1')._pool_maxsize, 2 * (webdav.PARALLEL_STREAMS + 1))
+        storage.session.close()
+
+    @raises(exception.RucioException)
+    def test_get_incomplete_range(self):
+        """WebDAV (RSE/PROTOCOLS): A file truncated during a parallel get is not accepted (RucioException)"""
+        with open('%s/short.raw' % self.tmpdir, 'wb') as out:
+            out.write(self.data)
+        chunks = self.storage.stream('short.raw')
+        next(chunks)
+        with open('%s/short.raw' % self.tmpdir, 'wb') as out:
+            out.write(self.data[:500000])
+        list(chunks)
@@ -0,0 +1,55 @@
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+from nose.tools import assert_equal, assert_in, assert_not_in, assert_not_equal, assert_raises
+
+from rucio.common.exception import RSEProtocolNotSupported
+from rucio.common.utils import generate_uuid
+from rucio.core import rse_topology
+from rucio.core.rse import add_rse, add_rse_attribute, add_protocol, update_rse
+
+
+class TestRSETopologyCore(object):
+
+    def __init__(self):
+        self.rse = 'MOCK_%s' % generate_uuid()[:10].upper()
+        self.rse_id = add_rse(self.rse)
+        add_rse_attribute(self.rse, 'fts', 'https://fts.example.com:8446')
+        add_protocol(self.rse, {'scheme': 'root',
+                                'hostname': 'root.example.com',
+                                'port': 1094,
+                                'prefix': '/rucio/',
+                                'impl': 'rucio.rse.protocols.xrootd.Default',
+                                'domains': {'lan': {'read': 1, 'write': 1, 'delete': 1},
+                                            'wan': {'read': 1, 'write': 1, 'delete': 1}}})
+        rse_topology.invalidate_topology()
+
+    def test_snapshot(self):
+        """ RSE TOPOLOGY (CORE): Build a topology snapshot """
+        topology = rse_topology.get_topology()
+        assert_equal(topology.get_rse_name(self.rse_id), self.rse)
+        assert_equal(topology.get_rse_attributes(self.rse_id)['fts'], 'https://fts.example.com:8446')
+        assert_equal(topology.get_rse_info(self.rse_id)['rse'], self.rse)
+        assert_not_in(self.rse_id, topology.unavailable_read)
+        assert_equal(topology.find_matching_scheme(self.rse_id, self.rse_id), ('root', 'root'))
+        assert_raises(RSEProtocolNotSupported, topology.find_matching_scheme, self.rse_id, self.rse_id, ['srm'])
+        # The snapshot is shared until its version is checked again
+        assert_equal(rse_topology.get_topology() is topology, True)
+
+    def test_rebuild_on_change(self):
+        """ RSE TOPOLOGY (CORE): Rebuild the topology snapshot when the RSEs change """
+        topology = rse_topology.get_topology()
+        check_interval, rse_topology.SNAPSHOT_CHECK_INTERVAL = rse_topology.SNAPSHOT_CHECK_INTERVAL, -1
+        try:
+            assert_equal(rse_topology.get_topology() is topology, True)
+
+            update_rse(self.rse, {'availability_read': False})
+            new_topology = rse_topology.get_topology()
+            assert_not_equal(new_topology.version, topology.version)
+            assert_in(self.rse_id, new_topology.unavailable_read)
+        finally:
+            rse_topology.SNAPSHOT_CHECK_INTERVAL = check_interval
@@ -31,7 +31,7 @@ from rucio.common.exception import (RuleNotFound, AccessDenied, InsufficientAcco
 from rucio.core.account_counter import get_counter as get_account_counter
 from rucio.daemons.judge.evaluator import re_evaluator
 from rucio.core.did import add_did, attach_dids, set_status
-from rucio.core.lock import get_replica_locks, get_dataset_locks, successful_transfer
+from rucio.core.lock import get_replica_locks, get_dataset_locks, successful_transfer, finished_transfers
 from rucio.core.account import add_account_attribute
 from rucio.core.account_limit import set_account_limit
 from rucio.core.request import get_request_by_did
@@ -42,7 +42,7 @@ from rucio.core.rule import add_rule, get_rule, delete_rule, add_rules, update_r
 from rucio.daemons.abacus.account import account_update
 from rucio.daemons.abacus.rse import rse_update
 from rucio.db.sqla import models
-from rucio.db.sqla.constants import DIDType, OBSOLETE, RuleState, LockState
+from rucio.db.sqla.constants import DIDType, OBSOLETE, RuleState, LockState, ReplicaState
 from rucio.db.sqla.session import transactional_session
 from rucio.tests.common import rse_name_generator, account_name_generator
 
@@ -84,6 +84,11 @@ def check_dataset_ok_callback(scope, name, rse, rule_id, session=None):
     return False
 
 
+@transactional_session
+def count_updated_collection_replicas(scope, name, rse_id, session=None):
+    return session.query(models.UpdatedCollectionReplica).filter_by(scope=scope, name=name, rse_id=rse_id).count()
+
+
 class TestReplicationRuleCore():
 
     @classmethod
@@ -576,6 +581,34 @@ class TestReplicationRuleCore():
         # Check if rule exists
         assert(True is check_dataset_ok_callback(scope, dataset, self.rse3, rule_id))
 
+    def test_finished_transfers_bulk(self):
+        """ REPLICATION RULE (CORE): Update the locks and rule of a batch of finished transfers"""
+
+        scope = 'mock'
+        files = create_files(4, scope, self.rse1, bytes=100)
+        dataset = 'dataset_' + str(uuid())
+        add_did(scope, dataset, DIDType.from_sym('DATASET'), 'jdoe')
+        attach_dids(scope, dataset, files, 'jdoe')
+        set_status(scope=scope, name=dataset, open=False)
+
+        rule_id = add_rule(dids=[{'scope': scope, 'name': dataset}], account='jdoe', copies=1, rse_expression=self.rse3, grouping='DATASET', weight=None, lifetime=None, locked=False, subscription_id=None, notify='C')[0]
+
+        finished_transfers([{'scope': scope, 'name': files[0]['name'], 'rse_id': self.rse3_id, 'state': ReplicaState.AVAILABLE},
+                            {'scope': scope, 'name': files[1]['name'], 'rse_id': self.rse3_id, 'state': ReplicaState.AVAILABLE},
+                            {'scope': scope, 'name': files[2]['name'], 'rse_id': self.rse3_id, 'state': ReplicaState.AVAILABLE},
+                            {'scope': scope, 'name': files[3]['name'], 'rse_id': self.rse3_id, 'state': ReplicaState.UNAVAILABLE, 'error_message': 'transfer failed'}], nowait=False)
+        rule = get_rule(rule_id)
+        assert_equal((rule['locks_ok_cnt'], rule['locks_replicating_cnt'], rule['locks_stuck_cnt']), (3, 0, 1))
+        assert_equal(rule['state'], RuleState.STUCK)
+        assert_equal(rule['error'], 'transfer failed')
+        # One collection replica update for the dataset, not one per file
+        assert_equal(count_updated_collection_replicas(scope, dataset, self.rse3_id), 1)
+
+        finished_transfers([{'scope': scope, 'name': files[3]['name'], 'rse_id': self.rse3_id, 'state': ReplicaState.AVAILABLE}], nowait=False)
+        rule = get_rule(rule_id)
+        assert_equal((rule['locks_ok_cnt'], rule['locks_replicating_cnt'], rule['locks_stuck_cnt']), (4, 0, 0))
+        assert_equal(get_replica_locks(scope=scope, name=files[3]['name'])[0].state, LockState.OK)
+
     def test_dataset_callback_no(self):
         """ REPLICATION RULE (CORE): Test dataset callback should not be sent"""
 
@@ -0,0 +1,139 @@
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#              http://www.apache.org/licenses/LICENSE-2.0
+
+import zlib
+
+from datetime import datetime
+from StringIO import StringIO
+
+from nose import SkipTest
+from nose.tools import eq_, raises
+from web import ctx
+
+from rucio.common import streaming
+from rucio.common.exception import RucioException
+from rucio.common.streaming import (COMPACT_JSON_STREAM, JSON_STREAM, MSGPACK_STREAM, STREAM_DECODERS,
+                                    DecompressingReader, StreamEncoder, compress_stream,
+                                    iter_json, iter_lines, iter_metalink)
+from rucio.web.rest.common import compression_processor, negotiate_compression
+
+METALINK = '''<?xml version="1.0" encoding="UTF-8"?>
+<metalink xmlns="urn:ietf:params:xml:ns:metalink">
+ <file name="file_1">
+  <identity>mock:file_1</identity>
+  <hash type="adler32">0cc737eb</hash>
+  <hash type="md5">b026324c6904b2a9cb4b88d6d61c81d1</hash>
+  <size>1024</size>
+  <url location="MOCK" priority="1">root://mock.cern.ch//data/file_1</url>
+  <url location="MOCK2" priority="2">https://mock2.cern.ch/data/file_1</url>
+ </file>
+ <file name="file_2">
+  <identity>mock:file_2</identity>
+  <size>2048</size>
+  <url location="MOCK" priority="1">root://mock.cern.ch//data/file_2</url>
+ </file>
+</metalink>
+'''
+
+
+def split(data, size):
+    """ Split a string in chunks of the given size """
+    return [data[i:i + size] for i in xrange(0, len(data), size)]
+
+
+class TestStreaming(object):
+
+    def test_iter_lines(self):
+        """ STREAMING (COMMON): Lines split across chunks are rebuilt """
+        data = 'first line\nsecond line\n\nthird line'
+        for size in (1, 3, 7, len(data)):
+            eq_(list(iter_lines(split(data, size))), ['first line', 'second line', 'third line'])
+
+    @raises(RucioException)
+    def test_iter_lines_max_size(self):
+        """ STREAMING (COMMON): A line longer than the maximum size is refused """
+        list(iter_lines(split('x' * 100 + '\n', 10), max_line_size=50))
+
+    def test_iter_json(self):
+        """ STREAMING (COMMON): JSON objects are decoded one per line, as dictionaries or records """
+        data = '{"scope": "mock", "name": "file_1", "bytes": 1, "created_at": "Mon, 02 Oct 2017 10:00:00 UTC"}\n' \
+               '{"scope": "mock", "name": "file_2", "bytes": 2}\n'
+        objects = list(iter_json(split(data, 5)))
+        eq_([obj['name'] for obj in objects], ['file_1', 'file_2'])
+        eq_(objects[0]['created_at'], datetime(2017, 10, 2, 10, 0, 0))
+
+        records = list(iter_json(split(data, 5), fields=['name', 'bytes', 'md5']))
+        eq_(records[1].name, 'file_2')
+        eq_(records[1].bytes, 2)
+        eq_(records[1].md5, None)
+
+    def test_iter_metalink(self):
+        """ STREAMING (COMMON): A chunked metalink is decoded file by file """
+        for size in (16, len(METALINK)):
+            files = list(iter_metalink(split(METALINK, size)))
+            eq_(len(files), 2)
+            eq_(files[0], {'scope': 'mock', 'name': 'file_1', 'bytes': 1024,
+                           'adler32': '0cc737eb', 'md5': 'b026324c6904b2a9cb4b88d6d61c81d1',
+                           'rses': {'MOCK': ['root://mock.cern.ch//data/file_1'],
+                                    'MOCK2': ['https://mock2.cern.ch/data/file_1']}})
+            eq_(files[1]['adler32'], None)
+
+        records = list(iter_metalink([METALINK], fields=['name', 'bytes']))
+        eq_([(record.name, record.bytes) for record in records], [('file_1', 1024), ('file_2', 2048)])
+
+    def test_stream_encoder(self):
+        """ STREAMING (COMMON): The objects of the compact formats are decoded as sent """
+        objects = [{'scope': 'mock', 'name': 'file_1', 'bytes': 1, 'created_at': datetime(2017, 10, 2, 10, 0, 0)},
+                   {'scope': 'mock', 'name': 'file_2', 'bytes': 2, 'created_at': datetime(2017, 10, 2, 11, 0, 0)},
+                   {'scope': 'mock', 'name': 'file_3', 'rses': {'MOCK': ['root://mock.cern.ch//data/file_3']}},
+                   'file_4']
+        formats = [JSON_STREAM, COMPACT_JSON_STREAM] + ([MSGPACK_STREAM] if streaming.msgpack is not None else [])
+        for content_type in formats:
+            encoder = StreamEncoder(content_type)
+            data = ''.join(encoder.encode(obj) for obj in objects)
+            eq_(list(STREAM_DECODERS[content_type](split(data, 7))), objects)
+
+        # The columns are only sent when they change
+        encoder = StreamEncoder(COMPACT_JSON_STREAM)
+        eq_(''.join(encoder.encode(obj) for obj in objects[:2]).count('columns'), 1)
+
+    def test_compress_stream(self):
+        """ STREAMING (COMMON): A gzip stream is decompressed by a client which does not know about chunks """
+        chunks = ['{"name": "file_%s"}\n' % i for i in xrange(10000)]
+        compressed = ''.join(compress_stream(chunks, 'gzip'))
+        eq_(zlib.decompress(compressed, 16 + zlib.MAX_WBITS), ''.join(chunks))
+        eq_(len(compressed) < len(''.join(chunks)) / 4, True)
+
+        reader = DecompressingReader(StringIO(compressed), 'gzip', chunk_size=100)
+        eq_(len(list(iter_json(iter(lambda: reader.read(1000), '')))), 10000)
+
+    def test_compress_stream_zstd(self):
+        """ STREAMING (COMMON): A zstd stream is decompressed """
+        if streaming.zstandard is None:
+            raise SkipTest('zstandard is not installed')
+        chunks = ['{"name": "file_%s"}\n' % i for i in xrange(10000)]
+        reader = DecompressingReader(StringIO(''.join(compress_stream(chunks, 'zstd'))), 'zstd')
+        eq_(reader.read(), ''.join(chunks))
+
+    def test_negotiate_compression(self):
+        """ STREAMING (REST): The content coding is negotiated with the Accept-Encoding header """
+        eq_(negotiate_compression(None), None)
+        eq_(negotiate_compression('identity'), None)
+        eq_(negotiate_compression('gzip, deflate'), 'gzip')
+        eq_(negotiate_compression('gzip;q=0, deflate'), None)
+        eq_(negotiate_compression('*'), streaming.content_codings()[0])
+
+    def test_compression_processor(self):
+        """ STREAMING (REST): The streamed responses are compressed and the empty ones stay empty """
+        ctx.env, ctx.headers = {'HTTP_ACCEPT_ENCODING': 'gzip'}, [('Content-Type', JSON_STREAM)]
+        chunks = ['{"name": "file_%s"}\n' % i for i in xrange(100)]
+        compressed = ''.join(compression_processor(lambda: (chunk for chunk in chunks)))
+        eq_(zlib.decompress(compressed, 16 + zlib.MAX_WBITS), ''.join(chunks))
+        eq_(('Content-Encoding', 'gzip') in ctx.headers, True)
+
+        ctx.env, ctx.headers = {'HTTP_ACCEPT_ENCODING': 'gzip'}, [('Content-Type', JSON_STREAM)]
+        eq_(compression_processor(lambda: (chunk for chunk in [])), '')
@@ -26,8 +26,8 @@ from rucio.api.account_limit import get_account_limits, get_account_limit, get_a
 from rucio.api.rule import list_replication_rules
 from rucio.api.scope import add_scope, get_scopes
 from rucio.common.exception import AccountNotFound, Duplicate, AccessDenied, RucioException, RuleNotFound, RSENotFound, IdentityError
-from rucio.common.utils import generate_http_error, APIEncoder, render_json
-from rucio.web.rest.common import rucio_loadhook, RucioController
+from rucio.common.utils import generate_http_error, render_json
+from rucio.web.rest.common import compression_processor, rucio_loadhook, stream_encoder, RucioController
 
 
 LOGGER = getLogger("rucio.account")
@@ -389,13 +389,13 @@ class Account(RucioController):
         :param Rucio-Auth-Token: as an 32 character hex string.
         :returns: A list containing all account names as dict.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         filter = {}
         if ctx.query:
             filter = dict(parse_qsl(ctx.query[1:]))
 
         for account in list_accounts(filter=filter):
-            yield render_json(**account) + "\n"
+            yield encoder.encode(account)
 
 
 class AccountLimits(RucioController):
@@ -486,10 +486,10 @@ class Identities(RucioController):
         raise Created()
 
     def GET(self, account):
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         try:
             for identity in list_identities(account):
-                yield render_json(**identity) + "\n"
+                yield encoder.encode(identity)
         except AccountNotFound, e:
             raise generate_http_error(404, 'AccountNotFound', e.args[0][0])
         except Exception, e:
@@ -558,7 +558,7 @@ class Rules(RucioController):
 
         :param scope: The scope name.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         filters = {'account': account}
         if ctx.query:
             params = dict(parse_qsl(ctx.query[1:]))
@@ -566,7 +566,7 @@ class Rules(RucioController):
 
         try:
             for rule in list_replication_rules(filters=filters):
-                yield dumps(rule, cls=APIEncoder) + '\n'
+                yield encoder.encode(rule)
         except RuleNotFound, e:
             raise generate_http_error(404, 'RuleNotFound', e.args[0][0])
         except Exception, e:
@@ -598,10 +598,10 @@ class Usage1(RucioController):
 
         :param account: The account name.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         try:
             for usage in get_account_usage(account=account, rse=None, issuer=ctx.env.get('issuer')):
-                yield dumps(usage, cls=APIEncoder) + '\n'
+                yield encoder.encode(usage)
         except AccountNotFound, e:
             raise generate_http_error(404, 'AccountNotFound', e.args[0][0])
         except AccessDenied, e:
@@ -636,10 +636,10 @@ class Usage2(RucioController):
         :param account: The account name.
         :param rse:     The rse.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         try:
             for usage in get_account_usage(account=account, rse=rse, issuer=ctx.env.get('issuer')):
-                yield dumps(usage, cls=APIEncoder) + '\n'
+                yield encoder.encode(usage)
         except AccountNotFound, e:
             raise generate_http_error(404, 'AccountNotFound', e.args[0][0])
         except RSENotFound, e:
@@ -666,4 +666,5 @@ class Usage2(RucioController):
 
 APP = application(URLS, globals())
 APP.add_processor(loadhook(rucio_loadhook))
+APP.add_processor(compression_processor)
 application = APP.wsgifunc()
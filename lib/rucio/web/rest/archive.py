@@ -10,13 +10,12 @@
   - Vincent Garonne, <vincent.garonne@cern.ch>, 2017
 '''
 
-from json import dumps
 from logging import getLogger, StreamHandler, DEBUG
 from traceback import format_exc
-from web import application, loadhook, header, InternalError
+from web import application, loadhook, InternalError
 
 from rucio.api.did import list_archive_content
-from rucio.web.rest.common import rucio_loadhook, RucioController
+from rucio.web.rest.common import compression_processor, rucio_loadhook, stream_encoder, RucioController
 
 LOGGER, SH = getLogger("rucio.meta"), StreamHandler()
 SH.setLevel(DEBUG)
@@ -35,10 +34,10 @@ class Archive(RucioController):
         HTTP Success:
             200 Success
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         try:
             for file in list_archive_content(scope=scope, name=name):
-                yield dumps(file) + '\n'
+                yield encoder.encode(file)
         except Exception, error:
             print format_exc()
             raise InternalError(error)
@@ -50,4 +49,5 @@ class Archive(RucioController):
 
 APP = application(URLS, globals())
 APP.add_processor(loadhook(rucio_loadhook))
+APP.add_processor(compression_processor)
 application = APP.wsgifunc()
@@ -12,17 +12,37 @@
 REST utilities
 """
 
+from ConfigParser import NoOptionError, NoSectionError
+from itertools import chain
 from json import loads
 from time import time
 from traceback import format_exc
+from types import GeneratorType
 from web import BadRequest, ctx, data, header, InternalError
 from web.webapi import Created, HTTPError, OK, seeother
 
 from rucio.api.authentication import validate_auth_token
+from rucio.common.config import config_get, config_get_int
 from rucio.common.exception import RucioException
+from rucio.common.streaming import (JSON_STREAM, COMPACT_JSON_STREAM, MSGPACK_STREAM, METALINK, GZIP_LEVEL, ZSTD_LEVEL,
+                                    StreamEncoder, compress_stream, content_codings, stream_formats)
 from rucio.common.utils import generate_http_error, generate_uuid
 from rucio.core.monitor import record_timer
 
+try:
+    COMPRESSION = [coding.strip() for coding in config_get('api', 'compression').split(',') if coding.strip() in content_codings()]
+except (NoOptionError, NoSectionError):
+    COMPRESSION = content_codings()
+COMPRESSION_LEVELS = {}
+for coding, level in (('gzip', GZIP_LEVEL), ('zstd', ZSTD_LEVEL)):
+    try:
+        COMPRESSION_LEVELS[coding] = config_get_int('api', '%s_level' % coding)
+    except (NoOptionError, NoSectionError, ValueError):
+        COMPRESSION_LEVELS[coding] = level
+
+# The content types of the streamed responses which are compressed
+COMPRESSED_TYPES = (JSON_STREAM, COMPACT_JSON_STREAM, MSGPACK_STREAM, METALINK)
+
 
 def rucio_loadhook():
     """ Rucio load Hook to authenticate, timing, etc. """
@@ -78,6 +98,77 @@ def rucio_unloadhook():
     record_timer(time_serie_name, duration * 1000)
 
 
+def stream_encoder():
+    """
+    Get the encoder of a streamed list response, with the first stream format of the Accept header
+    supported by the server, and set the Content-Type. The JSON stream is the default.
+
+    :returns: The StreamEncoder.
+    """
+    content_type = JSON_STREAM
+    formats = stream_formats()
+    for accepted in (ctx.env.get('HTTP_ACCEPT') or '').split(','):
+        accepted = accepted.split(';')[0].strip()
+        if accepted in formats:
+            content_type = accepted
+            break
+    # Replace the default Content-Type of the rucio_loadhook
+    ctx.headers[:] = [(name, value) for name, value in ctx.headers if name.lower() != 'content-type']
+    header('Content-Type', content_type)
+    return StreamEncoder(content_type)
+
+
+def negotiate_compression(accept_encoding):
+    """
+    Select the content coding of a response.
+
+    :param accept_encoding: The Accept-Encoding header of the request.
+    :returns: The first configured coding accepted by the client, or None.
+    """
+    accepted = set()
+    for coding in (accept_encoding or '').split(','):
+        params = coding.split(';')
+        coding = params[0].strip().lower()
+        quality = [param.split('=', 1)[1].strip() for param in params[1:] if param.strip().startswith('q=')]
+        try:
+            if quality and float(quality[0]) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(coding)
+    for coding in COMPRESSION:
+        if coding in accepted or '*' in accepted:
+            return coding
+    return None
+
+
+def compression_processor(handler):
+    """
+    Processor compressing the streamed responses with the content coding negotiated with the Accept-Encoding header.
+
+    The first chunk of the response is computed here, so that the Content-Type set by the controller is known
+    and its errors are raised before the response starts.
+    """
+    result = handler()
+    if not isinstance(result, GeneratorType):
+        return result
+    coding = negotiate_compression(ctx.env.get('HTTP_ACCEPT_ENCODING'))
+    if coding is None:
+        return result
+
+    try:
+        first = next(result)
+    except StopIteration:
+        # An empty body, a list would be rendered as a string
+        return ''
+    content_type = [value for name, value in ctx.headers if name.lower() == 'content-type']
+    if not content_type or content_type[-1] not in COMPRESSED_TYPES:
+        return chain([first], result)
+    header('Content-Encoding', coding)
+    header('Vary', 'Accept-Encoding')
+    return compress_stream(chain([first], result), coding, level=COMPRESSION_LEVELS.get(coding))
+
+
 def load_json_data():
     """ Hook to load json data. """
     json_data = data()
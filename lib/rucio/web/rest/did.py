@@ -14,7 +14,7 @@
 # - Cedric Serfon, <cedric.serfon@cern.ch>, 2014-2015
 # - Martin Baristis, <martin.barisits@cern.ch>, 2014-2015
 
-from json import dumps, loads
+from json import loads
 from traceback import format_exc
 from urlparse import parse_qs
 from web import application, ctx, data, Created, header, InternalError, OK, loadhook
@@ -32,8 +32,8 @@ from rucio.common.exception import (ScopeNotFound, DataIdentifierNotFound,
                                     UnsupportedStatus, UnsupportedOperation,
                                     RSENotFound, RucioException, RuleNotFound,
                                     InvalidMetadata)
-from rucio.common.utils import generate_http_error, render_json, APIEncoder
-from rucio.web.rest.common import rucio_loadhook, RucioController
+from rucio.common.utils import generate_http_error, render_json
+from rucio.web.rest.common import compression_processor, rucio_loadhook, stream_encoder, RucioController
 
 URLS = (
     '/(.*)/$', 'Scope',
@@ -72,7 +72,7 @@ class Scope(RucioController):
 
         :param scope: The scope name.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         name = None
         recursive = False
         if ctx.query:
@@ -84,7 +84,7 @@ class Scope(RucioController):
 
         try:
             for did in scope_list(scope=scope, name=name, recursive=recursive):
-                yield render_json(**did) + '\n'
+                yield encoder.encode(did)
         except DataIdentifierNotFound, error:
             raise generate_http_error(404, 'DataIdentifierNotFound', error.args[0][0])
         except Exception, error:
@@ -109,9 +109,10 @@ class Search(RucioController):
         :param scope: The scope name.
         """
 
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         filters = {}
         long = False
+        limit, offset, marker, range_start, range_end = None, None, None, None, None
         if ctx.query:
             params = parse_qs(ctx.query[1:])
             for k, v in params.items():
@@ -119,12 +120,33 @@ class Search(RucioController):
                     type = v[0]
                 elif k == 'long':
                     long = bool(v[0])
+                elif k == 'limit':
+                    try:
+                        limit = int(v[0])
+                    except ValueError:
+                        raise generate_http_error(400, 'ValueError', 'limit must be an integer')
+                elif k == 'offset':
+                    try:
+                        offset = int(v[0])
+                    except ValueError:
+                        raise generate_http_error(400, 'ValueError', 'offset must be an integer')
+                elif k == 'marker':
+                    marker = v[0]
+                elif k == 'range_start':
+                    range_start = v[0]
+                elif k == 'range_end':
+                    range_end = v[0]
                 else:
                     filters[k] = v[0]
 
+        name_range = None
+        if range_start or range_end:
+            name_range = (range_start, range_end)
+
         try:
-            for did in list_dids(scope=scope, filters=filters, type=type, long=long):
-                yield dumps(did) + '\n'
+            for did in list_dids(scope=scope, filters=filters, type=type, long=long,
+                                 limit=limit, offset=offset, marker=marker, name_range=name_range):
+                yield encoder.encode(did)
         except UnsupportedOperation, error:
             raise generate_http_error(409, 'UnsupportedOperation', error.args[0][0])
         except KeyNotFound, error:
@@ -350,10 +372,10 @@ class Attachment(RucioController):
 
         :returns: A list with the contents.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         try:
             for did in list_content(scope=scope, name=name):
-                yield render_json(**did) + '\n'
+                yield encoder.encode(did)
         except DataIdentifierNotFound, error:
             raise generate_http_error(404, 'DataIdentifierNotFound', error.args[0][0])
         except RucioException, error:
@@ -455,10 +477,10 @@ class AttachmentHistory(RucioController):
 
         :returns: A list with the contents.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         try:
             for did in list_content_history(scope=scope, name=name):
-                yield render_json(**did) + '\n'
+                yield encoder.encode(did)
         except DataIdentifierNotFound, error:
             raise generate_http_error(404, 'DataIdentifierNotFound', error.args[0][0])
         except RucioException, error:
@@ -488,7 +510,7 @@ class Files(RucioController):
 
         :returns: A dictionary containing all replicas information.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         long = False
         if ctx.query:
             params = parse_qs(ctx.query[1:])
@@ -496,7 +518,7 @@ class Files(RucioController):
                 long = True
         try:
             for file in list_files(scope=scope, name=name, long=long):
-                yield dumps(file) + "\n"
+                yield encoder.encode(file)
         except DataIdentifierNotFound, error:
             raise generate_http_error(404, 'DataIdentifierNotFound', error.args[0][0])
         except RucioException, error:
@@ -520,10 +542,10 @@ class Parents(RucioController):
 
         :returns: A list of dictionary containing all dataset information.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         try:
             for dataset in list_parent_dids(scope=scope, name=name):
-                yield render_json(**dataset) + "\n"
+                yield encoder.encode(dataset)
         except DataIdentifierNotFound, error:
             raise generate_http_error(404, 'DataIdentifierNotFound', error.args[0][0])
         except RucioException, error:
@@ -624,10 +646,10 @@ class Rules(RucioController):
 
         :param scope: The scope name.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         try:
             for rule in list_replication_rules({'scope': scope, 'name': name}):
-                yield dumps(rule, cls=APIEncoder) + '\n'
+                yield encoder.encode(rule)
         except RuleNotFound, error:
             raise generate_http_error(404, 'RuleNotFound', error.args[0][0])
         except RucioException, error:
@@ -651,10 +673,10 @@ class AssociatedRules(RucioController):
 
         :param scope: The scope name.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         try:
             for rule in list_associated_replication_rules_for_file(scope=scope, name=name):
-                yield dumps(rule, cls=APIEncoder) + '\n'
+                yield encoder.encode(rule)
         except RucioException, error:
             raise generate_http_error(500, error.__class__.__name__, error.args[0])
         except Exception, error:
@@ -676,10 +698,10 @@ class GUIDLookup(RucioController):
 
         :param scope: The scope name.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         try:
             for dataset in get_dataset_by_guid(guid):
-                yield dumps(dataset, cls=APIEncoder) + '\n'
+                yield encoder.encode(dataset)
         except DataIdentifierNotFound, error:
             raise generate_http_error(404, 'DataIdentifierNotFound', error.args[0][0])
         except RucioException, error:
@@ -745,7 +767,7 @@ class NewDIDs(RucioController):
 
         :param type: The DID type.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         params = parse_qs(ctx.query[1:])
 
         type = None
@@ -753,7 +775,7 @@ class NewDIDs(RucioController):
             type = params['type'][0]
         try:
             for did in list_new_dids(type):
-                yield dumps(did, cls=APIEncoder) + '\n'
+                yield encoder.encode(did)
         except RucioException, error:
             raise generate_http_error(500, error.__class__.__name__, error.args[0])
         except Exception, error:
@@ -811,4 +833,5 @@ class Resurrect(RucioController):
 
 APP = application(URLS, globals())
 APP.add_processor(loadhook(rucio_loadhook))
+APP.add_processor(compression_processor)
 application = APP.wsgifunc()
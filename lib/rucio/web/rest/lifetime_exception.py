@@ -17,7 +17,7 @@ from web import application, ctx, data, header, BadRequest, Created, InternalErr
 from rucio.api.lifetime_exception import list_exceptions, add_exception, update_exception
 from rucio.common.exception import LifetimeExceptionNotFound, UnsupportedOperation, InvalidObject, RucioException, AccessDenied, LifetimeExceptionDuplicate
 from rucio.common.utils import generate_http_error, APIEncoder
-from rucio.web.rest.common import rucio_loadhook
+from rucio.web.rest.common import compression_processor, rucio_loadhook, stream_encoder
 
 
 URLS = ('/', 'LifetimeException',
@@ -39,10 +39,10 @@ class LifetimeException:
             500 Internal Error
 
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         try:
             for exception in list_exceptions():
-                yield dumps(exception, cls=APIEncoder) + '\n'
+                yield encoder.encode(exception)
         except LifetimeExceptionNotFound as error:
             raise generate_http_error(404, 'LifetimeExceptionNotFound', error.args[0][0])
         except RucioException as error:
@@ -168,4 +168,5 @@ class LifetimeExceptionId:
 
 APP = application(URLS, globals())
 APP.add_processor(loadhook(rucio_loadhook))
+APP.add_processor(compression_processor)
 application = APP.wsgifunc()
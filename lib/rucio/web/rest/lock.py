@@ -11,12 +11,12 @@
 
 from logging import getLogger, StreamHandler, DEBUG
 from urlparse import parse_qs
-from web import application, ctx, header, InternalError, loadhook
+from web import application, ctx, InternalError, loadhook
 
 from rucio.api.lock import get_dataset_locks_by_rse, get_dataset_locks
 from rucio.common.exception import RucioException
-from rucio.common.utils import generate_http_error, render_json
-from rucio.web.rest.common import rucio_loadhook
+from rucio.common.utils import generate_http_error
+from rucio.web.rest.common import compression_processor, rucio_loadhook, stream_encoder
 
 LOGGER = getLogger("rucio.lock")
 SH = StreamHandler()
@@ -42,7 +42,7 @@ class LockByRSE(object):
 
         :returns: JSON dict containing informations about the requested user.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         did_type = None
         if ctx.query:
             params = parse_qs(ctx.query[1:])
@@ -51,7 +51,7 @@ class LockByRSE(object):
         try:
             if did_type == 'dataset':
                 for lock in get_dataset_locks_by_rse(rse):
-                    yield render_json(**lock) + '\n'
+                    yield encoder.encode(lock)
             else:
                 raise InternalError('Wrong did_type specified')
         except RucioException, error:
@@ -75,7 +75,7 @@ class LockByScopeName(object):
 
         :returns: JSON dict containing informations about the requested user.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         did_type = None
         if ctx.query:
             params = parse_qs(ctx.query[1:])
@@ -84,7 +84,7 @@ class LockByScopeName(object):
         try:
             if did_type == 'dataset':
                 for lock in get_dataset_locks(scope, name):
-                    yield render_json(**lock) + '\n'
+                    yield encoder.encode(lock)
             else:
                 raise InternalError('Wrong did_type specified')
         except RucioException, error:
@@ -99,4 +99,5 @@ class LockByScopeName(object):
 
 APP = application(URLS, globals())
 APP.add_processor(loadhook(rucio_loadhook))
+APP.add_processor(compression_processor)
 application = APP.wsgifunc()
@@ -11,7 +11,8 @@
 
 
 import traceback
-from web import application, header, data, loadhook, unloadhook, InternalError, OK
+from urlparse import parse_qsl
+from web import application, ctx, header, data, loadhook, unloadhook, InternalError, OK
 # from web import application, ctx, header, data, loadhook, unloadhook, InternalError, found, OK
 
 from rucio.common.exception import RucioException
@@ -78,6 +79,8 @@ class ObjectStore(RucioController):
         HTTP Error:
             401 Unauthorized
             500 Internal Error
+
+        :query check: If False, the URLs to read are signed without checking that the files exist.
         """
         header('Content-Type', 'application/json')
         json_data = data()
@@ -86,8 +89,12 @@ class ObjectStore(RucioController):
         except ValueError:
             raise generate_http_error(400, 'ValueError', 'Cannot decode json parameter list')
 
+        check = True
+        if ctx.query:
+            check = dict(parse_qsl(ctx.query[1:])).get('check', 'True').lower() not in ('false', '0')
+
         try:
-            result = objectstore.get_signed_urls(parameters, rse=rse, operation=operation)
+            result = objectstore.get_signed_urls(parameters, rse=rse, operation=operation, check=check)
             for url in result:
                 if isinstance(result[url], Exception):
                     raise result[url]
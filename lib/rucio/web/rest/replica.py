@@ -33,8 +33,8 @@ from rucio.common.exception import (AccessDenied, DataIdentifierAlreadyExists,
                                     RSENotFound, UnsupportedOperation, ReplicaNotFound)
 from rucio.common.replica_sorter import sort_random, sort_geoip, sort_closeness, sort_dynamic, sort_ranking
 
-from rucio.common.utils import generate_http_error, parse_response, APIEncoder
-from rucio.web.rest.common import rucio_loadhook, rucio_unloadhook, RucioController
+from rucio.common.utils import generate_http_error, parse_response
+from rucio.web.rest.common import compression_processor, rucio_loadhook, rucio_unloadhook, stream_encoder, RucioController
 
 URLS = ('/list/?$', 'ListReplicas',
         '/?$', 'Replicas',
@@ -48,6 +48,35 @@ URLS = ('/list/?$', 'ListReplicas',
         '/dids/?$', 'ReplicasDIDs')
 
 
+def metalink_file(rfile, replicas, dictreplica, limit=None):
+    """
+    Build the metalink description of a file.
+
+    :param rfile: The file replicas dictionary, as returned by list_replicas.
+    :param replicas: The PFNs, in order of priority.
+    :param dictreplica: The RSE of each PFN.
+    :param limit: The maximum number of PFNs.
+    :returns: The <file> element as a string.
+    """
+    parts = [' <file name="', rfile['name'], '">\n',
+             '  <identity>', rfile['scope'], ':', rfile['name'], '</identity>\n']
+    if rfile['adler32'] is not None:
+        parts.extend(('  <hash type="adler32">', rfile['adler32'], '</hash>\n'))
+    if rfile['md5'] is not None:
+        parts.extend(('  <hash type="md5">', rfile['md5'], '</hash>\n'))
+    parts.extend(('  <size>', str(rfile['bytes']), '</size>\n',
+                  '  <glfn name="/atlas/rucio/%s:%s">' % (rfile['scope'], rfile['name']), '</glfn>\n'))
+
+    idx = 0
+    for replica in replicas:
+        parts.extend(('   <url location="', str(dictreplica[replica]), '" priority="', str(idx + 1), '">', replica, '</url>\n'))
+        idx += 1
+        if limit and limit == idx:
+            break
+    parts.append(' </file>\n')
+    return ''.join(parts)
+
+
 class Replicas(RucioController):
 
     def GET(self, scope, name):
@@ -79,12 +108,15 @@ class Replicas(RucioController):
             if 'select' in params:
                 select = params['select'][0]
             if 'limit' in params:
-                limit = int(params['limit'][0])
+                try:
+                    limit = int(params['limit'][0])
+                except ValueError:
+                    raise generate_http_error(400, 'ValueError', 'limit must be an integer')
 
         try:
             # first, set the appropriate content type, and stream the header
             if not metalink:
-                header('Content-Type', 'application/x-json-stream')
+                encoder = stream_encoder()
             else:
                 header('Content-Type', 'application/metalink4+xml')
                 yield '<?xml version="1.0" encoding="UTF-8"?>\n<metalink xmlns="urn:ietf:params:xml:ns:metalink">\n'
@@ -109,28 +141,9 @@ class Replicas(RucioController):
                 else:
                     replicas = sort_random(dictreplica)
                 if not metalink:
-                    yield dumps(rfile) + '\n'
+                    yield encoder.encode(rfile)
                 else:
-                    yield ' <file name="' + rfile['name'] + '">\n'
-                    yield '  <identity>' + rfile['scope'] + ':' + rfile['name'] + '</identity>\n'
-
-                    if rfile['adler32'] is not None:
-                        yield '  <hash type="adler32">' + rfile['adler32'] + '</hash>\n'
-                    if rfile['md5'] is not None:
-                        yield '  <hash type="md5">' + rfile['md5'] + '</hash>\n'
-
-                    yield '  <size>' + str(rfile['bytes']) + '</size>\n'
-
-                    yield '  <glfn name="/atlas/rucio/%s:%s">' % (rfile['scope'], rfile['name'])
-                    yield '</glfn>\n'
-
-                    idx = 0
-                    for replica in replicas:
-                        yield '   <url location="' + str(dictreplica[replica]) + '" priority="' + str(idx + 1) + '">' + replica + '</url>\n'
-                        idx += 1
-                        if limit and limit == idx:
-                            break
-                    yield ' </file>\n'
+                    yield metalink_file(rfile, replicas, dictreplica, limit)
 
             # don't forget to send the metalink footer
             if metalink:
@@ -314,7 +327,7 @@ class ListReplicas(RucioController):
         try:
             # first, set the appropriate content type, and stream the header
             if not metalink:
-                header('Content-Type', 'application/x-json-stream')
+                encoder = stream_encoder()
             else:
                 header('Content-Type', 'application/metalink4+xml')
                 yield '<?xml version="1.0" encoding="UTF-8"?>\n<metalink xmlns="urn:ietf:params:xml:ns:metalink">\n'
@@ -335,19 +348,8 @@ class ListReplicas(RucioController):
                         dictreplica[replica] = rse
 
                 if not metalink:
-                    yield dumps(rfile, cls=APIEncoder) + '\n'
+                    yield encoder.encode(rfile)
                 else:
-                    yield ' <file name="' + rfile['name'] + '">\n'
-                    yield '  <identity>' + rfile['scope'] + ':' + rfile['name'] + '</identity>\n'
-                    if rfile['adler32'] is not None:
-                        yield '  <hash type="adler32">' + rfile['adler32'] + '</hash>\n'
-                    if rfile['md5'] is not None:
-                        yield '  <hash type="md5">' + rfile['md5'] + '</hash>\n'
-                    yield '  <size>' + str(rfile['bytes']) + '</size>\n'
-
-                    yield '  <glfn name="/atlas/rucio/%s:%s">' % (rfile['scope'], rfile['name'])
-                    yield '</glfn>\n'
-
                     if select == 'geoip':
                         replicas = sort_geoip(dictreplica, client_location['ip'])
                     elif select == 'closeness':
@@ -359,13 +361,7 @@ class ListReplicas(RucioController):
                     else:
                         replicas = sort_random(dictreplica)
 
-                    idx = 0
-                    for replica in replicas:
-                        yield '   <url location="' + str(dictreplica[replica]) + '" priority="' + str(idx + 1) + '">' + replica + '</url>\n'
-                        idx += 1
-                        if limit and limit == idx:
-                            break
-                    yield ' </file>\n'
+                    yield metalink_file(rfile, replicas, dictreplica, limit)
 
             # don't forget to send the metalink footer
             if metalink:
@@ -397,7 +393,7 @@ class ReplicasDIDs(RucioController):
         """
         json_data = data()
         rse, pfns = None, []
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         rse = None
         try:
             params = parse_response(json_data)
@@ -410,7 +406,7 @@ class ReplicasDIDs(RucioController):
 
         try:
             for pfn in get_did_from_pfns(pfns, rse):
-                yield dumps(pfn) + '\n'
+                yield encoder.encode(pfn)
         except RucioException, e:
             raise generate_http_error(500, e.__class__.__name__, e.args[0][0])
         except Exception, e:
@@ -509,7 +505,7 @@ class BadReplicasStates(RucioController):
             500 InternalError
 
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         result = []
         state, rse, younger_than, older_than, limit, list_pfns = None, None, None, None, None, None
         if ctx.query:
@@ -528,7 +524,10 @@ class BadReplicasStates(RucioController):
             if 'older_than' in params:
                 older_than = datetime.strptime(params['older_than'], "%Y-%m-%dT%H:%M:%S.%f")
             if 'limit' in params:
-                limit = int(params['limit'][0])
+                try:
+                    limit = int(params['limit'][0])
+                except ValueError:
+                    raise generate_http_error(400, 'ValueError', 'limit must be an integer')
             if 'list_pfns' in params:
                 list_pfns = bool(params['list_pfns'][0])
 
@@ -540,7 +539,7 @@ class BadReplicasStates(RucioController):
             print format_exc()
             raise InternalError(e)
         for row in result:
-            yield dumps(row, cls=APIEncoder) + '\n'
+            yield encoder.encode(row)
 
 
 class BadReplicasSummary(RucioController):
@@ -556,7 +555,7 @@ class BadReplicasSummary(RucioController):
             500 InternalError
 
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         result = []
         rse_expression, from_date, to_date = None, None, None
         if ctx.query:
@@ -579,7 +578,7 @@ class BadReplicasSummary(RucioController):
             print format_exc()
             raise InternalError(e)
         for row in result:
-            yield dumps(row, cls=APIEncoder) + '\n'
+            yield encoder.encode(row)
 
 
 class DatasetReplicas(RucioController):
@@ -597,7 +596,7 @@ class DatasetReplicas(RucioController):
 
         :returns: A dictionary containing all replicas information.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         deep = False
         if ctx.query:
             try:
@@ -608,7 +607,7 @@ class DatasetReplicas(RucioController):
                 deep = params['deep'][0]
         try:
             for row in list_dataset_replicas(scope=scope, name=name, deep=deep):
-                yield dumps(row, cls=APIEncoder) + '\n'
+                yield encoder.encode(row)
         except RucioException, e:
             raise generate_http_error(500, e.__class__.__name__, e.args[0][0])
         except Exception, e:
@@ -631,10 +630,10 @@ class ReplicasRSE(RucioController):
 
         :returns: A dictionary containing all replicas on the RSE.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         try:
             for row in list_datasets_per_rse(rse=rse):
-                yield dumps(row, cls=APIEncoder) + '\n'
+                yield encoder.encode(row)
         except RucioException, e:
             raise generate_http_error(500, e.__class__.__name__, e.args[0][0])
         except Exception, e:
@@ -649,4 +648,5 @@ class ReplicasRSE(RucioController):
 APP = application(URLS, globals())
 APP.add_processor(loadhook(rucio_loadhook))
 APP.add_processor(unloadhook(rucio_unloadhook))
+APP.add_processor(compression_processor)
 application = APP.wsgifunc()
@@ -27,7 +27,7 @@ from rucio.api.rse import (add_rse, update_rse, list_rses, del_rse, add_rse_attr
                            set_rse_limits, get_rse_limits, parse_rse_expression)
 from rucio.common.exception import Duplicate, AccessDenied, RSENotFound, RucioException, RSEOperationNotSupported, RSEProtocolNotSupported, InvalidObject, RSEProtocolDomainNotSupported, RSEProtocolPriorityError, InvalidRSEExpression
 from rucio.common.utils import generate_http_error, render_json, APIEncoder
-from rucio.web.rest.common import rucio_loadhook, RucioController
+from rucio.web.rest.common import compression_processor, rucio_loadhook, stream_encoder, RucioController
 
 URLS = (
     '/(.+)/attr/(.+)', 'Attributes',
@@ -63,13 +63,13 @@ class RSEs(RucioController):
 
         :returns: A list containing all RSEs.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         params = input()
         if 'expression' in params:
             try:
                 for rse in parse_rse_expression(params['expression']):
                     item = {'rse': rse}
-                    yield render_json(**item) + '\n'
+                    yield encoder.encode(item)
             except InvalidRSEExpression, error:
                 raise generate_http_error(400, 'InvalidRSEExpression', error[0][0])
             except InvalidObject, error:
@@ -78,7 +78,7 @@ class RSEs(RucioController):
                 raise generate_http_error(500, error.__class__.__name__, error.args[0][0])
         else:
             for rse in list_rses():
-                yield render_json(**rse) + '\n'
+                yield encoder.encode(rse)
 
 
 class RSE(RucioController):
@@ -500,7 +500,7 @@ class Usage:
 
         :param rse: the RSE name.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         usage = None
         source = None
         if ctx.query:
@@ -519,7 +519,7 @@ class Usage:
             raise InternalError(error)
 
         for u in usage:
-            yield render_json(**u) + '\n'
+            yield encoder.encode(u)
 
     def PUT(self, rse):
         """ Update RSE usage information.
@@ -573,7 +573,7 @@ class UsageHistory:
 
         :param rse: the RSE name.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         source = None
         if ctx.query:
             params = parse_qs(ctx.query[1:])
@@ -582,7 +582,7 @@ class UsageHistory:
 
         try:
             for usage in list_rse_usage_history(rse=rse, issuer=ctx.env.get('issuer'), source=source):
-                yield render_json(**usage) + '\n'
+                yield encoder.encode(usage)
         except RSENotFound, error:
             raise generate_http_error(404, 'RSENotFound', error[0][0])
         except RucioException, error:
@@ -692,4 +692,5 @@ class RSEAccountUsageLimit:
 
 APP = application(URLS, globals())
 APP.add_processor(loadhook(rucio_loadhook))
+APP.add_processor(compression_processor)
 application = APP.wsgifunc()
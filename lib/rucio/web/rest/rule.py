@@ -27,8 +27,8 @@ from rucio.common.exception import (InsufficientAccountLimit, RuleNotFound, Acce
                                     ReplicationRuleCreationTemporaryFailed, InvalidRuleWeight, StagingAreaRuleRequiresLifetime,
                                     DuplicateRule, InvalidObject, AccountNotFound, RuleReplaceFailed, ScratchDiskLifetimeConflict,
                                     ManualRuleApprovalBlocked, UnsupportedOperation)
-from rucio.common.utils import generate_http_error, render_json, APIEncoder
-from rucio.web.rest.common import rucio_loadhook
+from rucio.common.utils import generate_http_error, render_json
+from rucio.web.rest.common import compression_processor, rucio_loadhook, stream_encoder
 
 LOGGER = getLogger("rucio.rule")
 SH = StreamHandler()
@@ -155,7 +155,7 @@ class AllRule:
 
         :param scope: The scope name.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         filters = {}
         if ctx.query:
             params = dict(parse_qsl(ctx.query[1:]))
@@ -163,7 +163,7 @@ class AllRule:
 
         try:
             for rule in list_replication_rules(filters=filters):
-                yield dumps(rule, cls=APIEncoder) + '\n'
+                yield encoder.encode(rule)
         except RuleNotFound as error:
             raise generate_http_error(404, 'RuleNotFound', error.args[0][0])
         except Exception as error:
@@ -304,7 +304,7 @@ class ReplicaLocks:
 
         :returns: JSON dict containing informations about the requested user.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         try:
             locks = get_replica_locks_for_rule_id(rule_id)
         except RucioException as error:
@@ -313,7 +313,7 @@ class ReplicaLocks:
             raise InternalError(error)
 
         for lock in locks:
-            yield dumps(lock, cls=APIEncoder) + '\n'
+            yield encoder.encode(lock)
 
 
 class ReduceRule:
@@ -379,7 +379,7 @@ class RuleHistory:
 
         :returns: JSON dict containing informations about the requested user.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         try:
             history = list_replication_rule_history(rule_id)
         except RucioException as error:
@@ -388,7 +388,7 @@ class RuleHistory:
             raise InternalError(error)
 
         for hist in history:
-            yield dumps(hist, cls=APIEncoder) + '\n'
+            yield encoder.encode(hist)
 
 
 class RuleHistoryFull:
@@ -406,7 +406,7 @@ class RuleHistoryFull:
 
         :returns: JSON dict containing informations about the requested user.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         try:
             history = list_replication_rule_full_history(scope, name)
         except RucioException as error:
@@ -415,7 +415,7 @@ class RuleHistoryFull:
             raise InternalError(error)
 
         for hist in history:
-            yield dumps(hist, cls=APIEncoder) + '\n'
+            yield encoder.encode(hist)
 
 
 class RuleAnalysis:
@@ -450,4 +450,5 @@ class RuleAnalysis:
 
 APP = application(URLS, globals())
 APP.add_processor(loadhook(rucio_loadhook))
+APP.add_processor(compression_processor)
 application = APP.wsgifunc()
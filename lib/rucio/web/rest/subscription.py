@@ -11,7 +11,7 @@
  - Thomas Beermann, <thomas.beermann@cern.ch>, 2014
 """
 
-from json import dumps, loads
+from json import loads
 try:
     from urllib.parse import parse_qs
 except ImportError:
@@ -23,8 +23,8 @@ from web import application, ctx, data, header, BadRequest, Created, InternalErr
 from rucio.api.rule import list_replication_rules
 from rucio.api.subscription import list_subscriptions, add_subscription, update_subscription, list_subscription_rule_states, get_subscription_by_id
 from rucio.common.exception import InvalidObject, RucioException, SubscriptionDuplicate, SubscriptionNotFound, RuleNotFound, AccessDenied
-from rucio.common.utils import generate_http_error, APIEncoder, render_json
-from rucio.web.rest.common import rucio_loadhook, RucioController
+from rucio.common.utils import generate_http_error, render_json
+from rucio.web.rest.common import compression_processor, rucio_loadhook, stream_encoder, RucioController
 
 URLS = (
     '/Id/(.*)', 'SubscriptionId',
@@ -54,10 +54,10 @@ class Subscription:
         :param account: The account name.
         :param name: The subscription name.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         try:
             for subscription in list_subscriptions(name=name, account=account):
-                yield dumps(subscription, cls=APIEncoder) + '\n'
+                yield encoder.encode(subscription)
         except SubscriptionNotFound as error:
             raise generate_http_error(404, 'SubscriptionNotFound', error[0][0])
         except Exception as error:
@@ -166,7 +166,7 @@ class Rules:
 
         :param scope: The scope name.
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         state = None
         if ctx.query:
             params = parse_qs(ctx.query[1:])
@@ -177,10 +177,10 @@ class Rules:
             if len(subscriptions) > 0:
                 if state:
                     for rule in list_replication_rules({'subscription_id': subscriptions[0], 'state': state}):
-                        yield dumps(rule, cls=APIEncoder) + '\n'
+                        yield encoder.encode(rule)
                 else:
                     for rule in list_replication_rules({'subscription_id': subscriptions[0]}):
-                        yield dumps(rule, cls=APIEncoder) + '\n'
+                        yield encoder.encode(rule)
         except RuleNotFound as error:
             raise generate_http_error(404, 'RuleNotFound', error.args[0][0])
         except SubscriptionNotFound as error:
@@ -214,10 +214,10 @@ class States(RucioController):
             500 Internal Error
 
         """
-        header('Content-Type', 'application/x-json-stream')
+        encoder = stream_encoder()
         try:
             for row in list_subscription_rule_states(account=account):
-                yield dumps(row, cls=APIEncoder) + '\n'
+                yield encoder.encode(row)
         except RucioException as error:
             raise generate_http_error(500, error.__class__.__name__, error.args[0])
         except Exception as error:
@@ -257,4 +257,5 @@ class SubscriptionId:
 
 APP = application(URLS, globals())
 APP.add_processor(loadhook(rucio_loadhook))
+APP.add_processor(compression_processor)
 application = APP.wsgifunc()
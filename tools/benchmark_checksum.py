@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#                       http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+Compare the checksum implementations over files from 1 KB to 10 GB.
+
+- legacy adler32: the file iterated by lines, as rucio.common.utils.adler32 did;
+- legacy adler32+md5: the same, then another read of the file for md5;
+- adler32: rucio.common.checksum with a fixed buffer;
+- adler32+md5: both checksums in a single pass;
+- parallel: adler32 of several files of the same size with checksum_files.
+
+The files are written once and read several times, so the timings are the ones of a warm
+page cache, where the checksums and not the disk are the bottleneck. The files are removed
+at the end.
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+
+from rucio.common.checksum import BUFFER_SIZE, checksum_files, file_checksums
+
+SIZES = ['1K', '1M', '100M', '1G', '10G']
+UNITS = {'K': 1000, 'M': 1000 ** 2, 'G': 1000 ** 3}
+
+
+def parse_size(size):
+    if size[-1].upper() in UNITS:
+        return int(size[:-1]) * UNITS[size[-1].upper()]
+    return int(size)
+
+
+def write_file(path, size):
+    """
+    Write a file of random data, made of a repeated random block.
+    """
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as out:
+        for _ in xrange(size / len(block)):
+            out.write(block)
+        out.write(block[:size % len(block)])
+
+
+def legacy_adler32(path):
+    adler = 1L
+    with open(path, 'rb') as fileobj:
+        for line in fileobj:
+            adler = zlib.adler32(line, adler)
+    return '%08x' % (adler & 0xffffffff)
+
+
+def legacy_md5(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as fileobj:
+        for line in fileobj:
+            md5.update(line)
+    return md5.hexdigest()
+
+
+def measure(function, size, repeat):
+    """
+    :returns: The best throughput of the function, in MB/s.
+    """
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return size / 1e6 / max(best, 1e-9)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', default=SIZES, help='File sizes, with K, M or G suffixes (default: %s)' % ' '.join(SIZES))
+    parser.add_argument('--buffer-size', type=int, default=BUFFER_SIZE, help='Size of the reads in bytes')
+    parser.add_argument('--files', type=int, default=4, help='Number of files checksummed in parallel')
+    parser.add_argument('--processes', type=int, help='Number of checksum processes, the number of CPUs by default')
+    parser.add_argument('--dir', help='Directory of the test files, a temporary directory by default')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(dir=args.dir)
+    columns = ['legacy adler32', 'legacy adler32+md5', 'adler32', 'adler32+md5', 'parallel adler32']
+    print 'throughput in MB/s, buffer of %i bytes, %i files in parallel' % (args.buffer_size, args.files)
+    print '%-8s' % 'size' + ''.join('%20s' % column for column in columns)
+    try:
+        for size in args.sizes:
+            nbytes = parse_size(size)
+            path = os.path.join(directory, 'file_0')
+            write_file(path, nbytes)
+            # Fewer repetitions for the large files
+            repeat = max(1, min(20, int(1e9 / max(nbytes, 1))))
+            assert legacy_adler32(path) == file_checksums(path, ('adler32',), args.buffer_size)['adler32']
+            results = [measure(lambda: legacy_adler32(path), nbytes, repeat),
+                       measure(lambda: (legacy_adler32(path), legacy_md5(path)), nbytes, repeat),
+                       measure(lambda: file_checksums(path, ('adler32',), args.buffer_size), nbytes, repeat),
+                       measure(lambda: file_checksums(path, ('adler32', 'md5'), args.buffer_size), nbytes, repeat)]
+            paths = [path]
+            for index in xrange(1, args.files):
+                paths.append(os.path.join(directory, 'file_%i' % index))
+                shutil.copy(path, paths[-1])
+            results.append(measure(lambda: checksum_files(paths, ('adler32',), args.processes, args.buffer_size), nbytes * len(paths), repeat))
+            for extra in paths[1:]:
+                os.unlink(extra)
+            print '%-8s' % size + ''.join('%20.1f' % result for result in results)
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(directory)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#                       http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+Measure the end to end throughput of hermes, in messages per second.
+
+The messages table is filled with generated messages, which the hermes broker
+threads deliver to a local STOMP stand-in accepting every frame. The rate is
+measured from the first frame received by the stand-in until the messages
+table is drained.
+
+This deletes all pending messages of the configured database.
+"""
+
+import argparse
+import socket
+import SocketServer
+import sys
+import threading
+import time
+
+from rucio.common import config
+from rucio.core.message import add_messages, truncate_messages
+from rucio.daemons.hermes import hermes
+from rucio.db.sqla import models
+from rucio.db.sqla.session import get_session
+
+
+class StompStandIn(SocketServer.ThreadingTCPServer):
+    """
+    Minimal STOMP server counting the received messages.
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address):
+        SocketServer.ThreadingTCPServer.__init__(self, address, StompHandler)
+        self.lock = threading.Lock()
+        self.received = 0
+        self.first_received_at = None
+
+
+class StompHandler(SocketServer.BaseRequestHandler):
+    """
+    Answer CONNECT and receipt requests, count SEND frames.
+    """
+
+    def handle(self):
+        data = ''
+        while True:
+            try:
+                chunk = self.request.recv(65536)
+            except socket.error:
+                return
+            if not chunk:
+                return
+            data += chunk
+            while '\x00' in data:
+                frame, data = data.split('\x00', 1)
+                if not self.handle_frame(frame.lstrip('\r\n')):
+                    return
+
+    def handle_frame(self, frame):
+        if not frame:
+            return True
+        lines = frame.split('\n\n', 1)[0].split('\n')
+        command = lines[0].strip()
+        headers = dict(line.split(':', 1) for line in lines[1:] if ':' in line)
+
+        if command in ('CONNECT', 'STOMP'):
+            self.request.sendall('CONNECTED\nversion:1.2\nheart-beat:0,0\n\n\x00')
+        elif command == 'SEND':
+            with self.server.lock:
+                if self.server.first_received_at is None:
+                    self.server.first_received_at = time.time()
+                self.server.received += 1
+        if 'receipt' in headers:
+            self.request.sendall('RECEIPT\nreceipt-id:%s\n\n\x00' % headers['receipt'])
+        return command != 'DISCONNECT'
+
+
+def count_messages():
+    session = get_session()
+    try:
+        return session.query(models.Message).count()
+    finally:
+        session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=10000, help='Number of messages to deliver')
+    parser.add_argument('--threads', type=int, default=1, help='Number of hermes broker threads')
+    parser.add_argument('--bulk', type=int, default=1000, help='Number of messages retrieved per iteration')
+    parser.add_argument('--payload-size', type=int, default=200, help='Size of the message payloads in bytes')
+    parser.add_argument('--timeout', type=int, default=600, help='Give up after this number of seconds')
+    args = parser.parse_args()
+
+    server = StompStandIn(('127.0.0.1', 0))
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
+    parser = getattr(config, '__CONFIG')
+    if not parser.has_section('messaging-hermes'):
+        parser.add_section('messaging-hermes')
+    for option, value in (('use_ssl', 'False'),
+                          ('username', 'benchmark'),
+                          ('password', 'benchmark'),
+                          ('port', str(server.server_address[1])),
+                          ('nonssl_port', str(server.server_address[1])),
+                          ('destination', '/topic/rucio.events')):
+        parser.set('messaging-hermes', option, value)
+
+    truncate_messages()
+    padding = 'x' * args.payload_size
+    for start in xrange(0, args.messages, 10000):
+        add_messages([{'event_type': 'benchmark', 'payload': {'number': number, 'padding': padding}}
+                      for number in xrange(start, min(start + 10000, args.messages))])
+    print 'Inserted %i messages' % args.messages
+
+    threads = [threading.Thread(target=hermes.deliver_messages,
+                                kwargs={'brokers_resolved': ['127.0.0.1'],
+                                        'thread': i,
+                                        'bulk': args.bulk,
+                                        'delay': 1}) for i in xrange(args.threads)]
+    t_start = time.time()
+    for thread in threads:
+        thread.start()
+
+    remaining = args.messages
+    while remaining and time.time() - t_start < args.timeout:
+        time.sleep(0.1)
+        remaining = count_messages()
+    t_end = time.time()
+
+    hermes.GRACEFUL_STOP.set()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+
+    if remaining or not server.first_received_at:
+        print 'Timeout: %i messages not delivered' % remaining
+        return 1
+
+    duration = t_end - server.first_received_at
+    print 'Delivered %i messages (%i received) with %i threads in %.2f seconds: %.1f messages/second' % (args.messages,
+                                                                                                         server.received,
+                                                                                                         args.threads,
+                                                                                                         duration,
+                                                                                                         args.messages / duration)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#                       http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+Compare the encodings of the replica list responses: bytes on the wire and CPU time.
+
+Replicas shaped like the ones of list_replicas are generated, encoded in each
+stream format available here and compressed with each content coding, as the
+REST server does. The server CPU time is the time spent encoding and compressing,
+the time to generate the replicas is measured separately and subtracted. The
+client CPU time is the time spent decompressing and decoding.
+
+msgpack and zstd are only measured if the modules are installed.
+"""
+
+import argparse
+import os
+import sys
+
+from StringIO import StringIO
+
+from rucio.common.streaming import (JSON_STREAM, METALINK, STREAM_DECODERS, DecompressingReader,
+                                    StreamEncoder, compress_stream, content_codings, iter_metalink, stream_formats)
+from rucio.web.rest.replica import metalink_file
+
+
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def generate_replicas(number, rses):
+    """
+    Generate the replicas of a dataset, each file on the given number of RSEs.
+    """
+    for index in xrange(number):
+        name = 'data17_13TeV.00331951.physics_Main.merge.AOD.f848_m1844._lb%04d._%06d.1' % (index / 1000, index)
+        replicas = {}
+        pfns = {}
+        states = {}
+        for rse_index in xrange(rses):
+            rse = 'SITE%02d_DATADISK' % rse_index
+            pfn = 'root://se%02d.example.org:1094//atlas/rucio/data17_13TeV/%02x/%02x/%s' % (rse_index, index % 256, (index / 256) % 256, name)
+            replicas[rse] = [pfn]
+            pfns[pfn] = {'rse': rse, 'type': 'DISK', 'volatile': False}
+            states[rse] = 'AVAILABLE'
+        yield {'scope': 'data17_13TeV', 'name': name, 'bytes': 2000000000 + index,
+               'adler32': '%08x' % (index * 2654435761 % 2 ** 32), 'md5': None,
+               'rses': replicas, 'pfns': pfns, 'states': states}
+
+
+def encode(replicas, content_type):
+    if content_type == METALINK:
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n<metalink xmlns="urn:ietf:params:xml:ns:metalink">\n'
+        for replica in replicas:
+            pfns = [pfn for rse in replica['rses'] for pfn in replica['rses'][rse]]
+            dictreplica = dict((pfn, rse) for rse in replica['rses'] for pfn in replica['rses'][rse])
+            yield metalink_file(replica, pfns, dictreplica)
+        yield '</metalink>\n'
+    else:
+        encoder = StreamEncoder(content_type)
+        for replica in replicas:
+            yield encoder.encode(replica)
+
+
+def measure(args, content_type, coding, generation_time):
+    chunks = encode(generate_replicas(args.replicas, args.rses), content_type)
+    if coding != 'identity':
+        chunks = compress_stream(chunks, coding, level=args.gzip_level if coding == 'gzip' else args.zstd_level)
+
+    # Only keep the body when it is decoded afterwards
+    body = StringIO() if args.decode else None
+    size = 0
+    start = cpu_time()
+    for chunk in chunks:
+        size += len(chunk)
+        if body is not None:
+            body.write(chunk)
+    server_time = cpu_time() - start - generation_time
+
+    client_time = None
+    if body is not None:
+        body.seek(0)
+        start = cpu_time()
+        raw = body if coding == 'identity' else DecompressingReader(body, coding)
+        decoder = iter_metalink if content_type == METALINK else STREAM_DECODERS[content_type]
+        decoded = sum(1 for _ in decoder(iter(lambda: raw.read(65536), '')))
+        client_time = cpu_time() - start
+        assert decoded == args.replicas
+    return size, server_time, client_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--replicas', type=int, default=1000000, help='Number of file replicas to list')
+    parser.add_argument('--rses', type=int, default=2, help='Number of RSEs per file')
+    parser.add_argument('--gzip-level', type=int, default=1, help='gzip compression level')
+    parser.add_argument('--zstd-level', type=int, default=3, help='zstd compression level')
+    parser.add_argument('--no-metalink', dest='metalink', action='store_false', help='Do not measure the metalink format')
+    parser.add_argument('--no-decode', dest='decode', action='store_false', help='Do not measure the client decoding, which keeps the responses in memory')
+    args = parser.parse_args()
+
+    start = cpu_time()
+    for _ in generate_replicas(args.replicas, args.rses):
+        pass
+    generation_time = cpu_time() - start
+
+    formats = stream_formats() + ([METALINK] if args.metalink else [])
+    print '%i replicas on %i RSEs, generated in %.2f CPU seconds' % (args.replicas, args.rses, generation_time)
+    print '%-42s %-8s %14s %7s %12s %12s' % ('format', 'coding', 'bytes', 'ratio', 'server cpu s', 'client cpu s')
+    reference = None
+    for content_type in formats:
+        for coding in ['identity'] + content_codings():
+            size, server_time, client_time = measure(args, content_type, coding, generation_time)
+            if reference is None and content_type == JSON_STREAM:
+                reference = size
+            client_cpu = '-' if client_time is None else '%.2f' % client_time
+            print '%-42s %-8s %14i %7.2f %12.2f %12s' % (content_type, coding, size, float(reference) / size, server_time, client_cpu)
+            sys.stdout.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#                       http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+Measure the throughput of the WebDAV protocol against a local HTTP server.
+
+A file is uploaded with put and downloaded with get and stream, with the buffer size
+and number of parallel range requests given. The former behaviour of the protocol is
+approximated with a single stream and chunks of 10 MB for put, 1 KB for get and 1 MB
+for stream.
+
+Without --url, the test server of rucio.tests.mock.http serves a temporary directory.
+It is written in Python and its connections share the interpreter of the benchmark,
+so it limits the throughput. Use --url to measure against a real server, e.g. a local
+nginx or Apache with WebDAV enabled.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from urlparse import urlparse
+
+from rucio.rse.protocols import webdav
+from rucio.tests.mock.http import start_http_server
+
+
+def create_protocol(url, buffer_size, streams, segment_size):
+    parsed = urlparse(url)
+    storage = webdav.Default({'scheme': parsed.scheme, 'hostname': parsed.hostname, 'port': parsed.port,
+                              'prefix': parsed.path if parsed.path.endswith('/') else parsed.path + '/'},
+                             {'deterministic': True})
+    storage.connect({'cert': os.getenv('X509_USER_PROXY'), 'buffer_size': buffer_size, 'parallel_streams': streams,
+                     'range_threshold': segment_size, 'segment_size': segment_size})
+    return storage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1024, help='Size of the file in MB')
+    parser.add_argument('--streams', type=int, default=webdav.PARALLEL_STREAMS, help='Number of parallel range requests')
+    parser.add_argument('--buffer-size', type=int, default=webdav.BUFFER_SIZE, help='Buffer size in bytes')
+    parser.add_argument('--segment-size', type=int, default=webdav.SEGMENT_SIZE, help='Size of the range requests in bytes')
+    parser.add_argument('--url', help='URL of the directory to use on a WebDAV server, instead of a local test server')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    server = None
+    try:
+        url = args.url
+        if url is None:
+            os.mkdir(os.path.join(tmpdir, 'server'))
+            server = start_http_server(os.path.join(tmpdir, 'server'))
+            url = 'http://127.0.0.1:%i/' % server.server_port
+        source = os.path.join(tmpdir, 'source.raw')
+        block = os.urandom(1024 * 1024)
+        with open(source, 'wb') as out:
+            for _ in xrange(args.size):
+                out.write(block)
+
+        # name, buffer size of put, get and stream, number of streams
+        configurations = [('legacy', 10000000, 1024, 1024 * 1024, 1), ('buffer', args.buffer_size, args.buffer_size, args.buffer_size, 1),
+                          ('parallel', args.buffer_size, args.buffer_size, args.buffer_size, args.streams)]
+        print '%i MB file, throughput in MB/s' % args.size
+        print '%-10s %12s %8s %10s %10s %10s' % ('setting', 'buffer', 'streams', 'put', 'get', 'stream')
+        for index, (name, put_buffer_size, buffer_size, stream_buffer_size, streams) in enumerate(configurations):
+            storage = create_protocol(url, put_buffer_size, streams, args.segment_size)
+            target = 'benchmark_%i_%s.raw' % (os.getpid(), index)
+            results = []
+            start = time.time()
+            storage.put(source, target)
+            results.append(time.time() - start)
+            storage.buffer_size = buffer_size
+
+            start = time.time()
+            with open(os.devnull, 'w') as devnull:
+                # The progress bar of get is not part of the measurement
+                stdout, stderr, sys.stdout, sys.stderr = sys.stdout, sys.stderr, devnull, devnull
+                try:
+                    storage.get(target, os.path.join(tmpdir, 'get.raw'))
+                finally:
+                    sys.stdout, sys.stderr = stdout, stderr
+            results.append(time.time() - start)
+            assert os.path.getsize(os.path.join(tmpdir, 'get.raw')) == args.size * 1024 * 1024
+            os.unlink(os.path.join(tmpdir, 'get.raw'))
+
+            start = time.time()
+            received = sum(len(chunk) for chunk in storage.stream(target, chunksize=stream_buffer_size))
+            results.append(time.time() - start)
+            assert received == args.size * 1024 * 1024
+
+            storage.delete(storage.path2pfn(target))
+            print '%-10s %12i %8i' % (name, buffer_size, streams) + ''.join('%11.1f' % (args.size * 1.048576 / elapsed) for elapsed in results)
+            sys.stdout.flush()
+    finally:
+        if server is not None:
+            server.shutdown()
+        shutil.rmtree(tmpdir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())